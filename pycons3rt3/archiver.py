@@ -0,0 +1,464 @@
+"""Module: archiver
+
+This module creates zip archives of directory trees.
+
+Members are compressed in parallel by a pool of worker threads (zlib releases
+the GIL while compressing) and written in a deterministic sorted order by a
+single writer.  The archive is written sequentially without seeking, so the
+output can be a file or a pipe, for example the stdin of an upload command.
+Zip64 records are added automatically for large members, large archives, and
+archives with more than 65535 members.
+
+Files with extensions that are already compressed are stored rather than
+deflated, and deflated members that do not get smaller are stored as well.
+
+Classes:
+    ZipArchiver: Creates zip archives with parallel member compression
+
+"""
+import logging
+import os
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import ArchiveError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.archiver'
+
+# Extensions of files that are already compressed and are stored without deflating
+default_store_extensions = [
+    '.7z', '.bz2', '.cab', '.deb', '.docx', '.ear', '.gif', '.gz', '.iso', '.jar', '.jpeg', '.jpg', '.lz4', '.mp3',
+    '.mp4', '.msi', '.png', '.pptx', '.qcow2', '.rar', '.rpm', '.tgz', '.war', '.whl', '.xlsx', '.xz', '.zip', '.zst'
+]
+
+# Default deflate compression level
+default_compress_level = 6
+
+# Size of each read from a member file
+read_chunk_bytes = 1024 * 1024
+
+# Members whose first chunk deflates to more than this fraction of its size are stored
+incompressible_ratio = 0.95
+
+# Size of the first chunk of a member, used to decide whether the member is incompressible
+incompressible_probe_min_bytes = 64 * 1024
+
+# Compressed members larger than this are spooled to a temporary file instead of memory
+default_spool_max_bytes = 16 * 1024 * 1024
+
+# Zip format constants
+zip_stored = 0
+zip_deflated = 8
+zip_version = 20
+zip64_version = 45
+zip_unix_system = 3
+zip_utf8_flag = 0x800
+zip64_extra_tag = 0x0001
+zip32_limit = 0xFFFFFFFF
+zip_count_limit = 0xFFFF
+zip_min_date_time = (1980, 1, 1, 0, 0, 0)
+
+# Zip format records
+local_header_struct = struct.Struct('<4s2B4HL2L2H')
+central_dir_struct = struct.Struct('<4s4B4HL2L5H2L')
+end_archive_struct = struct.Struct('<4s4H2LH')
+end_archive64_struct = struct.Struct('<4sQ2H2L4Q')
+end_archive64_locator_struct = struct.Struct('<4sLQL')
+local_header_signature = b'PK\003\004'
+central_dir_signature = b'PK\001\002'
+end_archive_signature = b'PK\005\006'
+end_archive64_signature = b'PK\006\006'
+end_archive64_locator_signature = b'PK\006\007'
+
+
+def get_dos_date_time(timestamp):
+    """Returns the DOS date and time for a timestamp
+
+    :param timestamp: (float) seconds since the epoch, or None for the earliest zip date
+    :return: (tuple) DOS date and DOS time
+    """
+    date_time = zip_min_date_time if timestamp is None else max(time.localtime(timestamp)[0:6], zip_min_date_time)
+    dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+    dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+    return dos_date, dos_time
+
+
+def get_flag_bits(arcname):
+    """Returns the general purpose flag bits for a member name
+
+    :param arcname: (str) name of the member in the archive
+    :return: (int) flag bits, with the UTF-8 flag set for non-ASCII names
+    """
+    return 0 if all(ord(c) < 128 for c in arcname) else zip_utf8_flag
+
+
+class ZipMember(object):
+    """A file to add to the archive and, once compressed, its data
+
+    :param file_path: (str) full path to the file
+    :param arcname: (str) name of the file in the archive
+    :param file_stat: (os.stat_result) stat of the file
+    :param compress: (bool) Set True to deflate, False to store
+    """
+
+    def __init__(self, file_path, arcname, file_stat, compress):
+        self.file_path = file_path
+        self.arcname = arcname
+        self.file_stat = file_stat
+        self.compress_type = zip_deflated if compress else zip_stored
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.data = None
+        self.header_offset = 0
+
+
+class ZipArchiver(object):
+    """Creates zip archives with parallel member compression
+
+    Add files and directories, then call close to compress and write the archive.  Members
+    are written in the order they were added, and directories are walked in sorted order,
+    so the same tree always produces the same member order.
+
+    :param output: (str) path of the zip file to create, or a writable binary file object such as a pipe
+    :param max_workers: (int) number of members compressed at once
+    :param compress_level: (int) deflate compression level, 1 (fastest) to 9 (smallest)
+    :param store_extensions: (list) extensions of files to store without deflating
+    :param reproducible: (bool) Set True to write fixed timestamps and normalized permissions
+    :param spool_max_bytes: (int) compressed members larger than this are held in a temporary file
+    """
+
+    def __init__(self, output, max_workers=None, compress_level=default_compress_level, store_extensions=None,
+                 reproducible=False, spool_max_bytes=default_spool_max_bytes):
+        self.cls_logger = mod_logger + '.ZipArchiver'
+        self.output = output
+        self.max_workers = max_workers if max_workers else os.cpu_count() or 1
+        self.compress_level = compress_level
+        self.store_extensions = set(store_extensions if store_extensions is not None else default_store_extensions)
+        self.reproducible = reproducible
+        self.spool_max_bytes = spool_max_bytes
+        self.members = []
+        self.arcnames = set()
+        self.offset = 0
+        self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def is_stored(self, file_path):
+        """Returns True if the file should be stored without deflating
+
+        :param file_path: (str) path to the file
+        :return: (bool)
+        """
+        return os.path.splitext(file_path)[1].lower() in self.store_extensions
+
+    def add_file(self, file_path, arcname=None):
+        """Adds a file to the archive
+
+        :param file_path: (str) full path to the file
+        :param arcname: (str) name of the file in the archive, the file name by default
+        :return: None
+        :raises: ArchiveError
+        """
+        if not arcname:
+            arcname = os.path.basename(file_path)
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        if arcname in self.arcnames:
+            raise ArchiveError('Duplicate archive name: {a}'.format(a=arcname))
+        try:
+            file_stat = os.stat(file_path)
+        except OSError as exc:
+            raise ArchiveError('Unable to read file: {f}'.format(f=file_path)) from exc
+        self.arcnames.add(arcname)
+        self.members.append(ZipMember(file_path=file_path, arcname=arcname, file_stat=file_stat,
+                                      compress=not self.is_stored(file_path)))
+
+    def add_dir(self, dir_path, prefix=None, filter_func=None):
+        """Adds the files in a directory tree to the archive in sorted order
+
+        :param dir_path: (str) full path to the directory
+        :param prefix: (str) path in the archive to add the files under, the top of the archive by default
+        :param filter_func: (callable) called with the full path of each file, return False to skip the file
+        :return: (int) number of files added
+        :raises: ArchiveError
+        """
+        if not os.path.isdir(dir_path):
+            raise ArchiveError('Directory not found: {d}'.format(d=dir_path))
+        dir_path = os.path.abspath(dir_path)
+        num_added = 0
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            rel_root = os.path.relpath(root, dir_path)
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                if filter_func and not filter_func(file_path):
+                    continue
+                arcname = file_name if rel_root == os.curdir else os.path.join(rel_root, file_name)
+                if prefix:
+                    arcname = os.path.join(prefix, arcname)
+                self.add_file(file_path=file_path, arcname=arcname)
+                num_added += 1
+        return num_added
+
+    def compress_member(self, member):
+        """Computes the CRC of a member and, for deflated members, compresses it into memory or a temp file
+
+        Stored members are read again by the writer rather than copied here.  A member whose first
+        chunk does not compress is switched to stored, so incompressible files are not deflated in full.
+
+        :param member: (ZipMember)
+        :return: (ZipMember)
+        :raises: ArchiveError
+        """
+        crc = 0
+        file_size = 0
+        compressor = None
+        data = None
+        if member.compress_type == zip_deflated:
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+            data = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            with open(member.file_path, 'rb') as f:
+                while True:
+                    chunk = f.read(read_chunk_bytes if file_size else incompressible_probe_min_bytes)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    file_size += len(chunk)
+                    if compressor:
+                        data.write(compressor.compress(chunk))
+                        if file_size == len(chunk) == incompressible_probe_min_bytes:
+                            probe_size = data.tell() + len(compressor.copy().flush())
+                            if probe_size > file_size * incompressible_ratio:
+                                data.close()
+                                data = None
+                                compressor = None
+            if compressor:
+                data.write(compressor.flush())
+        except OSError as exc:
+            if data:
+                data.close()
+            raise ArchiveError('Unable to read file: {f}'.format(f=member.file_path)) from exc
+        member.crc = crc
+        member.file_size = file_size
+        if compressor and data.tell() < file_size:
+            member.compress_size = data.tell()
+            data.seek(0)
+            member.data = data
+        else:
+            # Store members that did not get smaller
+            if data:
+                data.close()
+            member.compress_type = zip_stored
+            member.compress_size = file_size
+        return member
+
+    def write_bytes(self, data):
+        """Writes bytes to the output and advances the offset
+
+        :param data: (bytes) data to write
+        :return: None
+        """
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def write_member(self, member):
+        """Writes the local header and data of a compressed member
+
+        :param member: (ZipMember)
+        :return: None
+        :raises: ArchiveError
+        """
+        member.header_offset = self.offset
+        filename = member.arcname.encode('utf-8')
+        flag_bits = get_flag_bits(member.arcname)
+        dos_date, dos_time = get_dos_date_time(None if self.reproducible else member.file_stat.st_mtime)
+        extra = b''
+        compress_size = member.compress_size
+        file_size = member.file_size
+        extract_version = zip_version
+        if member.file_size >= zip32_limit or member.compress_size >= zip32_limit:
+            extra = struct.pack('<HHQQ', zip64_extra_tag, 16, member.file_size, member.compress_size)
+            compress_size = file_size = zip32_limit
+            extract_version = zip64_version
+        self.write_bytes(local_header_struct.pack(
+            local_header_signature, extract_version, 0, flag_bits, member.compress_type, dos_time, dos_date,
+            member.crc, compress_size, file_size, len(filename), len(extra)))
+        self.write_bytes(filename)
+        self.write_bytes(extra)
+        if member.data:
+            try:
+                while True:
+                    chunk = member.data.read(read_chunk_bytes)
+                    if not chunk:
+                        break
+                    self.write_bytes(chunk)
+            finally:
+                member.data.close()
+                member.data = None
+            return
+        written = 0
+        try:
+            with open(member.file_path, 'rb') as f:
+                while True:
+                    chunk = f.read(read_chunk_bytes)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    self.write_bytes(chunk)
+        except OSError as exc:
+            raise ArchiveError('Unable to read file: {f}'.format(f=member.file_path)) from exc
+        if written != member.file_size:
+            raise ArchiveError('File changed while it was being archived: {f}'.format(f=member.file_path))
+
+    def write_central_directory(self):
+        """Writes the central directory and end of archive records
+
+        :return: None
+        """
+        central_dir_offset = self.offset
+        for member in self.members:
+            filename = member.arcname.encode('utf-8')
+            flag_bits = get_flag_bits(member.arcname)
+            dos_date, dos_time = get_dos_date_time(None if self.reproducible else member.file_stat.st_mtime)
+            mode = member.file_stat.st_mode
+            if self.reproducible:
+                mode = stat.S_IFREG | (0o755 if mode & stat.S_IXUSR else 0o644)
+            zip64_fields = []
+            file_size = member.file_size
+            compress_size = member.compress_size
+            header_offset = member.header_offset
+            if file_size >= zip32_limit:
+                zip64_fields.append(file_size)
+                file_size = zip32_limit
+            if compress_size >= zip32_limit:
+                zip64_fields.append(compress_size)
+                compress_size = zip32_limit
+            if header_offset >= zip32_limit:
+                zip64_fields.append(header_offset)
+                header_offset = zip32_limit
+            extra = b''
+            extract_version = zip_version
+            if zip64_fields:
+                extra = struct.pack('<HH' + 'Q' * len(zip64_fields), zip64_extra_tag, 8 * len(zip64_fields),
+                                    *zip64_fields)
+                extract_version = zip64_version
+            self.write_bytes(central_dir_struct.pack(
+                central_dir_signature, zip64_version, zip_unix_system, extract_version, 0, flag_bits,
+                member.compress_type, dos_time, dos_date, member.crc, compress_size, file_size, len(filename),
+                len(extra), 0, 0, 0, (mode & 0xFFFF) << 16, header_offset))
+            self.write_bytes(filename)
+            self.write_bytes(extra)
+        central_dir_size = self.offset - central_dir_offset
+        num_members = len(self.members)
+        if num_members >= zip_count_limit or central_dir_offset >= zip32_limit or central_dir_size >= zip32_limit:
+            end_archive64_offset = self.offset
+            self.write_bytes(end_archive64_struct.pack(
+                end_archive64_signature, end_archive64_struct.size - 12, zip64_version, zip64_version, 0, 0,
+                num_members, num_members, central_dir_size, central_dir_offset))
+            self.write_bytes(end_archive64_locator_struct.pack(
+                end_archive64_locator_signature, 0, end_archive64_offset, 1))
+            num_members = min(num_members, zip_count_limit)
+            central_dir_size = min(central_dir_size, zip32_limit)
+            central_dir_offset = min(central_dir_offset, zip32_limit)
+        self.write_bytes(end_archive_struct.pack(
+            end_archive_signature, 0, 0, num_members, num_members, central_dir_size, central_dir_offset, 0))
+
+    def close(self):
+        """Compresses the members in parallel and writes the archive
+
+        At most twice max_workers compressed members wait to be written at any time, which bounds
+        memory and temp file use.
+
+        :return: (dict) files, bytes_in, bytes_out, elapsed_sec, and mb_per_sec (uncompressed input)
+        :raises: ArchiveError
+        """
+        log = logging.getLogger(self.cls_logger + '.close')
+        start_time = time.monotonic()
+        close_stream = False
+        if isinstance(self.output, str):
+            try:
+                self.stream = open(self.output, 'wb')
+            except OSError as exc:
+                raise ArchiveError('Unable to create zip file: {f}'.format(f=self.output)) from exc
+            close_stream = True
+        else:
+            self.stream = self.output
+        max_pending = self.max_workers * 2
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='zip') as executor:
+                try:
+                    next_index = 0
+                    for member in self.members:
+                        while next_index < len(self.members) and len(futures) < max_pending:
+                            futures.append(executor.submit(self.compress_member, self.members[next_index]))
+                            next_index += 1
+                        futures.pop(0).result()
+                        self.write_member(member)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+                finally:
+                    for future in futures:
+                        if not future.cancelled():
+                            try:
+                                pending_member = future.result()
+                            except ArchiveError:
+                                continue
+                            if pending_member.data:
+                                pending_member.data.close()
+            self.write_central_directory()
+            self.stream.flush()
+        except OSError as exc:
+            raise ArchiveError('Problem writing zip archive') from exc
+        finally:
+            if close_stream:
+                self.stream.close()
+        elapsed_sec = time.monotonic() - start_time
+        bytes_in = sum(member.file_size for member in self.members)
+        stats = {
+            'files': len(self.members),
+            'bytes_in': bytes_in,
+            'bytes_out': self.offset,
+            'elapsed_sec': elapsed_sec,
+            'mb_per_sec': bytes_in / (1024.0 * 1024.0) / elapsed_sec if elapsed_sec > 0 else 0.0
+        }
+        log.info('Archived {n} files, {i} bytes to {o} bytes in {t:.2f} seconds ({r:.1f} MB/s)'.format(
+            n=str(stats['files']), i=str(bytes_in), o=str(self.offset), t=elapsed_sec, r=stats['mb_per_sec']))
+        return stats
+
+
+def zip_dir(dir_path, output, include_dir_name=True, max_workers=None, compress_level=default_compress_level,
+            reproducible=False):
+    """Creates a zip archive of a directory tree
+
+    :param dir_path: (str) full path to the directory
+    :param output: (str) path of the zip file to create, or a writable binary file object such as a pipe
+    :param include_dir_name: (bool) Set True to add the files under the directory name in the archive
+    :param max_workers: (int) number of members compressed at once
+    :param compress_level: (int) deflate compression level, 1 (fastest) to 9 (smallest)
+    :param reproducible: (bool) Set True to write fixed timestamps and normalized permissions
+    :return: (dict) archive stats, see ZipArchiver.close
+    :raises: ArchiveError
+    """
+    prefix = os.path.basename(os.path.normpath(dir_path)) if include_dir_name else None
+    archiver = ZipArchiver(output=output, max_workers=max_workers, compress_level=compress_level,
+                           reproducible=reproducible)
+    archiver.add_dir(dir_path=dir_path, prefix=prefix)
+    return archiver.close()
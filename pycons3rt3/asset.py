@@ -6,7 +6,6 @@ This module provides utilities for creating asset zip files.
 
 """
 import argparse
-import contextlib
 import logging
 import os
 import shutil
@@ -14,14 +13,16 @@ import sys
 import time
 import traceback
 import yaml
-import zipfile
 
 from .logify import Logify
+from .archiver import ZipArchiver
+from .assetcatalog import AssetCatalog
 from .bash import mkdir_p
 from .cons3rtapi import Cons3rtApi
 from .cons3rtcli import validate_ids
 from .cons3rtenums import cons3rt_asset_types
-from .exceptions import AssetError, AssetZipCreationError, Cons3rtApiError, Cons3rtAssetStructureError, Cons3rtCliError
+from .exceptions import AssetCatalogError, AssetError, AssetZipCreationError, Cons3rtApiError, \
+    Cons3rtAssetStructureError, Cons3rtCliError
 from .osutil import get_dest_dir
 
 __author__ = 'Joe Yennaco'
@@ -597,9 +598,10 @@ def make_asset_zip(asset_dir_path, destination_directory=None):
     # Attempt to create the zip
     log.debug('Attempting to create asset zip file: {f}'.format(f=asset_info.asset_zip_path))
     try:
-        with contextlib.closing(zipfile.ZipFile(asset_info.asset_zip_path, 'w', allowZip64=True)) as zip_w:
+        with ZipArchiver(output=asset_info.asset_zip_path) as zip_w:
             for root, dirs, files in os.walk(staging_directory):
-                for f in files:
+                dirs.sort()
+                for f in sorted(files):
                     skip = False
                     file_path = os.path.join(root, f)
                     log.debug('Evaluating file: {f}'.format(f=file_path))
@@ -638,7 +640,7 @@ def make_asset_zip(asset_dir_path, destination_directory=None):
                         log.debug('Trimming the leading char: [/]')
                         archive_name = archive_name[1:]
                     log.debug('Adding file to archive as: {a}'.format(a=archive_name))
-                    zip_w.write(file_path, archive_name)
+                    zip_w.add_file(file_path, archive_name)
     except Exception as exc:
         raise AssetZipCreationError('Unable to create zip file: {f}'.format(f=asset_info.asset_zip_path)) from exc
     try:
@@ -1100,7 +1102,10 @@ def query_assets_args(args, id_only=False, log_level='WARNING'):
     asset_subtype = None
     asset_name = None
     latest = False
+    cached = False
 
+    if args.cached:
+        cached = True
     if args.expanded:
         expanded = True
     if args.community:
@@ -1129,7 +1134,8 @@ def query_assets_args(args, id_only=False, log_level='WARNING'):
             community=community,
             latest=latest,
             asset_name=asset_name,
-            category_ids=category_ids
+            category_ids=category_ids,
+            cached=cached
         )
     except AssetError as exc:
         print('ERROR: Problem querying for assets\n{e}'.format(e=str(exc)))
@@ -1148,7 +1154,7 @@ def query_assets_args(args, id_only=False, log_level='WARNING'):
 
 
 def query_assets(asset_type, asset_subtype=None, expanded=False, community=False, latest=False, asset_name=None,
-                 category_ids=None, max_results=None):
+                 category_ids=None, max_results=None, cached=False):
     """Queries assets and prints IDs of assets matching the query
 
     :param asset_type: (str) asset type
@@ -1159,6 +1165,7 @@ def query_assets(asset_type, asset_subtype=None, expanded=False, community=False
     :param asset_name: (str) name to filter results on
     :param category_ids: (list) list of category IDs to filter on
     :param max_results: (int) maximum number of assets to query for
+    :param cached: (bool) set true to query the local asset catalog, syncing it when stale
     :return: (list) of assets
     :raises: AssetError
     """
@@ -1171,6 +1178,23 @@ def query_assets(asset_type, asset_subtype=None, expanded=False, community=False
     if asset_type not in cons3rt_asset_types:
         raise AssetError('Invalid asset_type found, valid asset types: [{t}]'.format(t=','.join(cons3rt_asset_types)))
     c = Cons3rtApi()
+    if cached:
+        try:
+            catalog = AssetCatalog(cons3rt_api=c)
+            filtered_assets = catalog.query(
+                asset_type=asset_type,
+                asset_subtype=asset_subtype,
+                community=community,
+                asset_name=asset_name,
+                category_ids=category_ids,
+                latest=latest,
+                max_results=max_results
+            )
+        except AssetCatalogError as exc:
+            raise AssetError('Problem querying the local asset catalog') from exc
+        log.info('Found {n} assets matching the query in the asset catalog'.format(n=str(len(filtered_assets))))
+        print('Found {n} assets matching the query'.format(n=str(len(filtered_assets))))
+        return filtered_assets
     if asset_type == 'SOFTWARE':
         try:
             assets = c.retrieve_software_assets(
@@ -1240,12 +1264,33 @@ def query_assets(asset_type, asset_subtype=None, expanded=False, community=False
         return filtered_assets
 
 
+def sync_asset_catalog(c5t):
+    """Syncs the local asset catalog used by queries with --cached
+
+    :param c5t: (Cons3rtApi) API object
+    :return: (int) 0 if successful, non-zero otherwise
+    """
+    try:
+        catalog = AssetCatalog(cons3rt_api=c5t)
+        counts = catalog.sync()
+    except AssetCatalogError as exc:
+        print('ERROR: Problem syncing the asset catalog\n{e}'.format(e=str(exc)))
+        traceback.print_exc()
+        return 1
+    print('Synced the asset catalog [{f}]: added [{a}], updated [{u}], removed [{r}], unchanged [{n}]'.format(
+        f=catalog.catalog_file, a=str(counts['added']), u=str(counts['updated']), r=str(counts['removed']),
+        n=str(counts['unchanged'])))
+    return 0
+
+
 def main():
     parser = argparse.ArgumentParser(description='cons3rt asset CLI')
     parser.add_argument('command', help='Command for the Asset CLI')
     parser.add_argument('--asset_dir', help='Path to the asset to import')
     parser.add_argument('--asset_subtype', help='Asset subtype to query on')
     parser.add_argument('--asset_type', help='Set to: containers, software')
+    parser.add_argument('--cached', help='Include to query the local asset catalog instead of the site',
+                        action='store_true')
     parser.add_argument('--category_ids', help='List of category IDs to filter on')
     parser.add_argument('--community', help='Include to retrieve community assets', action='store_true')
     parser.add_argument('--config', help='Path to a config file to load', required=False)
@@ -1266,7 +1311,7 @@ def main():
     parser.add_argument('--zip', help='Path to the asset zip file to import')
     args = parser.parse_args()
 
-    valid_commands = ['create', 'download', 'import', 'query', 'queryids', 'update', 'updateonly', 'validate']
+    valid_commands = ['create', 'download', 'import', 'query', 'queryids', 'sync', 'update', 'updateonly', 'validate']
     valid_commands_str = ','.join(valid_commands)
 
     # Get the command
@@ -1397,7 +1442,7 @@ def main():
             res = validate(asset_dir=asset_dir)
 
     # These commands need cons3rt API
-    elif command in ['download', 'import', 'query', 'queryids', 'update', 'updateonly']:
+    elif command in ['download', 'import', 'query', 'queryids', 'sync', 'update', 'updateonly']:
 
         # Create a cons3rt api object
         c5t = Cons3rtApi(config_file=config_file, url=cons3rt_site_url, project=asset_owning_project)
@@ -1414,6 +1459,8 @@ def main():
             res = query_assets_args(args, log_level=log_level)
         elif command == 'queryids':
             res = query_assets_args(args, id_only=True, log_level=log_level)
+        elif command == 'sync':
+            res = sync_asset_catalog(c5t=c5t)
         elif command == 'update':
             asset, res, err = import_update(dest_dir=dest_dir, c5t=c5t, asset_dir=asset_dir,
                                             asset_zip_file=zip_file_path, visibility=visibility, log_level=log_level,
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""Module: assetcatalog
+
+This module provides a locally persisted catalog of CONS3RT software, container,
+and test assets with indexes on name tokens, category, type/subtype, and visibility.
+
+The catalog is stored in a SQLite database in the pycons3rt data directory, one per
+site URL and project.  Syncing lists the assets from the site and only rewrites the
+catalog rows that are new, changed, or removed.  The asset listing API has no filter
+for assets changed since a point in time, so every sync is a full listing and the
+high water mark (the highest asset ID seen) only reports how many assets are new.
+Callers that need a single filtered listing while the catalog is stale should call
+the API directly rather than trigger a sync, see is_stale.
+
+Classes:
+    AssetCatalog: Syncs and queries the local asset catalog
+
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .cons3rtapi import Cons3rtApi
+from .cons3rtconfig import get_data_dir
+from .cons3rtenums import cons3rt_asset_types, cons3rt_software_asset_types, cons3rt_test_asset_types
+from .exceptions import AssetCatalogError, Cons3rtApiError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.assetcatalog'
+
+# Default maximum age of the catalog before a query triggers a sync
+default_max_age_sec = 3600
+
+# Catalog schema
+catalog_schema = '''
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id INTEGER PRIMARY KEY,
+    asset_type TEXT NOT NULL,
+    subtype TEXT,
+    name TEXT NOT NULL,
+    visibility TEXT,
+    state TEXT,
+    in_project INTEGER NOT NULL DEFAULT 0,
+    digest TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_assets_type ON assets (asset_type, subtype);
+CREATE INDEX IF NOT EXISTS idx_assets_visibility ON assets (visibility);
+CREATE TABLE IF NOT EXISTS asset_tokens (
+    token TEXT NOT NULL,
+    asset_id INTEGER NOT NULL,
+    PRIMARY KEY (token, asset_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_asset_tokens_asset ON asset_tokens (asset_id);
+CREATE TABLE IF NOT EXISTS asset_categories (
+    category_id INTEGER NOT NULL,
+    asset_id INTEGER NOT NULL,
+    PRIMARY KEY (category_id, asset_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_asset_categories_asset ON asset_categories (asset_id);
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_categories_name ON categories (name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    asset_type TEXT PRIMARY KEY,
+    high_water_mark INTEGER NOT NULL DEFAULT 0,
+    last_sync REAL NOT NULL DEFAULT 0
+);
+'''
+
+# Splits asset names into searchable tokens
+token_regex = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Splits text into lowercase alphanumeric tokens
+
+    :param text: (str) text to tokenize
+    :return: (set) of str tokens
+    """
+    if not text:
+        return set()
+    return set(token_regex.findall(text.lower()))
+
+
+class AssetCatalog(object):
+    """Local catalog of CONS3RT assets for fast queries without re-listing assets from the site
+
+    :param cons3rt_api: (Cons3rtApi) API object for the site, created when needed if not provided
+    :param catalog_file: (str) path to the SQLite catalog file, defaults to one per site and project
+    :param max_age_sec: (int) maximum age in seconds before a query triggers a sync, None to never auto-sync
+    """
+
+    def __init__(self, cons3rt_api=None, catalog_file=None, max_age_sec=default_max_age_sec):
+        self.cls_logger = mod_logger + '.AssetCatalog'
+        self.cons3rt_api = cons3rt_api
+        self.max_age_sec = max_age_sec
+        if catalog_file:
+            self.catalog_file = catalog_file
+        else:
+            self.catalog_file = self.get_default_catalog_file()
+        self.lock = threading.Lock()
+        try:
+            self.db = sqlite3.connect(self.catalog_file, check_same_thread=False)
+            self.db.executescript(catalog_schema)
+        except sqlite3.Error as exc:
+            msg = 'Problem opening asset catalog: {f}'.format(f=self.catalog_file)
+            raise AssetCatalogError(msg) from exc
+
+    def get_api(self):
+        if not self.cons3rt_api:
+            self.cons3rt_api = Cons3rtApi()
+        return self.cons3rt_api
+
+    def get_default_catalog_file(self):
+        """Determines the catalog file for the site URL and project of the API
+
+        :return: (str) path to the catalog file
+        """
+        api = self.get_api()
+        site_key = '{u}|{p}'.format(u=api.rest_user.rest_api_url, p=api.rest_user.project_name)
+        digest = hashlib.sha1(site_key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(get_data_dir(), 'asset_catalog_{d}.db'.format(d=digest))
+
+    def close(self):
+        self.db.close()
+
+    def get_last_sync(self, asset_type):
+        """Returns the last sync time for the asset type
+
+        :param asset_type: (str) CONTAINER, SOFTWARE, or TEST
+        :return: (tuple) float epoch time of the last sync (0 if never), and int high water mark asset ID
+        """
+        row = self.db.execute('SELECT last_sync, high_water_mark FROM sync_state WHERE asset_type = ?',
+                              (asset_type,)).fetchone()
+        if not row:
+            return 0, 0
+        return row[0], row[1]
+
+    def is_stale(self, asset_type):
+        """Determines if a query for the asset type would trigger a full sync
+
+        :param asset_type: (str) CONTAINER, SOFTWARE, or TEST
+        :return: (bool) True if the catalog for the asset type is older than max_age_sec
+        """
+        if self.max_age_sec is None:
+            return False
+        last_sync, _ = self.get_last_sync(asset_type=asset_type)
+        return (time.time() - last_sync) > self.max_age_sec
+
+    def list_site_assets(self, asset_type, community):
+        """Lists assets of the type from the site, by subtype so the subtype of each asset is known
+
+        :param asset_type: (str) CONTAINER, SOFTWARE, or TEST
+        :param community: (bool) set True to include community assets
+        :return: (dict) of int asset ID to tuple of (str subtype, dict asset data)
+        :raises: Cons3rtApiError
+        """
+        api = self.get_api()
+        assets = {}
+        if asset_type == 'SOFTWARE':
+            for subtype in cons3rt_software_asset_types:
+                for asset in api.retrieve_software_assets(software_asset_type=subtype, community=community,
+                                                          expanded=True):
+                    assets[int(asset['id'])] = (subtype, asset)
+        elif asset_type == 'TEST':
+            for subtype in cons3rt_test_asset_types:
+                for asset in api.retrieve_test_assets(test_asset_type=subtype, community=community, expanded=True):
+                    assets[int(asset['id'])] = (subtype, asset)
+        elif asset_type == 'CONTAINER':
+            for asset in api.retrieve_container_assets(community=community, expanded=True):
+                assets[int(asset['id'])] = (None, asset)
+        return assets
+
+    def sync(self, asset_types=None):
+        """Syncs the catalog with the site, rewriting only new, changed, and removed assets
+
+        This lists every asset of each type (community and project), plus one listing per
+        category when the asset data does not include categories.
+
+        :param asset_types: (list) of asset types to sync, defaults to all
+        :return: (dict) counts of added, updated, removed, and unchanged assets
+        :raises: AssetCatalogError
+        """
+        log = logging.getLogger(self.cls_logger + '.sync')
+        if not asset_types:
+            asset_types = cons3rt_asset_types
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        self.sync_categories()
+        for asset_type in asset_types:
+            asset_type = asset_type.upper()
+            if asset_type not in cons3rt_asset_types:
+                raise AssetCatalogError('Invalid asset_type found, valid asset types: [{t}]'.format(
+                    t=','.join(cons3rt_asset_types)))
+            start_time = time.time()
+            try:
+                site_assets = self.list_site_assets(asset_type=asset_type, community=True)
+                project_asset_ids = set(self.list_site_assets(asset_type=asset_type, community=False).keys())
+            except Cons3rtApiError as exc:
+                msg = 'Problem listing {t} assets to sync the asset catalog'.format(t=asset_type)
+                raise AssetCatalogError(msg) from exc
+            _, high_water_mark = self.get_last_sync(asset_type=asset_type)
+            existing = dict(self.db.execute('SELECT asset_id, digest FROM assets WHERE asset_type = ?',
+                                            (asset_type,)).fetchall())
+            with self.lock, self.db:
+                for asset_id, (subtype, asset) in site_assets.items():
+                    in_project = 1 if asset_id in project_asset_ids else 0
+                    data = json.dumps(asset, sort_keys=True)
+                    digest = hashlib.sha1('{p}{d}'.format(p=in_project, d=data).encode('utf-8')).hexdigest()
+                    if existing.get(asset_id) == digest:
+                        counts['unchanged'] += 1
+                        continue
+                    if asset_id in existing:
+                        counts['updated'] += 1
+                    else:
+                        counts['added'] += 1
+                    self.upsert_asset(asset_id=asset_id, asset_type=asset_type, subtype=subtype, asset=asset,
+                                      in_project=in_project, digest=digest, data=data)
+                removed_asset_ids = set(existing.keys()) - set(site_assets.keys())
+                for asset_id in removed_asset_ids:
+                    self.delete_asset(asset_id=asset_id)
+                counts['removed'] += len(removed_asset_ids)
+                if site_assets:
+                    new_asset_ids = [asset_id for asset_id in site_assets.keys() if asset_id > high_water_mark]
+                    log.info('Found {n} {t} assets above the high water mark asset ID: {h}'.format(
+                        n=str(len(new_asset_ids)), t=asset_type, h=str(high_water_mark)))
+                    high_water_mark = max(high_water_mark, max(site_assets.keys()))
+                self.db.execute('INSERT OR REPLACE INTO sync_state (asset_type, high_water_mark, last_sync) '
+                                'VALUES (?, ?, ?)', (asset_type, high_water_mark, time.time()))
+            # Expanded asset data without categories requires a listing per category to index them
+            if site_assets and not any('categories' in asset for _, asset in site_assets.values()):
+                self.index_categories_by_query(asset_type=asset_type)
+            log.info('Synced {n} {t} assets in {s} seconds, high water mark asset ID: {h}'.format(
+                n=str(len(site_assets)), t=asset_type, s=str(round(time.time() - start_time, 2)),
+                h=str(high_water_mark)))
+        log.info('Asset catalog sync results: {c}'.format(c=str(counts)))
+        return counts
+
+    def sync_categories(self):
+        """Syncs the asset category names and IDs
+
+        :return: None
+        :raises: AssetCatalogError
+        """
+        try:
+            categories = self.get_api().retrieve_asset_categories()
+        except Cons3rtApiError as exc:
+            raise AssetCatalogError('Problem retrieving asset categories') from exc
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM categories')
+            self.db.executemany('INSERT INTO categories (category_id, name) VALUES (?, ?)',
+                                [(int(category['id']), category['name']) for category in categories])
+
+    def index_categories_by_query(self, asset_type):
+        """Rebuilds the category index for the asset type by listing the assets in each category
+
+        :param asset_type: (str) CONTAINER, SOFTWARE, or TEST
+        :return: None
+        :raises: AssetCatalogError
+        """
+        log = logging.getLogger(self.cls_logger + '.index_categories_by_query')
+        api = self.get_api()
+        entries = []
+        category_ids = [row[0] for row in self.db.execute('SELECT category_id FROM categories')]
+        log.info('Indexing {t} assets in {n} categories...'.format(t=asset_type, n=str(len(category_ids))))
+        for category_id in category_ids:
+            try:
+                if asset_type == 'SOFTWARE':
+                    assets = api.retrieve_software_assets(community=True, category_ids=[category_id])
+                elif asset_type == 'TEST':
+                    assets = api.retrieve_test_assets(community=True, category_ids=[category_id])
+                else:
+                    assets = api.retrieve_container_assets(community=True, category_ids=[category_id])
+            except Cons3rtApiError as exc:
+                msg = 'Problem listing {t} assets in category ID: {c}'.format(t=asset_type, c=str(category_id))
+                raise AssetCatalogError(msg) from exc
+            entries += [(category_id, int(asset['id'])) for asset in assets]
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM asset_categories WHERE asset_id IN '
+                            '(SELECT asset_id FROM assets WHERE asset_type = ?)', (asset_type,))
+            self.db.executemany('INSERT OR IGNORE INTO asset_categories (category_id, asset_id) VALUES (?, ?)',
+                                entries)
+
+    def upsert_asset(self, asset_id, asset_type, subtype, asset, in_project, digest, data):
+        """Writes the asset row and its token and category index entries, call within a transaction"""
+        self.db.execute('INSERT OR REPLACE INTO assets (asset_id, asset_type, subtype, name, visibility, state, '
+                        'in_project, digest, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (asset_id, asset_type, subtype, asset.get('name', ''), asset.get('visibility'),
+                         asset.get('state'), in_project, digest, data))
+        self.db.execute('DELETE FROM asset_tokens WHERE asset_id = ?', (asset_id,))
+        self.db.executemany('INSERT INTO asset_tokens (token, asset_id) VALUES (?, ?)',
+                            [(token, asset_id) for token in tokenize(asset.get('name'))])
+        self.db.execute('DELETE FROM asset_categories WHERE asset_id = ?', (asset_id,))
+        category_ids = set()
+        for category in asset.get('categories') or []:
+            if isinstance(category, dict) and 'id' in category:
+                category_ids.add(int(category['id']))
+        self.db.executemany('INSERT INTO asset_categories (category_id, asset_id) VALUES (?, ?)',
+                            [(category_id, asset_id) for category_id in category_ids])
+
+    def delete_asset(self, asset_id):
+        """Removes the asset and its index entries, call within a transaction"""
+        self.db.execute('DELETE FROM assets WHERE asset_id = ?', (asset_id,))
+        self.db.execute('DELETE FROM asset_tokens WHERE asset_id = ?', (asset_id,))
+        self.db.execute('DELETE FROM asset_categories WHERE asset_id = ?', (asset_id,))
+
+    def ensure_synced(self, asset_type):
+        if self.is_stale(asset_type=asset_type):
+            self.sync(asset_types=[asset_type])
+
+    def get_category_id(self, category_name):
+        """Returns the ID of the category by name
+
+        :param category_name: (str) category name
+        :return: (int) category ID or None
+        """
+        row = self.db.execute('SELECT category_id FROM categories WHERE name = ?', (category_name,)).fetchone()
+        if not row:
+            self.sync_categories()
+            row = self.db.execute('SELECT category_id FROM categories WHERE name = ?', (category_name,)).fetchone()
+        if row:
+            return row[0]
+
+    def get_asset_category_ids(self, asset_ids):
+        """Returns the indexed category IDs of assets in the catalog, without syncing
+
+        :param asset_ids: (list) of int asset IDs
+        :return: (dict) of int asset ID to set of int category IDs, for the asset IDs found in the catalog
+        """
+        asset_ids = [int(asset_id) for asset_id in asset_ids]
+        category_ids = {}
+        for start in range(0, len(asset_ids), 500):
+            chunk = asset_ids[start:start + 500]
+            rows = self.db.execute('SELECT asset_id FROM assets WHERE asset_id IN ({q})'.format(
+                q=','.join('?' * len(chunk))), chunk).fetchall()
+            for row in rows:
+                category_ids[row[0]] = set()
+            rows = self.db.execute('SELECT asset_id, category_id FROM asset_categories WHERE asset_id IN ({q})'.format(
+                q=','.join('?' * len(chunk))), chunk).fetchall()
+            for asset_id, category_id in rows:
+                if asset_id in category_ids:
+                    category_ids[asset_id].add(category_id)
+        return category_ids
+
+    def query(self, asset_type, asset_subtype=None, community=False, asset_name=None, category_ids=None,
+              visibility=None, latest=False, max_results=None):
+        """Queries the catalog, matching the filters of asset.query_assets
+
+        :param asset_type: (str) CONTAINER, SOFTWARE, or TEST
+        :param asset_subtype: (str) asset subtype
+        :param community: (bool) set True to include community assets
+        :param asset_name: (str) substring of the asset name to filter on
+        :param category_ids: (list) of int category IDs, assets must be in at least one
+        :param visibility: (str) asset visibility to filter on
+        :param latest: (bool) set True to return just the asset with the highest ID
+        :param max_results: (int) maximum number of assets to return
+        :return: (list) of asset data (dict) sorted by asset ID
+        :raises: AssetCatalogError
+        """
+        if not isinstance(asset_type, str) or asset_type.upper() not in cons3rt_asset_types:
+            raise AssetCatalogError('Invalid asset_type found, valid asset types: [{t}]'.format(
+                t=','.join(cons3rt_asset_types)))
+        asset_type = asset_type.upper()
+        self.ensure_synced(asset_type=asset_type)
+        sql = 'SELECT assets.name, assets.data FROM assets WHERE asset_type = ?'
+        params = [asset_type]
+        if asset_subtype:
+            sql += ' AND subtype = ?'
+            params.append(asset_subtype.upper())
+        if not community:
+            sql += ' AND in_project = 1'
+        if visibility:
+            sql += ' AND visibility = ?'
+            params.append(visibility.upper())
+        if category_ids:
+            sql += ' AND asset_id IN (SELECT asset_id FROM asset_categories WHERE category_id IN ({q}))'.format(
+                q=','.join('?' * len(category_ids)))
+            params += [int(category_id) for category_id in category_ids]
+        if asset_name:
+            sql += " AND name LIKE ? ESCAPE '\\'"
+            params.append('%' + re.sub(r'([%_\\])', r'\\\1', asset_name) + '%')
+        sql += ' ORDER BY asset_id DESC' if latest else ' ORDER BY asset_id'
+        assets = []
+        for name, data in self.db.execute(sql, params):
+            # LIKE is case-insensitive, keep the case-sensitive match of query_assets
+            if asset_name and asset_name not in name:
+                continue
+            assets.append(json.loads(data))
+            if latest or (max_results and len(assets) >= max_results):
+                break
+        return assets
+
+    def search(self, text, asset_types=None, limit=50):
+        """Full-text search on asset name tokens, ranked by the number of matching tokens
+
+        Each search token matches catalog tokens it is a prefix of.
+
+        :param text: (str) search text
+        :param asset_types: (list) of asset types to search, defaults to all
+        :param limit: (int) maximum number of results
+        :return: (list) of asset data (dict), best match first
+        """
+        if not asset_types:
+            asset_types = cons3rt_asset_types
+        for asset_type in asset_types:
+            self.ensure_synced(asset_type=asset_type.upper())
+        scores = {}
+        for token in tokenize(text):
+            rows = self.db.execute('SELECT asset_id FROM asset_tokens WHERE token >= ? AND token < ?',
+                                   (token, token + '\uffff')).fetchall()
+            for asset_id in set(row[0] for row in rows):
+                scores[asset_id] = scores.get(asset_id, 0) + 1
+        if not scores:
+            return []
+        asset_ids = [asset_id for asset_id, _ in sorted(scores.items(), key=lambda item: (-item[1], -item[0]))]
+        results = []
+        type_filter = set(asset_type.upper() for asset_type in asset_types)
+        for asset_id in asset_ids:
+            row = self.db.execute('SELECT asset_type, data FROM assets WHERE asset_id = ?', (asset_id,)).fetchone()
+            if row and row[0] in type_filter:
+                results.append(json.loads(row[1]))
+                if len(results) >= limit:
+                    break
+        return results
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""Module: assetexport
+
+This module provides a parallel asset export engine that downloads multiple
+assets at once while sharing a single disk byte budget.
+
+Classes:
+    ExportJournal: Indexed journal of completed asset exports
+    DiskBudget: Thread-safe byte budget for the export destination
+    VolumePacker: Packs exported asset zips into size-bounded volumes (e.g. DVDs)
+    AssetExporter: Runs concurrent asset downloads using the journal, budget, and packer
+
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .cons3rtapi import Cons3rtApi
+from .exceptions import AssetExportError, Cons3rtApiError
+from .httpclient import write_file_download
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.assetexport'
+
+# File name of the export journal in the download directory
+export_journal_file_name = 'export_journal.jsonl'
+
+# Legacy YAML list of downloaded asset IDs written by the export_by_category.py sample script
+legacy_downloaded_asset_file_name = 'completed_downloads.txt'
+
+# Max size in bytes to put on a DVD
+dvd_volume_size_bytes = 4294967296
+
+# Default number of concurrent asset downloads
+default_max_workers = 4
+
+# Keep at least this factor of the exported bytes free on the destination disk
+default_free_space_factor = 3
+
+# Bytes to reserve for an asset download when the size is not known ahead of time
+default_unknown_size_reservation_bytes = 1073741824
+
+# Chunk size for writing asset downloads
+download_chunk_size_bytes = 1048576
+
+
+class ExportJournal(object):
+    """Append-only journal of completed asset exports, indexed by asset ID
+
+    Each line in the journal file is a JSON record, so adding a completed export does not
+    rewrite the whole list.  Asset IDs from the legacy completed_downloads.txt YAML list are
+    imported on load when present.
+    """
+
+    def __init__(self, download_dir):
+        self.cls_logger = mod_logger + '.ExportJournal'
+        self.download_dir = download_dir
+        self.journal_file = os.path.join(download_dir, export_journal_file_name)
+        self.records = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Loads the journal file and any legacy download list into the index
+
+        :return: None
+        :raises: AssetExportError
+        """
+        log = logging.getLogger(self.cls_logger + '.load')
+        self.records = {}
+        legacy_file = os.path.join(self.download_dir, legacy_downloaded_asset_file_name)
+        if os.path.isfile(legacy_file):
+            try:
+                with open(legacy_file, 'r') as f:
+                    legacy_asset_ids = yaml.load(f, Loader=yaml.FullLoader)
+            except (OSError, IOError, yaml.YAMLError) as exc:
+                msg = 'Problem reading legacy download list: {f}'.format(f=legacy_file)
+                raise AssetExportError(msg) from exc
+            if isinstance(legacy_asset_ids, list):
+                for legacy_asset_id in legacy_asset_ids:
+                    try:
+                        legacy_asset_id = int(legacy_asset_id)
+                    except ValueError:
+                        log.warning('Skipping invalid asset ID in legacy download list: {i}'.format(
+                            i=str(legacy_asset_id)))
+                        continue
+                    self.records[legacy_asset_id] = {'asset_id': legacy_asset_id}
+                log.info('Imported {n} asset IDs from the legacy download list: {f}'.format(
+                    n=str(len(self.records)), f=legacy_file))
+        if not os.path.isfile(self.journal_file):
+            log.info('No export journal exists yet: {f}'.format(f=self.journal_file))
+            return
+        try:
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning('Skipping corrupt export journal line: {r}'.format(r=line))
+                        continue
+                    self.records[int(record['asset_id'])] = record
+        except (OSError, IOError) as exc:
+            msg = 'Problem reading export journal: {f}'.format(f=self.journal_file)
+            raise AssetExportError(msg) from exc
+        log.info('Loaded {n} completed exports from journal: {f}'.format(
+            n=str(len(self.records)), f=self.journal_file))
+
+    def is_complete(self, asset_id):
+        """Determines if the asset ID has already been exported, or skipped because it can never be exported
+
+        :param asset_id: (int) asset ID
+        :return: (bool) True if the asset is in the journal
+        """
+        return int(asset_id) in self.records
+
+    def completed_asset_ids(self):
+        """Returns a sorted list of exported asset IDs
+
+        :return: (list) of int asset IDs
+        """
+        return sorted(asset_id for asset_id, record in self.records.items() if record.get('status') != 'skipped')
+
+    def volume_usage(self):
+        """Returns the bytes used in each volume according to the journal
+
+        :return: (dict) of int volume number to int bytes used
+        """
+        usage = {}
+        for record in self.records.values():
+            if record.get('volume') is None:
+                continue
+            usage[record['volume']] = usage.get(record['volume'], 0) + record.get('size_bytes', 0)
+        return usage
+
+    def add(self, asset_id, file_path, size_bytes, volume=None):
+        """Appends a completed export to the journal
+
+        :param asset_id: (int) asset ID
+        :param file_path: (str) path to the exported asset zip
+        :param size_bytes: (int) size of the exported asset zip in bytes
+        :param volume: (int) volume number the asset zip was packed into
+        :return: (dict) journal record
+        :raises: AssetExportError
+        """
+        record = {
+            'asset_id': int(asset_id),
+            'file': file_path,
+            'size_bytes': size_bytes,
+            'volume': volume,
+            'completed': int(time.time())
+        }
+        return self.write_record(record)
+
+    def add_skipped(self, asset_id, size_bytes, reason):
+        """Appends an asset that can never be exported to the journal, so later runs do not retry it
+
+        :param asset_id: (int) asset ID
+        :param size_bytes: (int) size of the asset zip in bytes
+        :param reason: (str) reason the asset was skipped
+        :return: (dict) journal record
+        :raises: AssetExportError
+        """
+        record = {
+            'asset_id': int(asset_id),
+            'size_bytes': size_bytes,
+            'status': 'skipped',
+            'reason': reason,
+            'completed': int(time.time())
+        }
+        return self.write_record(record)
+
+    def write_record(self, record):
+        """Appends a record to the journal file and the index
+
+        :param record: (dict) journal record containing asset_id
+        :return: (dict) journal record
+        :raises: AssetExportError
+        """
+        with self.lock:
+            try:
+                with open(self.journal_file, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            except (OSError, IOError) as exc:
+                msg = 'Problem writing to export journal: {f}'.format(f=self.journal_file)
+                raise AssetExportError(msg) from exc
+            self.records[record['asset_id']] = record
+        return record
+
+
+class DiskBudget(object):
+    """Thread-safe byte budget shared by concurrent downloads to the same destination
+
+    Space is reserved before a download writes any content, and the reservation is replaced
+    by the actual size once the download completes.
+    """
+
+    def __init__(self, dest_dir, budget_bytes=None, free_space_factor=default_free_space_factor):
+        self.cls_logger = mod_logger + '.DiskBudget'
+        self.dest_dir = dest_dir
+        self.budget_bytes = budget_bytes
+        self.free_space_factor = free_space_factor
+        self.committed_bytes = 0
+        self.reserved_bytes = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, num_bytes):
+        """Reserves space in the budget
+
+        :param num_bytes: (int) number of bytes to reserve
+        :return: (bool) True if the space was reserved, False if it does not fit
+        """
+        log = logging.getLogger(self.cls_logger + '.reserve')
+        with self.lock:
+            pending_bytes = self.committed_bytes + self.reserved_bytes + num_bytes
+            if self.budget_bytes is not None and pending_bytes > self.budget_bytes:
+                log.info('Reserving [{n}] bytes would exceed the budget of [{b}] bytes'.format(
+                    n=str(num_bytes), b=str(self.budget_bytes)))
+                return False
+            free_disk_space = shutil.disk_usage(self.dest_dir).free - self.reserved_bytes
+            if (num_bytes * self.free_space_factor) > free_disk_space:
+                log.info('Reserving [{n}] bytes would leave too little free disk space: [{f}] bytes'.format(
+                    n=str(num_bytes), f=str(free_disk_space)))
+                return False
+            self.reserved_bytes += num_bytes
+            return True
+
+    def commit(self, reserved_bytes, actual_bytes):
+        """Replaces a reservation with the actual number of bytes written
+
+        :param reserved_bytes: (int) number of bytes previously reserved
+        :param actual_bytes: (int) number of bytes actually written
+        :return: None
+        """
+        with self.lock:
+            self.reserved_bytes -= reserved_bytes
+            self.committed_bytes += actual_bytes
+
+    def release(self, reserved_bytes):
+        """Releases a reservation without writing content
+
+        :param reserved_bytes: (int) number of bytes previously reserved
+        :return: None
+        """
+        with self.lock:
+            self.reserved_bytes -= reserved_bytes
+
+
+class VolumePacker(object):
+    """Assigns exported asset zips to size-bounded volumes using first-fit
+
+    Volumes are numbered from 1 and map to volume-NNN subdirectories of the download directory.
+    """
+
+    def __init__(self, volume_size_bytes, max_volumes=None, volume_usage=None):
+        self.cls_logger = mod_logger + '.VolumePacker'
+        self.volume_size_bytes = volume_size_bytes
+        self.max_volumes = max_volumes
+        self.volume_usage = {}
+        if volume_usage:
+            self.volume_usage.update(volume_usage)
+        self.lock = threading.Lock()
+
+    def assign(self, num_bytes):
+        """Reserves space for the provided number of bytes in the first volume it fits
+
+        :param num_bytes: (int) number of bytes
+        :return: (int) volume number or None if no volume has space
+        """
+        log = logging.getLogger(self.cls_logger + '.assign')
+        if num_bytes > self.volume_size_bytes:
+            log.warning('[{n}] bytes is larger than the volume size [{v}] bytes'.format(
+                n=str(num_bytes), v=str(self.volume_size_bytes)))
+            return
+        with self.lock:
+            volume = 1
+            while True:
+                if self.max_volumes and volume > self.max_volumes:
+                    return
+                used_bytes = self.volume_usage.get(volume, 0)
+                if used_bytes + num_bytes <= self.volume_size_bytes:
+                    self.volume_usage[volume] = used_bytes + num_bytes
+                    return volume
+                volume += 1
+
+    def adjust(self, volume, reserved_bytes, actual_bytes):
+        """Replaces the bytes reserved in a volume with the actual size
+
+        :param volume: (int) volume number
+        :param reserved_bytes: (int) bytes reserved by assign
+        :param actual_bytes: (int) actual bytes written
+        :return: None
+        """
+        with self.lock:
+            self.volume_usage[volume] = self.volume_usage.get(volume, 0) - reserved_bytes + actual_bytes
+
+    @staticmethod
+    def get_volume_dir_name(volume):
+        return 'volume-{v:03d}'.format(v=volume)
+
+
+class AssetExporter(object):
+    """Downloads many assets concurrently under a shared disk budget
+
+    :param cons3rt_api: (Cons3rtApi) API object for the site to export from
+    :param download_dir: (str) path to the destination directory
+    :param max_workers: (int) number of concurrent downloads
+    :param budget_bytes: (int) maximum number of bytes to export in this run, or None for disk space only
+    :param volume_size_bytes: (int) size of each output volume (e.g. dvd_volume_size_bytes), or None for no volumes
+    :param max_volumes: (int) maximum number of volumes to fill
+    :param max_assets: (int) maximum number of assets to download in this run
+    :param max_attempts: (int) number of download attempts for each asset
+    """
+
+    def __init__(self, download_dir, cons3rt_api=None, max_workers=default_max_workers, budget_bytes=None,
+                 volume_size_bytes=None, max_volumes=None, max_assets=None, max_attempts=3):
+        self.cls_logger = mod_logger + '.AssetExporter'
+        if cons3rt_api:
+            self.cons3rt_api = cons3rt_api
+        else:
+            self.cons3rt_api = Cons3rtApi()
+        self.download_dir = download_dir
+        self.max_workers = max_workers
+        self.max_assets = max_assets
+        self.max_attempts = max_attempts
+        if not os.path.isdir(self.download_dir):
+            os.makedirs(self.download_dir, exist_ok=True)
+        self.journal = ExportJournal(download_dir=self.download_dir)
+        self.budget = DiskBudget(dest_dir=self.download_dir, budget_bytes=budget_bytes)
+        if volume_size_bytes:
+            self.packer = VolumePacker(volume_size_bytes=volume_size_bytes, max_volumes=max_volumes,
+                                       volume_usage=self.journal.volume_usage())
+        else:
+            self.packer = None
+        self.budget_exhausted = threading.Event()
+
+    def export_assets(self, assets):
+        """Exports the provided assets concurrently, skipping assets already in the journal
+
+        :param assets: (list) of int asset IDs, or asset dicts containing "id" and optionally "size"
+        :return: (dict) of lists: completed (journal records), failed (int asset IDs),
+                 deferred (int asset IDs that did not fit in the budget), skipped (int asset IDs already in
+                 the journal), oversized (int asset IDs larger than a volume, recorded as skipped)
+        :raises: AssetExportError
+        """
+        log = logging.getLogger(self.cls_logger + '.export_assets')
+        results = {
+            'completed': [],
+            'failed': [],
+            'deferred': [],
+            'skipped': [],
+            'oversized': []
+        }
+        pending = {}
+        for asset in assets:
+            if isinstance(asset, dict):
+                asset_id, size_bytes = asset['id'], asset.get('size')
+            else:
+                asset_id, size_bytes = asset, None
+            try:
+                asset_id = int(asset_id)
+            except ValueError as exc:
+                raise AssetExportError('Invalid asset ID found: {i}'.format(i=str(asset_id))) from exc
+            if self.journal.is_complete(asset_id):
+                log.info('Already exported or skipped asset ID: {i}'.format(i=str(asset_id)))
+                results['skipped'].append(asset_id)
+                continue
+            pending[asset_id] = size_bytes
+        pending = sorted(pending.items())
+        if self.max_assets is not None and len(pending) > self.max_assets:
+            results['deferred'] += [asset_id for asset_id, _ in pending[self.max_assets:]]
+            pending = pending[:self.max_assets]
+        log.info('Exporting {n} assets with {w} concurrent downloads to: {d}'.format(
+            n=str(len(pending)), w=str(self.max_workers), d=self.download_dir))
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='export') as executor:
+            futures = {}
+            for asset_id, size_bytes in pending:
+                futures[executor.submit(self.export_asset, asset_id, size_bytes)] = asset_id
+            for future in as_completed(futures):
+                asset_id = futures[future]
+                try:
+                    record = future.result()
+                except AssetExportError as exc:
+                    log.error('Problem exporting asset ID [{i}]\n{e}'.format(i=str(asset_id), e=str(exc)))
+                    results['failed'].append(asset_id)
+                    continue
+                if record is None:
+                    results['deferred'].append(asset_id)
+                elif record.get('status') == 'skipped':
+                    results['oversized'].append(asset_id)
+                else:
+                    results['completed'].append(record)
+        exported_bytes = sum(record['size_bytes'] for record in results['completed'])
+        elapsed_sec = max(time.time() - start_time, 0.001)
+        log.info('Exported {n} assets totaling [{b}] bytes in {t} seconds ({r} MB/s), failed: {f}, deferred: '
+                 '{d}, skipped: {s}, oversized: {o}'.format(n=str(len(results['completed'])), b=str(exported_bytes),
+                                                           t=str(round(elapsed_sec, 2)),
+                                                           r=str(round(exported_bytes / elapsed_sec / 1048576, 2)),
+                                                           f=str(len(results['failed'])),
+                                                           d=str(len(results['deferred'])),
+                                                           s=str(len(results['skipped'])),
+                                                           o=str(len(results['oversized']))))
+        results['failed'].sort()
+        results['deferred'].sort()
+        results['oversized'].sort()
+        return results
+
+    def export_asset(self, asset_id, size_bytes=None):
+        """Downloads a single asset into the budget and volume, and records it in the journal
+
+        :param asset_id: (int) asset ID
+        :param size_bytes: (int) size of the asset zip if known ahead of time
+        :return: (dict) journal record, or None if the asset did not fit in the budget
+        :raises: AssetExportError
+        """
+        log = logging.getLogger(self.cls_logger + '.export_asset')
+        if self.budget_exhausted.is_set():
+            log.info('Export budget exhausted, deferring asset ID: {i}'.format(i=str(asset_id)))
+            return
+        err_msg = ''
+        for attempt_num in range(1, self.max_attempts + 1):
+            try:
+                return self.download_into_budget(asset_id=asset_id, size_bytes=size_bytes)
+            except (Cons3rtApiError, OSError) as exc:
+                err_msg = 'Attempt #{n} of {m} to export asset ID [{i}] failed\n{e}\n{t}'.format(
+                    n=str(attempt_num), m=str(self.max_attempts), i=str(asset_id), e=str(exc),
+                    t=traceback.format_exc())
+                log.warning(err_msg)
+                time.sleep(5 * attempt_num)
+        raise AssetExportError(err_msg)
+
+    def download_into_budget(self, asset_id, size_bytes=None):
+        """Opens the download, reserves space from the known size, and writes the asset zip
+
+        :param asset_id: (int) asset ID
+        :param size_bytes: (int) size of the asset zip if known ahead of time
+        :return: (dict) journal record, or None if the asset did not fit in the budget
+        :raises: Cons3rtApiError, OSError, AssetExportError
+        """
+        log = logging.getLogger(self.cls_logger + '.download_into_budget')
+        response, content_length = self.cons3rt_api.open_asset_download(asset_id=asset_id)
+        try:
+            if content_length:
+                size_bytes = content_length
+            reserved_bytes = size_bytes if size_bytes else default_unknown_size_reservation_bytes
+            if self.packer:
+                if size_bytes and size_bytes > self.packer.volume_size_bytes:
+                    # This asset never fits, record it so it does not block this and later runs
+                    log.warning('Skipping asset ID [{i}] of [{n}] bytes, it is larger than a volume of [{v}] '
+                                'bytes'.format(i=str(asset_id), n=str(size_bytes),
+                                               v=str(self.packer.volume_size_bytes)))
+                    return self.journal.add_skipped(asset_id=asset_id, size_bytes=size_bytes,
+                                                    reason='larger than a volume')
+                reserved_bytes = min(reserved_bytes, self.packer.volume_size_bytes)
+            if not self.budget.reserve(reserved_bytes):
+                self.budget_exhausted.set()
+                return
+            volume = None
+            if self.packer:
+                volume = self.packer.assign(reserved_bytes)
+                if volume is None:
+                    self.budget.release(reserved_bytes)
+                    self.budget_exhausted.set()
+                    log.info('All volumes are full, no space for asset ID [{i}] of [{n}] bytes'.format(
+                        i=str(asset_id), n=str(reserved_bytes)))
+                    return
+                dest_dir = os.path.join(self.download_dir, VolumePacker.get_volume_dir_name(volume))
+                os.makedirs(dest_dir, exist_ok=True)
+            else:
+                dest_dir = self.download_dir
+            download_file = os.path.join(dest_dir, 'asset-{i}.zip'.format(i=str(asset_id)))
+            log.info('Downloading asset ID [{i}] of [{n}] bytes to: {f}'.format(
+                i=str(asset_id), n=str(size_bytes), f=download_file))
+            if not write_file_download(download_file=download_file, http_response=response,
+                                       file_size=size_bytes if size_bytes else 0,
+                                       chunk_size=download_chunk_size_bytes, suppress_status=True):
+                self.budget.release(reserved_bytes)
+                if volume is not None:
+                    self.packer.adjust(volume=volume, reserved_bytes=reserved_bytes, actual_bytes=0)
+                raise OSError('Problem writing download for asset ID: {i}'.format(i=str(asset_id)))
+        finally:
+            response.close()
+        actual_bytes = os.path.getsize(download_file)
+        self.budget.commit(reserved_bytes=reserved_bytes, actual_bytes=actual_bytes)
+        if volume is not None:
+            self.packer.adjust(volume=volume, reserved_bytes=reserved_bytes, actual_bytes=actual_bytes)
+        record = self.journal.add(asset_id=asset_id, file_path=download_file, size_bytes=actual_bytes, volume=volume)
+        log.info('Exported asset ID [{i}] with size [{b} bytes] to: {f}'.format(
+            i=str(asset_id), b=str(actual_bytes), f=download_file))
+        return record
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Module: assetgraph
+
+This module builds the dependency graph for a set of CONS3RT assets and uses it
+to run bulk deletes or visibility changes in a safe order.
+
+Dependent assets are fetched concurrently and cached, then the graph is split into
+levels: every asset in a level only has dependents in earlier levels.  Deletes and
+visibility restrictions run level by level with the assets in each level in parallel.
+
+Classes:
+    AssetDependencyGraph: Builds the graph and runs ordered bulk operations
+
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .cons3rtapi import Cons3rtApi
+from .exceptions import AssetDependencyError, Cons3rtApiError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.assetgraph'
+
+# Default number of concurrent API calls
+default_max_workers = 8
+
+# Visibility values from the most to the least restrictive
+visibility_order = ['OWNER', 'OWNING_PROJECT', 'TRUSTED_PROJECTS', 'COMMUNITY']
+
+
+class AssetDependencyGraph(object):
+    """Dependency graph of CONS3RT assets
+
+    :param cons3rt_api: (Cons3rtApi) API object, created if not provided
+    :param max_workers: (int) number of concurrent API calls
+    """
+
+    def __init__(self, cons3rt_api=None, max_workers=default_max_workers):
+        self.cls_logger = mod_logger + '.AssetDependencyGraph'
+        if cons3rt_api:
+            self.cons3rt_api = cons3rt_api
+        else:
+            self.cons3rt_api = Cons3rtApi()
+        self.max_workers = max_workers
+        self.dependents = {}
+        self.asset_names = {}
+        self.lock = threading.Lock()
+
+    def fetch_dependents(self, asset_id):
+        """Returns the cached list of asset IDs that depend on the asset, querying the site when not cached
+
+        :param asset_id: (int) asset ID
+        :return: (set) of int dependent asset IDs
+        :raises: Cons3rtApiError
+        """
+        with self.lock:
+            if asset_id in self.dependents:
+                return self.dependents[asset_id]
+        dependent_assets = self.cons3rt_api.get_dependent_assets(asset_id=asset_id)
+        dependent_asset_ids = set()
+        with self.lock:
+            for dependent_asset in dependent_assets:
+                dependent_asset_id = int(dependent_asset['id'])
+                dependent_asset_ids.add(dependent_asset_id)
+                if 'name' in dependent_asset:
+                    self.asset_names[dependent_asset_id] = dependent_asset['name']
+            self.dependents[asset_id] = dependent_asset_ids
+        return dependent_asset_ids
+
+    def build(self, asset_ids):
+        """Builds the graph from the provided assets and everything that depends on them
+
+        :param asset_ids: (list) of int asset IDs
+        :return: None
+        :raises: AssetDependencyError
+        """
+        log = logging.getLogger(self.cls_logger + '.build')
+        start_time = time.time()
+        to_fetch = set(int(asset_id) for asset_id in asset_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='assetgraph') as executor:
+            while to_fetch:
+                futures = {executor.submit(self.fetch_dependents, asset_id): asset_id for asset_id in to_fetch}
+                to_fetch = set()
+                for future in as_completed(futures):
+                    try:
+                        dependent_asset_ids = future.result()
+                    except Cons3rtApiError as exc:
+                        msg = 'Problem retrieving dependent assets for asset ID: {i}'.format(i=str(futures[future]))
+                        raise AssetDependencyError(msg) from exc
+                    to_fetch.update(dependent_asset_ids - set(self.dependents.keys()))
+        log.info('Built a dependency graph of {n} assets in {t} seconds'.format(
+            n=str(len(self.dependents)), t=str(round(time.time() - start_time, 2))))
+
+    def get_all_dependents(self, asset_id):
+        """Returns every asset that directly or transitively depends on the asset
+
+        :param asset_id: (int) asset ID
+        :return: (set) of int asset IDs
+        """
+        found = set()
+        to_visit = list(self.dependents.get(int(asset_id), set()))
+        while to_visit:
+            dependent_asset_id = to_visit.pop()
+            if dependent_asset_id in found:
+                continue
+            found.add(dependent_asset_id)
+            to_visit += list(self.dependents.get(dependent_asset_id, set()))
+        return found
+
+    def get_levels(self, asset_ids=None, dependents_first=True):
+        """Splits the assets into levels that can each be processed in parallel
+
+        With dependents_first, the first level contains assets nothing else in the set depends on, which
+        is the safe order for deletes and visibility restrictions.  Reverse it for visibility expansions.
+
+        :param asset_ids: (list) of int asset IDs, defaults to every asset in the graph
+        :param dependents_first: (bool) set False to order dependencies before their dependents
+        :return: (list) of lists of int asset IDs
+        :raises: AssetDependencyError
+        """
+        if asset_ids is None:
+            asset_ids = set(self.dependents.keys())
+        else:
+            asset_ids = set(int(asset_id) for asset_id in asset_ids)
+        remaining_dependents = {}
+        for asset_id in asset_ids:
+            remaining_dependents[asset_id] = set(self.dependents.get(asset_id, set())) & asset_ids
+        levels = []
+        while remaining_dependents:
+            level = sorted(asset_id for asset_id, deps in remaining_dependents.items() if not deps)
+            if not level:
+                msg = 'Dependency cycle found among asset IDs: {i}'.format(i=str(sorted(remaining_dependents.keys())))
+                raise AssetDependencyError(msg)
+            levels.append(level)
+            for asset_id in level:
+                del remaining_dependents[asset_id]
+            for deps in remaining_dependents.values():
+                deps.difference_update(level)
+        if not dependents_first:
+            levels.reverse()
+        return levels
+
+    def run_levels(self, levels, func, action):
+        """Runs the function on each asset, level by level, with the assets in a level in parallel
+
+        Processing stops after a level with failures, since the following levels depend on it.
+
+        :param levels: (list) of lists of int asset IDs
+        :param func: (callable) function that takes an int asset ID
+        :param action: (str) description of the action for logging
+        :return: (dict) of lists of int asset IDs: succeeded, failed, and skipped
+        """
+        log = logging.getLogger(self.cls_logger + '.run_levels')
+        results = {'succeeded': [], 'failed': [], 'skipped': []}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='assetgraph') as executor:
+            for level_num, level in enumerate(levels, start=1):
+                if results['failed']:
+                    results['skipped'] += level
+                    continue
+                log.info('Running {a} on level {n} of {t} with {c} assets'.format(
+                    a=action, n=str(level_num), t=str(len(levels)), c=str(len(level))))
+                futures = {executor.submit(func, asset_id): asset_id for asset_id in level}
+                for future in as_completed(futures):
+                    asset_id = futures[future]
+                    try:
+                        future.result()
+                    except Cons3rtApiError as exc:
+                        log.error('Problem running {a} on asset ID [{i}]\n{e}'.format(
+                            a=action, i=str(asset_id), e=str(exc)))
+                        results['failed'].append(asset_id)
+                    else:
+                        results['succeeded'].append(asset_id)
+        if results['skipped']:
+            log.warning('Skipped {a} on {n} assets due to failures in an earlier level'.format(
+                a=action, n=str(len(results['skipped']))))
+        return results
+
+    def delete_assets(self, asset_ids, include_dependents=False, force=False):
+        """Deletes assets with their dependents deleted first, running each level in parallel
+
+        :param asset_ids: (list) of int asset IDs to delete
+        :param include_dependents: (bool) set True to also delete every asset that depends on them
+        :param force: (bool) passed through to the delete API call
+        :return: (dict) of lists of int asset IDs: succeeded, failed, skipped, and blocked (assets with
+                 dependents outside of the set when include_dependents is False)
+        :raises: AssetDependencyError
+        """
+        log = logging.getLogger(self.cls_logger + '.delete_assets')
+        asset_ids = set(int(asset_id) for asset_id in asset_ids)
+        self.build(asset_ids=asset_ids)
+        blocked = set()
+        if include_dependents:
+            for asset_id in list(asset_ids):
+                asset_ids.update(self.get_all_dependents(asset_id=asset_id))
+        else:
+            for asset_id in asset_ids:
+                if self.get_all_dependents(asset_id=asset_id) - asset_ids:
+                    blocked.add(asset_id)
+            # Dependencies of blocked assets are blocked too
+            for asset_id in asset_ids:
+                if self.get_all_dependents(asset_id=asset_id) & blocked:
+                    blocked.add(asset_id)
+            if blocked:
+                log.warning('Not deleting {n} assets with dependents outside of the delete list: {i}'.format(
+                    n=str(len(blocked)), i=str(sorted(blocked))))
+        levels = self.get_levels(asset_ids=asset_ids - blocked, dependents_first=True)
+        results = self.run_levels(
+            levels=levels,
+            func=lambda asset_id: self.cons3rt_api.delete_asset(asset_id=asset_id, force=force),
+            action='delete'
+        )
+        results['blocked'] = sorted(blocked)
+        return results
+
+    def fetch_visibility(self, asset_id):
+        """Returns the current visibility of the asset
+
+        The asset type is not known, so software, container, and test asset details are tried in turn.
+
+        :param asset_id: (int) asset ID
+        :return: (str) asset visibility
+        :raises: Cons3rtApiError
+        """
+        err_msg = ''
+        for retrieve_func in [self.cons3rt_api.retrieve_software_asset, self.cons3rt_api.retrieve_container_asset,
+                              self.cons3rt_api.retrieve_test_asset]:
+            try:
+                asset = retrieve_func(asset_id=asset_id)
+            except Cons3rtApiError as exc:
+                err_msg = str(exc)
+                continue
+            if asset and asset.get('visibility'):
+                return asset['visibility'].upper()
+        raise Cons3rtApiError('Unable to determine the visibility of asset ID [{i}]: {e}'.format(
+            i=str(asset_id), e=err_msg))
+
+    def get_current_visibility(self, assets):
+        """Returns the current visibility of each asset, retrieving it for assets provided only by ID
+
+        :param assets: (list) of int asset IDs, or asset dicts containing "id" and optionally "visibility"
+        :return: (dict) of int asset ID to str visibility
+        :raises: AssetDependencyError
+        """
+        current_visibility = {}
+        to_fetch = []
+        for asset in assets:
+            if isinstance(asset, dict):
+                if asset.get('visibility'):
+                    current_visibility[int(asset['id'])] = asset['visibility'].upper()
+                else:
+                    to_fetch.append(int(asset['id']))
+            else:
+                to_fetch.append(int(asset))
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='assetgraph') as executor:
+            futures = {executor.submit(self.fetch_visibility, asset_id): asset_id for asset_id in to_fetch}
+            for future in as_completed(futures):
+                try:
+                    current_visibility[futures[future]] = future.result()
+                except Cons3rtApiError as exc:
+                    msg = 'Problem retrieving the visibility of asset ID: {i}'.format(i=str(futures[future]))
+                    raise AssetDependencyError(msg) from exc
+        return current_visibility
+
+    def update_asset_visibility(self, asset_ids, visibility, trusted_projects=None):
+        """Updates the visibility of assets in dependency order, running each level in parallel
+
+        Assets whose visibility is restricted are updated dependents first, so no asset is left depending
+        on an asset it can no longer see.  Assets whose visibility is expanded (or unchanged, for example to
+        add trusted projects) are updated dependencies first for the same reason.  The direction is decided
+        per asset from its current and desired rank in visibility_order.
+
+        :param asset_ids: (list) of int asset IDs to update, or asset dicts containing "id" and "visibility"
+            to avoid retrieving the current visibility
+        :param visibility: (str) desired asset visibility
+        :param trusted_projects: (list) of int project IDs to add for TRUSTED_PROJECTS
+        :return: (dict) of lists of int asset IDs: succeeded, failed, and skipped
+        :raises: AssetDependencyError
+        """
+        log = logging.getLogger(self.cls_logger + '.update_asset_visibility')
+        visibility = visibility.upper().strip()
+        if visibility not in visibility_order:
+            raise AssetDependencyError('Provided visibility is not valid: {s}, must be one of: {v}'.format(
+                s=visibility, v=visibility_order))
+        current_visibility = self.get_current_visibility(assets=asset_ids)
+        target_rank = visibility_order.index(visibility)
+        restricted = set()
+        expanded = set()
+        for asset_id, current in current_visibility.items():
+            current_rank = visibility_order.index(current) if current in visibility_order else target_rank
+            if target_rank < current_rank:
+                restricted.add(asset_id)
+            else:
+                expanded.add(asset_id)
+        log.info('Restricting visibility of {r} assets and expanding visibility of {e} assets to: {v}'.format(
+            r=str(len(restricted)), e=str(len(expanded)), v=visibility))
+        self.build(asset_ids=list(current_visibility.keys()))
+        results = {'succeeded': [], 'failed': [], 'skipped': []}
+        for asset_group, dependents_first in [(restricted, True), (expanded, False)]:
+            if not asset_group:
+                continue
+            levels = self.get_levels(asset_ids=asset_group, dependents_first=dependents_first)
+            group_results = self.run_levels(
+                levels=levels,
+                func=lambda asset_id: self.cons3rt_api.update_asset_visibility(
+                    asset_id=asset_id, visibility=visibility, trusted_projects=trusted_projects),
+                action='visibility update to {v}'.format(v=visibility)
+            )
+            for key in results.keys():
+                results[key] += group_results[key]
+        return results
@@ -7,13 +7,14 @@ metadata service.
 
 """
 import logging
+import threading
 import time
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from .bash import get_mac_addresses
 from .logify import Logify
 from .exceptions import AWSMetaDataError, CommandError
+from .metadataclient import MetadataClient, character_encoding
 
 
 __author__ = 'Joe Yennaco'
@@ -25,6 +26,9 @@ mod_logger = Logify.get_name() + '.aws_metadata'
 # AWS Meta Data Service URL
 metadata_url = 'http://169.254.169.254/latest/meta-data/'
 
+# AWS IMDSv2 session token URL
+token_url = 'http://169.254.169.254/latest/api/token'
+
 # Number of seconds to timeout after, AWS should return quickly
 query_timeout_sec = 5
 
@@ -34,8 +38,195 @@ retry_time_sec = 3
 # number of re-tries before giving up
 max_num_tries = 3
 
-# Character encoding
-character_encoding = 'utf-8'
+# Lifetime requested for IMDSv2 tokens, and the time before expiration to get a new one
+token_ttl_sec = 21600
+token_refresh_ahead_sec = 60
+
+# Metadata paths that do not change while the instance is up, cached in the metadata cache file
+immutable_paths = [
+    'ami-id',
+    'instance-id',
+    'instance-type',
+    'mac',
+    'placement/availability-zone',
+    'placement/region',
+    'network/interfaces/macs/'
+]
+
+# Name of the cache file in the pycons3rt data directory
+cache_file_name = 'aws_metadata_cache.json'
+
+# Default number of concurrent requests when fetching a metadata tree
+default_tree_max_workers = 8
+
+# Shared client used by the module functions
+shared_client = None
+shared_client_lock = threading.Lock()
+
+
+class AwsMetadataClient(MetadataClient):
+    """Client for the AWS instance metadata service
+
+    Uses IMDSv2 session tokens, reused until shortly before they expire, and falls back to IMDSv1 when
+    the service does not issue tokens.
+
+    :param cache_file: (str) path to the file of cached immutable values, defaults to the pycons3rt data dir
+    :param use_cache_file: (bool) Set False to keep cached values in memory only
+    """
+
+    def __init__(self, cache_file=None, use_cache_file=True):
+        super(AwsMetadataClient, self).__init__(
+            query_timeout_sec=query_timeout_sec, retry_time_sec=retry_time_sec, max_num_tries=max_num_tries)
+        self.cls_logger = mod_logger + '.AwsMetadataClient'
+        if use_cache_file:
+            self.cache_file = cache_file if cache_file else self.get_default_cache_file(cache_file_name)
+        self.token = None
+        self.token_expiration = 0
+        self.imds_v1 = False
+        self.on_aws = None
+
+    def get_token_headers(self, refresh=False):
+        """Returns the headers with a valid IMDSv2 token, getting a new token when needed
+
+        :param refresh: (bool) Set True to get a new token even if the current one is valid
+        :return: (dict) request headers, empty when using IMDSv1
+        :raises: AWSMetaDataError
+        """
+        log = logging.getLogger(self.cls_logger + '.get_token_headers')
+        with self.lock:
+            if self.imds_v1:
+                return {}
+            if self.token and not refresh and time.time() < self.token_expiration - token_refresh_ahead_sec:
+                return {'X-aws-ec2-metadata-token': self.token}
+            response = self.request(
+                method='PUT', url=token_url, headers={'X-aws-ec2-metadata-token-ttl-seconds': str(token_ttl_sec)})
+            if response is None:
+                raise AWSMetaDataError('Unable to reach the AWS metadata service: {u}'.format(u=token_url))
+            if response.status_code in [403, 404, 405]:
+                log.info('IMDSv2 tokens not available, using IMDSv1')
+                self.imds_v1 = True
+                return {}
+            if response.status_code != 200:
+                msg = 'AWS metadata service returned code {c} requesting a token'.format(c=str(response.status_code))
+                raise AWSMetaDataError(msg)
+            self.token = response.content.decode(character_encoding)
+            self.token_expiration = time.time() + token_ttl_sec
+            return {'X-aws-ec2-metadata-token': self.token}
+
+    def get(self, path):
+        """Returns the value at the metadata path
+
+        :param path: (str) metadata path relative to the meta-data URL, directories end with /
+        :return: (str) value, or None if the path does not exist
+        :raises: AWSMetaDataError
+        """
+        url = metadata_url + path
+        response = self.request(method='GET', url=url, headers=self.get_token_headers())
+        if response is not None and response.status_code == 401:
+            response = self.request(method='GET', url=url, headers=self.get_token_headers(refresh=True))
+        if response is None:
+            raise AWSMetaDataError('Unable to reach the AWS metadata service: {u}'.format(u=url))
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            msg = 'There was a problem querying url: {u}, returned code: {c}'.format(u=url, c=response.status_code)
+            raise AWSMetaDataError(msg)
+        return response.content.decode(character_encoding)
+
+    def get_value(self, path):
+        """Returns the value at the metadata path, from the cache for immutable paths
+
+        :param path: (str) metadata path relative to the meta-data URL
+        :return: (str) value, or None if the path does not exist
+        :raises: AWSMetaDataError
+        """
+        if path in immutable_paths:
+            return self.get_cached(key=path, func=lambda: self.get(path))
+        return self.get(path)
+
+    def get_tree(self, path='', max_workers=default_tree_max_workers):
+        """Returns the metadata tree under the path, fetching each level of the tree concurrently
+
+        :param path: (str) metadata directory path ending with /, or empty for the whole tree
+        :param max_workers: (int) number of concurrent requests
+        :return: (dict) nested dict of the metadata, keyed by the entry names without trailing /
+        :raises: AWSMetaDataError
+        """
+        log = logging.getLogger(self.cls_logger + '.get_tree')
+        start_time = time.time()
+        tree = {}
+        num_requests = 0
+        level = [(path, tree)]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='metadata') as executor:
+            while level:
+                listings = list(executor.map(lambda item: self.get_value(item[0]), level))
+                num_requests += len(level)
+                leaves = []
+                next_level = []
+                for (dir_path, node), listing in zip(level, listings):
+                    for entry in (listing or '').splitlines():
+                        entry = entry.strip()
+                        if not entry:
+                            continue
+                        if entry.endswith('/'):
+                            node[entry[:-1]] = {}
+                            next_level.append((dir_path + entry, node[entry[:-1]]))
+                        else:
+                            leaves.append((dir_path + entry, node, entry))
+                values = list(executor.map(lambda item: self.get_value(item[0]), leaves))
+                num_requests += len(leaves)
+                for (_, node, entry), value in zip(leaves, values):
+                    node[entry] = value
+                level = next_level
+        log.info('Fetched metadata tree [{p}] with {n} requests in {t} seconds'.format(
+            p=path, n=str(num_requests), t=str(round(time.time() - start_time, 2))))
+        return tree
+
+    def is_aws(self):
+        """Determines if this system is on AWS, remembering a positive answer for this client
+
+        A negative answer is not remembered, so a metadata service that was briefly unreachable is
+        queried again on the next call.
+
+        :return: bool True if this system is running on AWS
+        """
+        log = logging.getLogger(self.cls_logger + '.is_aws')
+        with self.lock:
+            if self.on_aws:
+                return True
+            log.info('Querying AWS meta data URL to determine if this system is on AWS: {u}'.format(u=metadata_url))
+            try:
+                self.on_aws = self.get_value('instance-id') is not None
+            except AWSMetaDataError as exc:
+                log.info('Unable to query the AWS meta data URL, this system appears to be not running on AWS\n'
+                         '{e}'.format(e=str(exc)))
+                return False
+            return self.on_aws
+
+
+def get_aws_metadata_client():
+    """Returns the shared AWS metadata client
+
+    :return: (AwsMetadataClient)
+    """
+    global shared_client
+    with shared_client_lock:
+        if shared_client is None:
+            shared_client = AwsMetadataClient()
+        return shared_client
+
+
+def get_metadata_value(path):
+    """Returns the value at the metadata path, logging instead of raising on errors
+
+    :param path: (str) metadata path relative to the meta-data URL
+    :return: (str) value or None
+    """
+    log = logging.getLogger(mod_logger + '.get_metadata_value')
+    try:
+        return get_aws_metadata_client().get_value(path)
+    except AWSMetaDataError as exc:
+        log.error('Unable to query metadata path [{p}]\n{e}'.format(p=path, e=str(exc)))
 
 
 def is_aws():
@@ -43,41 +234,7 @@ def is_aws():
 
     :return: bool True if this system is running on AWS
     """
-    log = logging.getLogger(mod_logger + '.is_aws')
-    log.info('Querying AWS meta data URL to determine if this system is on AWS: {u}'.format(u=metadata_url))
-
-    # Re-try logic for checking the AWS metadata URL
-    attempt_num = 1
-
-    while True:
-        if attempt_num > max_num_tries:
-            log.info('Unable to query the AWS meta data URL, this system appears to be not running on AWS')
-            return False
-
-        # Query the AWS metadata URL
-        try:
-            response = requests.get(metadata_url, timeout=query_timeout_sec)
-        except(IOError, OSError) as ex:
-            log.info('OSError querying the AWS meta data URL\n{e}'.format(e=str(ex)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
-        except requests.exceptions.ConnectTimeout as ex:
-            log.info('Timeout after [{t}] seconds on query the AWS meta data URL\n{e}'.format(
-                t=str(query_timeout_sec), e=str(ex)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
-
-        # Check the code
-        if response.status_code == 200:
-            log.info('AWS metadata service returned code 200, this system is running on AWS')
-            return True
-        else:
-            log.warning('AWS metadata service returned error code: {c}'.format(c=str(response.status_code)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
+    return get_aws_metadata_client().is_aws()
 
 
 def get_instance_id():
@@ -91,26 +248,7 @@ def get_instance_id():
     if not is_aws():
         log.info('This machine is not running in AWS, exiting...')
         return
-
-    instance_id_url = metadata_url + 'instance-id'
-    try:
-        response = requests.get(instance_id_url)
-    except(IOError, OSError) as ex:
-        msg = 'Unable to query URL to get instance ID: {u}\n{e}'. \
-            format(u=instance_id_url, e=ex)
-        log.error(msg)
-        return
-
-    # Check the code
-    if response.status_code != 200:
-        msg = 'There was a problem querying url: {u}, returned code: {c}, unable to get the instance-id'.format(
-                u=instance_id_url, c=response.status_code)
-        log.error(msg)
-        return
-    instance_id = response.content
-    if isinstance(instance_id, bytes):
-        instance_id = instance_id.decode(character_encoding)
-    return instance_id
+    return get_metadata_value('instance-id')
 
 
 def get_vpc_id_from_mac_address():
@@ -134,24 +272,8 @@ def get_vpc_id_from_mac_address():
         log.error(msg)
         return
 
-    vpc_id_url = metadata_url + 'network/interfaces/macs/' + mac_address + '/vpc-id'
-    try:
-        response = requests.get(vpc_id_url)
-    except(IOError, OSError) as ex:
-        msg = 'Unable to query URL to get VPC ID: {u}\n{e}'.format(u=vpc_id_url, e=ex)
-        log.error(msg)
-        return
-
-    # Check the code
-    if response.status_code != 200:
-        msg = 'There was a problem querying url: {u}, returned code: {c}, unable to get the vpc-id'.format(
-                u=vpc_id_url, c=response.status_code)
-        log.error(msg)
-        return
-    vpc_id = response.content
-    if isinstance(vpc_id, bytes):
-        vpc_id = vpc_id.decode(character_encoding)
-    return vpc_id
+    # Query the metadata service
+    return get_metadata_value('network/interfaces/macs/' + mac_address + '/vpc-id')
 
 
 def get_owner_id_from_mac_address():
@@ -175,24 +297,8 @@ def get_owner_id_from_mac_address():
         log.error(msg)
         return
 
-    owner_id_url = metadata_url + 'network/interfaces/macs/' + mac_address + '/owner-id'
-    try:
-        response = requests.get(owner_id_url)
-    except(IOError, OSError) as ex:
-        msg = 'Unable to query URL to get Owner ID: {u}\n{e}'.format(u=owner_id_url, e=ex)
-        log.error(msg)
-        return
-
-    # Check the code
-    if response.status_code != 200:
-        msg = 'There was a problem querying url: {u}, returned code: {c}, unable to get the Owner ID'.format(
-            u=owner_id_url, c=response.status_code)
-        log.error(msg)
-        return
-    owner_id = response.content
-    if isinstance(owner_id, bytes):
-        owner_id = owner_id.decode(character_encoding)
-    return owner_id
+    # Query the metadata service
+    return get_metadata_value('network/interfaces/macs/' + mac_address + '/owner-id')
 
 
 def get_availability_zone():
@@ -207,24 +313,8 @@ def get_availability_zone():
         log.info('This machine is not running in AWS, exiting...')
         return
 
-    availability_zone_url = metadata_url + 'placement/availability-zone'
-    try:
-        response = requests.get(availability_zone_url)
-    except(IOError, OSError) as ex:
-        msg = 'Unable to query URL to get Availability Zone: {u}\n{e}'.format(u=availability_zone_url, e=ex)
-        log.error(msg)
-        return
-
-    # Check the code
-    if response.status_code != 200:
-        msg = 'There was a problem querying url: {u}, returned code: {c}, unable to get the Availability Zone'.format(
-            u=availability_zone_url, c=response.status_code)
-        log.error(msg)
-        return
-    availability_zone = response.content
-    if isinstance(availability_zone, bytes):
-        availability_zone = availability_zone.decode(character_encoding)
-    return availability_zone
+    # Query the metadata service
+    return get_metadata_value('placement/availability-zone')
 
 
 def get_region():
@@ -260,6 +350,22 @@ def get_primary_mac_address():
         msg = 'Problem getting mac addresses on this host'
         raise AWSMetaDataError(msg) from exc
     if 'eth0' not in mac_addresses.keys():
+        # Newer instance types name the primary interface differently, ask the metadata service
+        mac_address = get_aws_metadata_client().get_value('mac')
+        if mac_address:
+            return mac_address
         msg = 'Problem getting the mac address for eth0 from list: {d}'.format(d=str(mac_addresses))
         raise AWSMetaDataError(msg)
     return mac_addresses['eth0']
+
+
+def get_instance_mac_addresses():
+    """Returns the MAC addresses of the network interfaces attached to this instance
+
+    :return: (list) of str MAC addresses
+    :raises: AWSMetaDataError
+    """
+    macs = get_aws_metadata_client().get_value('network/interfaces/macs/')
+    if not macs:
+        return []
+    return [mac.strip().rstrip('/') for mac in macs.splitlines() if mac.strip()]
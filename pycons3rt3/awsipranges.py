@@ -0,0 +1,373 @@
+"""Module: awsipranges
+
+This module provides a cached and indexed copy of the published AWS IP ranges
+document (ip-ranges.json).
+
+The document is kept in the pycons3rt data directory and refreshed with a
+conditional request once it is older than the maximum age, so an unchanged
+document is not downloaded again.  A newer document only replaces the cached
+copy when its syncToken is newer.  When the site cannot be reached, the cached
+copy is used regardless of age, or a pre-seeded snapshot file set with the
+AWS_IP_RANGES_SNAPSHOT environment variable.
+
+The parsed prefixes are indexed by region and service, and a prefix trie
+answers which AWS ranges contain an IP address.
+
+Classes:
+    AwsIpRanges: Loads, refreshes, and queries the AWS IP ranges
+    PrefixTrie: Binary trie of CIDR blocks for IP containment lookups
+
+"""
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from .cons3rtconfig import get_data_dir
+from .exceptions import AWSIpRangesError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.awsipranges'
+
+# URL of the published AWS IP ranges
+ip_ranges_url = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+
+# Default maximum age of the cached document before checking for a newer one
+default_max_age_sec = 86400
+
+# Environment variable with the path to a pre-seeded ip-ranges.json snapshot for offline use
+snapshot_env_var = 'AWS_IP_RANGES_SNAPSHOT'
+
+# Shared instance used by get_aws_ip_ranges
+shared_ip_ranges = None
+shared_ip_ranges_lock = threading.Lock()
+
+
+class PrefixTrie(object):
+    """Binary trie of CIDR blocks for finding every block that contains an IP address
+
+    Each node is a list of [zero child, one child, entries ending at this node].
+    """
+
+    def __init__(self):
+        self.roots = {4: [None, None, []], 6: [None, None, []]}
+
+    def insert(self, cidr, entry):
+        """Adds the CIDR block to the trie
+
+        :param cidr: (str) IPv4 or IPv6 CIDR block
+        :param entry: (object) returned by find for addresses in the block
+        :return: None
+        :raises: ValueError
+        """
+        network = ipaddress.ip_network(cidr, strict=False)
+        node = self.roots[network.version]
+        address = int(network.network_address)
+        for bit_num in range(network.max_prefixlen - 1, network.max_prefixlen - 1 - network.prefixlen, -1):
+            bit = (address >> bit_num) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[2].append(entry)
+
+    def find(self, ip_address):
+        """Returns the entries for every block containing the IP address, least specific first
+
+        :param ip_address: (str) IPv4 or IPv6 address
+        :return: (list) of entries
+        :raises: ValueError
+        """
+        address = ipaddress.ip_address(ip_address)
+        node = self.roots[address.version]
+        found = list(node[2])
+        address_int = int(address)
+        for bit_num in range(address.max_prefixlen - 1, -1, -1):
+            node = node[(address_int >> bit_num) & 1]
+            if node is None:
+                break
+            found += node[2]
+        return found
+
+
+class AwsIpRanges(object):
+    """Cached and indexed AWS IP ranges
+
+    :param cache_file: (str) path to the cached document, defaults to the pycons3rt data directory
+    :param snapshot_file: (str) path to a snapshot to use when offline, defaults to AWS_IP_RANGES_SNAPSHOT
+    :param max_age_sec: (int) seconds before checking the site for a newer document
+    :param offline: (bool) set True to never contact the site
+    """
+
+    def __init__(self, cache_file=None, snapshot_file=None, max_age_sec=default_max_age_sec, offline=False):
+        self.cls_logger = mod_logger + '.AwsIpRanges'
+        if cache_file:
+            self.cache_file = cache_file
+        else:
+            self.cache_file = os.path.join(get_data_dir(), 'aws-ip-ranges.json')
+        self.meta_file = self.cache_file + '.meta'
+        if snapshot_file:
+            self.snapshot_file = snapshot_file
+        else:
+            self.snapshot_file = os.environ.get(snapshot_env_var)
+        self.max_age_sec = max_age_sec
+        self.offline = offline
+        self.sync_token = None
+        self.create_date = None
+        self.loaded_time = 0
+        self.prefixes = {4: [], 6: []}
+        self.by_region = {4: {}, 6: {}}
+        self.by_service = {4: {}, 6: {}}
+        self.trie = PrefixTrie()
+
+    def is_stale(self):
+        """Determines if the loaded document is older than the maximum age
+
+        :return: (bool) True if the document should be checked for updates
+        """
+        return time.time() - self.loaded_time > self.max_age_sec
+
+    def read_meta(self):
+        """Reads the HTTP validators and last check time of the cached document
+
+        :return: (dict) with etag, last_modified, and checked
+        """
+        try:
+            with open(self.meta_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_json(self, file_path, data):
+        """Atomically writes data to a JSON file
+
+        :param file_path: (str) path to the file
+        :param data: (dict) data to write
+        :return: None
+        :raises: OSError
+        """
+        tmp_file = file_path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, file_path)
+
+    def read_document(self, file_path):
+        """Reads an ip-ranges.json document
+
+        :param file_path: (str) path to the document
+        :return: (dict) document or None if it cannot be read
+        """
+        log = logging.getLogger(self.cls_logger + '.read_document')
+        if not file_path or not os.path.isfile(file_path):
+            return None
+        try:
+            with open(file_path, 'r') as f:
+                document = json.load(f)
+        except (OSError, ValueError) as exc:
+            log.warning('Unable to read AWS IP ranges document [{f}]: {e}'.format(f=file_path, e=str(exc)))
+            return None
+        if 'prefixes' not in document:
+            log.warning('AWS IP ranges document has no prefixes: {f}'.format(f=file_path))
+            return None
+        return document
+
+    def load(self):
+        """Loads the document from the cache, refreshing it from the site when stale
+
+        Falls back to the cached document regardless of age, then to the snapshot file.
+
+        :return: None
+        :raises: AWSIpRangesError
+        """
+        log = logging.getLogger(self.cls_logger + '.load')
+        meta = self.read_meta()
+        document = None
+        cache_age_sec = time.time() - meta.get('checked', 0)
+        if cache_age_sec <= self.max_age_sec or self.offline:
+            document = self.read_document(self.cache_file)
+        if not document and not self.offline:
+            try:
+                document = self.refresh(meta=meta)
+            except AWSIpRangesError as exc:
+                log.warning('Unable to refresh the AWS IP ranges, using a local copy: {e}'.format(e=str(exc)))
+        if not document:
+            document = self.read_document(self.cache_file)
+        if not document:
+            document = self.read_document(self.snapshot_file)
+            if document:
+                log.info('Loaded AWS IP ranges from snapshot: {f}'.format(f=self.snapshot_file))
+        if not document:
+            msg = 'AWS IP ranges are not available from the site, the cache file [{c}], or a snapshot'.format(
+                c=self.cache_file)
+            raise AWSIpRangesError(msg)
+        self.build_index(document=document)
+
+    def refresh(self, meta=None):
+        """Downloads the document when it changed since the cached copy, and updates the cache
+
+        :param meta: (dict) HTTP validators of the cached copy
+        :return: (dict) current document
+        :raises: AWSIpRangesError
+        """
+        log = logging.getLogger(self.cls_logger + '.refresh')
+        if meta is None:
+            meta = self.read_meta()
+        cached_document = self.read_document(self.cache_file)
+        headers = {}
+        if cached_document:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = requests.get(ip_ranges_url, headers=headers, timeout=30)
+        except requests.exceptions.RequestException as exc:
+            msg = 'Problem retrieving the AWS IP ranges from: {u}'.format(u=ip_ranges_url)
+            raise AWSIpRangesError(msg) from exc
+        if response.status_code == 304 and cached_document:
+            log.info('AWS IP ranges unchanged since syncToken: {t}'.format(t=cached_document.get('syncToken')))
+            document = cached_document
+        elif response.status_code == 200:
+            try:
+                document = response.json()
+            except ValueError as exc:
+                msg = 'Problem parsing the AWS IP ranges from: {u}'.format(u=ip_ranges_url)
+                raise AWSIpRangesError(msg) from exc
+            if 'prefixes' not in document:
+                raise AWSIpRangesError('AWS IP ranges document has no prefixes')
+            if cached_document and int(cached_document.get('syncToken', 0)) > int(document.get('syncToken', 0)):
+                log.warning('Downloaded AWS IP ranges are older than the cached copy, keeping syncToken: {t}'.format(
+                    t=cached_document.get('syncToken')))
+                document = cached_document
+            else:
+                log.info('Downloaded AWS IP ranges with syncToken [{t}] created: {c}'.format(
+                    t=document.get('syncToken'), c=document.get('createDate')))
+                self.save(file_path=self.cache_file, data=document)
+        else:
+            msg = 'Problem retrieving the AWS IP ranges, received code [{c}] from: {u}'.format(
+                c=str(response.status_code), u=ip_ranges_url)
+            raise AWSIpRangesError(msg)
+        meta = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked': time.time(),
+            'sync_token': document.get('syncToken')
+        }
+        self.save(file_path=self.meta_file, data=meta)
+        return document
+
+    def save(self, file_path, data):
+        """Writes data to the cache, logging instead of failing since the cache is optional
+
+        :param file_path: (str) path to the file
+        :param data: (dict) data to write
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.save')
+        try:
+            self.write_json(file_path=file_path, data=data)
+        except OSError as exc:
+            log.warning('Unable to write AWS IP ranges cache file [{f}]: {e}'.format(f=file_path, e=str(exc)))
+
+    def build_index(self, document):
+        """Indexes the prefixes in the document by region and service, and builds the prefix trie
+
+        :param document: (dict) ip-ranges.json document
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.build_index')
+        prefixes = {4: [], 6: []}
+        by_region = {4: {}, 6: {}}
+        by_service = {4: {}, 6: {}}
+        trie = PrefixTrie()
+        for version, list_key, prefix_key in [(4, 'prefixes', 'ip_prefix'), (6, 'ipv6_prefixes', 'ipv6_prefix')]:
+            for ip_range in document.get(list_key, []):
+                if prefix_key not in ip_range:
+                    continue
+                record = {
+                    'cidr': ip_range[prefix_key],
+                    'region': ip_range.get('region'),
+                    'service': ip_range.get('service'),
+                    'network_border_group': ip_range.get('network_border_group')
+                }
+                prefixes[version].append(record)
+                by_region[version].setdefault(record['region'], []).append(record)
+                by_service[version].setdefault(record['service'], set()).add(record['cidr'])
+                try:
+                    trie.insert(cidr=record['cidr'], entry=record)
+                except ValueError:
+                    log.warning('Skipping invalid CIDR in AWS IP ranges: {c}'.format(c=record['cidr']))
+        self.prefixes = prefixes
+        self.by_region = by_region
+        self.by_service = by_service
+        self.trie = trie
+        self.sync_token = document.get('syncToken')
+        self.create_date = document.get('createDate')
+        self.loaded_time = time.time()
+        log.info('Indexed {n} IPv4 and {m} IPv6 AWS IP ranges with syncToken: {t}'.format(
+            n=str(len(prefixes[4])), m=str(len(prefixes[6])), t=self.sync_token))
+
+    def get_prefixes(self, ipv6=False, regions=None, services=None):
+        """Returns the prefix records matching the regions and services
+
+        :param ipv6: (bool) Set True for IPv6 prefixes, False for IPv4
+        :param regions: (list) of str region IDs, use 'GLOBAL' for non-region-specific ranges
+        :param services: (list) of str service names
+        :return: (list) of dict prefix records with cidr, region, service, and network_border_group
+        """
+        version = 6 if ipv6 else 4
+        if regions:
+            records = []
+            for region in regions:
+                records += self.by_region[version].get(region, [])
+        else:
+            records = self.prefixes[version]
+        if services:
+            records = [record for record in records if record['service'] in services]
+        return list(records)
+
+    def get_service_cidrs(self, service, ipv6=False):
+        """Returns the CIDR blocks for a service in every region
+
+        :param service: (str) service name
+        :param ipv6: (bool) Set True for IPv6 prefixes, False for IPv4
+        :return: (set) of str CIDR blocks
+        """
+        return set(self.by_service[6 if ipv6 else 4].get(service, set()))
+
+    def lookup(self, ip_address):
+        """Returns the AWS IP ranges containing the IP address, most specific last
+
+        :param ip_address: (str) IPv4 or IPv6 address
+        :return: (list) of dict prefix records
+        :raises: AWSIpRangesError
+        """
+        try:
+            return self.trie.find(ip_address)
+        except ValueError as exc:
+            raise AWSIpRangesError('Invalid IP address: {i}'.format(i=str(ip_address))) from exc
+
+
+def get_aws_ip_ranges(max_age_sec=default_max_age_sec, offline=False):
+    """Returns the shared AwsIpRanges, loading it on first use and reloading it when stale
+
+    :param max_age_sec: (int) seconds before checking the site for a newer document
+    :param offline: (bool) set True to never contact the site
+    :return: (AwsIpRanges) loaded IP ranges
+    :raises: AWSIpRangesError
+    """
+    global shared_ip_ranges
+    with shared_ip_ranges_lock:
+        if shared_ip_ranges is None or shared_ip_ranges.offline != offline:
+            shared_ip_ranges = AwsIpRanges(max_age_sec=max_age_sec, offline=offline)
+        shared_ip_ranges.max_age_sec = max_age_sec
+        if shared_ip_ranges.is_stale():
+            shared_ip_ranges.load()
+        return shared_ip_ranges
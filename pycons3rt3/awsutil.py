@@ -5,9 +5,14 @@ API, common to other AWS utils in this project.
 
 """
 import boto3
+import collections
+import hashlib
+import jmespath
 import logging
 import os
+import threading
 from botocore.client import ClientError
+from botocore.config import Config
 
 from .exceptions import AWSAPIError
 from .logify import Logify
@@ -28,6 +33,24 @@ gov_regions = ['us-gov-east-1', 'us-gov-west-1']
 global_regions = foreign_regions + us_regions
 all_regions = global_regions + gov_regions
 
+# Defaults for the botocore config shared by cached clients
+default_max_pool_connections = 50
+default_retry_mode = 'adaptive'
+default_max_attempts = 10
+
+# Maximum number of cached boto3 clients, the least recently used are dropped first
+default_max_cached_clients = 256
+
+# Process-wide cache of boto3 sessions and clients, see get_boto3_client
+boto3_cache_lock = threading.RLock()
+boto3_sessions = collections.OrderedDict()
+boto3_clients = collections.OrderedDict()
+boto3_config_settings = {
+    'max_pool_connections': default_max_pool_connections,
+    'retry_mode': default_retry_mode,
+    'max_attempts': default_max_attempts
+}
+
 linux_migration_user_data_script_contents = '''#!/bin/bash
 # = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 #
@@ -558,6 +581,15 @@ exit ${result}
 
 '''
 
+# Environment variables holding default chain credentials, part of the default credential identity
+default_credential_env_vars = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']
+
+# Environment variables and default paths of the shared AWS credentials and config files
+default_credential_files = [
+    ('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'),
+    ('AWS_CONFIG_FILE', '~/.aws/config')
+]
+
 # AWS credentials file content template
 aws_credentials_file_content_template = '''[default]
 aws_access_key_id = REPLACE_ACCESS_KEY_ID
@@ -574,30 +606,283 @@ output = text
 '''
 
 
+def get_credential_identity(aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None):
+    """Returns a key identifying a set of credentials without holding the secret
+
+    When no access key is provided the identity is the default credential chain.  botocore
+    only refreshes temporary credentials (instance roles, assume-role profiles, and SSO), and
+    a cached client keeps static keys from the environment or the shared credentials file for
+    its lifetime.  So the identity includes the AWS_PROFILE, a digest of the AWS_ACCESS_KEY_ID,
+    AWS_SECRET_ACCESS_KEY, and AWS_SESSION_TOKEN environment variables, and the modification
+    times of the shared credentials and config files, and a new client is created when any of
+    them change.  Call invalidate_boto3_clients when credentials change in any other way.
+
+    :param aws_access_key_id: (str) AWS Access Key ID
+    :param aws_secret_access_key: (str) AWS Secret Access Key
+    :param aws_session_token: (str) AWS Session Token
+    :return: (tuple) credential identity
+    """
+    digest = hashlib.sha256()
+    if not aws_access_key_id:
+        values = [os.environ.get(name) for name in default_credential_env_vars]
+        for file_env_var, default_file in default_credential_files:
+            file_path = os.path.expanduser(os.environ.get(file_env_var, default_file))
+            try:
+                values.append(os.stat(file_path).st_mtime_ns)
+            except OSError:
+                values.append(None)
+        for value in values:
+            digest.update(str(value).encode('utf-8'))
+            digest.update(b'\0')
+        return 'default', os.environ.get('AWS_PROFILE', ''), digest.hexdigest()
+    for value in [aws_secret_access_key, aws_session_token]:
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return aws_access_key_id, digest.hexdigest()
+
+
+def get_boto3_config(max_pool_connections=None, retry_mode=None, max_attempts=None):
+    """Returns a botocore config for boto3 clients
+
+    :param max_pool_connections: (int) connections kept in each client pool
+    :param retry_mode: (str) botocore retry mode: legacy, standard, or adaptive
+    :param max_attempts: (int) maximum attempts per API call including retries
+    :return: botocore.config.Config object
+    """
+    with boto3_cache_lock:
+        if not max_pool_connections:
+            max_pool_connections = boto3_config_settings['max_pool_connections']
+        if not retry_mode:
+            retry_mode = boto3_config_settings['retry_mode']
+        if not max_attempts:
+            max_attempts = boto3_config_settings['max_attempts']
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={
+            'mode': retry_mode,
+            'total_max_attempts': max_attempts
+        }
+    )
+
+
+def configure_boto3_clients(max_pool_connections=None, retry_mode=None, max_attempts=None):
+    """Sets the botocore config used for cached clients and clears the client cache
+
+    :param max_pool_connections: (int) connections kept in each client pool
+    :param retry_mode: (str) botocore retry mode: legacy, standard, or adaptive
+    :param max_attempts: (int) maximum attempts per API call including retries
+    :return: None
+    """
+    log = logging.getLogger(mod_logger + '.configure_boto3_clients')
+    with boto3_cache_lock:
+        if max_pool_connections:
+            boto3_config_settings['max_pool_connections'] = max_pool_connections
+        if retry_mode:
+            boto3_config_settings['retry_mode'] = retry_mode
+        if max_attempts:
+            boto3_config_settings['max_attempts'] = max_attempts
+        boto3_clients.clear()
+        log.info('Configured boto3 clients: {c}'.format(c=str(boto3_config_settings)))
+
+
+def get_boto3_session(region_name=None, aws_access_key_id=None, aws_secret_access_key=None,
+                      aws_session_token=None):
+    """Gets a cached boto3 session for the region and credentials
+
+    Sessions are not thread-safe, so create clients and resources from them while holding
+    boto3_cache_lock, or use get_boto3_client and get_boto3_resource.
+
+    :param region_name: (str) name of the region
+    :param aws_access_key_id: (str) AWS Access Key ID
+    :param aws_secret_access_key: (str) AWS Secret Access Key
+    :param aws_session_token: (str) AWS Session Token
+    :return: boto3.session.Session object
+    """
+    identity = get_credential_identity(aws_access_key_id=aws_access_key_id,
+                                       aws_secret_access_key=aws_secret_access_key,
+                                       aws_session_token=aws_session_token)
+    session_key = (region_name, identity)
+    with boto3_cache_lock:
+        if session_key in boto3_sessions:
+            boto3_sessions.move_to_end(session_key)
+            return boto3_sessions[session_key]
+        session = boto3.session.Session(
+            region_name=region_name,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            aws_session_token=aws_session_token
+        )
+        boto3_sessions[session_key] = session
+        while len(boto3_sessions) > default_max_cached_clients:
+            boto3_sessions.popitem(last=False)
+    return session
+
+
 def get_boto3_client(service, region_name=None, aws_access_key_id=None, aws_secret_access_key=None,
-                     aws_session_token=None):
-    """Gets an EC2 client
+                     aws_session_token=None, config=None, cached=True):
+    """Gets a boto3 client for the service
+
+    Clients are cached process-wide by service, region, and credential identity, and are
+    thread-safe so they can be shared between threads.  Call invalidate_boto3_clients when
+    credentials rotate.
 
     :param service: (str) name of the service to configure
     :param region_name: (str) name of the region
     :param aws_access_key_id: (str) AWS Access Key ID
     :param aws_secret_access_key: (str) AWS Secret Access Key
     :param aws_session_token: (str) AWS Session Token
+    :param config: (botocore.config.Config) config for the client, bypasses the cache when provided
+    :param cached: (bool) set False to always create a new client
     :return: boto3.client object
     :raises: AWSAPIError
     """
-    try:
-        client = boto3.client(
-            service,
+    identity = get_credential_identity(aws_access_key_id=aws_access_key_id,
+                                       aws_secret_access_key=aws_secret_access_key,
+                                       aws_session_token=aws_session_token)
+    client_key = (service, region_name, identity)
+    use_cache = cached and config is None
+    with boto3_cache_lock:
+        if use_cache and client_key in boto3_clients:
+            boto3_clients.move_to_end(client_key)
+            return boto3_clients[client_key]
+        session = get_boto3_session(
             region_name=region_name,
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
             aws_session_token=aws_session_token
         )
+        if config is None:
+            config = get_boto3_config()
+        try:
+            client = session.client(service, config=config)
+        except ClientError as exc:
+            msg = 'Problem creating a boto3 client, ensure credentials and region are set appropriately.'
+            raise AWSAPIError(msg) from exc
+        if use_cache:
+            boto3_clients[client_key] = client
+            while len(boto3_clients) > default_max_cached_clients:
+                boto3_clients.popitem(last=False)
+    return client
+
+
+def get_boto3_resource(service, region_name=None, aws_access_key_id=None, aws_secret_access_key=None,
+                       aws_session_token=None):
+    """Gets a new boto3 resource for the service from the cached session
+
+    Resources are not thread-safe so they are not cached, but creating them from a cached
+    session reuses the loaded service models.
+
+    :param service: (str) name of the service to configure
+    :param region_name: (str) name of the region
+    :param aws_access_key_id: (str) AWS Access Key ID
+    :param aws_secret_access_key: (str) AWS Secret Access Key
+    :param aws_session_token: (str) AWS Session Token
+    :return: boto3.resource object
+    :raises: AWSAPIError
+    """
+    with boto3_cache_lock:
+        session = get_boto3_session(
+            region_name=region_name,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            aws_session_token=aws_session_token
+        )
+        try:
+            return session.resource(service, config=get_boto3_config())
+        except ClientError as exc:
+            msg = 'Problem creating a boto3 resource, ensure credentials and region are set appropriately.'
+            raise AWSAPIError(msg) from exc
+
+
+def invalidate_boto3_clients(aws_access_key_id=None, region_name=None, service=None):
+    """Removes cached boto3 clients and sessions, for example after credentials rotate
+
+    With no arguments the whole cache is cleared.
+
+    :param aws_access_key_id: (str) only remove entries for this AWS Access Key ID
+    :param region_name: (str) only remove entries for this region
+    :param service: (str) only remove clients for this service
+    :return: (int) number of clients removed
+    """
+    log = logging.getLogger(mod_logger + '.invalidate_boto3_clients')
+    with boto3_cache_lock:
+        removed_clients = [k for k in boto3_clients.keys()
+                           if (service is None or k[0] == service)
+                           and (region_name is None or k[1] == region_name)
+                           and (aws_access_key_id is None or k[2][0] == aws_access_key_id)]
+        for client_key in removed_clients:
+            del boto3_clients[client_key]
+        if service is None:
+            removed_sessions = [k for k in boto3_sessions.keys()
+                                if (region_name is None or k[0] == region_name)
+                                and (aws_access_key_id is None or k[1][0] == aws_access_key_id)]
+            for session_key in removed_sessions:
+                del boto3_sessions[session_key]
+    log.debug('Removed {n} cached boto3 clients'.format(n=str(len(removed_clients))))
+    return len(removed_clients)
+
+
+def reset_boto3_cache_after_fork():
+    """Clears the boto3 cache in a forked child so it does not share connection pools with the parent
+
+    :return: None
+    """
+    global boto3_cache_lock
+    boto3_cache_lock = threading.RLock()
+    boto3_clients.clear()
+    boto3_sessions.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_boto3_cache_after_fork)
+
+
+def paginate(client, operation, search=None, projection=None, page_size=None, **kwargs):
+    """Lazily yields the items from every page of a paginated boto3 operation
+
+    Pages are fetched with the botocore paginator only as the items are consumed, so callers that stop
+    early do not fetch the remaining pages.  Pass server-side filters such as Filters or PathPrefix as
+    keyword arguments.
+
+    :param client: boto3.client object
+    :param operation: (str) name of the paginated client operation, e.g. describe_instances
+    :param search: (str) JMESPath expression that selects the items in each page, defaults to the
+                   operation's result key, e.g. 'Reservations[].Instances[]'
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed,
+                       e.g. '{id: InstanceId, state: State.Name}'
+    :param page_size: (int) number of items to request per page, use the service maximum
+    :param kwargs: parameters passed to the operation
+    :return: generator of items
+    :raises: AWSAPIError
+    """
+    try:
+        paginator = client.get_paginator(operation)
+    except Exception as exc:
+        msg = 'Operation [{o}] cannot be paginated'.format(o=operation)
+        raise AWSAPIError(msg) from exc
+    if page_size:
+        kwargs['PaginationConfig'] = {'PageSize': page_size}
+    if not search:
+        search = paginator.result_keys[0].expression + '[]'
+    search_expression = jmespath.compile(search)
+    projection_expression = None
+    if projection:
+        projection_expression = jmespath.compile(projection)
+    try:
+        for page in paginator.paginate(**kwargs):
+            items = search_expression.search(page)
+            if items is None:
+                continue
+            if not isinstance(items, list):
+                items = [items]
+            for item in items:
+                if projection_expression:
+                    yield projection_expression.search(item)
+                else:
+                    yield item
     except ClientError as exc:
-        msg = 'Problem creating a boto3 client, ensure credentials and region are set appropriately.'
+        msg = 'Problem listing results from operation: {o}'.format(o=operation)
         raise AWSAPIError(msg) from exc
-    return client
 
 
 def get_linux_migration_user_data_script_contents():
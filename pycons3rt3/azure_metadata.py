@@ -8,11 +8,10 @@ metadata service.
 """
 import json
 import logging
-import time
-
-import requests
+import threading
 
 from .logify import Logify
+from .metadataclient import MetadataClient, character_encoding
 
 
 __author__ = 'Joe Yennaco'
@@ -38,8 +37,99 @@ retry_time_sec = 3
 # number of re-tries before giving up
 max_num_tries = 3
 
-# Character encoding
-character_encoding = 'utf-8'
+# Compute metadata that does not change while the VM is up, cached in the metadata cache file
+immutable_compute_keys = ['location', 'name', 'vmId', 'vmSize', 'subscriptionId', 'resourceGroupName']
+
+# Name of the cache file in the pycons3rt data directory
+cache_file_name = 'azure_metadata_cache.json'
+
+# Shared client used by the module functions
+shared_client = None
+shared_client_lock = threading.Lock()
+
+
+class AzureMetadataClient(MetadataClient):
+    """Client for the Azure instance metadata service
+
+    The whole instance metadata document is returned by a single request.  The document holds values
+    that change while the VM runs, such as network interfaces and tags, so it is fetched on each call to
+    get_instance_metadata, and only the immutable compute values are cached, in memory and in the
+    metadata cache file.  A positive answer to is_azure is remembered for the client.
+
+    :param cache_file: (str) path to the file of cached immutable values, defaults to the pycons3rt data dir
+    :param use_cache_file: (bool) Set False to keep cached values in memory only
+    """
+
+    def __init__(self, cache_file=None, use_cache_file=True):
+        super(AzureMetadataClient, self).__init__(
+            query_timeout_sec=query_timeout_sec, retry_time_sec=retry_time_sec, max_num_tries=max_num_tries)
+        self.cls_logger = mod_logger + '.AzureMetadataClient'
+        if use_cache_file:
+            self.cache_file = cache_file if cache_file else self.get_default_cache_file(cache_file_name)
+        self.on_azure = False
+
+    def get_instance_metadata(self):
+        """Queries and returns the Azure instance metadata
+
+        :return: (tuple):
+            bool -- True if this instance is on Azure, False otherwise
+            dict -- Containing Azure instance metadata
+        """
+        log = logging.getLogger(self.cls_logger + '.get_instance_metadata')
+        log.info('Querying Azure meta data URL to determine if this system is on Azure: {u}'.format(u=metadata_url))
+        response = self.request(method='GET', url=metadata_url, headers=headers)
+        if response is None:
+            log.info('Unable to query the Azure meta data URL, this system appears to be not running on Azure')
+            return False, None
+        if response.status_code != 200:
+            log.warning('Azure metadata service returned error code: {c}'.format(c=str(response.status_code)))
+            return False, None
+        log.info('Azure metadata service returned code 200, this system is running on Azure')
+        decoded_content = response.content.decode(character_encoding)
+        try:
+            instance_metadata = json.loads(decoded_content)
+        except json.JSONDecodeError as exc:
+            log.warning('Problem loading response into JSON: {d}\n{e}'.format(d=decoded_content, e=str(exc)))
+            return False, None
+        self.on_azure = True
+        return True, instance_metadata
+
+    def is_azure(self):
+        """Determines if this system is on Azure, remembering a positive answer for this client
+
+        :return: bool True if this system is running on Azure, False otherwise
+        """
+        if self.on_azure:
+            return True
+        is_azure_vm, _ = self.get_instance_metadata()
+        return is_azure_vm
+
+    def get_compute_value(self, key):
+        """Returns a value from the compute section of the instance metadata, cached for immutable keys
+
+        :param key: (str) key in the compute section
+        :return: value or None when not on Azure or not found
+        """
+        def query():
+            is_azure_vm, instance_metadata = self.get_instance_metadata()
+            if not is_azure_vm or not instance_metadata:
+                return None
+            return instance_metadata.get('compute', {}).get(key)
+        if key in immutable_compute_keys:
+            return self.get_cached(key='compute/' + key, func=query)
+        return query()
+
+
+def get_azure_metadata_client():
+    """Returns the shared Azure metadata client
+
+    :return: (AzureMetadataClient)
+    """
+    global shared_client
+    with shared_client_lock:
+        if shared_client is None:
+            shared_client = AzureMetadataClient()
+        return shared_client
 
 
 def get_azure_instance_metadata():
@@ -49,47 +139,7 @@ def get_azure_instance_metadata():
         bool -- True if this instance is on Azure, False otherwise
         dict -- Containing Azure instance metadata
     """
-    log = logging.getLogger(mod_logger + '.get_azure_instance_metadata')
-    log.info('Querying Azure meta data URL to determine if this system is on Azure: {u}'.format(u=metadata_url))
-
-    # Re-try logic for checking the AWS metadata URL
-    attempt_num = 1
-
-    while True:
-        if attempt_num > max_num_tries:
-            log.info('Unable to query the Azure meta data URL, this system appears to be not running on Azure')
-            return False, None
-
-        # Query the AWS metadata URL
-        try:
-            response = requests.get(metadata_url, headers=headers, timeout=query_timeout_sec)
-        except(IOError, OSError) as ex:
-            log.info('Error querying the Azure meta data URL: {u}\n{e}'.format(u=metadata_url, e=str(ex)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
-        except requests.exceptions.ConnectTimeout as ex:
-            log.info('Timeout after [{t}] seconds on query the Azure meta data URL: {u}\n{e}'.format(
-                t=str(query_timeout_sec), u=metadata_url, e=str(ex)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
-
-        # Check the code
-        if response.status_code == 200:
-            log.info('AWS metadata service returned code 200, this system is running on Azure')
-            decoded_content = response.content.decode(character_encoding)
-            try:
-                instance_metadata = json.loads(decoded_content)
-            except json.JSONDecodeError as exc:
-                log.warning('Problem loading response into JSON: {d}\n{e}'.format(d=decoded_content, e=str(exc)))
-                continue
-            return True, instance_metadata
-        else:
-            log.warning('Azure metadata service returned error code: {c}'.format(c=str(response.status_code)))
-            attempt_num += 1
-            time.sleep(retry_time_sec)
-            continue
+    return get_azure_metadata_client().get_instance_metadata()
 
 
 def get_azure_location():
@@ -99,15 +149,10 @@ def get_azure_location():
     """
     log = logging.getLogger(mod_logger + '.get_location')
     log.info('Attempting to determine the Azure VM location from instance metadata...')
-    is_azure_vm, instance_metadata = get_azure_instance_metadata()
-    if is_azure_vm and instance_metadata:
-        if 'compute' in instance_metadata.keys():
-            if 'location' in instance_metadata['compute'].keys():
-                return instance_metadata['compute']['location']
-        log.info('This VM is on Azure, but location data was not found')
-    else:
-        log.info('This VM is not on Azure')
-    return None
+    location = get_azure_metadata_client().get_compute_value('location')
+    if not location:
+        log.info('Azure VM location not found, this VM may not be on Azure')
+    return location
 
 
 def get_azure_region():
@@ -119,8 +164,7 @@ def is_azure():
 
     :return: bool True if this system is running on Azure, False otherwise
     """
-    is_azure_vm, _ = get_azure_instance_metadata()
-    return is_azure_vm
+    return get_azure_metadata_client().is_azure()
 
 
 def get_mac_address_for_ip_address(desired_ip_address):
@@ -165,16 +209,12 @@ def get_azure_vm_id():
     """
     log = logging.getLogger(mod_logger + '.get_azure_vm_id')
     log.info('Attempting to get the Azure VM ID from instance metadata...')
-    is_azure_vm, instance_metadata = get_azure_instance_metadata()
-    if is_azure_vm and instance_metadata:
-        if 'compute' in instance_metadata.keys():
-            if 'vmId' in instance_metadata['compute'].keys():
-                log.info('Found Azure VM ID: {i}'.format(i=instance_metadata['compute']['vmId']))
-                return instance_metadata['compute']['vmId']
-        log.info('This VM is on Azure, but vmId data was not found')
+    value = get_azure_metadata_client().get_compute_value('vmId')
+    if value:
+        log.info('Found Azure VM ID: {i}'.format(i=value))
     else:
-        log.info('This VM is not on Azure')
-    return None
+        log.info('Azure vmId data not found, this VM may not be on Azure')
+    return value
 
 
 def get_azure_vm_size():
@@ -184,13 +224,9 @@ def get_azure_vm_size():
     """
     log = logging.getLogger(mod_logger + '.get_azure_vm_size')
     log.info('Attempting to get the Azure VM size from instance metadata...')
-    is_azure_vm, instance_metadata = get_azure_instance_metadata()
-    if is_azure_vm and instance_metadata:
-        if 'compute' in instance_metadata.keys():
-            if 'vmSize' in instance_metadata['compute'].keys():
-                log.info('Found Azure VM size: {i}'.format(i=instance_metadata['compute']['vmSize']))
-                return instance_metadata['compute']['vmSize']
-        log.info('This VM is on Azure, but vmSize data was not found')
+    value = get_azure_metadata_client().get_compute_value('vmSize')
+    if value:
+        log.info('Found Azure VM size: {i}'.format(i=value))
     else:
-        log.info('This VM is not on Azure')
-    return None
+        log.info('Azure vmSize data not found, this VM may not be on Azure')
+    return value
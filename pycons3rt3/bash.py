@@ -6,24 +6,23 @@ This module provides utilities for running standard bash commands
 from python.
 
 """
+import collections
 import logging
 import os
 import subprocess
 import errno
-import fileinput
 import re
-import sys
-import zipfile
-import contextlib
-import signal
 import time
 import platform
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from threading import Timer
 
+from .archiver import ZipArchiver
+from .commandrunner import CommandRunner
 from .logify import Logify
-from .exceptions import CommandError, SystemRebootError, SystemRebootTimeoutError
+from .exceptions import ArchiveError, CommandError, SystemRebootError, SystemRebootTimeoutError
 from .network import validate_ip_address as network_validate_ip_address
 
 __author__ = 'Joe Yennaco'
@@ -32,6 +31,13 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.bash'
 
+# Seconds an OpenSSH master connection stays open after its last remote command
+ssh_control_persist_sec = 300
+
+# Directory for OpenSSH control sockets, shared by remote commands to the same host
+ssh_control_dir = os.path.join(tempfile.gettempdir(), 'pycons3rt-ssh-{u}'.format(
+    u=str(os.getuid()) if hasattr(os, 'getuid') else 'user'))
+
 
 def process_killer(p):
     """Returns a function to kill the process p
@@ -47,14 +53,63 @@ def enqueue_output(out, queue):
     out.close()
 
 
+def print_command_output_line(stream, line):
+    """Prints a line of command output
+
+    :param stream: (str) stdout or stderr
+    :param line: (str) line of output
+    :return: None
+    """
+    print('>>> ' + line)
+
+
+def get_ssh_command(host, user=None, port=22):
+    """Returns the ssh command prefix for running remote commands on the host
+
+    On systems that support it, the command shares an OpenSSH master connection per
+    user, host, and port, so consecutive remote commands skip the handshake and
+    authentication.  The master closes after ssh_control_persist_sec without use, and
+    ssh falls back to a direct connection if the master socket is stale.
+
+    :param host: (str) host to connect to
+    :param user: (str) username on the remote host
+    :param port: (int) SSH port to connect on the remote machine
+    :return: (list) ssh command and args, without the remote command
+    """
+    log = logging.getLogger(mod_logger + '.get_ssh_command')
+    ssh_command = ['ssh']
+    if platform.system() != 'Windows':
+        try:
+            os.makedirs(ssh_control_dir, mode=0o700, exist_ok=True)
+        except OSError as exc:
+            log.warning('Unable to create SSH control directory [{d}], connections will not be shared: {e}'.format(
+                d=ssh_control_dir, e=str(exc)))
+        else:
+            ssh_command += [
+                '-o', 'ControlMaster=auto',
+                '-o', 'ControlPath={d}/%C'.format(d=ssh_control_dir),
+                '-o', 'ControlPersist={t}'.format(t=str(ssh_control_persist_sec))
+            ]
+    if port != 22:
+        ssh_command += ['-p', str(port)]
+    if user:
+        ssh_command += ['{u}@{h}'.format(u=user, h=host)]
+    else:
+        ssh_command += ['{h}'.format(h=host)]
+    return ssh_command
+
+
 def run_command(command, timeout_sec=3600.0, output=True, bufsize=-1, print_output=True):
     """Runs a command using the subprocess module
 
+    Output is read in chunks and collected in an OutputBuffer, which spills to a temporary
+    file for very large output, so memory use stays bounded while the command runs.
+
     :param command: List containing the command and all args
     :param timeout_sec: (float) seconds to wait before killing
         the command.
     :param output: (bool) True collects output, False ignores output
-    :param bufsize: (int) See python3 subprocess docs
+    :param bufsize: (int) Not used, output is read in fixed size chunks
     :param print_output: (bool) Set True to print command output, False to not print
     :return: Dict containing the command output and return code
     :raises CommandError
@@ -62,67 +117,41 @@ def run_command(command, timeout_sec=3600.0, output=True, bufsize=-1, print_outp
     log = logging.getLogger(mod_logger + '.run_command')
     if not isinstance(command, list):
         raise CommandError('command arg must be a list')
-    if output:
-        subproc_stdout = subprocess.PIPE
-        subproc_stderr = subprocess.STDOUT
-    else:
-        subproc_stdout = None
-        subproc_stderr = None
     command_str = ' '.join(command)
-    timer = None
     log.debug('Running command: {c}'.format(c=command_str))
-    output_collector = ''
-    try:
-        log.debug('Opening subprocess...')
-        subproc = subprocess.Popen(
-            command,
-            bufsize=bufsize,
-            stdin=subprocess.DEVNULL,
-            stdout=subproc_stdout,
-            stderr=subproc_stderr)
-        log.debug('Opened subprocess wih PID: {p}'.format(p=subproc.pid))
-        log.debug('Setting up process kill timer for PID {p} at {s} sec...'.format(p=subproc.pid, s=timeout_sec))
-        kill_proc = process_killer
-        timer = Timer(timeout_sec, kill_proc, [subproc])
-        timer.start()
-        if output:
-            log.debug('Collecting and logging output...')
-            with subproc.stdout:
-                for line in iter(subproc.stdout.readline, b''):
-                    line_str = line.decode('utf-8')
-                    line_str = str(line_str).rstrip()
-                    output_collector += line_str + '\n'
-                    if print_output:
-                        print(">>> " + line_str)
-        log.debug('Waiting for process completion...')
-        subproc.wait()
-        log.debug('Collecting the exit code...')
-        code = subproc.poll()
-    except ValueError as exc:
-        raise CommandError('Bad command supplied: {c}'.format(c=command_str)) from exc
-    except (OSError, IOError) as exc:
-        raise CommandError('There was a problem running command: {c}'.format(c=command_str)) from exc
-    except subprocess.CalledProcessError as exc:
-        raise CommandError('Command returned a non-zero exit code: {c}, return code'.format(c=command_str)) from exc
-    finally:
-        if timer is not None:
-            log.debug('Cancelling the timer...')
-            timer.cancel()
-        else:
-            log.debug('No need to cancel the timer.')
-    # Collect exit code and output for return
-    output = output_collector.strip()
-    try:
-        code = int(code)
-    except ValueError as exc:
-        raise CommandError('Return code {c} could not be parsed into an int'.format(c=code)) from exc
-    else:
-        log.debug('Command executed and returned code: {c} with output:\n{o}'.format(c=code, o=output))
-        output = {
-            'output': output,
+    if not output:
+        try:
+            subproc = subprocess.Popen(command, stdin=subprocess.DEVNULL)
+        except ValueError as exc:
+            raise CommandError('Bad command supplied: {c}'.format(c=command_str)) from exc
+        except (OSError, IOError) as exc:
+            raise CommandError('There was a problem running command: {c}'.format(c=command_str)) from exc
+        try:
+            code = subproc.wait(timeout=timeout_sec)
+        except subprocess.TimeoutExpired:
+            log.error('Command timeout of {t} seconds expired for: [{c}]'.format(t=str(timeout_sec), c=command_str))
+            subproc.kill()
+            code = subproc.wait()
+        return {
+            'output': '',
             'code': code
         }
-    return output
+    runner = CommandRunner(
+        command=command,
+        timeout_sec=timeout_sec,
+        merge_stderr=True,
+        line_callback=print_command_output_line if print_output else None
+    )
+    result = runner.run()
+    try:
+        output = '\n'.join(line.rstrip() for line in result['stdout'].get_text().splitlines()).strip()
+    finally:
+        result['stdout'].close()
+    log.debug('Command executed and returned code: {c} with output:\n{o}'.format(c=result['code'], o=output))
+    return {
+        'output': output,
+        'code': result['code']
+    }
 
 
 def run_command_large_buffer(command, timeout_sec=3600.0):
@@ -140,48 +169,171 @@ def run_command_large_buffer(command, timeout_sec=3600.0):
     command_str = ' '.join(command)
     log.info('Running command: {c}'.format(c=command_str))
     print('Running command: {c}'.format(c=command_str))
-    subproc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    pid = subproc.pid
-    log.debug('Opened up PID {p} with a timeout of {s} sec...'.format(p=pid, s=str(timeout_sec)))
-    timeout = False
-    stdout = ''
-    stderr = ''
+    runner = CommandRunner(command=command, timeout_sec=timeout_sec)
+    result = runner.run()
     try:
-        stdout, stderr = subproc.communicate(timeout=timeout_sec)
-    except ValueError as exc:
-        raise CommandError('Bad command supplied: {c}'.format(c=command_str)) from exc
-    except (OSError, IOError) as exc:
-        raise CommandError('There was a problem running command: {c}'.format(c=command_str)) from exc
-    except subprocess.CalledProcessError as exc:
-        raise CommandError('Command returned a non-zero exit code: {c}, return code'.format(c=command_str)) from exc
-    except subprocess.TimeoutExpired:
-        log.error('Command timeout of {t} seconds expired for: [{c}]'.format(t=str(timeout_sec), c=command_str))
-        timeout = True
+        if result['timed_out']:
+            raise CommandError('Command timed out: {c}'.format(c=command_str))
+        output = {
+            'stdout': result['stdout'].get_text(),
+            'stderr': result['stderr'].get_text(),
+            'code': result['code']
+        }
+    finally:
+        result['stdout'].close()
+        result['stderr'].close()
+    return output
+
+
+def run_commands(commands, max_workers=4, timeout_sec=3600.0, print_output=False, fail_fast=False):
+    """Runs independent commands in parallel, in dependency order when dependencies are provided
+
+    Each command is a list of command args, or a dict with:
+        name: (str) unique name, defaults to the command string with a #2, #3, ... suffix for repeats
+        command: (list) command and args
+        depends_on: (list) of names of commands that must succeed first
+        timeout_sec: (float) timeout for this command, defaults to timeout_sec
 
-    if timeout:
-        log.info('Attempting to kill the PID: {p}'.format(p=str(pid)))
+    A command starts as soon as the commands it depends on have succeeded and a worker is free.
+    When a command fails or times out, every command that depends on it, directly or not, is
+    skipped.  With fail_fast, no new commands are started after the first failure.
+
+    :param commands: (list) of commands
+    :param max_workers: (int) maximum number of commands running at once
+    :param timeout_sec: (float) default seconds to wait before killing each command
+    :param print_output: (bool) Set True to print command output prefixed with the command name
+    :param fail_fast: (bool) Set True to stop starting commands after the first failure
+    :return: (dict) of command name to a dict with: status (succeeded, failed, timed_out, or skipped),
+             code, output, start_time, end_time, and elapsed_sec
+    :raises: CommandError
+    """
+    log = logging.getLogger(mod_logger + '.run_commands')
+    normalized = []
+    used_names = set()
+    for command in commands:
+        if isinstance(command, list):
+            command = {'command': command}
+        if not isinstance(command, dict) or not isinstance(command.get('command'), list):
+            raise CommandError('Each command must be a list or a dict with a command list: {c}'.format(c=str(command)))
+        if 'name' in command:
+            if command['name'] in used_names:
+                raise CommandError('Duplicate command name: {n}'.format(n=command['name']))
+            used_names.add(command['name'])
+        normalized.append(command)
+
+    # Unnamed commands are named after the command string, with an index suffix for repeats
+    specs = collections.OrderedDict()
+    for command in normalized:
+        name = command.get('name')
+        if name is None:
+            base_name = ' '.join(command['command'])
+            name = base_name
+            index = 1
+            while name in used_names:
+                index += 1
+                name = '{b}#{i}'.format(b=base_name, i=str(index))
+            used_names.add(name)
+        specs[name] = {
+            'command': command['command'],
+            'depends_on': set(command.get('depends_on', [])),
+            'timeout_sec': command.get('timeout_sec', timeout_sec)
+        }
+    for name, spec in specs.items():
+        unknown = spec['depends_on'] - set(specs.keys())
+        if unknown:
+            raise CommandError('Command [{n}] depends on unknown commands: {u}'.format(n=name, u=sorted(unknown)))
+
+    # Ensure the dependencies have no cycles
+    remaining = {name: set(spec['depends_on']) for name, spec in specs.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise CommandError('Dependency cycle found among commands: {c}'.format(c=sorted(remaining.keys())))
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    def get_skipped_result():
+        return {'status': 'skipped', 'code': None, 'output': '', 'start_time': None, 'end_time': None,
+                'elapsed_sec': 0}
+
+    def run_one(run_name):
+        line_callback = None
+        if print_output:
+            def line_callback(stream, line):
+                print('>>> [{n}] {l}'.format(n=run_name, l=line))
+        runner = CommandRunner(command=specs[run_name]['command'], timeout_sec=specs[run_name]['timeout_sec'],
+                               merge_stderr=True, line_callback=line_callback)
+        run_start_time = time.time()
+        run_result = runner.run()
         try:
-            subproc.terminate()
-            subproc.kill()
-            os.kill(pid, signal.SIGINT)
-            log.error('Force terminated: {p}'.format(p=str(pid)))
-        except OSError as exc:
-            log.info('Process {p} exited gracefully\n{e}'.format(p=str(pid), e=str(exc)))
-        except subprocess.TimeoutExpired:
-            raise CommandError('Command timed out and could not retrieve output for: {c}'.format(c=command_str))
+            run_output = run_result['stdout'].get_text().strip()
         finally:
-            raise CommandError('Command timed out: {c}'.format(c=command_str))
+            run_result['stdout'].close()
+        if run_result['timed_out']:
+            status = 'timed_out'
+        elif run_result['code'] == 0:
+            status = 'succeeded'
+        else:
+            status = 'failed'
+        run_end_time = time.time()
+        return {
+            'status': status,
+            'code': run_result['code'],
+            'output': run_output,
+            'start_time': run_start_time,
+            'end_time': run_end_time,
+            'elapsed_sec': run_end_time - run_start_time
+        }
 
-    # Collect exit code and output for return
-    code = subproc.poll()
-    stdout = stdout.decode('utf-8')
-    stderr = stderr.decode('utf-8')
-    output = {
-        'stdout': stdout,
-        'stderr': stderr,
-        'code': code
-    }
-    return output
+    log.info('Running {n} commands with up to {w} at once'.format(n=str(len(specs)), w=str(max_workers)))
+    start_time = time.time()
+    results = {}
+    pending = collections.OrderedDict((name, None) for name in specs)
+    failed = False
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bash') as executor:
+        futures = {}
+        while pending or futures:
+            # Skip commands with a dependency that did not succeed
+            for name in list(pending.keys()):
+                if any(dep in results and results[dep]['status'] != 'succeeded' for dep in specs[name]['depends_on']):
+                    log.warning('Skipping command [{n}] since a command it depends on did not succeed'.format(n=name))
+                    results[name] = get_skipped_result()
+                    del pending[name]
+            if not (fail_fast and failed):
+                for name in list(pending.keys()):
+                    if len(futures) >= max_workers:
+                        break
+                    if all(dep in results for dep in specs[name]['depends_on']):
+                        log.info('Starting command [{n}]'.format(n=name))
+                        futures[executor.submit(run_one, name)] = name
+                        del pending[name]
+            elif pending:
+                for name in list(pending.keys()):
+                    results[name] = get_skipped_result()
+                    del pending[name]
+            if not futures:
+                continue
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    results[name] = future.result()
+                except CommandError as exc:
+                    results[name] = {'status': 'failed', 'code': None, 'output': str(exc), 'start_time': None,
+                                     'end_time': time.time(), 'elapsed_sec': 0}
+                if results[name]['status'] != 'succeeded':
+                    failed = True
+                    log.error('Command [{n}] {s} with code [{c}]:\n{o}'.format(
+                        n=name, s=results[name]['status'], c=str(results[name]['code']), o=results[name]['output']))
+                else:
+                    log.info('Command [{n}] succeeded in {t} seconds'.format(
+                        n=name, t=str(round(results[name]['elapsed_sec'], 2))))
+    counts = collections.Counter(result['status'] for result in results.values())
+    log.info('Completed {n} commands in {t} seconds: {c}'.format(
+        n=str(len(results)), t=str(round(time.time() - start_time, 2)), c=dict(counts)))
+    return collections.OrderedDict((name, results[name]) for name in specs)
 
 
 def validate_ip_address(ip_address):
@@ -611,10 +763,119 @@ def rpm_install(install_dir):
     return result['code']
 
 
+def get_edit_rules(rules):
+    """Returns a list of compiled edit rules
+
+    :param rules: (list) of tuples of pattern (str or compiled regex), replacement string, and optionally
+        count, where count 0 replaces every match in a line (equivalent to the 'g' option in bash sed)
+    :return: (list) of tuples of compiled regex, replacement string, and count
+    :raises: CommandError
+    """
+    edit_rules = []
+    for rule in rules:
+        if not isinstance(rule, (list, tuple)) or len(rule) not in [2, 3]:
+            raise CommandError('Edit rules must be (pattern, replace_str) or (pattern, replace_str, count), '
+                               'found: {r}'.format(r=str(rule)))
+        pattern, replace_str = rule[0], rule[1]
+        count = rule[2] if len(rule) == 3 else 0
+        if not isinstance(replace_str, str):
+            raise CommandError('replace_str must be a string, found: {t}'.format(t=type(replace_str).__name__))
+        if isinstance(pattern, str):
+            try:
+                regex = re.compile(pattern)
+            except re.error as exc:
+                raise CommandError('Invalid pattern: {p}'.format(p=pattern)) from exc
+        elif hasattr(pattern, 'search') and hasattr(pattern, 'sub'):
+            regex = pattern
+        else:
+            raise CommandError('pattern must be a string or compiled regex, found: {t}'.format(
+                t=type(pattern).__name__))
+        edit_rules.append((regex, replace_str, count))
+    return edit_rules
+
+
+def write_file_atomic(file_path, lines):
+    """Replaces a file with the provided lines through a temp file and rename
+
+    The mode and, where permitted, the owner of an existing file are preserved.
+
+    :param file_path: (str) Full path to the file to write
+    :param lines: (iterable) of lines to write
+    :return: None
+    :raises: CommandError
+    """
+    file_dir = os.path.dirname(os.path.abspath(file_path))
+    try:
+        fd, tmp_file = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.', dir=file_dir)
+    except OSError as exc:
+        raise CommandError('Unable to create a temp file in directory: {d}'.format(d=file_dir)) from exc
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+        if os.path.isfile(file_path):
+            shutil.copymode(file_path, tmp_file)
+            if hasattr(os, 'chown'):
+                file_stat = os.stat(file_path)
+                try:
+                    os.chown(tmp_file, file_stat.st_uid, file_stat.st_gid)
+                except PermissionError:
+                    pass
+        os.replace(tmp_file, file_path)
+    except OSError as exc:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise CommandError('Unable to write file: {f}'.format(f=file_path)) from exc
+
+
+def edit_file(file_path, rules):
+    """Applies a list of sed-style pattern and replacement rules to a file in one pass
+
+    Rules are compiled once and applied in order to each line.  The file is replaced atomically
+    through a temp file and rename, and is not written at all when no line changed.
+
+    :param file_path: (str) Full path to the file to be edited
+    :param rules: (list) of tuples of pattern, replacement string, and optionally count, see get_edit_rules
+    :return: (int) number of lines changed
+    :raises: CommandError
+    """
+    log = logging.getLogger(mod_logger + '.edit_file')
+    if not isinstance(file_path, str):
+        msg = 'file_path argument must be a string'
+        log.error(msg)
+        raise CommandError(msg)
+    if not os.path.isfile(file_path):
+        msg = 'File not found: {f}'.format(f=file_path)
+        log.error(msg)
+        raise CommandError(msg)
+    edit_rules = get_edit_rules(rules)
+
+    log.info('Updating file: %s...', file_path)
+    new_lines = []
+    num_changed = 0
+    with open(file_path, 'r') as f:
+        for line in f:
+            new_line = line
+            for regex, replace_str, count in edit_rules:
+                if regex.search(new_line):
+                    new_line = regex.sub(replace_str, new_line, count=count)
+            if new_line != line:
+                log.info('Updating line: %s', line)
+                log.info('Replacing with line: %s', new_line)
+                num_changed += 1
+            new_lines.append(new_line)
+    if num_changed == 0:
+        log.info('No changes to file: %s', file_path)
+        return 0
+    write_file_atomic(file_path=file_path, lines=new_lines)
+    log.info('Updated {n} lines in file: {f}'.format(n=str(num_changed), f=file_path))
+    return num_changed
+
+
 def sed(file_path, pattern, replace_str, g=0):
     """Python impl of the bash sed command
 
-    This method emulates the functionality of a bash sed command.
+    This method emulates the functionality of a bash sed command.  To apply
+    several patterns to the same file, use edit_file to make one pass.
 
     :param file_path: (str) Full path to the file to be edited
     :param pattern: (str) Search pattern to replace as a regex
@@ -639,30 +900,15 @@ def sed(file_path, pattern, replace_str, g=0):
         msg = 'replace_str argument must be a string'
         log.error(msg)
         raise CommandError(msg)
-
-    # Ensure the file_path file exists
-    if not os.path.isfile(file_path):
-        msg = 'File not found: {f}'.format(f=file_path)
-        log.error(msg)
-        raise CommandError(msg)
-
-    # Search for a matching pattern and replace matching patterns
-    log.info('Updating file: %s...', file_path)
-    for line in fileinput.input(file_path, inplace=True):
-        if re.search(pattern, line):
-            log.info('Updating line: %s', line)
-            new_line = re.sub(pattern, replace_str, line, count=g)
-            log.info('Replacing with line: %s', new_line)
-            sys.stdout.write(new_line)
-        else:
-            sys.stdout.write(line)
+    edit_file(file_path=file_path, rules=[(pattern, replace_str, g)])
 
 
 def zip_dir(dir_path, zip_file):
     """Creates a zip file of a directory tree
 
     This method creates a zip archive using the directory tree dir_path
-    and adds to zip_file output.
+    and adds to zip_file output.  Files are compressed in parallel, see
+    archiver.ZipArchiver.
 
     :param dir_path: (str) Full path to directory to be zipped
     :param zip_file: (str) Full path to the output zip file
@@ -688,15 +934,10 @@ def zip_dir(dir_path, zip_file):
         raise CommandError(msg)
 
     try:
-        with contextlib.closing(zipfile.ZipFile(zip_file, 'w', allowZip64=True)) as zip_w:
-            for root, dirs, files in os.walk(dir_path):
-                for f in files:
-                    log.debug('Adding file to zip: %s', f)
-                    strip = len(dir_path) - len(os.path.split(dir_path)[-1])
-                    file_name = os.path.join(root, f)
-                    archive_name = os.path.join(root[strip:], f)
-                    zip_w.write(file_name, archive_name)
-    except Exception as exc:
+        archiver = ZipArchiver(output=zip_file)
+        archiver.add_dir(dir_path=dir_path, prefix=os.path.split(dir_path)[-1])
+        archiver.close()
+    except ArchiveError as exc:
         raise CommandError('Unable to create zip file: {f}'.format(f=zip_file)) from exc
     log.info('Successfully created zip file: %s', zip_file)
 
@@ -715,53 +956,80 @@ def update_hosts_file(ip, entry):
 
 
 def update_hosts_file_content(hosts_file_path, ip, entry):
-    """
+    """Updates the hosts file for the specified ip
 
     :param hosts_file_path: (str) path to the hosts file
     :param ip: (str) IP address to be added or updated
     :param entry: (str) Hosts file entry to be added
     :raises: CommandError
     """
-    log = logging.getLogger(mod_logger + '.update_hosts_file')
+    update_hosts_file_entries(entries=[(ip, entry)], hosts_file_path=hosts_file_path)
+
+
+def update_hosts_file_entries(entries, hosts_file_path='/etc/hosts'):
+    """Adds or updates many hosts file entries in a single pass
+
+    Lines for each IP address are replaced with its entry, entries for IP addresses not
+    in the file are appended, and the file is replaced atomically only if it changed.
+    When an IP address is listed more than once, the last entry is used.
+
+    :param entries: (list) of (ip, entry) tuples, or (dict) of ip -> entry
+    :param hosts_file_path: (str) path to the hosts file
+    :return: (int) number of lines added or updated
+    :raises: CommandError
+    """
+    log = logging.getLogger(mod_logger + '.update_hosts_file_entries')
 
     # Validate args
-    if not isinstance(ip, str):
-        msg = 'ip argument must be a string'
-        log.error(msg)
-        raise CommandError(msg)
-    if not isinstance(entry, str):
-        msg = 'entry argument must be a string'
-        log.error(msg)
-        raise CommandError(msg)
+    if isinstance(entries, dict):
+        entries = list(entries.items())
+    full_entries = collections.OrderedDict()
+    for ip, entry in entries:
+        if not isinstance(ip, str):
+            msg = 'ip argument must be a string'
+            log.error(msg)
+            raise CommandError(msg)
+        if not isinstance(entry, str):
+            msg = 'entry argument must be a string'
+            log.error(msg)
+            raise CommandError(msg)
+        full_entries[ip] = ip + ' ' + entry.strip() + '\n'
     if not os.path.isfile(hosts_file_path):
         msg = 'File not found: {f}'.format(f=hosts_file_path)
         log.error(msg)
         raise CommandError(msg)
 
-    log.info('Updating hosts file: {f} with IP {i} and entry: {e}'.format(f=hosts_file_path, i=ip, e=entry))
-    full_entry = ip + ' ' + entry.strip() + '\n'
-    updated = False
-    for line in fileinput.input(hosts_file_path, inplace=True):
-        if re.search(ip, line):
-            if line.split()[0] == ip:
-                log.info('Found IP {i} in line: {li}, updating...'.format(i=ip, li=line))
-                log.info('Replacing with new line: {n}'.format(n=full_entry))
-                sys.stdout.write(full_entry)
-                updated = True
+    log.info('Updating hosts file {f} with {n} entries'.format(f=hosts_file_path, n=str(len(full_entries))))
+    new_lines = []
+    updated_ips = set()
+    num_changed = 0
+    with open(hosts_file_path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields and fields[0] in full_entries:
+                full_entry = full_entries[fields[0]]
+                updated_ips.add(fields[0])
+                if line != full_entry:
+                    log.info('Found IP {i} in line: {li}, replacing with: {n}'.format(
+                        i=fields[0], li=line.strip(), n=full_entry.strip()))
+                    num_changed += 1
+                new_lines.append(full_entry)
             else:
-                log.debug('Found ip {i} in line {li} but not an exact match, adding line back to hosts file {f}...'.
-                          format(i=ip, li=line, f=hosts_file_path))
-                sys.stdout.write(line)
-        else:
-            log.debug('IP address {i} not found in line, adding line back to hosts file {f}: {li}'.format(
-                i=ip, li=line, f=hosts_file_path))
-            sys.stdout.write(line)
-
-    # Append the entry if the hosts file was not updated
-    if updated is False:
-        with open(hosts_file_path, 'a') as f:
-            log.info('Appending hosts file entry to {f}: {e}'.format(f=hosts_file_path, e=full_entry))
-            f.write(full_entry)
+                new_lines.append(line)
+
+    # Append the entries for IP addresses not found in the hosts file
+    for ip, full_entry in full_entries.items():
+        if ip not in updated_ips:
+            if new_lines and not new_lines[-1].endswith('\n'):
+                new_lines[-1] += '\n'
+            log.info('Appending hosts file entry to {f}: {e}'.format(f=hosts_file_path, e=full_entry.strip()))
+            new_lines.append(full_entry)
+            num_changed += 1
+    if num_changed == 0:
+        log.info('Hosts file {f} already contains the entries'.format(f=hosts_file_path))
+        return 0
+    write_file_atomic(file_path=hosts_file_path, lines=new_lines)
+    return num_changed
 
 
 def set_hostname(new_hostname, pretty_hostname=None):
@@ -1086,7 +1354,7 @@ def get_remote_host_environment_variable(host, environment_variable):
         log.error(msg)
         raise TypeError(msg)
     log.info('Checking host {h} for environment variable: {v}...'.format(h=host, v=environment_variable))
-    command = ['ssh', '{h}'.format(h=host), 'echo ${v}'.format(v=environment_variable)]
+    command = get_ssh_command(host=host) + ['echo ${v}'.format(v=environment_variable)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1133,7 +1401,7 @@ def set_remote_host_environment_variable(host, variable_name, variable_value, en
         log.error(msg)
         raise TypeError(msg)
     log.info('Creating the environment file if it does not exist...')
-    command = ['ssh', host, 'touch {f}'.format(f=env_file)]
+    command = get_ssh_command(host=host) + ['touch {f}'.format(f=env_file)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1147,7 +1415,7 @@ def set_remote_host_environment_variable(host, variable_name, variable_value, en
         raise CommandError(msg)
 
     log.info('Creating ensuring the environment file is executable...')
-    command = ['ssh', host, 'chmod +x {f}'.format(f=env_file)]
+    command = get_ssh_command(host=host) + ['chmod +x {f}'.format(f=env_file)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1162,7 +1430,8 @@ def set_remote_host_environment_variable(host, variable_name, variable_value, en
 
     log.info('Adding environment variable {v} with value {n} to file {f}...'.format(
             v=variable_name, n=variable_value, f=env_file))
-    command = ['ssh', host, 'echo "export {v}=\\"{n}\\"" >> {f}'.format(f=env_file, v=variable_name, n=variable_value)]
+    command = get_ssh_command(host=host) + [
+        'echo "export {v}=\\"{n}\\"" >> {f}'.format(f=env_file, v=variable_name, n=variable_value)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1203,13 +1472,7 @@ def run_remote_command(host, command, user=None, timeout_sec=5.0, port=22, outpu
             msg = 'user argument must be a string'
             raise TypeError(msg)
     log.debug('Running remote command on host: {h}: {c}...'.format(h=host, c=command))
-    remote_command = ['ssh']
-    if port != 22:
-        remote_command += ['-p', str(port)]
-    if user:
-        remote_command += ['{u}@{h}'.format(u=user, h=host)]
-    else:
-        remote_command += ['{h}'.format(h=host)]
+    remote_command = get_ssh_command(host=host, user=user, port=port)
     remote_command += ['{c}'.format(c=command)]
     try:
         result = run_command(remote_command, timeout_sec=timeout_sec, output=output)
@@ -1250,7 +1513,7 @@ def check_remote_host_marker_file(host, file_path):
         log.error(msg)
         raise TypeError(msg)
     log.debug('Checking host {h} for marker file: {f}...'.format(h=host, f=file_path))
-    command = ['ssh', '{h}'.format(h=host), 'if [ -f {f} ] ; then exit 0 ; else exit 1 ; fi'.format(f=file_path)]
+    command = get_ssh_command(host=host) + ['if [ -f {f} ] ; then exit 0 ; else exit 1 ; fi'.format(f=file_path)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1289,7 +1552,7 @@ def create_remote_host_marker_file(host, file_path):
         log.error(msg)
         raise TypeError(msg)
     log.debug('Attempting to create marker file {f} on host: {h}...'.format(f=file_path, h=host))
-    command = ['ssh', '{h}'.format(h=host), 'touch {f}'.format(f=file_path)]
+    command = get_ssh_command(host=host) + ['touch {f}'.format(f=file_path)]
     try:
         result = run_command(command, timeout_sec=5.0)
         code = result['code']
@@ -1360,14 +1623,10 @@ def remove_default_gateway():
 
     # Remove settings for GATEWAY and GATEWAYDEV
     log.info('Attempting to remove any default gateway configurations...')
-    for line in fileinput.input(network_script, inplace=True):
-        if re.search('^GATEWAY=.*', line):
-            log.info('Removing GATEWAY line: {li}'.format(li=line))
-        elif re.search('^GATEWAYDEV=.*', line):
-            log.info('Removing GATEWAYDEV line: {li}'.format(li=line))
-        else:
-            log.debug('Keeping line: {li}'.format(li=line))
-            sys.stdout.write(line)
+    try:
+        edit_file(file_path=network_script, rules=[('^GATEWAY=.*\n?', ''), ('^GATEWAYDEV=.*\n?', '')])
+    except CommandError as exc:
+        raise OSError('Unable to remove default gateway configurations from: {f}'.format(f=network_script)) from exc
 
     # Restart networking for the changes to take effect
     log.info('Restarting the network service...')
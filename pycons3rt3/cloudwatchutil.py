@@ -7,8 +7,8 @@ import logging
 
 from botocore.client import ClientError
 
-from .awsutil import get_boto3_client
-from .exceptions import CloudwatchUtilError
+from .awsutil import get_boto3_client, paginate
+from .exceptions import AWSAPIError, CloudwatchUtilError
 from .logify import Logify
 
 
@@ -18,6 +18,9 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.cloudwatchutil'
 
+# Maximum page size for describing log groups
+log_groups_max_page_size = 50
+
 
 class CloudwatchUtil(object):
     """Utility for interacting with the AWS Cloudwatch API
@@ -73,31 +76,26 @@ def list_log_groups_with_marker(client, marker=None):
         return client.describe_log_groups()
 
 
-def list_log_groups(client):
+def list_log_groups(client, prefix=None, projection=None):
     """Lists Log Groups
 
     :param client: boto3.client object
+    :param prefix: (str) only list log groups with names starting with this prefix
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
     :return: (list) of groups (dict)
     :raises: CloudwatchUtilError
     """
     log = logging.getLogger(mod_logger + '.list_log_groups')
-    marker = None
-    next_query = True
-    log_group_list = []
     log.info('Attempting to list cloudwatch log groups...')
-    while True:
-        if not next_query:
-            break
-        response = list_log_groups_with_marker(client=client, marker=marker)
-        if 'logGroups' not in response.keys():
-            log.warning('logGroups not found in response: {r}'.format(r=str(response)))
-            return log_group_list
-        log_group_list += response['logGroups']
-        if 'nextToken' not in response.keys():
-            next_query = False
-        else:
-            marker = response['nextToken']
-            next_query = True
+    kwargs = {}
+    if prefix:
+        kwargs['logGroupNamePrefix'] = prefix
+    try:
+        log_group_list = list(paginate(client=client, operation='describe_log_groups', projection=projection,
+                                       page_size=log_groups_max_page_size, **kwargs))
+    except AWSAPIError as exc:
+        msg = 'Problem listing cloudwatch log groups'
+        raise CloudwatchUtilError(msg) from exc
     log.info('Found {n} cloudwatch log groups'.format(n=str(len(log_group_list))))
     return log_group_list
 
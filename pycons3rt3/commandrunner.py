@@ -0,0 +1,415 @@
+"""Module: commandrunner
+
+This module runs commands with streaming, bounded-memory output collection.
+
+stdout and stderr are read in large chunks from non-blocking pipes with a
+selector, so a single thread serves both streams and enforces the timeout
+without a timer thread.  Output is collected into an OutputBuffer, which keeps
+it in memory up to a limit and then spills to a temporary file, or keeps only
+the last part of the output in ring mode.  Complete lines can be passed to a
+callback as they arrive, and commands can be iterated line by line, either
+synchronously or with async for.
+
+Classes:
+    CommandRunner: Runs a command and streams its output
+    OutputBuffer: Chunked output buffer with spill to disk or ring mode
+
+"""
+import asyncio
+import collections
+import logging
+import os
+import selectors
+import subprocess
+import tempfile
+import time
+
+from .exceptions import CommandError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.commandrunner'
+
+# Size of each read from the command pipes
+read_size_bytes = 65536
+
+# Default output kept in memory before spilling to a temporary file
+default_max_memory_bytes = 8 * 1024 * 1024
+
+# Time to wait for a process to exit after terminating it before killing it
+terminate_grace_sec = 5
+
+# Character encoding
+character_encoding = 'utf-8'
+
+
+class OutputBuffer(object):
+    """Collects command output in chunks with bounded memory
+
+    By default output is kept in memory until max_memory_bytes, then moved to a temporary file that
+    grows as needed.  With ring_bytes set, only the last ring_bytes of output are kept, in memory.
+
+    :param max_memory_bytes: (int) output kept in memory before spilling to a temporary file
+    :param ring_bytes: (int) keep only the last ring_bytes of output, or None to keep everything
+    :param spill_dir: (str) directory for the temporary file, defaults to the system temp dir
+    """
+
+    def __init__(self, max_memory_bytes=default_max_memory_bytes, ring_bytes=None, spill_dir=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.ring_bytes = ring_bytes
+        self.spill_dir = spill_dir
+        self.chunks = collections.deque()
+        self.memory_bytes = 0
+        self.total_bytes = 0
+        self.spill_file = None
+
+    def write(self, data):
+        """Adds data to the buffer
+
+        :param data: (bytes) data to add
+        :return: None
+        """
+        if not data:
+            return
+        self.total_bytes += len(data)
+        if self.spill_file:
+            self.spill_file.write(data)
+            return
+        self.chunks.append(data)
+        self.memory_bytes += len(data)
+        if self.ring_bytes is not None:
+            while self.memory_bytes - len(self.chunks[0]) >= self.ring_bytes:
+                self.memory_bytes -= len(self.chunks.popleft())
+        elif self.memory_bytes > self.max_memory_bytes:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+            while self.chunks:
+                self.spill_file.write(self.chunks.popleft())
+            self.memory_bytes = 0
+
+    def is_truncated(self):
+        """Returns True if ring mode dropped the start of the output
+
+        :return: (bool)
+        """
+        return self.ring_bytes is not None and self.total_bytes > self.ring_bytes
+
+    def getvalue(self):
+        """Returns the collected output
+
+        :return: (bytes) output, only the last ring_bytes in ring mode
+        """
+        if self.spill_file:
+            self.spill_file.flush()
+            self.spill_file.seek(0)
+            data = self.spill_file.read()
+            self.spill_file.seek(0, os.SEEK_END)
+            return data
+        data = b''.join(self.chunks)
+        if self.ring_bytes is not None:
+            data = data[-self.ring_bytes:]
+        return data
+
+    def get_text(self):
+        """Returns the collected output decoded, replacing undecodable bytes
+
+        :return: (str) output
+        """
+        return self.getvalue().decode(character_encoding, errors='replace')
+
+    def iter_chunks(self):
+        """Yields the collected output in chunks without loading a spilled file into memory
+
+        :return: generator of bytes
+        """
+        if not self.spill_file:
+            yield self.getvalue()
+            return
+        self.spill_file.flush()
+        self.spill_file.seek(0)
+        while True:
+            data = self.spill_file.read(read_size_bytes)
+            if not data:
+                break
+            yield data
+        self.spill_file.seek(0, os.SEEK_END)
+
+    def close(self):
+        """Releases the memory and temporary file
+
+        :return: None
+        """
+        self.chunks.clear()
+        self.memory_bytes = 0
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class CommandRunner(object):
+    """Runs a command and streams its output
+
+    :param command: (list) command and args
+    :param timeout_sec: (float) seconds to wait before killing the command, or None to wait forever
+    :param merge_stderr: (bool) Set True to collect stderr together with stdout
+    :param line_callback: (callable) called as line_callback(stream, line) for each complete line, where
+                          stream is stdout or stderr and line is a str without the line ending
+    :param max_memory_bytes: (int) output kept in memory per stream before spilling to a temporary file
+    :param ring_bytes: (int) keep only the last ring_bytes of each stream, or None to keep everything
+    :param cwd: (str) working directory for the command
+    :param env: (dict) environment for the command
+    """
+
+    def __init__(self, command, timeout_sec=3600.0, merge_stderr=False, line_callback=None,
+                 max_memory_bytes=default_max_memory_bytes, ring_bytes=None, cwd=None, env=None):
+        self.cls_logger = mod_logger + '.CommandRunner'
+        if not isinstance(command, list):
+            raise CommandError('command arg must be a list')
+        self.command = command
+        self.command_str = ' '.join(command)
+        self.timeout_sec = timeout_sec
+        self.merge_stderr = merge_stderr
+        self.line_callback = line_callback
+        self.cwd = cwd
+        self.env = env
+        self.stdout = OutputBuffer(max_memory_bytes=max_memory_bytes, ring_bytes=ring_bytes)
+        self.stderr = OutputBuffer(max_memory_bytes=max_memory_bytes, ring_bytes=ring_bytes)
+        self.code = None
+        self.timed_out = False
+        self.pid = None
+        self.yield_lines = False
+
+    def start(self):
+        """Starts the command
+
+        :return: (subprocess.Popen)
+        :raises: CommandError
+        """
+        log = logging.getLogger(self.cls_logger + '.start')
+        stderr = subprocess.STDOUT if self.merge_stderr else subprocess.PIPE
+        try:
+            subproc = subprocess.Popen(self.command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr,
+                                       cwd=self.cwd, env=self.env)
+        except ValueError as exc:
+            raise CommandError('Bad command supplied: {c}'.format(c=self.command_str)) from exc
+        except (OSError, IOError) as exc:
+            raise CommandError('There was a problem running command: {c}'.format(c=self.command_str)) from exc
+        self.pid = subproc.pid
+        log.debug('Opened subprocess with PID: {p}'.format(p=subproc.pid))
+        return subproc
+
+    def stop(self, subproc):
+        """Terminates the command, killing it if it does not exit within the grace period
+
+        :param subproc: (subprocess.Popen)
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.stop')
+        log.error('Command timeout of {t} seconds expired for: [{c}]'.format(
+            t=str(self.timeout_sec), c=self.command_str))
+        self.timed_out = True
+        try:
+            subproc.terminate()
+            subproc.wait(timeout=terminate_grace_sec)
+        except subprocess.TimeoutExpired:
+            subproc.kill()
+        except OSError:
+            pass
+
+    def reap(self, subproc):
+        """Terminates and waits for a command whose output is no longer being read
+
+        Called when a consumer stops iterating before the command exits, so it is not left running
+        or un-reaped.
+
+        :param subproc: (subprocess.Popen)
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.reap')
+        log.debug('Output no longer read, terminating command: [{c}]'.format(c=self.command_str))
+        try:
+            subproc.terminate()
+            self.code = subproc.wait(timeout=terminate_grace_sec)
+        except subprocess.TimeoutExpired:
+            subproc.kill()
+            self.code = subproc.wait()
+        except OSError:
+            pass
+
+    def handle_data(self, stream, data, partials):
+        """Adds data read from a stream to its buffer and returns the complete lines
+
+        :param stream: (str) stdout or stderr
+        :param data: (bytes) data read, empty at the end of the stream
+        :param partials: (dict) of stream to the incomplete last line
+        :return: (list) of (stream, str line) tuples
+        """
+        buffer = self.stdout if stream == 'stdout' else self.stderr
+        buffer.write(data)
+        if not self.line_callback and not self.yield_lines:
+            return []
+        if data:
+            pieces = (partials[stream] + data).split(b'\n')
+            partials[stream] = pieces.pop()
+        else:
+            pieces = [partials[stream]] if partials[stream] else []
+            partials[stream] = b''
+        lines = [(stream, piece.rstrip(b'\r').decode(character_encoding, errors='replace')) for piece in pieces]
+        if self.line_callback:
+            for line_stream, line in lines:
+                self.line_callback(line_stream, line)
+        return lines
+
+    def iter_lines(self):
+        """Runs the command, yielding each complete line of output as it arrives
+
+        After the generator is exhausted, code, timed_out, stdout, and stderr are set.
+
+        :return: generator of tuples: (str) stdout or stderr, (str) line without the line ending
+        :raises: CommandError
+        """
+        self.yield_lines = True
+        for lines in self.stream():
+            for line in lines:
+                yield line
+
+    def run(self):
+        """Runs the command to completion
+
+        :return: (dict) code, timed_out, stdout, and stderr, where stdout and stderr are OutputBuffers
+        :raises: CommandError
+        """
+        self.yield_lines = False
+        for _ in self.stream():
+            pass
+        return {
+            'code': self.code,
+            'timed_out': self.timed_out,
+            'stdout': self.stdout,
+            'stderr': self.stderr
+        }
+
+    def stream(self):
+        """Runs the command, reading stdout and stderr with a selector in this thread
+
+        When the generator is closed before the command exits, the command is terminated and reaped.
+
+        :return: generator of lists of (stream, line) tuples
+        :raises: CommandError
+        """
+        log = logging.getLogger(self.cls_logger + '.stream')
+        subproc = self.start()
+        try:
+            deadline = None if self.timeout_sec is None else time.monotonic() + self.timeout_sec
+            partials = {'stdout': b'', 'stderr': b''}
+            pipes = {subproc.stdout: 'stdout'}
+            if subproc.stderr:
+                pipes[subproc.stderr] = 'stderr'
+            if os.name == 'nt':
+                # Selectors do not support pipes on Windows
+                try:
+                    stdout, stderr = subproc.communicate(timeout=self.timeout_sec)
+                except subprocess.TimeoutExpired:
+                    self.stop(subproc)
+                    stdout, stderr = subproc.communicate()
+                yield self.handle_data('stdout', stdout or b'', partials) + self.handle_data('stdout', b'', partials)
+                yield self.handle_data('stderr', stderr or b'', partials) + self.handle_data('stderr', b'', partials)
+            else:
+                with selectors.DefaultSelector() as selector:
+                    for pipe, stream in pipes.items():
+                        os.set_blocking(pipe.fileno(), False)
+                        selector.register(pipe, selectors.EVENT_READ, stream)
+                    try:
+                        while selector.get_map():
+                            timeout = None
+                            if deadline is not None:
+                                timeout = deadline - time.monotonic()
+                                if timeout <= 0:
+                                    if self.timed_out:
+                                        # Child processes of the command are still holding the pipes open
+                                        break
+                                    self.stop(subproc)
+                                    deadline = time.monotonic() + terminate_grace_sec
+                                    continue
+                            for key, _ in selector.select(timeout=timeout):
+                                try:
+                                    data = os.read(key.fd, read_size_bytes)
+                                except BlockingIOError:
+                                    continue
+                                if not data:
+                                    selector.unregister(key.fileobj)
+                                    key.fileobj.close()
+                                lines = self.handle_data(key.data, data, partials)
+                                if lines:
+                                    yield lines
+                    finally:
+                        for pipe in pipes:
+                            pipe.close()
+            try:
+                if deadline is None or self.timed_out:
+                    self.code = subproc.wait()
+                else:
+                    self.code = subproc.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                self.stop(subproc)
+                self.code = subproc.wait()
+            log.debug('Command [{c}] returned code: {r}'.format(c=self.command_str, r=str(self.code)))
+        finally:
+            if subproc.returncode is None:
+                self.reap(subproc)
+
+    async def aiter_lines(self):
+        """Runs the command with asyncio, yielding each complete line of output as it arrives
+
+        For use with async for.  After iteration completes, code, timed_out, stdout, and stderr are set.  When
+        the generator is closed before the command exits, the command is terminated and reaped.
+
+        :return: async generator of tuples: (str) stdout or stderr, (str) line without the line ending
+        :raises: CommandError
+        """
+        self.yield_lines = True
+        stderr = asyncio.subprocess.STDOUT if self.merge_stderr else asyncio.subprocess.PIPE
+        try:
+            subproc = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=stderr,
+                cwd=self.cwd, env=self.env)
+        except (OSError, ValueError) as exc:
+            raise CommandError('There was a problem running command: {c}'.format(c=self.command_str)) from exc
+        self.pid = subproc.pid
+        deadline = None if self.timeout_sec is None else time.monotonic() + self.timeout_sec
+        partials = {'stdout': b'', 'stderr': b''}
+        readers = {'stdout': subproc.stdout}
+        if subproc.stderr:
+            readers['stderr'] = subproc.stderr
+        tasks = {asyncio.ensure_future(reader.read(read_size_bytes)): stream for stream, reader in readers.items()}
+        try:
+            while tasks:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.timed_out = True
+                    subproc.kill()
+                    deadline = None
+                    continue
+                for task in done:
+                    stream = tasks.pop(task)
+                    data = task.result()
+                    for line in self.handle_data(stream, data, partials):
+                        yield line
+                    if data:
+                        tasks[asyncio.ensure_future(readers[stream].read(read_size_bytes))] = stream
+            self.code = await subproc.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if subproc.returncode is None:
+                try:
+                    subproc.terminate()
+                    self.code = await asyncio.wait_for(subproc.wait(), timeout=terminate_grace_sec)
+                except asyncio.TimeoutError:
+                    subproc.kill()
+                    self.code = await subproc.wait()
+                except ProcessLookupError:
+                    pass
@@ -5,9 +5,12 @@ import json
 import logging
 import multiprocessing
 import os
+import tempfile
+import threading
 import time
 import traceback
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .bash import validate_ip_address
 from .logify import Logify
@@ -20,7 +23,8 @@ from .cons3rtenums import (cons3rt_deployment_run_status_active, cons3rt_softwar
                            valid_search_type)
 from .cons3rtwaiters import RunWaiter
 from .deployment import Deployment
-from .pycons3rtlibs import HostActionResult, RestUser
+from .httpclient import BoundedPipe, default_pipe_buffer_bytes, pump_response_to_pipe
+from .pycons3rtlibs import HostActionResult, RateLimiter, RestUser
 from .cons3rtconfig import cons3rtapi_config_file, get_pycons3rt_conf_dir, get_data_dir
 from .exceptions import Cons3rtClientError, Cons3rtApiError, DeploymentError, InvalidCloudError, \
     InvalidOperatingSystemTemplate
@@ -49,6 +53,10 @@ project_manager_roles = ['PROJECT_OWNER', 'PROJECT_MANAGER', 'PROJECT_MODERATOR'
 # All valid roles combined
 valid_member_roles = express_roles + standard_roles + asset_developer_roles + project_manager_roles
 
+# Default concurrency and rate limit for batch asset updates
+default_batch_max_workers = 8
+default_batch_max_calls_per_sec = 10
+
 # Collab tools project names
 bitbucket_project_name = 'AtlassianBitbucket-project'
 confluence_project_name = 'AtlassianConfluence-project'
@@ -91,6 +99,8 @@ class Cons3rtApi(object):
         self.rest_user_list = []
         self.config_default_site_url = None
         self.config_default_project = None
+        self.asset_state_cache = {}
+        self.asset_state_lock = threading.Lock()
         self.load_config()
         self.cons3rt_client = Cons3rtClient(user=self.rest_user)
 
@@ -2514,6 +2524,192 @@ class Cons3rtApi(object):
             raise Cons3rtApiError(msg) from exc
         log.info('Successfully updated visibility for Asset ID {i} to: {s}'.format(i=str(asset_id), s=visibility))
 
+    def cache_asset_state(self, assets):
+        """Caches the current visibility and categories of assets, used to skip no-op batch updates
+
+        :param assets: (list) of asset data (dict) as returned by the retrieve asset calls
+        :return: None
+        """
+        with self.asset_state_lock:
+            for asset in assets:
+                if not isinstance(asset, dict) or 'id' not in asset:
+                    continue
+                state = self.asset_state_cache.setdefault(int(asset['id']), {})
+                if 'visibility' in asset:
+                    state['visibility'] = asset['visibility']
+                if isinstance(asset.get('categories'), list):
+                    state['category_ids'] = set(
+                        int(category['id']) for category in asset['categories']
+                        if isinstance(category, dict) and 'id' in category)
+
+    def get_cached_asset_state(self, asset):
+        """Returns the asset ID and cached state for an asset ID or asset data dict
+
+        :param asset: (int) asset ID or (dict) asset data
+        :return: (tuple) int asset ID and dict of cached state
+        :raises: Cons3rtApiError
+        """
+        if isinstance(asset, dict):
+            self.cache_asset_state(assets=[asset])
+            asset = asset.get('id')
+        try:
+            asset_id = int(asset)
+        except (TypeError, ValueError) as exc:
+            raise Cons3rtApiError('Invalid asset ID found: {i}'.format(i=str(asset))) from exc
+        with self.asset_state_lock:
+            return asset_id, dict(self.asset_state_cache.get(asset_id, {}))
+
+    def invalidate_asset_state(self, asset_ids=None):
+        """Removes cached asset state so the next batch update does not skip changes based on it
+
+        :param asset_ids: (list) of int asset IDs, or None to clear the whole cache
+        :return: None
+        """
+        with self.asset_state_lock:
+            if asset_ids is None:
+                self.asset_state_cache.clear()
+                return
+            for asset_id in asset_ids:
+                self.asset_state_cache.pop(int(asset_id), None)
+
+    def run_asset_batch(self, calls, max_workers, max_calls_per_sec, action):
+        """Runs a list of asset update calls concurrently with rate limiting
+
+        The cached state of every asset in the batch is invalidated when its call completes, so later batch
+        updates only skip changes based on state the caller seeds again.
+
+        :param calls: (list) of tuples: (int asset ID, callable, dict kwargs), each callable is passed the
+                      rate limiter as the limiter kwarg and must acquire it before each API call
+        :param max_workers: (int) number of concurrent calls
+        :param max_calls_per_sec: (float) maximum rate of calls across all workers
+        :param action: (str) description of the action for logging
+        :return: (tuple) lists of int asset IDs that succeeded and failed
+        """
+        log = logging.getLogger(self.cls_logger + '.run_asset_batch')
+        limiter = RateLimiter(max_calls_per_sec=max_calls_per_sec)
+        succeeded = []
+        failed = []
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='assetbatch') as executor:
+            futures = {}
+            for asset_id, func, kwargs in calls:
+                futures[executor.submit(func, limiter=limiter, **kwargs)] = asset_id
+            for future in as_completed(futures):
+                asset_id = futures[future]
+                try:
+                    future.result()
+                except (Cons3rtApiError, Cons3rtClientError) as exc:
+                    log.error('Problem running {a} on asset ID [{i}]\n{e}'.format(
+                        a=action, i=str(asset_id), e=str(exc)))
+                    failed.append(asset_id)
+                else:
+                    succeeded.append(asset_id)
+                finally:
+                    self.invalidate_asset_state(asset_ids=[asset_id])
+        log.info('Completed {n} {a} calls in {t} seconds, {f} assets with failures'.format(
+            n=str(len(calls)), a=action, t=str(round(time.time() - start_time, 2)), f=str(len(failed))))
+        return sorted(succeeded), sorted(failed)
+
+    def rate_limited_visibility_update(self, asset_id, visibility, trusted_projects, limiter):
+        """Updates the visibility of an asset after acquiring the rate limiter, used by update_assets_visibility
+
+        :param asset_id: (int) asset ID
+        :param visibility: (str) visibility to set
+        :param trusted_projects: (list) of trusted project IDs or None
+        :param limiter: (RateLimiter) shared rate limiter
+        :return: None
+        :raises: Cons3rtApiError
+        """
+        limiter.acquire()
+        self.update_asset_visibility(asset_id=asset_id, visibility=visibility, trusted_projects=trusted_projects)
+
+    def rate_limited_category_update(self, asset_id, add_category_ids, remove_category_ids, limiter):
+        """Removes then adds categories on an asset, used by update_assets_categories
+
+        The categories are removed first, and none are added if a removal fails, so an asset is not left in
+        both the old and new categories.
+
+        :param asset_id: (int) asset ID
+        :param add_category_ids: (list) of int category IDs to add
+        :param remove_category_ids: (list) of int category IDs to remove
+        :param limiter: (RateLimiter) shared rate limiter, acquired before each API call
+        :return: None
+        :raises: Cons3rtApiError
+        """
+        for category_id in remove_category_ids:
+            limiter.acquire()
+            self.remove_category_from_asset(asset_id=asset_id, category_id=category_id)
+        for category_id in add_category_ids:
+            limiter.acquire()
+            self.add_category_to_asset(asset_id=asset_id, category_id=category_id)
+
+    def update_assets_visibility(self, changes, max_workers=default_batch_max_workers,
+                                 max_calls_per_sec=default_batch_max_calls_per_sec):
+        """Updates the visibility of many assets concurrently, skipping assets already at the visibility
+
+        :param changes: (list) of tuples: (asset, visibility) or (asset, visibility, trusted_projects), where
+                        asset is an int asset ID or asset data (dict) containing the current visibility
+        :param max_workers: (int) number of concurrent calls
+        :param max_calls_per_sec: (float) maximum rate of calls across all workers
+        :return: (dict) of lists of int asset IDs: succeeded, failed, and skipped (already at the visibility)
+        :raises: Cons3rtApiError
+        """
+        log = logging.getLogger(self.cls_logger + '.update_assets_visibility')
+        calls = []
+        skipped = []
+        for change in changes:
+            asset, visibility = change[0], change[1]
+            trusted_projects = change[2] if len(change) > 2 else None
+            asset_id, state = self.get_cached_asset_state(asset=asset)
+            visibility = visibility.upper().strip()
+            if state.get('visibility') == visibility and not trusted_projects:
+                skipped.append(asset_id)
+                continue
+            calls.append((asset_id, self.rate_limited_visibility_update,
+                          {'asset_id': asset_id, 'visibility': visibility, 'trusted_projects': trusted_projects}))
+        log.info('Updating visibility on {n} assets, skipping {s} already at the requested visibility'.format(
+            n=str(len(calls)), s=str(len(skipped))))
+        succeeded, failed = self.run_asset_batch(calls=calls, max_workers=max_workers,
+                                                 max_calls_per_sec=max_calls_per_sec, action='visibility update')
+        return {'succeeded': succeeded, 'failed': failed, 'skipped': sorted(skipped)}
+
+    def update_assets_categories(self, changes, max_workers=default_batch_max_workers,
+                                 max_calls_per_sec=default_batch_max_calls_per_sec):
+        """Adds and removes categories on many assets concurrently, skipping changes already in effect
+
+        Changes are only skipped for assets with cached categories, pass asset data or call cache_asset_state
+        first.  Each asset has its categories removed before any are added, and nothing is added to an asset
+        when a removal fails.
+
+        :param changes: (list) of tuples: (asset, add_category_ids, remove_category_ids), where asset is an int
+                        asset ID or asset data (dict) containing the current categories
+        :param max_workers: (int) number of concurrent calls
+        :param max_calls_per_sec: (float) maximum rate of calls across all workers
+        :return: (dict) of lists of int asset IDs: succeeded, failed, and skipped (no changes needed)
+        :raises: Cons3rtApiError
+        """
+        log = logging.getLogger(self.cls_logger + '.update_assets_categories')
+        calls = []
+        skipped = []
+        for asset, add_category_ids, remove_category_ids in changes:
+            asset_id, state = self.get_cached_asset_state(asset=asset)
+            add_category_ids = set(int(category_id) for category_id in add_category_ids or [])
+            remove_category_ids = set(int(category_id) for category_id in remove_category_ids or [])
+            if 'category_ids' in state:
+                add_category_ids -= state['category_ids']
+                remove_category_ids &= state['category_ids']
+            if not add_category_ids and not remove_category_ids:
+                skipped.append(asset_id)
+                continue
+            calls.append((asset_id, self.rate_limited_category_update,
+                          {'asset_id': asset_id, 'add_category_ids': sorted(add_category_ids),
+                           'remove_category_ids': sorted(remove_category_ids)}))
+        log.info('Updating categories on {n} assets, skipping {s} assets with no changes needed'.format(
+            n=str(len(calls)), s=str(len(skipped))))
+        succeeded, failed = self.run_asset_batch(calls=calls, max_workers=max_workers,
+                                                 max_calls_per_sec=max_calls_per_sec, action='category update')
+        return {'succeeded': succeeded, 'failed': failed, 'skipped': sorted(skipped)}
+
     def import_asset(self, asset_zip_file):
         """Imports an asset zip file into CONS3RT
 
@@ -6103,6 +6299,145 @@ class Cons3rtApi(object):
         log.info('Completed download of asset ID {a} to: {d}'.format(a=str(asset_id), d=download_file))
         return asset_zip
 
+    def open_asset_download(self, asset_id):
+        """Opens a streaming download of the asset ID without writing it to disk
+
+        The caller is responsible for reading the content and closing the response.
+
+        :param asset_id: (int) asset ID
+        :return: (tuple) requests.Response streaming response, and (int) content length in bytes or None
+        :raises: Cons3rtApiError
+        """
+        log = logging.getLogger(self.cls_logger + '.open_asset_download')
+        log.info('Opening a streaming download of asset ID: {a}'.format(a=str(asset_id)))
+        try:
+            response = self.cons3rt_client.open_asset_download(asset_id=asset_id)
+        except Cons3rtClientError as exc:
+            msg = 'Problem opening a download for asset ID: {a}'.format(a=str(asset_id))
+            raise Cons3rtApiError(msg) from exc
+        content_length = None
+        if 'Content-Length' in response.headers.keys():
+            try:
+                content_length = int(response.headers['Content-Length'])
+            except ValueError:
+                log.warning('Invalid Content-Length found for asset ID [{a}]: {c}'.format(
+                    a=str(asset_id), c=response.headers['Content-Length']))
+        log.info('Opened download for asset ID [{a}] with content length: [{n}]'.format(
+            a=str(asset_id), n=str(content_length)))
+        return response, content_length
+
+    def transfer_asset(self, asset_id, target_api, target_asset_id=None, tee_dir=None,
+                       max_buffer_bytes=default_pipe_buffer_bytes):
+        """Streams an asset from this site into an import or content update on the target site
+
+        The download is piped directly into the multipart upload through a bounded in-memory buffer, so
+        the asset zip is not written to disk unless tee_dir is provided for archival.  When the asset
+        size is not known ahead of time, the asset is staged in tee_dir or a temporary directory.
+
+        :param asset_id: (int) ID of the asset to export from this site
+        :param target_api: (Cons3rtApi) API object for the site to import into
+        :param target_asset_id: (int) ID of an existing asset on the target site to update, or None to import new
+        :param tee_dir: (str) path to a directory to also save the asset zip to
+        :param max_buffer_bytes: (int) maximum number of bytes held in memory for the transfer
+        :return: (int) asset ID on the target site
+        :raises: Cons3rtApiError
+        """
+        log = logging.getLogger(self.cls_logger + '.transfer_asset')
+        if not isinstance(target_api, Cons3rtApi):
+            raise Cons3rtApiError('target_api must be a Cons3rtApi, found: {t}'.format(
+                t=target_api.__class__.__name__))
+        tee_file = None
+        if tee_dir:
+            tee_file = os.path.join(tee_dir, 'asset-{i}.zip'.format(i=str(asset_id)))
+        start_time = time.time()
+        response, content_length = self.open_asset_download(asset_id=asset_id)
+
+        # Without a known length the multipart upload cannot stream, so stage the zip on disk
+        if not content_length:
+            response.close()
+            log.warning('Size unknown for asset ID [{i}], staging the asset zip before uploading'.format(
+                i=str(asset_id)))
+            with tempfile.TemporaryDirectory() as staging_dir:
+                asset_zip = self.download_asset(asset_id=asset_id, dest_dir=tee_dir if tee_dir else staging_dir)
+                try:
+                    if target_asset_id:
+                        target_api.update_asset_content(asset_id=target_asset_id, asset_zip_file=asset_zip)
+                        return target_asset_id
+                    return target_api.import_asset(asset_zip_file=asset_zip)
+                except (OSError, ValueError) as exc:
+                    msg = 'Problem uploading staged asset zip: {f}'.format(f=asset_zip)
+                    raise Cons3rtApiError(msg) from exc
+
+        # Start the producer thread to pipe the download into the upload
+        pipe = BoundedPipe(content_length=content_length, max_buffer_bytes=max_buffer_bytes)
+        producer = threading.Thread(
+            target=pump_response_to_pipe,
+            kwargs={'http_response': response, 'pipe': pipe, 'tee_file': tee_file},
+            name='transfer-{i}'.format(i=str(asset_id)),
+            daemon=True
+        )
+        log.info('Streaming asset ID [{i}] of [{n}] bytes from [{s}] to [{t}]'.format(
+            i=str(asset_id), n=str(content_length), s=self.url_base, t=target_api.url_base))
+        producer.start()
+        try:
+            if target_asset_id:
+                target_api.cons3rt_client.update_asset_content_stream(asset_id=target_asset_id, content_stream=pipe)
+                transferred_asset_id = target_asset_id
+            else:
+                transferred_asset_id = target_api.cons3rt_client.import_asset_stream(content_stream=pipe)
+        except Cons3rtClientError as exc:
+            msg = 'Problem streaming asset ID [{i}] to the target site'.format(i=str(asset_id))
+            raise Cons3rtApiError(msg) from exc
+        finally:
+            pipe.close()
+            producer.join()
+        elapsed_sec = max(time.time() - start_time, 0.001)
+        log.info('Transferred asset ID [{i}] to target asset ID [{t}] in {s} seconds ({r} MB/s)'.format(
+            i=str(asset_id), t=str(transferred_asset_id), s=str(round(elapsed_sec, 2)),
+            r=str(round(content_length / elapsed_sec / 1048576, 2))))
+        return transferred_asset_id
+
+    def transfer_assets(self, asset_ids, target_api, target_asset_ids=None, tee_dir=None, max_workers=4,
+                        max_buffer_bytes=default_pipe_buffer_bytes):
+        """Streams multiple assets from this site to the target site concurrently
+
+        :param asset_ids: (list) of int asset IDs to export from this site
+        :param target_api: (Cons3rtApi) API object for the site to import into
+        :param target_asset_ids: (list) of int asset IDs on the target site to update, in the same order as
+                                 asset_ids, or None to import all as new assets
+        :param tee_dir: (str) path to a directory to also save the asset zips to
+        :param max_workers: (int) number of concurrent transfers
+        :param max_buffer_bytes: (int) maximum number of bytes held in memory for each transfer
+        :return: (tuple) dict of transferred asset ID to target asset ID, and list of failed asset IDs
+        :raises: Cons3rtApiError
+        """
+        log = logging.getLogger(self.cls_logger + '.transfer_assets')
+        if target_asset_ids is None:
+            target_asset_ids = [None] * len(asset_ids)
+        if len(target_asset_ids) != len(asset_ids):
+            raise Cons3rtApiError('The asset_ids and target_asset_ids lists must be the same length')
+        transferred = {}
+        failed = []
+        log.info('Transferring {n} assets with {w} concurrent transfers'.format(
+            n=str(len(asset_ids)), w=str(max_workers)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transfer') as executor:
+            futures = {}
+            for asset_id, target_asset_id in zip(asset_ids, target_asset_ids):
+                future = executor.submit(self.transfer_asset, asset_id=asset_id, target_api=target_api,
+                                         target_asset_id=target_asset_id, tee_dir=tee_dir,
+                                         max_buffer_bytes=max_buffer_bytes)
+                futures[future] = asset_id
+            for future in as_completed(futures):
+                asset_id = futures[future]
+                try:
+                    transferred[asset_id] = future.result()
+                except Cons3rtApiError as exc:
+                    log.error('Problem transferring asset ID [{i}]\n{e}\n{t}'.format(
+                        i=str(asset_id), e=str(exc), t=traceback.format_exc()))
+                    failed.append(asset_id)
+        log.info('Transferred {n} assets, {f} failed'.format(n=str(len(transferred)), f=str(len(failed))))
+        return transferred, failed
+
     def get_my_run_id(self):
         """From deployment properties on this host, gets the run ID
 
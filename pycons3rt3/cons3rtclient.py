@@ -1797,6 +1797,50 @@ class Cons3rtClient:
             raise Cons3rtClientError(str(exc)) from exc
         return asset_id
 
+    def import_asset_stream(self, content_stream):
+        """Imports a new asset from a readable stream of asset zip content
+
+        :param content_stream: (file-like) asset zip content with a known length
+        :return: (int) software asset ID
+        :raises: Cons3rtClientError
+        """
+        try:
+            response = self.http_client.http_post_multipart(
+                rest_user=self.user,
+                target='import/',
+                content_stream=content_stream
+            )
+        except Cons3rtClientError as exc:
+            msg = 'Unable to import asset from a content stream'
+            raise Cons3rtClientError(msg) from exc
+        try:
+            asset_id = parse_response(response=response)
+        except Cons3rtClientError as exc:
+            raise Cons3rtClientError(str(exc)) from exc
+        return asset_id
+
+    def update_asset_content_stream(self, asset_id, content_stream):
+        """Updates the content of the specified asset_id from a readable stream of asset zip content
+
+        :param asset_id: (int) ID of the asset to update
+        :param content_stream: (file-like) asset zip content with a known length
+        :return: None
+        :raises: Cons3rtClientError
+        """
+        try:
+            response = self.http_client.http_put_multipart(
+                rest_user=self.user,
+                target='assets/' + str(asset_id) + '/updatecontent/',
+                content_stream=content_stream
+            )
+        except Cons3rtClientError as exc:
+            msg = 'Unable to update asset ID {i} from a content stream'.format(i=asset_id)
+            raise Cons3rtClientError(msg) from exc
+        try:
+            parse_response(response=response)
+        except Cons3rtClientError as exc:
+            raise Cons3rtClientError(str(exc)) from exc
+
     def add_virtualization_realm_service(self, vr_id, service_content):
         """Add a virtualization realm service using the provided content
 
@@ -2317,6 +2361,28 @@ class Cons3rtClient:
             raise Cons3rtClientError(msg) from exc
         return asset_zip
 
+    def open_asset_download(self, asset_id, read_timeout=900):
+        """Opens a streaming download of the asset ID, the caller must read and close the response
+
+        :param asset_id: (int) asset ID
+        :param read_timeout: (int) seconds to wait in between bytes received
+        :return: (requests.Response) streaming response for the asset zip content
+        :raises: Cons3rtClientError
+        """
+        target = 'assets/{i}/download?background=false'.format(i=str(asset_id))
+        try:
+            response = self.http_client.http_get_download(rest_user=self.user, target=target,
+                                                          read_timeout=read_timeout, stream=True)
+        except Cons3rtClientError as exc:
+            msg = 'Problem opening a download for asset ID: {a}'.format(a=str(asset_id))
+            raise Cons3rtClientError(msg) from exc
+        if response.status_code != 200:
+            response.close()
+            msg = 'Received HTTP code [{n}] opening a download for asset ID: {a}'.format(
+                n=str(response.status_code), a=str(asset_id))
+            raise Cons3rtClientError(msg)
+        return response
+
     def perform_host_action(self, dr_id, dr_host_id, action, cpu=None, ram=None):
         """Performs the provided host action on the host ID
 
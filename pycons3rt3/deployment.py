@@ -25,11 +25,13 @@ import yaml
 
 from .bash import get_ip_addresses, ip_addr
 from .bash import update_hosts_file as update_hosts_file_linux
+from .bash import update_hosts_file_entries as update_hosts_file_entries_linux
 from .exceptions import DeploymentError, CommandError, SshConfigError
 from .logify import Logify
 from .osutil import get_os
-from .ssh import generate_ssh_rsa_key, ssh_copy_id, wait_for_host_key, unrestrict_host_key_checking
+from .ssh import generate_ssh_rsa_key, ssh_copy_id, wait_for_host_keys, unrestrict_host_key_checking
 from .windows import update_hosts_file as update_hosts_file_windows
+from .windows import update_hosts_file_entries as update_hosts_file_entries_windows
 
 
 __author__ = 'Joe Yennaco'
@@ -696,6 +698,21 @@ class Deployment(object):
         else:
             log.warning('OS detected was not Windows nor Linux')
 
+    def update_hosts_file_entries(self, entries):
+        """Adds or updates many hosts file entries at once depending on the OS
+
+        :param entries: (list) of (ip, entry) tuples
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.update_hosts_file_entries')
+
+        if get_os() in ['Linux', 'Darwin']:
+            update_hosts_file_entries_linux(entries=entries)
+        elif get_os() == 'Windows':
+            update_hosts_file_entries_windows(entries=entries)
+        else:
+            log.warning('OS detected was not Windows nor Linux')
+
     def set_scenario_hosts_file(self, network_name='user-net', domain_name=None):
         """Adds hosts file entries for each system in the scenario
         for the specified network_name provided
@@ -707,6 +724,7 @@ class Deployment(object):
         log = logging.getLogger(self.cls_logger + '.set_scenario_hosts_file')
 
         log.info('Scanning scenario hosts to make entries in the hosts file for network: {n}'.format(n=network_name))
+        hosts_file_entries = []
         for scenario_host in self.scenario_network_info:
             if domain_name:
                 host_file_entry = '{r}.{d} {r}'.format(r=scenario_host['scenario_role_name'], d=domain_name)
@@ -714,7 +732,8 @@ class Deployment(object):
                 host_file_entry = scenario_host['scenario_role_name']
             for host_network_info in scenario_host['network_info']:
                 if host_network_info['network_name'] == network_name:
-                    self.update_hosts_file(ip=host_network_info['internal_ip'], entry=host_file_entry)
+                    hosts_file_entries.append((host_network_info['internal_ip'], host_file_entry))
+        self.update_hosts_file_entries(entries=hosts_file_entries)
 
     def set_hosts_file_entry_for_role(self, role_name, network_name='user-net', fqdn=None, domain_name=None):
         """Adds an entry to the hosts file for a scenario host given
@@ -928,11 +947,17 @@ class Deployment(object):
             if host != self.cons3rt_role_name:
                 remote_hosts.append(host)
 
+        # Wait for the remote hosts to come up and collect their host keys all at once
+        try:
+            wait_for_host_keys(hosts=remote_hosts)
+        except SshConfigError as exc:
+            raise DeploymentError('Problem collecting SSH host keys from hosts: {h}'.format(
+                h=', '.join(remote_hosts))) from exc
+
         # Distribute the key to remote hosts
         for host in remote_hosts:
             log.info('Distributing SSH key to host: {h}'.format(h=host))
             try:
-                wait_for_host_key(host=host)
                 ssh_copy_id(pub_key_path=pub_key_path, remote_username=username, host=host, port=str(port))
             except CommandError as exc:
                 raise DeploymentError('Problem copying SSH key to host: {h}'.format(h=host)) from exc
@@ -5,23 +5,23 @@ EC2 API, including networking and security group
 configurations.
 
 """
+import ipaddress
 import logging
 import os
-import socket
 import time
 import traceback
 
 from botocore.client import ClientError
-import requests
 
 from .aws_metadata import is_aws, get_instance_id, get_vpc_id_from_mac_address
+from .awsipranges import get_aws_ip_ranges
 from .awsutil import get_boto3_client, get_linux_migration_user_data_script_contents, \
-    get_linux_nat_config_user_data_script_contents, global_regions, gov_regions, us_regions
+    get_linux_nat_config_user_data_script_contents, global_regions, gov_regions, paginate, us_regions
 from .bash import get_ip_addresses, validate_ip_address
 from .cons3rtinfra import Cons3rtInfra
-from .exceptions import AWSAPIError, AwsTransitGatewayError, EC2UtilError
+from .exceptions import AWSAPIError, AWSIpRangesError, AwsTransitGatewayError, EC2UtilError
 from .logify import Logify
-from .network import get_ip_list_for_hostname_list
+from .network import get_dns_resolver, get_ip_list_for_hostname_list
 from .osutil import get_os
 
 __author__ = 'Joe Yennaco'
@@ -43,6 +43,33 @@ nat_vm_ami = {
 # Default size of a NAT instance
 nat_default_size = 't3.micro'
 
+# Maximum number of security group rules sent in a single authorize or revoke call
+default_max_rules_per_call = 100
+
+# Polling intervals for the batched resource waiter, the interval grows while nothing changes
+default_waiter_min_interval_sec = 2
+default_waiter_max_interval_sec = 30
+
+# Maximum page sizes for the EC2 list calls
+ec2_max_page_size = 1000
+ebs_volumes_max_page_size = 500
+route_tables_max_page_size = 100
+
+# Maximum number of IDs in a single describe filter
+max_filter_values = 200
+
+# States a waited-on resource cannot leave, so waiting for any other state fails right away
+waiter_terminal_states = {
+    'instance': ['terminated'],
+    'instance_status': ['terminated'],
+    'image': ['invalid', 'deregistered', 'failed', 'error'],
+    'volume': ['error', 'deleted'],
+    'snapshot': ['error']
+}
+
+# IP protocol numbers AWS may return in place of protocol names
+ip_protocol_names = {'1': 'icmp', '6': 'tcp', '17': 'udp', '58': 'icmpv6'}
+
 # Amazon service names when querying IPs
 amazon_service_names = ['AMAZON', 'CHIME_VOICECONNECTOR', 'ROUTE53_HEALTHCHECKS', 'S3', 'IVS_REALTIME',
                         'WORKSPACES_GATEWAYS', 'EC2', 'ROUTE53', 'CLOUDFRONT', 'GLOBALACCELERATOR', 'AMAZON_CONNECT',
@@ -342,29 +369,27 @@ class EC2Util(object):
             raise EC2UtilError('Subnets not found in response: {r}'.format(r=str(response)))
         return response
 
-    def list_subnets(self, vpc_id=None):
+    def list_subnets(self, vpc_id=None, projection=None):
         """Returns the list of subnets for the VPC
 
         :param vpc_id: (str) VPC ID to filter on if provided
+        :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
         :return: (list) of subnets (see boto3 docs)
         :raises: EC2UtilError
         """
         log = logging.getLogger(self.cls_logger + '.list_subnets')
+        filters = []
         if vpc_id:
             log.info('Listing subnets in VPC ID: {v}'.format(v=vpc_id))
+            filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
         else:
             log.info('Listing subnets...')
-        next_token = None
-        next_query = True
-        subnets = []
-        while next_query:
-            response = self.list_subnets_with_token(vpc_id=vpc_id, next_token=next_token)
-            if 'NextToken' not in response.keys():
-                next_query = False
-            else:
-                next_token = response['NextToken']
-            subnets += response['Subnets']
-        return subnets
+        try:
+            return list(paginate(client=self.client, operation='describe_subnets', projection=projection,
+                                 page_size=ec2_max_page_size, DryRun=False, Filters=filters))
+        except AWSAPIError as exc:
+            msg = 'Problem listing subnets with filters: {f}'.format(f=str(filters))
+            raise EC2UtilError(msg) from exc
 
     def get_subnet(self, subnet_id):
         return self.retrieve_subnet(subnet_id=subnet_id)
@@ -506,29 +531,27 @@ class EC2Util(object):
             raise EC2UtilError('RouteTables not found in response: {r}'.format(r=str(response)))
         return response
 
-    def list_vpc_route_tables(self, vpc_id=None):
-        """Returns the list of subnets for the VPC
+    def list_vpc_route_tables(self, vpc_id=None, projection=None):
+        """Returns the list of route tables for the VPC
 
         :param vpc_id: (str) VPC ID to filter on if provided
+        :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
         :return: (list) of route tables (see boto3 docs)
         :raises: EC2UtilError
         """
         log = logging.getLogger(self.cls_logger + '.list_vpc_route_tables')
+        filters = []
         if vpc_id:
             log.info('Listing route tables in VPC ID: {v}'.format(v=vpc_id))
+            filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
         else:
             log.info('Listing route tables...')
-        next_token = None
-        next_query = True
-        route_tables = []
-        while next_query:
-            response = self.list_vpc_route_tables_with_token(vpc_id=vpc_id, next_token=next_token)
-            if 'NextToken' not in response.keys():
-                next_query = False
-            else:
-                next_token = response['NextToken']
-            route_tables += response['RouteTables']
-        return route_tables
+        try:
+            return list(paginate(client=self.client, operation='describe_route_tables', projection=projection,
+                                 page_size=route_tables_max_page_size, DryRun=False, Filters=filters))
+        except AWSAPIError as exc:
+            msg = 'Problem listing route tables with filters: {f}'.format(f=str(filters))
+            raise EC2UtilError(msg) from exc
 
     def get_route_table(self, route_table_id):
         """Retrieves the route table
@@ -2019,72 +2042,26 @@ class EC2Util(object):
                 g=security_group_id, r=str(add_rule), e=str(exc))) from exc
 
     def add_security_group_egress_rules(self, security_group_id, add_rules):
-        """Revokes a list of security group rules
+        """Adds a list of security group egress rules in batched API calls
 
         :param security_group_id: (str) Security Group ID
         :param add_rules: (list) List of IpPermission objects to add
         :return: (bool) True if all rules added successfully, False otherwise
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.add_security_group_egress_rules')
-
-        # Return True if none of the rules fail to add
-        success = True
-
-        if not isinstance(add_rules, list):
-            raise EC2UtilError('add_rules arg must be type list, found: {t}'.format(
-                t=add_rules.__class__.__name__))
-
-        if len(add_rules) < 1:
-            log.info('No egress rules provided to add to security group: {g}'.format(g=security_group_id))
-            return success
-
-        log.info('Adding {n} egress rules to security group: {g}'.format(n=str(len(add_rules)), g=security_group_id))
-        for add_rule in add_rules:
-            try:
-                self.add_single_security_group_egress_rule(
-                    security_group_id=security_group_id,
-                    add_rule=add_rule
-                )
-            except EC2UtilError as exc:
-                log.warning('Failed to add egress rule to security group {g}: {r}\n{e}'.format(
-                    g=security_group_id, r=str(add_rule), e=str(exc)))
-                success = False
-        return success
+        return self.update_security_group_rules(
+            security_group_id=security_group_id, rules=add_rules, action='authorize', direction='egress')
 
     def add_security_group_ingress_rules(self, security_group_id, add_rules):
-        """Revokes a list of security group rules
+        """Adds a list of security group ingress rules in batched API calls
 
         :param security_group_id: (str) Security Group ID
         :param add_rules: (list) List of IpPermission objects to add
         :return: (bool) True if all rules added successfully, False otherwise
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.add_security_group_ingress_rules')
-        
-        # Return True if none of the rules fail to add
-        success = True
-
-        if not isinstance(add_rules, list):
-            raise EC2UtilError('add_rules arg must be type list, found: {t}'.format(
-                t=add_rules.__class__.__name__))
-
-        if len(add_rules) < 1:
-            log.info('No ingress rules provided to add to security group: {g}'.format(g=security_group_id))
-            return success
-
-        log.info('Adding {n} ingress rules to security group: {g}'.format(n=str(len(add_rules)), g=security_group_id))
-        for add_rule in add_rules:
-            try:
-                self.add_single_security_group_ingress_rule(
-                    security_group_id=security_group_id,
-                    add_rule=add_rule
-                )
-            except EC2UtilError as exc:
-                log.warning('Failed to add ingress rule to security group {g}: {r}\n{e}'.format(
-                    g=security_group_id, r=str(add_rule), e=str(exc)))
-                success = False
-        return success
+        return self.update_security_group_rules(
+            security_group_id=security_group_id, rules=add_rules, action='authorize', direction='ingress')
 
     def revoke_single_security_group_egress_rule(self, security_group_id, revoke_rule):
         """Revokes a single security group rule
@@ -2133,62 +2110,91 @@ class EC2Util(object):
                 g=security_group_id, r=str(revoke_rule))) from exc
 
     def revoke_security_group_egress_rules(self, security_group_id, revoke_rules):
-        """Revokes a list of security group rules
+        """Revokes a list of security group egress rules in batched API calls
 
         :param security_group_id: (str) Security Group ID
         :param revoke_rules: (list) List of IpPermission objects to revoke
+        :return: (bool) True if all rules revoked successfully, False otherwise
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.revoke_security_group_egress_rules')
-
-        if not isinstance(revoke_rules, list):
-            raise EC2UtilError('revoke_rules arg must be type list, found: {t}'.format(
-                t=revoke_rules.__class__.__name__))
-
-        if len(revoke_rules) < 1:
-            log.info('No egress rules provided to revoke from security group: {g}'.format(g=security_group_id))
-            return
-
-        log.info('Revoking {n} egress rules from security group: {g}'.format(
-            n=str(len(revoke_rules)), g=security_group_id))
-        for revoke_rule in revoke_rules:
-            try:
-                self.revoke_single_security_group_egress_rule(
-                    security_group_id=security_group_id,
-                    revoke_rule=revoke_rule
-                )
-            except EC2UtilError as exc:
-                log.warning('Failed to revoke egress rule from security group {g}: {r}\n{e}'.format(
-                    g=security_group_id, r=str(revoke_rule), e=str(exc)))
+        return self.update_security_group_rules(
+            security_group_id=security_group_id, rules=revoke_rules, action='revoke', direction='egress')
 
     def revoke_security_group_ingress_rules(self, security_group_id, revoke_rules):
-        """Revokes a list of security group rules
+        """Revokes a list of security group ingress rules in batched API calls
 
         :param security_group_id: (str) Security Group ID
         :param revoke_rules: (list) List of IpPermission objects to revoke
+        :return: (bool) True if all rules revoked successfully, False otherwise
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.revoke_security_group_ingress_rules')
+        return self.update_security_group_rules(
+            security_group_id=security_group_id, rules=revoke_rules, action='revoke', direction='ingress')
 
-        if not isinstance(revoke_rules, list):
-            raise EC2UtilError('revoke_rules arg must be type list, found: {t}'.format(
-                t=revoke_rules.__class__.__name__))
+    def update_security_group_rules(self, security_group_id, rules, action, direction,
+                                    max_rules_per_call=default_max_rules_per_call):
+        """Authorizes or revokes security group rules, batching up to max_rules_per_call rules per API call
 
-        if len(revoke_rules) < 1:
-            log.info('No ingress rules provided to revoke from security group: {g}'.format(g=security_group_id))
-            return
+        When a batch fails, for example because one rule is a duplicate, its rules are retried one at a time
+        so the rest of the batch is still applied.
+
+        :param security_group_id: (str) Security Group ID
+        :param rules: (list) List of IpPermission objects
+        :param action: (str) authorize or revoke
+        :param direction: (str) ingress or egress
+        :param max_rules_per_call: (int) maximum number of rules in a single API call
+        :return: (bool) True if all rules were updated successfully, False otherwise
+        :raises: EC2UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.update_security_group_rules')
+
+        if not isinstance(rules, list):
+            raise EC2UtilError('rules arg must be type list, found: {t}'.format(t=rules.__class__.__name__))
+        for rule in rules:
+            if not isinstance(rule, IpPermission):
+                raise EC2UtilError('rules must be type IpPermission, found: {t}'.format(t=rule.__class__.__name__))
+        if action == 'authorize':
+            if direction == 'ingress':
+                single_method = self.add_single_security_group_ingress_rule
+            else:
+                single_method = self.add_single_security_group_egress_rule
+        elif action == 'revoke':
+            if direction == 'ingress':
+                single_method = self.revoke_single_security_group_ingress_rule
+            else:
+                single_method = self.revoke_single_security_group_egress_rule
+        else:
+            raise EC2UtilError('action must be authorize or revoke, found: {a}'.format(a=action))
+        if direction not in ['ingress', 'egress']:
+            raise EC2UtilError('direction must be ingress or egress, found: {d}'.format(d=direction))
+        api_method = getattr(self.client, '{a}_security_group_{d}'.format(a=action, d=direction))
+
+        if len(rules) < 1:
+            log.info('No {d} rules provided to {a} for security group: {g}'.format(
+                d=direction, a=action, g=security_group_id))
+            return True
 
-        log.info('Revoking {n} ingress rules from security group: {g}'.format(
-            n=str(len(revoke_rules)), g=security_group_id))
-        for revoke_rule in revoke_rules:
+        success = True
+        batches = get_ip_permission_batches(ip_permissions=rules, max_rules_per_call=max_rules_per_call)
+        log.info('Running {a} on {n} {d} rules for security group {g} in {b} API calls'.format(
+            a=action, n=str(len(rules)), d=direction, g=security_group_id, b=str(len(batches))))
+        for batch_rules, batch_json in batches:
             try:
-                self.revoke_single_security_group_ingress_rule(
-                    security_group_id=security_group_id,
-                    revoke_rule=revoke_rule
-                )
-            except EC2UtilError as exc:
-                log.warning('Failed to revoke ingress rule from security group {g}: {r}\n{e}'.format(
-                    g=security_group_id, r=str(revoke_rule), e=str(exc)))
+                api_method(DryRun=False, GroupId=security_group_id, IpPermissions=batch_json)
+            except ClientError as exc:
+                log.warning('Batch {a} of {n} {d} rules failed for security group {g}, retrying one at a time\n'
+                            '{e}'.format(a=action, n=str(len(batch_rules)), d=direction, g=security_group_id,
+                                         e=str(exc)))
+            else:
+                continue
+            for rule in batch_rules:
+                try:
+                    single_method(security_group_id, rule)
+                except EC2UtilError as exc:
+                    log.warning('Failed to {a} {d} rule for security group {g}: {r}\n{e}'.format(
+                        a=action, d=direction, g=security_group_id, r=str(rule), e=str(exc)))
+                    success = False
+        return success
 
     def get_security_group(self, security_group_id):
         """Gets a list of IpPermission objects from the security group's egress rules
@@ -2209,10 +2215,11 @@ class EC2Util(object):
             raise AWSAPIError(msg) from exc
         return security_group_info
 
-    def get_security_group_egress_rules(self, security_group_id):
+    def get_security_group_egress_rules(self, security_group_id, include_group_pairs=False):
         """Gets a list of IpPermission objects from the security group's egress rules
 
         :param security_group_id: (str) Security Group ID
+        :param include_group_pairs: (bool) set True to include rules referencing security groups
         :return: (list) IpPermission objects
         :raises: AWSAPIError, EC2UtilError
         """
@@ -2227,12 +2234,13 @@ class EC2Util(object):
             raise AWSAPIError(msg) from exc
 
         # Parse permissions into comparable IpPermissions objects
-        return parse_ip_permissions(existing_egress_rules)
+        return parse_ip_permissions(existing_egress_rules, include_group_pairs=include_group_pairs)
 
-    def get_security_group_ingress_rules(self, security_group_id):
+    def get_security_group_ingress_rules(self, security_group_id, include_group_pairs=False):
         """Gets a list of IpPermission objects from the security group's ingess rules
 
         :param security_group_id: (str) Security Group ID
+        :param include_group_pairs: (bool) set True to include rules referencing security groups
         :return: (list) IpPermission objects
         :raises: AWSAPIError, EC2UtilError
         """
@@ -2247,15 +2255,17 @@ class EC2Util(object):
             raise AWSAPIError(msg) from exc
 
         # Parse permissions into comparable IpPermissions objects
-        return parse_ip_permissions(existing_ingress_rules)
+        return parse_ip_permissions(existing_ingress_rules, include_group_pairs=include_group_pairs)
 
-    def configure_security_group_egress(self, security_group_id, desired_egress_rules):
+    def configure_security_group_egress(self, security_group_id, desired_egress_rules, revoke_group_rules=False):
         """Configures the security group ID allowing access
         only to the specified CIDR blocks, for the specified
         port number.
 
         :param security_group_id: (str) Security Group ID
         :param desired_egress_rules: (list) List of IpPermissions as described in AWS boto3 docs
+        :param revoke_group_rules: (bool) set True to also revoke existing rules referencing security groups that
+                                   are not in the desired rules, by default they are left in place
         :return: (bool) True if all rules configured successfully, False otherwise
         :raises: AWSAPIError, EC2UtilError
         """
@@ -2267,7 +2277,8 @@ class EC2Util(object):
             raise EC2UtilError('desired_egress_rules argument is not a list')
 
         # Get the security group egress permissions
-        existing_ip_perms = self.get_security_group_egress_rules(security_group_id=security_group_id)
+        existing_ip_perms = self.get_security_group_egress_rules(
+            security_group_id=security_group_id, include_group_pairs=True)
 
         log.info('Existing egress IP permissions:')
         for existing_ip_perm in existing_ip_perms:
@@ -2276,25 +2287,15 @@ class EC2Util(object):
         for desired_egress_rule in desired_egress_rules:
             log.info('Desired egress IP permission: {p}'.format(p=str(desired_egress_rule)))
 
-        # Determine which rules to revoke
-        revoke_ip_perms = []
-        for existing_ip_perm in existing_ip_perms:
-            revoke = True
-            for desired_ip_perm in desired_egress_rules:
-                if existing_ip_perm == desired_ip_perm:
-                    revoke = False
-            if revoke:
-                revoke_ip_perms.append(existing_ip_perm)
-
-        # Determine which rules to add
-        add_ip_perms = []
-        for desired_ip_perm in desired_egress_rules:
-            add = True
-            for existing_ip_perm in existing_ip_perms:
-                if desired_ip_perm == existing_ip_perm:
-                    add = False
-            if add:
-                add_ip_perms.append(desired_ip_perm)
+        # Determine which rules to revoke and add
+        revoke_ip_perms, add_ip_perms = get_ip_permission_changes(
+            existing_ip_permissions=existing_ip_perms,
+            desired_ip_permissions=desired_egress_rules
+        )
+        if not revoke_group_rules:
+            revoke_ip_perms = [ip_perm for ip_perm in revoke_ip_perms if not ip_perm.GroupId]
+        log.info('Found {r} egress rules to revoke and {a} to add'.format(
+            r=str(len(revoke_ip_perms)), a=str(len(add_ip_perms))))
 
         # Revoke rules
         self.revoke_security_group_egress_rules(security_group_id=security_group_id, revoke_rules=revoke_ip_perms)
@@ -2304,13 +2305,15 @@ class EC2Util(object):
         log.info('Completed configuring egress rules for security group: {g}'.format(g=security_group_id))
         return result
 
-    def configure_security_group_ingress(self, security_group_id, desired_ingress_rules):
+    def configure_security_group_ingress(self, security_group_id, desired_ingress_rules, revoke_group_rules=False):
         """Configures the security group ID allowing access
         only to the specified CIDR blocks, for the specified
         port number.
 
         :param security_group_id: (str) Security Group ID
         :param desired_ingress_rules: (list) List of IpPermissions as described in AWS boto3 docs
+        :param revoke_group_rules: (bool) set True to also revoke existing rules referencing security groups that
+                                   are not in the desired rules, by default they are left in place
         :return: (bool) True if all rules configured successfully, False otherwise
         :raises: AWSAPIError, EC2UtilError
         """
@@ -2322,7 +2325,8 @@ class EC2Util(object):
             raise EC2UtilError('desired_egress_rules argument is not a list')
 
         # Get the security group ingress permissions
-        existing_ip_perms = self.get_security_group_ingress_rules(security_group_id=security_group_id)
+        existing_ip_perms = self.get_security_group_ingress_rules(
+            security_group_id=security_group_id, include_group_pairs=True)
 
         log.info('Existing ingress IP permissions:')
         for existing_ip_perm in existing_ip_perms:
@@ -2331,25 +2335,15 @@ class EC2Util(object):
         for desired_egress_rule in desired_ingress_rules:
             log.info('Desired ingress IP permission: {p}'.format(p=str(desired_egress_rule)))
 
-        # Determine which rules to revoke
-        revoke_ip_perms = []
-        for existing_ip_perm in existing_ip_perms:
-            revoke = True
-            for desired_ip_perm in desired_ingress_rules:
-                if existing_ip_perm == desired_ip_perm:
-                    revoke = False
-            if revoke:
-                revoke_ip_perms.append(existing_ip_perm)
-
-        # Determine which rules to add
-        add_ip_perms = []
-        for desired_ip_perm in desired_ingress_rules:
-            add = True
-            for existing_ip_perm in existing_ip_perms:
-                if desired_ip_perm == existing_ip_perm:
-                    add = False
-            if add:
-                add_ip_perms.append(desired_ip_perm)
+        # Determine which rules to revoke and add
+        revoke_ip_perms, add_ip_perms = get_ip_permission_changes(
+            existing_ip_permissions=existing_ip_perms,
+            desired_ip_permissions=desired_ingress_rules
+        )
+        if not revoke_group_rules:
+            revoke_ip_perms = [ip_perm for ip_perm in revoke_ip_perms if not ip_perm.GroupId]
+        log.info('Found {r} ingress rules to revoke and {a} to add'.format(
+            r=str(len(revoke_ip_perms)), a=str(len(add_ip_perms))))
 
         # Revoke rules
         self.revoke_security_group_ingress_rules(security_group_id=security_group_id, revoke_rules=revoke_ip_perms)
@@ -2770,142 +2764,179 @@ class EC2Util(object):
         :return: True when the instance reaches the target state, False if not in target state by the provided timeout
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.wait_for_instance_state')
-        check_interval_sec = 10
-        num_checks = timeout_sec // check_interval_sec
-        start_time = time.time()
-        log.info('Waiting a maximum of {t} seconds for instance ID [{i}] to reach a target state: {s}'.format(
-            t=str(timeout_sec), i=instance_id, s=target_state))
-        for _ in range(0, num_checks*2):
-            elapsed_time = round(time.time() - start_time, 1)
-            if elapsed_time > timeout_sec:
-                log.warning('Instance ID {i} not in target state [{s}] after {t} seconds'.format(
-                    i=instance_id, t=str(timeout_sec), s=target_state))
-                return False
-            try:
-                response = self.client.describe_instances(DryRun=False, InstanceIds=[instance_id])
-            except ClientError as exc:
-                log.warning('Problem describing instance ID: {i}\n{e}'.format(i=instance_id, e=str(exc)))
-                continue
-            if 'Reservations' not in response.keys():
-                log.warning('Reservations not found in response: {r}'.format(r=str(response)))
-                continue
-            if len(response['Reservations']) != 1:
-                log.warning('Expected 1 reservation, found in response: {n}'.format(
-                    n=str(len(response['Reservations']))))
-                continue
-            reservation = response['Reservations'][0]
-            if 'Instances' not in reservation.keys():
-                log.warning('Instances not found in reservation: {r}'.format(r=str(reservation)))
-                continue
-            if len(reservation['Instances']) != 1:
-                log.warning('Expected 1 instance, found in reservation: {n}'.format(
-                    n=str(len(reservation['Instances']))))
-                continue
-            instance = reservation['Instances'][0]
-            if 'InstanceId' not in instance.keys():
-                log.warning('InstanceId not found in instance data: {i}'.format(i=str(instance)))
-                continue
-            if 'State' not in instance.keys():
-                log.warning('State not found in instance data: {i}'.format(i=str(instance)))
-                continue
-            if 'Name' not in instance['State'].keys():
-                log.warning('Name not found in instance state data: {i}'.format(i=str(instance['State'])))
-                continue
-            if instance['State']['Name'] == target_state:
-                log.info('Instance ID [{i}] state is in the target state [{t}], exiting...'.format(
-                    i=instance_id, t=target_state))
-                return True
-            else:
-                log.info('Instance ID [{i}] is in state: {s}'.format(i=instance_id, s=instance['State']['Name']))
-            log.info('Waiting {t} seconds to check state of instance ID: {i}'.format(
-                t=str(check_interval_sec), i=instance_id))
-            time.sleep(check_interval_sec)
-        return False
+        result = self.wait_for_resources_state(
+            resource_type='instance',
+            resource_ids=[instance_id],
+            target_state=target_state,
+            timeout_sec=timeout_sec
+        )
+        return instance_id in result['reached']
 
     def wait_for_instance_status_checks(self, instance_id, timeout_sec=900):
-        """Waits until the instance ID is in a running state
+        """Waits until the instance ID is running and has passed its instance and system status checks
 
         :param instance_id: (str) ID of the instance
         :param timeout_sec: (int) Time in seconds before returning False
         :return: True when available, False if not available by the provided timeout
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.wait_for_instance_status_checks')
-        check_interval_sec = 10
-        num_checks = timeout_sec // check_interval_sec
-        start_time = time.time()
-        log.info('Waiting a maximum of {t} seconds for instance ID [{i}] to pass its instance status checks'.format(
-            t=str(timeout_sec), i=instance_id))
-        for _ in range(0, num_checks*2):
-            log.info('Waiting {t} seconds to check status of instance ID: {i}'.format(
-                t=str(check_interval_sec), i=instance_id))
-            time.sleep(check_interval_sec)
-            elapsed_time = round(time.time() - start_time, 1)
-            if elapsed_time > timeout_sec:
-                log.warning('Instance ID {i} has not passed instance status checks after {t} seconds'.format(
-                    i=instance_id, t=str(timeout_sec)))
-                return False
+        result = self.wait_for_resources_state(
+            resource_type='instance_status',
+            resource_ids=[instance_id],
+            target_state='ok',
+            timeout_sec=timeout_sec
+        )
+        return instance_id in result['reached']
+
+    def describe_resource_states(self, resource_type, resource_ids):
+        """Returns the current state of each resource using batched describe calls
+
+        Resources are looked up with ID filters, so IDs that do not exist yet are left out of the
+        result rather than failing the call.  Instance status has no ID filter so it is looked up by
+        instance ID, and its state is "ok" once the instance is running and both its instance and
+        system status checks pass.
+
+        :param resource_type: (str) instance, instance_status, image, volume, or snapshot
+        :param resource_ids: (list) of str resource IDs
+        :return: (dict) of resource ID to str state
+        :raises: EC2UtilError
+        """
+        states = {}
+        resource_ids = list(resource_ids)
+        for start in range(0, len(resource_ids), max_filter_values):
+            batch_ids = resource_ids[start:start + max_filter_values]
             try:
-                response = self.client.describe_instance_status(
-                    DryRun=False, InstanceIds=[instance_id], IncludeAllInstances=True)
+                if resource_type == 'instance':
+                    paginator = self.client.get_paginator('describe_instances')
+                    for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch_ids}]):
+                        for reservation in page.get('Reservations', []):
+                            for instance in reservation.get('Instances', []):
+                                states[instance['InstanceId']] = instance['State']['Name']
+                elif resource_type == 'instance_status':
+                    paginator = self.client.get_paginator('describe_instance_status')
+                    pages = paginator.paginate(InstanceIds=batch_ids, IncludeAllInstances=True)
+                    for page in pages:
+                        for instance_status in page.get('InstanceStatuses', []):
+                            state = instance_status['InstanceState']['Name']
+                            if state == 'running':
+                                if instance_status.get('InstanceStatus', {}).get('Status') == 'ok' and \
+                                        instance_status.get('SystemStatus', {}).get('Status') == 'ok':
+                                    state = 'ok'
+                            states[instance_status['InstanceId']] = state
+                elif resource_type == 'image':
+                    response = self.client.describe_images(Filters=[{'Name': 'image-id', 'Values': batch_ids}])
+                    for image in response.get('Images', []):
+                        states[image['ImageId']] = image['State']
+                elif resource_type == 'volume':
+                    paginator = self.client.get_paginator('describe_volumes')
+                    for page in paginator.paginate(Filters=[{'Name': 'volume-id', 'Values': batch_ids}]):
+                        for volume in page.get('Volumes', []):
+                            states[volume['VolumeId']] = volume['State']
+                elif resource_type == 'snapshot':
+                    paginator = self.client.get_paginator('describe_snapshots')
+                    for page in paginator.paginate(Filters=[{'Name': 'snapshot-id', 'Values': batch_ids}]):
+                        for snapshot in page.get('Snapshots', []):
+                            states[snapshot['SnapshotId']] = snapshot['State']
+                else:
+                    raise EC2UtilError('Unsupported resource type: {t}'.format(t=resource_type))
             except ClientError as exc:
-                log.warning('Problem describing status for instance ID: {i}\n{e}'.format(i=instance_id, e=str(exc)))
-                continue
-            if 'InstanceStatuses' not in response.keys():
-                log.warning('InstanceStatuses not found in response: {r}'.format(r=str(response)))
-                continue
-            if len(response['InstanceStatuses']) != 1:
-                log.warning('Expected 1 instance status, found in response: {n}'.format(
-                    n=str(len(response['InstanceStatuses']))))
-                continue
-            instance_status = response['InstanceStatuses'][0]
-            if 'InstanceId' not in instance_status.keys():
-                log.warning('InstanceId not found in instance status: {i}'.format(i=str(instance_status)))
-                continue
-            if instance_status['InstanceId'] != instance_id:
-                log.warning('Found instance ID [{i}] does not match the requested instance ID: {r}'.format(
-                    i=instance_status['InstanceId'], r=instance_id))
-                continue
-            if 'InstanceState' not in instance_status.keys():
-                log.warning('InstanceState not found in instance status: {i}'.format(i=str(instance_status)))
-                continue
-            if 'Name' not in instance_status['InstanceState'].keys():
-                log.warning('Name not found in instance state data: {i}'.format(
-                    i=str(instance_status['InstanceState'])))
-                continue
-            if instance_status['InstanceState']['Name'] != 'running':
-                log.info('Found instance state [{s}] is not running, re-checking...'.format(
-                    s=instance_status['InstanceState']['Name']))
-                continue
-            if 'InstanceStatus' not in instance_status.keys():
-                log.warning('InstanceStatus not found in instance status data: {i}'.format(
-                    i=str(instance_status)))
-                continue
-            if 'SystemStatus' not in instance_status.keys():
-                log.warning('SystemStatus not found in instance status data: {i}'.format(
-                    i=str(instance_status)))
-                continue
-            if 'Status' not in instance_status['InstanceStatus'].keys():
-                log.warning('Status not found in instance status data: {i}'.format(
-                    i=str(instance_status['InstanceStatus'])))
-                continue
-            if 'Status' not in instance_status['SystemStatus'].keys():
-                log.warning('Status not found in system status data: {i}'.format(
-                    i=str(instance_status['SystemStatus'])))
-                continue
-            current_instance_status = instance_status['InstanceStatus']['Status']
-            current_system_status = instance_status['SystemStatus']['Status']
-            log.info('Found current instance status for instance ID [{i}]: {s}'.format(
-                i=instance_id, s=current_instance_status))
-            log.info('Found current system status for instance ID [{i}]: {s}'.format(
-                i=instance_id, s=current_system_status))
-            if current_instance_status != 'ok' or current_system_status != 'ok':
-                log.info('Instance and system statii are both not [ok], rechecking...')
-                continue
-            log.info('Both instance and system statii are [ok], exiting...')
-            return True
-        return False
+                msg = 'Problem describing {n} {t} resources'.format(n=str(len(batch_ids)), t=resource_type)
+                raise EC2UtilError(msg) from exc
+            except KeyError as exc:
+                msg = 'Unexpected data describing {t} resources'.format(t=resource_type)
+                raise EC2UtilError(msg) from exc
+        return states
+
+    def iter_resources_state(self, resource_type, resource_ids, target_state, timeout_sec=900,
+                             min_interval_sec=default_waiter_min_interval_sec,
+                             max_interval_sec=default_waiter_max_interval_sec):
+        """Waits for many resources to reach the target state, yielding each one as it finishes
+
+        Each poll is one batched describe call for all of the resources still pending.  The poll interval
+        starts at min_interval_sec and grows up to max_interval_sec while no resource changes state, and
+        drops back when one does.  All resources share a single deadline.
+
+        :param resource_type: (str) instance, instance_status, image, volume, or snapshot
+        :param resource_ids: (list) of str resource IDs
+        :param target_state: (str) desired state, use "ok" with instance_status for passed status checks
+        :param timeout_sec: (int) overall time in seconds to wait for all of the resources
+        :param min_interval_sec: (int) shortest time between polls
+        :param max_interval_sec: (int) longest time between polls
+        :return: generator of tuples: (str) resource ID, (bool) True if it reached the target state, (str) state
+        :raises: EC2UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.iter_resources_state')
+        if resource_type not in waiter_terminal_states:
+            raise EC2UtilError('Unsupported resource type: {t}'.format(t=resource_type))
+        pending = {}
+        for resource_id in resource_ids:
+            pending[resource_id] = None
+        deadline = time.time() + timeout_sec
+        interval_sec = min_interval_sec
+        log.info('Waiting a maximum of {t} seconds for {n} {r} resources to reach state: {s}'.format(
+            t=str(timeout_sec), n=str(len(pending)), r=resource_type, s=target_state))
+        while pending:
+            try:
+                states = self.describe_resource_states(resource_type=resource_type, resource_ids=pending.keys())
+            except EC2UtilError as exc:
+                log.warning('Problem describing {r} resources, will retry\n{e}'.format(r=resource_type, e=str(exc)))
+                states = {}
+            changed = False
+            for resource_id, state in states.items():
+                if resource_id not in pending:
+                    continue
+                if state != pending[resource_id]:
+                    changed = True
+                    log.info('{r} [{i}] is in state: {s}'.format(r=resource_type, i=resource_id, s=state))
+                pending[resource_id] = state
+                if state == target_state:
+                    del pending[resource_id]
+                    yield resource_id, True, state
+                elif state in waiter_terminal_states[resource_type]:
+                    log.warning('{r} [{i}] will not reach state [{t}] from state: {s}'.format(
+                        r=resource_type, i=resource_id, t=target_state, s=state))
+                    del pending[resource_id]
+                    yield resource_id, False, state
+            if not pending:
+                break
+            remaining_sec = deadline - time.time()
+            if remaining_sec <= 0:
+                log.warning('{n} {r} resources not in state [{s}] after {t} seconds: {i}'.format(
+                    n=str(len(pending)), r=resource_type, s=target_state, t=str(timeout_sec),
+                    i=','.join(pending.keys())))
+                for resource_id, state in list(pending.items()):
+                    yield resource_id, False, state
+                break
+            if changed:
+                interval_sec = min_interval_sec
+            else:
+                interval_sec = min(interval_sec * 2, max_interval_sec)
+            time.sleep(min(interval_sec, remaining_sec))
+
+    def wait_for_resources_state(self, resource_type, resource_ids, target_state, timeout_sec=900,
+                                 min_interval_sec=default_waiter_min_interval_sec,
+                                 max_interval_sec=default_waiter_max_interval_sec):
+        """Waits for many resources to reach the target state with batched polling
+
+        :param resource_type: (str) instance, instance_status, image, volume, or snapshot
+        :param resource_ids: (list) of str resource IDs
+        :param target_state: (str) desired state, use "ok" with instance_status for passed status checks
+        :param timeout_sec: (int) overall time in seconds to wait for all of the resources
+        :param min_interval_sec: (int) shortest time between polls
+        :param max_interval_sec: (int) longest time between polls
+        :return: (dict) with lists of resource IDs: reached and failed, plus states: dict of ID to last known state
+        :raises: EC2UtilError
+        """
+        result = {'reached': [], 'failed': [], 'states': {}}
+        for resource_id, reached, state in self.iter_resources_state(
+                resource_type=resource_type, resource_ids=resource_ids, target_state=target_state,
+                timeout_sec=timeout_sec, min_interval_sec=min_interval_sec, max_interval_sec=max_interval_sec):
+            if reached:
+                result['reached'].append(resource_id)
+            else:
+                result['failed'].append(resource_id)
+            result['states'][resource_id] = state
+        return result
 
     def wait_for_instance_availability(self, instance_id):
         """Waits for instance to be running and passed all status checks
@@ -2936,35 +2967,13 @@ class EC2Util(object):
         :return: True when the AMI is available, False if not available by the provided timeout
         :raises: EC2UtilError
         """
-        log = logging.getLogger(self.cls_logger + '.wait_for_image_available')
-        check_interval_sec = 10
-        num_checks = timeout_sec // check_interval_sec
-        start_time = time.time()
-        log.info('Waiting a maximum of {t} seconds for image ID [{i}] to become available'.format(
-            t=str(timeout_sec), i=ami_id))
-        for _ in range(0, num_checks*2):
-            log.info('Waiting {t} seconds to check state of AMI ID: {i}'.format(
-                t=str(check_interval_sec), i=ami_id))
-            time.sleep(check_interval_sec)
-            elapsed_time = round(time.time() - start_time, 1)
-            if elapsed_time > timeout_sec:
-                log.warning('AMI ID {i} not in target state [available] after {t} seconds'.format(
-                    i=ami_id, t=str(timeout_sec)))
-                return False
-            try:
-                response = self.get_image(ami_id=ami_id)
-            except ClientError as exc:
-                log.warning('Problem getting details for AMI ID: {i}\n{e}'.format(i=ami_id, e=str(exc)))
-                continue
-            if 'State' not in response.keys():
-                log.warning('State not found in instance data: {i}'.format(i=str(response)))
-                continue
-            if response['State'] == 'available':
-                log.info('AMI ID [{i}] state is in the target state [available], exiting...'.format(i=ami_id))
-                return True
-            else:
-                log.info('AMI ID [{i}] is in state: {s}'.format(i=ami_id, s=response['State']))
-        return False
+        result = self.wait_for_resources_state(
+            resource_type='image',
+            resource_ids=[ami_id],
+            target_state='available',
+            timeout_sec=timeout_sec
+        )
+        return ami_id in result['reached']
 
     def get_host(self, host_id):
         """Gets into for a single host
@@ -3011,6 +3020,38 @@ class EC2Util(object):
         """
         return list_instances(client=self.client)
 
+    def list_instances(self, filters=None, projection=None):
+        """Lists EC2 instances, optionally filtered on the server side and projected to the needed fields
+
+        :param filters: (list) of describe_instances filters
+        :param projection: (str) JMESPath expression applied to each instance
+        :return: (list) of instances
+        :raises: EC2UtilError
+        """
+        return list_instances(client=self.client, filters=filters, projection=projection)
+
+    def list_images(self, owner_id='self', filters=None, projection=None):
+        """Lists EC2 images
+
+        :param owner_id: (str) ID of the account that owns the images
+        :param filters: (list) of describe_images filters
+        :param projection: (str) JMESPath expression applied to each image
+        :return: (list) of images
+        :raises: EC2UtilError
+        """
+        return list_images(client=self.client, owner_id=owner_id, filters=filters, projection=projection)
+
+    def list_snapshots(self, owner_id='self', filters=None, projection=None):
+        """Lists EBS snapshots
+
+        :param owner_id: (str) ID of the account that owns the snapshots
+        :param filters: (list) of describe_snapshots filters
+        :param projection: (str) JMESPath expression applied to each snapshot
+        :return: (list) of snapshots
+        :raises: EC2UtilError
+        """
+        return list_snapshots(client=self.client, owner_id=owner_id, filters=filters, projection=projection)
+
     def get_ec2_instances(self):
         """Describes the EC2 instances
 
@@ -3027,6 +3068,44 @@ class EC2Util(object):
         """
         return stop_instance(client=self.client, instance_id=instance_id)
 
+    def stop_instances(self, instance_ids):
+        """Stops the provided instances with one API call per batch
+
+        :param instance_ids: (list) of str instance IDs
+        :return: (dict) of instance ID to current state
+        :raises: EC2UtilError
+        """
+        return stop_instances(client=self.client, instance_ids=instance_ids)
+
+    def start_instances(self, instance_ids):
+        """Starts the provided instances with one API call per batch
+
+        :param instance_ids: (list) of str instance IDs
+        :return: (dict) of instance ID to current state
+        :raises: EC2UtilError
+        """
+        return start_instances(client=self.client, instance_ids=instance_ids)
+
+    def modify_instance_placement(self, instance_id, host_id):
+        """Moves a stopped instance on to a dedicated host
+
+        :param instance_id: (str) ID of the instance
+        :param host_id: (str) ID of the dedicated host
+        :return: None
+        :raises: EC2UtilError
+        """
+        modify_instance_placement(client=self.client, instance_id=instance_id, host_id=host_id)
+
+    def modify_instance_type(self, instance_id, instance_type):
+        """Changes the instance type of a stopped instance
+
+        :param instance_id: (str) ID of the instance
+        :param instance_type: (str) instance type
+        :return: None
+        :raises: EC2UtilError
+        """
+        modify_instance_type(client=self.client, instance_id=instance_id, instance_type=instance_type)
+
     def terminate_instance(self, instance_id):
         """Terminates the provided instance
 
@@ -3062,13 +3141,15 @@ class EC2Util(object):
         """
         return get_image(client=self.client, ami_id=ami_id)
 
-    def list_volumes(self):
+    def list_volumes(self, filters=None, projection=None):
         """Describes the EBS volumes
 
+        :param filters: (list) of describe_volumes filters
+        :param projection: (str) JMESPath expression applied to each volume
         :return: dict containing EBS volume data
         :raises EC2UtilError
         """
-        return list_volumes(client=self.client)
+        return list_volumes(client=self.client, filters=filters, projection=projection)
 
     def list_unattached_volumes(self):
         """Return a list of unattached EBS volumes
@@ -5081,6 +5162,32 @@ class IpPermission(object):
             return self.GroupId == other.GroupId
         return False
 
+    def get_key(self):
+        """Returns a hashable key that is the same for rules considered equal
+
+        The protocol is normalized to its lower-case name, ports are dropped for all-protocol rules
+        (AWS ignores them), and CIDR blocks are normalized.
+
+        :return: (tuple) rule key
+        """
+        protocol = str(self.IpProtocol).lower()
+        protocol = ip_protocol_names.get(protocol, protocol)
+        if protocol == '-1':
+            ports = (None, None)
+        else:
+            ports = (self.FromPort if self.FromPort else None, self.ToPort if self.ToPort else None)
+        if self.CidrIp:
+            target = ('CidrIp', normalize_cidr(self.CidrIp))
+        elif self.CidrIpv6:
+            target = ('CidrIpv6', normalize_cidr(self.CidrIpv6))
+        elif self.PrefixListId:
+            target = ('PrefixListId', self.PrefixListId)
+        elif self.GroupId:
+            target = ('GroupId', self.GroupId)
+        else:
+            target = ('None', id(self))
+        return (protocol,) + ports + target
+
     def get_json(self):
         json_output = {
             'IpProtocol': self.IpProtocol
@@ -6220,10 +6327,13 @@ def get_ec2_client(region_name=None, aws_access_key_id=None, aws_secret_access_k
                             aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
 
 
-def parse_ip_permissions(ip_permissions):
+def parse_ip_permissions(ip_permissions, include_group_pairs=False):
     """Parse a list of IpPermissions or IpPermissionsEgress as defined in the boto3 documentation and returns
     a list of IpPermissions objects
 
+    :param ip_permissions: (list) of IpPermissions dicts
+    :param include_group_pairs: (bool) set True to also return rules referencing security groups (UserIdGroupPairs)
+    :return: (list) of IpPermission objects
     """
     log = logging.getLogger(mod_logger + '.parse_ip_permissions')
     if not isinstance(ip_permissions, list):
@@ -6286,9 +6396,100 @@ def parse_ip_permissions(ip_permissions):
                         ToPort=to_port
                     )
                 )
+        if include_group_pairs and 'UserIdGroupPairs' in ip_permission:
+            for group_rule in ip_permission['UserIdGroupPairs']:
+                if 'GroupId' not in group_rule:
+                    continue
+                rule_description = None
+                if 'Description' in group_rule:
+                    rule_description = group_rule['Description']
+                permissions_list.append(
+                    IpPermission(
+                        IpProtocol=ip_permission['IpProtocol'],
+                        GroupId=group_rule['GroupId'],
+                        Description=rule_description,
+                        FromPort=from_port,
+                        ToPort=to_port
+                    )
+                )
     return permissions_list
 
 
+def normalize_cidr(cidr):
+    """Returns the CIDR block in its canonical form so equal blocks compare equal
+
+    :param cidr: (str) IPv4 or IPv6 CIDR block
+    :return: (str) normalized CIDR block, or the provided string if it is not a valid CIDR
+    """
+    try:
+        return str(ipaddress.ip_network(cidr, strict=False))
+    except ValueError:
+        return cidr
+
+
+def get_ip_permission_changes(existing_ip_permissions, desired_ip_permissions):
+    """Determines the rules to revoke and add to get from the existing to the desired rules
+
+    Rules are compared by IpPermission.get_key, so this runs in linear time.
+
+    :param existing_ip_permissions: (list) of IpPermission objects currently in the security group
+    :param desired_ip_permissions: (list) of desired IpPermission objects
+    :return: (tuple) lists of IpPermission objects to revoke and to add
+    """
+    existing_keys = set(ip_permission.get_key() for ip_permission in existing_ip_permissions)
+    desired_keys = set()
+    add_ip_permissions = []
+    for ip_permission in desired_ip_permissions:
+        key = ip_permission.get_key()
+        if key not in existing_keys and key not in desired_keys:
+            add_ip_permissions.append(ip_permission)
+        desired_keys.add(key)
+    revoke_ip_permissions = []
+    revoke_keys = set()
+    for ip_permission in existing_ip_permissions:
+        key = ip_permission.get_key()
+        if key not in desired_keys and key not in revoke_keys:
+            revoke_ip_permissions.append(ip_permission)
+            revoke_keys.add(key)
+    return revoke_ip_permissions, add_ip_permissions
+
+
+def get_ip_permission_batches(ip_permissions, max_rules_per_call=default_max_rules_per_call):
+    """Groups rules into IpPermissions payloads for authorize and revoke calls
+
+    Rules with the same protocol and ports are merged into one IpPermissions entry, and each batch
+    holds at most max_rules_per_call rules.
+
+    :param ip_permissions: (list) of IpPermission objects
+    :param max_rules_per_call: (int) maximum number of rules in a batch
+    :return: (list) of tuples: list of IpPermission objects in the batch, list of IpPermissions dicts
+    """
+    batches = []
+    for start in range(0, len(ip_permissions), max_rules_per_call):
+        batch_rules = ip_permissions[start:start + max_rules_per_call]
+        entries = {}
+        for ip_permission in batch_rules:
+            entry_key = (ip_permission.IpProtocol, ip_permission.FromPort, ip_permission.ToPort)
+            if entry_key not in entries:
+                entries[entry_key] = {'IpProtocol': ip_permission.IpProtocol}
+                if ip_permission.FromPort:
+                    entries[entry_key]['FromPort'] = ip_permission.FromPort
+                if ip_permission.ToPort:
+                    entries[entry_key]['ToPort'] = ip_permission.ToPort
+            for list_key, target_key, target in [('IpRanges', 'CidrIp', ip_permission.CidrIp),
+                                                 ('Ipv6Ranges', 'CidrIpv6', ip_permission.CidrIpv6),
+                                                 ('PrefixListIds', 'PrefixListId', ip_permission.PrefixListId),
+                                                 ('UserIdGroupPairs', 'GroupId', ip_permission.GroupId)]:
+                if not target:
+                    continue
+                rule = {target_key: target}
+                if ip_permission.Description:
+                    rule['Description'] = ip_permission.Description
+                entries[entry_key].setdefault(list_key, []).append(rule)
+        batches.append((batch_rules, list(entries.values())))
+    return batches
+
+
 def get_aws_service_permissions(regions, ipv6=False):
     """Returns a list of IpPermissions objects for a list of regions
 
@@ -6602,25 +6803,17 @@ def get_aws_service_ips(regions=None, ipv6=False, include_amazon_service=True, i
                 log.error('Invalid service name provided: [{n}]'.format(n=service))
                 return filtered_unique_amazon_cidr_ranges
 
-    # Determine the prefix ID
-    if ipv6:
-        prefix_id = 'ipv6_prefixes'
-    else:
-        prefix_id = 'prefixes'
-
-    # Get the full list from Amazon
+    # Get the cached and indexed list from Amazon, filtered to the regions
     try:
-        ip_ranges = requests.get('https://ip-ranges.amazonaws.com/ip-ranges.json').json()[prefix_id]
-    except Exception as exc:
+        aws_ip_ranges = get_aws_ip_ranges()
+    except AWSIpRangesError as exc:
         log.error('Problem retrieving the list of IP ranges from AWS{e}\n'.format(e=str(exc)))
         return filtered_unique_amazon_cidr_ranges
+    ip_ranges = aws_ip_ranges.get_prefixes(ipv6=ipv6, regions=regions)
 
-    # Set the prfix key based on IPv4 or IPv6
     if ipv6:
-        prefix_key = 'ipv6_prefix'
         log.info('Returning IPv6 results only')
     else:
-        prefix_key = 'ip_prefix'
         log.info('Returning IPv4 results only')
 
     # Resolve include_elastic_ips if service list includes "EC2"
@@ -6630,23 +6823,17 @@ def get_aws_service_ips(regions=None, ipv6=False, include_amazon_service=True, i
 
     # Collect IPs based on whether to include the AMAZON IPs or use the service list
     for ip_range in ip_ranges:
-        if prefix_key not in ip_range.keys():
-            continue
-        if regions:
-            if ip_range['region'] not in regions:
-                continue
         if ip_range['service'] == 'EC2':
             if include_elastic_ips:
-                amazon_cidr_ranges.append(ip_range[prefix_key])
+                amazon_cidr_ranges.append(ip_range['cidr'])
                 continue
         elif ip_range['service'] == 'AMAZON':
             if include_amazon_service:
-                amazon_cidr_ranges.append(ip_range[prefix_key])
+                amazon_cidr_ranges.append(ip_range['cidr'])
                 continue
         elif service_list:
-            for service in service_list:
-                if ip_range['service'] == service:
-                    amazon_cidr_ranges.append(ip_range[prefix_key])
+            if ip_range['service'] in service_list:
+                amazon_cidr_ranges.append(ip_range['cidr'])
 
     # Ensure the list in unique
     unique_amazon_cidr_ranges = list(set(amazon_cidr_ranges))
@@ -6655,7 +6842,7 @@ def get_aws_service_ips(regions=None, ipv6=False, include_amazon_service=True, i
 
     # Exclude EC2 elastic IPs if specified
     if not include_elastic_ips:
-        ec2_cidr_ranges = [item[prefix_key] for item in ip_ranges if item['service'] == 'EC2']
+        ec2_cidr_ranges = aws_ip_ranges.get_service_cidrs(service='EC2', ipv6=ipv6)
         log.info('Excluding [{n}] EC2 elastic IP CIDR blocks'.format(n=str(len(ec2_cidr_ranges))))
         for amazon_cidr in unique_amazon_cidr_ranges:
             if amazon_cidr not in ec2_cidr_ranges:
@@ -6716,26 +6903,24 @@ def get_aws_rhui_ips(regions=None, version=1):
 
     log.info('Returning RHUI IP addresses in regions: {r}'.format(r=','.join(regions)))
 
-    # Build the list of IPs for each region and RHUI subdomain
-    for region in regions:
-        for subdomain in subdomains:
-            rhui_server = '{s}.{r}.aws.ce.redhat.com'.format(s=subdomain, r=region)
-            log.info('Looking for the IP address for RHUI server: {s}'.format(s=rhui_server))
-            try:
-                _, _, rhui_region_ips = socket.gethostbyname_ex(rhui_server)
-            except (socket.gaierror, socket.error, socket.herror) as exc:
-                log.error('Problem retrieving RHUI IP address for region: {r}\n{e}'.format(r=region, e=str(exc)))
-                continue
-            if len(rhui_region_ips) < 1:
-                log.error('No RHUI IP addresses returned for server: {s}'.format(s=rhui_server))
-                continue
-            for rhui_region_ip in rhui_region_ips:
-                if validate_ip_address(rhui_region_ip):
-                    log.info('Found RHUI IP address for server {s}: {i}'.format(s=rhui_server, i=rhui_region_ip))
-                    rhui_ips.append(rhui_region_ip)
-                else:
-                    log.error('Invalid RHUI IP address returned for server [{s}]: {i}'.format(
-                        s=rhui_server, i=rhui_region_ip))
+    # Build the list of IPs for each region and RHUI subdomain, resolving the servers concurrently
+    rhui_servers = ['{s}.{r}.aws.ce.redhat.com'.format(s=subdomain, r=region)
+                    for region in regions for subdomain in subdomains]
+    log.info('Looking for the IP addresses for RHUI servers: {s}'.format(s=','.join(rhui_servers)))
+    for rhui_server, rhui_region_ips, error in get_dns_resolver().resolve(hostname_list=rhui_servers):
+        if rhui_region_ips is None:
+            log.error('Problem retrieving RHUI IP address for server: {s}\n{e}'.format(s=rhui_server, e=error))
+            continue
+        if len(rhui_region_ips) < 1:
+            log.error('No RHUI IP addresses returned for server: {s}'.format(s=rhui_server))
+            continue
+        for rhui_region_ip in rhui_region_ips:
+            if validate_ip_address(rhui_region_ip):
+                log.info('Found RHUI IP address for server {s}: {i}'.format(s=rhui_server, i=rhui_region_ip))
+                rhui_ips.append(rhui_region_ip)
+            else:
+                log.error('Invalid RHUI IP address returned for server [{s}]: {i}'.format(
+                    s=rhui_server, i=rhui_region_ip))
     return rhui_ips
 
 
@@ -6781,43 +6966,27 @@ def list_instances_with_token(client, max_results=100, continuation_token=None):
         )
 
 
-def list_instances(client):
+def list_instances(client, filters=None, projection=None):
     """Gets a list of EC2 instances in this account/region
 
     :param client: boto3.client object
+    :param filters: (list) of server-side filters, e.g. [{'Name': 'tag:Name', 'Values': ['nat']}]
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
     :return: (list)
     :raises: EC2UtilError
     """
     log = logging.getLogger(mod_logger + '.list_instances')
     log.info('Getting a list of EC2 instances...')
-    instances = []
-    continuation_token = None
-    next_query = True
-    max_results = 100
-    while True:
-        if not next_query:
-            break
-        try:
-            response = list_instances_with_token(
-                client=client,
-                max_results=max_results,
-                continuation_token=continuation_token
-            )
-        except ClientError as exc:
-            msg = 'Problem querying for EC2 instances'
-            raise EC2UtilError(msg) from exc
-        if 'Reservations' not in response.keys():
-            log.warning('Reservations not found in response: {r}'.format(r=str(response.keys())))
-            return instances
-        if 'NextToken' not in response.keys():
-            next_query = False
-        else:
-            continuation_token = response['NextToken']
-        for reservation in response['Reservations']:
-            if 'Instances' not in reservation.keys():
-                log.warning('Instances not found in reservation: {r}'.format(r=str(reservation)))
-                continue
-            instances += reservation['Instances']
+    kwargs = {'DryRun': False}
+    if filters:
+        kwargs['Filters'] = filters
+    try:
+        instances = list(paginate(
+            client=client, operation='describe_instances',
+            search='Reservations[].Instances[]', projection=projection, page_size=ec2_max_page_size, **kwargs))
+    except AWSAPIError as exc:
+        msg = 'Problem querying for EC2 instances'
+        raise EC2UtilError(msg) from exc
     log.info('Found {n} EC2 instances'.format(n=str(len(instances))))
     return instances
 
@@ -6913,6 +7082,90 @@ def stop_instance(client, instance_id):
     return instance_id, 'UNKNOWN', 'UNKNOWN'
 
 
+def stop_instances(client, instance_ids):
+    """Stops the provided instance IDs with one API call per batch
+
+    :param client: boto3.client object
+    :param instance_ids: (list) of str instance IDs
+    :return: (dict) of instance ID to current state
+    :raises: EC2UtilError
+    """
+    log = logging.getLogger(mod_logger + '.stop_instances')
+    states = {}
+    instance_ids = list(instance_ids)
+    for start in range(0, len(instance_ids), max_filter_values):
+        batch_ids = instance_ids[start:start + max_filter_values]
+        log.info('Stopping {n} instances: {i}'.format(n=str(len(batch_ids)), i=','.join(batch_ids)))
+        try:
+            response = client.stop_instances(InstanceIds=batch_ids, DryRun=False, Hibernate=False, Force=False)
+        except ClientError as exc:
+            msg = 'Problem stopping instances: {i}'.format(i=','.join(batch_ids))
+            raise EC2UtilError(msg) from exc
+        for stopping_instance in response.get('StoppingInstances', []):
+            states[stopping_instance['InstanceId']] = stopping_instance['CurrentState']['Name']
+    return states
+
+
+def start_instances(client, instance_ids):
+    """Starts the provided instance IDs with one API call per batch
+
+    :param client: boto3.client object
+    :param instance_ids: (list) of str instance IDs
+    :return: (dict) of instance ID to current state
+    :raises: EC2UtilError
+    """
+    log = logging.getLogger(mod_logger + '.start_instances')
+    states = {}
+    instance_ids = list(instance_ids)
+    for start in range(0, len(instance_ids), max_filter_values):
+        batch_ids = instance_ids[start:start + max_filter_values]
+        log.info('Starting {n} instances: {i}'.format(n=str(len(batch_ids)), i=','.join(batch_ids)))
+        try:
+            response = client.start_instances(InstanceIds=batch_ids, DryRun=False)
+        except ClientError as exc:
+            msg = 'Problem starting instances: {i}'.format(i=','.join(batch_ids))
+            raise EC2UtilError(msg) from exc
+        for starting_instance in response.get('StartingInstances', []):
+            states[starting_instance['InstanceId']] = starting_instance['CurrentState']['Name']
+    return states
+
+
+def modify_instance_placement(client, instance_id, host_id):
+    """Moves a stopped instance on to a dedicated host
+
+    :param client: boto3.client object
+    :param instance_id: (str) ID of the instance
+    :param host_id: (str) ID of the dedicated host
+    :return: None
+    :raises: EC2UtilError
+    """
+    log = logging.getLogger(mod_logger + '.modify_instance_placement')
+    log.info('Placing instance [{i}] on to host: {h}'.format(i=instance_id, h=host_id))
+    try:
+        client.modify_instance_placement(InstanceId=instance_id, HostId=host_id, Tenancy='host', Affinity='host')
+    except ClientError as exc:
+        msg = 'Problem placing instance [{i}] on to host: {h}'.format(i=instance_id, h=host_id)
+        raise EC2UtilError(msg) from exc
+
+
+def modify_instance_type(client, instance_id, instance_type):
+    """Changes the instance type of a stopped instance
+
+    :param client: boto3.client object
+    :param instance_id: (str) ID of the instance
+    :param instance_type: (str) instance type
+    :return: None
+    :raises: EC2UtilError
+    """
+    log = logging.getLogger(mod_logger + '.modify_instance_type')
+    log.info('Changing instance [{i}] to type: {t}'.format(i=instance_id, t=instance_type))
+    try:
+        client.modify_instance_attribute(InstanceId=instance_id, InstanceType={'Value': instance_type})
+    except ClientError as exc:
+        msg = 'Problem changing instance [{i}] to type: {t}'.format(i=instance_id, t=instance_type)
+        raise EC2UtilError(msg) from exc
+
+
 def terminate_instance(client, instance_id):
     """Terminates the provided instance ID
 
@@ -6995,41 +7248,28 @@ def list_snapshots_with_token(client, owner_id, max_results=100, continuation_to
         )
 
 
-def list_snapshots(client, owner_id):
+def list_snapshots(client, owner_id, filters=None, projection=None):
     """Gets a list of EC2 snapshots in this account/region
 
     :param client: boto3.client object
     :param owner_id: (str) ID of the account to search
+    :param filters: (list) of server-side filters, e.g. [{'Name': 'tag:Name', 'Values': ['nat']}]
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
     :return: (list)
     :raises: EC2UtilError
     """
     log = logging.getLogger(mod_logger + '.list_snapshots')
     log.info('Getting a list of EC2 snapshots in account ID: {i}'.format(i=owner_id))
-    snapshots = []
-    continuation_token = None
-    next_query = True
-    max_results = 100
-    while True:
-        if not next_query:
-            break
-        try:
-            response = list_snapshots_with_token(
-                client=client,
-                owner_id=owner_id,
-                max_results=max_results,
-                continuation_token=continuation_token
-            )
-        except ClientError as exc:
-            msg = 'Problem querying for EC2 snapshots'
-            raise EC2UtilError(msg) from exc
-        if 'Snapshots' not in response.keys():
-            log.warning('Snapshots not found in response: {r}'.format(r=str(response.keys())))
-            return snapshots
-        if 'NextToken' not in response.keys():
-            next_query = False
-        else:
-            continuation_token = response['NextToken']
-        snapshots += response['Snapshots']
+    kwargs = {'DryRun': False, 'OwnerIds': [owner_id]}
+    if filters:
+        kwargs['Filters'] = filters
+    try:
+        snapshots = list(paginate(
+            client=client, operation='describe_snapshots', projection=projection, page_size=ec2_max_page_size,
+            **kwargs))
+    except AWSAPIError as exc:
+        msg = 'Problem querying for EC2 snapshots'
+        raise EC2UtilError(msg) from exc
     log.info('Found {n} EC2 snapshots'.format(n=str(len(snapshots))))
     return snapshots
 
@@ -7100,28 +7340,27 @@ def create_image(client, instance_id, image_name, image_description='', no_reboo
     return image_id
 
 
-def list_images(client, owner_id):
+def list_images(client, owner_id, filters=None, projection=None):
     """Gets a list of EC2 images in this account/region
 
     :param client: boto3.client object
     :param owner_id: (str) ID of the account to search
+    :param filters: (list) of server-side filters, e.g. [{'Name': 'tag:Name', 'Values': ['nat']}]
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
     :return: (list)
     :raises: EC2UtilError
     """
     log = logging.getLogger(mod_logger + '.list_images')
     log.info('Getting a list of EC2 images/AMIs in account ID: {i}'.format(i=owner_id))
+    kwargs = {'DryRun': False, 'Owners': [owner_id]}
+    if filters:
+        kwargs['Filters'] = filters
     try:
-        response = client.describe_images(
-            DryRun=False,
-            Owners=[owner_id]
-        )
-    except ClientError as exc:
+        images = list(paginate(
+            client=client, operation='describe_images', projection=projection, page_size=ec2_max_page_size, **kwargs))
+    except AWSAPIError as exc:
         msg = 'Problem querying for EC2 images'
         raise EC2UtilError(msg) from exc
-    if 'Images' not in response.keys():
-        msg = 'Images not found in response: {r}'.format(r=str(response.keys()))
-        raise EC2UtilError(msg)
-    images = response['Images']
     log.info('Found {n} EC2 images'.format(n=str(len(images))))
     return images
 
@@ -7197,39 +7436,27 @@ def list_volumes_with_token(client, max_results=100, continuation_token=None):
         )
 
 
-def list_volumes(client):
+def list_volumes(client, filters=None, projection=None):
     """Gets a list of EBS volumes in this account/region
 
     :param client: boto3.client object
-    :return: (list) of volumes
+    :param filters: (list) of server-side filters, e.g. [{'Name': 'tag:Name', 'Values': ['nat']}]
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list)
     :raises: EC2UtilError
     """
     log = logging.getLogger(mod_logger + '.list_volumes')
     log.info('Getting a list of EBS volumes...')
-    volumes = []
-    continuation_token = None
-    next_query = True
-    max_results = 100
-    while True:
-        if not next_query:
-            break
-        try:
-            response = list_volumes_with_token(
-                client=client,
-                max_results=max_results,
-                continuation_token=continuation_token
-            )
-        except ClientError as exc:
-            msg = 'Problem querying for EBS volumes'
-            raise EC2UtilError(msg) from exc
-        if 'Volumes' not in response.keys():
-            log.warning('Volumes not found in response: {r}'.format(r=str(response.keys())))
-            return volumes
-        if 'NextToken' not in response.keys():
-            next_query = False
-        else:
-            continuation_token = response['NextToken']
-        volumes += response['Volumes']
+    kwargs = {'DryRun': False}
+    if filters:
+        kwargs['Filters'] = filters
+    try:
+        volumes = list(paginate(
+            client=client, operation='describe_volumes', projection=projection, page_size=ebs_volumes_max_page_size,
+            **kwargs))
+    except AWSAPIError as exc:
+        msg = 'Problem querying for EBS volumes'
+        raise EC2UtilError(msg) from exc
     log.info('Found {n} EBS volumes'.format(n=str(len(volumes))))
     return volumes
 
@@ -6,13 +6,15 @@ configurations.
 
 """
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from botocore.client import ClientError
 
-from .awsutil import get_boto3_client
+from .awsutil import get_boto3_client, paginate
 from .bash import validate_ip_address
 from .ec2util import EC2Util
-from .exceptions import EC2UtilError, ElbUtilError
+from .exceptions import AWSAPIError, EC2UtilError, ElbUtilError
 from .logify import Logify
 
 
@@ -36,6 +38,12 @@ required_props = [
 optional_props = {
 }
 
+# Maximum page size for describe_target_groups
+target_groups_max_page_size = 400
+
+# Default number of concurrent describe_target_health calls
+default_target_health_max_workers = 8
+
 
 class ElbUtil(object):
     """Utility for interacting with the AWS ELBv2 SDK
@@ -50,6 +58,12 @@ class ElbUtil(object):
             raise ElbUtilError(msg) from exc
         self.region = self.client.meta.region_name
 
+        # Index of target groups to their target IDs, and target IDs to target group ARNs
+        self.target_groups = {}
+        self.target_group_targets = {}
+        self.target_index = {}
+        self.index_lock = threading.RLock()
+
     def create_elb(self, name, subnets, security_groups, scheme='internal', load_balancer_type='application',
                    ip_address_type='ipv4'):
         """Creates an ELB using the provided
@@ -190,21 +204,19 @@ class ElbUtil(object):
     def describe_all_target_groups(self):
         """Returns a list of the existing target groups
 
-        :return: (dict) see boto3 docs
+        :return: (list) see boto3 docs
         :raises: ElbUtilError
         """
         log = logging.getLogger(self.cls_logger + '.describe_all_target_groups')
         log.info('Describing target groups...')
         try:
-            response = self.client.describe_target_groups()
-        except ClientError as exc:
-            msg = 'There was a problem describing target groups\n{e}'.format(e=str(exc))
+            target_groups = list(paginate(client=self.client, operation='describe_target_groups',
+                                          page_size=target_groups_max_page_size))
+        except AWSAPIError as exc:
+            msg = 'There was a problem describing target groups'
             raise ElbUtilError(msg) from exc
-        if 'TargetGroups' not in response.keys():
-            msg = 'TargetGroups not found in response: {r}'.format(r=str(response))
-            raise ElbUtilError(msg)
-        log.info('Found [{n}] target groups'.format(n=str(len(response['TargetGroups']))))
-        return response['TargetGroups']
+        log.info('Found [{n}] target groups'.format(n=str(len(target_groups))))
+        return target_groups
 
     def describe_target_health(self, target_group_arn):
         """Return a list of targets and their health info in the target group
@@ -279,6 +291,7 @@ class ElbUtil(object):
             msg = 'TargetGroupArn not found in target group data: {d}'.format(d=str(target_group))
             raise ElbUtilError(msg)
         log.info('Created target group in VPC ID [{v}]: {i}'.format(v=vpc_id, i=target_group['TargetGroupArn']))
+        self.index_target_group(target_group=target_group, target_health_descriptions=[])
 
         # Register the IP address targets
         self.register_ip_targets(target_group_arn=target_group['TargetGroupArn'], ip_address_list=ip_address_list)
@@ -313,13 +326,118 @@ class ElbUtil(object):
             msg = 'Problem registering targets [{t}] to target group: {g}\n{e}'.format(
                 t=','.join(ip_address_list), g=target_group_arn, e=str(exc))
             raise ElbUtilError(msg) from exc
+        with self.index_lock:
+            if target_group_arn in self.target_groups:
+                target_ids = self.target_group_targets[target_group_arn].union(ip_address_list)
+                self.index_target_group(
+                    target_group=self.target_groups[target_group_arn],
+                    target_health_descriptions=[{'Target': {'Id': x}} for x in target_ids]
+                )
+
+    def collect_target_health(self, target_group_arns, max_workers=default_target_health_max_workers):
+        """Describes the target health of the target groups concurrently
+
+        :param target_group_arns: (list) of str target group ARNs
+        :param max_workers: (int) number of concurrent describe_target_health calls
+        :return: (dict) of target group ARN to the list of target health descriptions (see boto3 docs)
+        :raises: ElbUtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.collect_target_health')
+        target_health = {}
+        if not target_group_arns:
+            return target_health
+        log.info('Describing target health for {n} target groups'.format(n=str(len(target_group_arns))))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='elbv2') as executor:
+            futures = {executor.submit(self.describe_target_health, arn): arn for arn in target_group_arns}
+            for future in as_completed(futures):
+                target_health[futures[future]] = future.result()
+        return target_health
+
+    def index_target_group(self, target_group, target_health_descriptions):
+        """Adds or replaces a target group in the target index
+
+        :param target_group: (dict) target group data (see boto3 docs)
+        :param target_health_descriptions: (list) of target health descriptions (see boto3 docs)
+        :return: None
+        """
+        target_ids = frozenset(x['Target']['Id'] for x in target_health_descriptions
+                               if 'Target' in x and 'Id' in x['Target'])
+        with self.index_lock:
+            self.unindex_target_group(target_group_arn=target_group['TargetGroupArn'])
+            self.target_groups[target_group['TargetGroupArn']] = target_group
+            self.target_group_targets[target_group['TargetGroupArn']] = target_ids
+            for target_id in target_ids:
+                self.target_index.setdefault(target_id, set()).add(target_group['TargetGroupArn'])
+
+    def unindex_target_group(self, target_group_arn):
+        """Removes a target group from the target index
 
-    def find_vpc_target_groups_for_ips(self, vpc_id, ip_address_list):
-        """Returns a Target Group in the provided VPC matching the provided IP address list, or None if not found
+        :param target_group_arn: (str) target group ARN
+        :return: None
+        """
+        with self.index_lock:
+            self.target_groups.pop(target_group_arn, None)
+            for target_id in self.target_group_targets.pop(target_group_arn, frozenset()):
+                target_group_arns = self.target_index.get(target_id)
+                if target_group_arns is None:
+                    continue
+                target_group_arns.discard(target_group_arn)
+                if not target_group_arns:
+                    del self.target_index[target_id]
+
+    def refresh_target_index(self, vpc_id=None, refresh=False, max_workers=default_target_health_max_workers):
+        """Updates the target index with one describe_target_groups sweep
+
+        Target health is only described for target groups not already in the index, unless refresh is
+        set, and deleted target groups are removed.
+
+        :param vpc_id: (str) ID of the VPC to index, or None for all VPCs
+        :param refresh: (bool) Set True to describe the target health of every target group again
+        :param max_workers: (int) number of concurrent describe_target_health calls
+        :return: (list) of target groups in the VPC (see boto3 docs)
+        :raises: ElbUtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.refresh_target_index')
+        target_groups = []
+        for target_group in self.describe_all_target_groups():
+            if not all(x in target_group for x in ['VpcId', 'TargetGroupArn', 'TargetGroupName']):
+                log.warning('VpcId, TargetGroupArn, or TargetGroupName not found in target group data: {d}'.format(
+                    d=str(target_group)))
+                continue
+            if vpc_id and vpc_id != target_group['VpcId']:
+                continue
+            target_groups.append(target_group)
+        current_arns = set(x['TargetGroupArn'] for x in target_groups)
+        with self.index_lock:
+            for target_group_arn in list(self.target_groups.keys()):
+                if target_group_arn in current_arns:
+                    continue
+                if vpc_id and self.target_groups[target_group_arn]['VpcId'] != vpc_id:
+                    continue
+                log.info('Removing deleted target group from the index: {g}'.format(g=target_group_arn))
+                self.unindex_target_group(target_group_arn=target_group_arn)
+            if refresh:
+                to_describe = target_groups
+            else:
+                to_describe = [x for x in target_groups if x['TargetGroupArn'] not in self.target_groups]
+        target_health = self.collect_target_health(
+            target_group_arns=[x['TargetGroupArn'] for x in to_describe], max_workers=max_workers)
+        for target_group in to_describe:
+            self.index_target_group(
+                target_group=target_group, target_health_descriptions=target_health[target_group['TargetGroupArn']])
+        log.info('Indexed {n} target groups, described target health for {d}'.format(
+            n=str(len(target_groups)), d=str(len(to_describe))))
+        return target_groups
+
+    def find_vpc_target_groups_for_ips(self, vpc_id, ip_address_list, refresh=False):
+        """Returns the Target Groups in the provided VPC with exactly the provided IP address targets
+
+        Uses the target index, described target health is cached on this object between calls.
 
         :param vpc_id: (str) ID of the VPC
         :param ip_address_list: (list) of the IP addresses
-        :return: (dict) see boto3 docs
+        :param refresh: (bool) Set True to describe the target health of every target group again
+        :return: (list) of target groups (see boto3 docs)
         :raises: ElbUtilError
         """
         log = logging.getLogger(self.cls_logger + '.find_vpc_target_groups_for_ips')
@@ -327,40 +445,29 @@ class ElbUtil(object):
             if not validate_ip_address(ip_address):
                 msg = 'Provided IP address is not valid: {i}'.format(i=ip_address)
                 raise ElbUtilError(msg)
-        target_groups = self.describe_all_target_groups()
-        vpc_target_groups = []
-        for target_group in target_groups:
-            if 'VpcId' not in target_group:
-                log.warning('VpcId not found in target group data: {d}'.format(d=str(target_group)))
-                continue
-            if 'TargetGroupArn' not in target_group:
-                log.warning('TargetGroupArn not found in target group data: {d}'.format(d=str(target_group)))
-                continue
-            if 'TargetGroupName' not in target_group:
-                log.warning('TargetGroupName not found in target group data: {d}'.format(d=str(target_group)))
-                continue
-            if vpc_id == target_group['VpcId']:
-                vpc_target_groups.append(target_group)
+        ip_addresses = frozenset(ip_address_list)
+        self.refresh_target_index(vpc_id=vpc_id, refresh=refresh)
         matching_target_groups = []
-        for vpc_target_group in vpc_target_groups:
-            targets = self.describe_target_health(target_group_arn=vpc_target_group['TargetGroupArn'])
-            found_list = []
-            for ip_address in ip_address_list:
-                ip_found = False
-                for target in targets:
-                    if 'Target' not in target:
-                        continue
-                    if 'Id' not in target['Target']:
-                        continue
-                    if target['Target']['Id'] == ip_address:
-                        ip_found = True
-                found_list.append(ip_found)
-            if all(found_list) and (len(found_list) == len(targets)):
-                log.info('Found matching target group in VPC [{v}]: {t}'.format(
-                    v=vpc_id, t=vpc_target_group['TargetGroupArn']))
-                matching_target_groups.append(vpc_target_group)
-        log.info('Matching target group in VPC [{v}] not found for targets: {t}'.format(
-            v=vpc_id, t=','.join(ip_address_list)))
+        with self.index_lock:
+            candidate_arns = None
+            for ip_address in ip_addresses:
+                target_group_arns = self.target_index.get(ip_address, set())
+                if candidate_arns is None:
+                    candidate_arns = set(target_group_arns)
+                else:
+                    candidate_arns &= target_group_arns
+                if not candidate_arns:
+                    break
+            for target_group_arn in sorted(candidate_arns or []):
+                if self.target_groups[target_group_arn]['VpcId'] != vpc_id:
+                    continue
+                if self.target_group_targets[target_group_arn] != ip_addresses:
+                    continue
+                log.info('Found matching target group in VPC [{v}]: {t}'.format(v=vpc_id, t=target_group_arn))
+                matching_target_groups.append(self.target_groups[target_group_arn])
+        if not matching_target_groups:
+            log.info('Matching target group in VPC [{v}] not found for targets: {t}'.format(
+                v=vpc_id, t=','.join(ip_address_list)))
         return matching_target_groups
 
 
@@ -81,6 +81,18 @@ class AssetError(Exception):
     """General exception for handling assets"""
 
 
+class AssetCatalogError(Exception):
+    """There was a problem with the local asset catalog"""
+
+
+class AssetDependencyError(Exception):
+    """There was a problem resolving asset dependencies"""
+
+
+class AssetExportError(Exception):
+    """There was a problem exporting assets"""
+
+
 class PyGitError(Exception):
     """There was a problem performing git operations"""
 
@@ -133,6 +145,10 @@ class NetworkRestartError(Exception):
     """There was a problem restarting network services"""
 
 
+class ArchiveError(Exception):
+    """There was a problem creating an archive"""
+
+
 """
 AWS API exceptions
 """
@@ -142,6 +158,10 @@ class AWSAPIError(Exception):
     """Simple exception type for AWS API errors"""
 
 
+class AWSIpRangesError(Exception):
+    """There was a problem retrieving or loading the AWS IP ranges"""
+
+
 class AWSMetaDataError(Exception):
     """There was a problem encountered with the AWS metadata service"""
 
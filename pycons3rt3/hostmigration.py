@@ -17,15 +17,24 @@ Usage:
     migrate on --cloudtype aws --host 'h-12345' --id 'i-12345' --size 'm5.large' --ami 'ami-12345' \
         --ostype 'linux|windows'
 
+    # Migrate many instances on to a dedicated host in parallel by changing their placement, resumable
+    # from the journal file if interrupted
+    migrate on --cloudtype aws --host 'h-12345' --ids 'i-12345,i-67890' --size 'm5.large' --parallel \
+        --journal ~/migration-journal.json
+
 """
 
 import argparse
 import datetime
+import json
 import logging
+import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from .ec2util import EC2Util
+from .ec2util import EC2Util, default_waiter_min_interval_sec, default_waiter_max_interval_sec
 from .exceptions import EC2UtilError
 from .logify import Logify
 
@@ -35,6 +44,16 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.hostmigration'
 
+# Phases of a placement migration in order, the journal records the last completed phase
+migration_phases = ['pending', 'stopping', 'stopped', 'placed', 'starting', 'available']
+
+# Default concurrency limits for placement migrations
+default_max_per_host = 4
+default_max_per_az = 8
+
+# Default time in seconds allowed for a single phase of an instance migration
+default_phase_timeout_sec = 1800
+
 
 def migrate_ec2_instance_to_host(ec2, instance_id, host_details, size, os_type=None, ami_id=None, nat=False):
     """Migrates a DR to a dedicated host
@@ -453,6 +472,337 @@ def migrate_ec2_instances_to_host(instance_ids, host_id, size, os_type=None, ami
         return False
 
 
+class HostMigrationOrchestrator(object):
+    """Migrates many instances on to dedicated hosts in parallel by changing their placement
+
+    Each instance is stopped, placed on its host, optionally resized, and started again.  Instances
+    move through the phases independently: one batched describe call per poll advances every instance
+    in flight, and new instances are admitted as others finish, up to max_per_host and max_per_az at
+    once.  The last completed phase of each instance is written to the journal file after every
+    change, so an interrupted run picks up where it left off.
+
+    :param migrations: (dict) of instance ID to the ID of the dedicated host to move it on to
+    :param size: (str) instance type for the instances on the hosts, or None to keep their type
+    :param journal_file: (str) path to the JSON journal file, or None to skip journaling
+    :param max_per_host: (int) maximum number of instances migrating on to a single host at once
+    :param max_per_az: (int) maximum number of instances migrating in a single availability zone at once
+    :param phase_timeout_sec: (int) time allowed for an instance to complete a single phase
+    :param ec2: (EC2Util) EC2 utility, created if not provided
+    """
+
+    def __init__(self, migrations, size=None, journal_file=None, max_per_host=default_max_per_host,
+                 max_per_az=default_max_per_az, phase_timeout_sec=default_phase_timeout_sec, ec2=None):
+        self.cls_logger = mod_logger + '.HostMigrationOrchestrator'
+        self.migrations = dict(migrations)
+        self.size = size
+        self.journal_file = journal_file
+        self.max_per_host = max_per_host
+        self.max_per_az = max_per_az
+        self.phase_timeout_sec = phase_timeout_sec
+        if ec2:
+            self.ec2 = ec2
+        else:
+            self.ec2 = EC2Util(skip_is_aws=True)
+        self.hosts = {}
+        self.journal = {}
+        self.phase_start_times = {}
+        self.lock = threading.Lock()
+
+    def load_journal(self):
+        """Loads the journal file, resetting failed instances to retry from their last completed phase
+
+        :return: None
+        :raises: EC2UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.load_journal')
+        self.journal = {}
+        if self.journal_file and os.path.isfile(self.journal_file):
+            try:
+                with open(self.journal_file, 'r') as f:
+                    self.journal = json.load(f)['instances']
+            except (OSError, ValueError, KeyError) as exc:
+                msg = 'Problem reading migration journal file: {f}'.format(f=self.journal_file)
+                raise EC2UtilError(msg) from exc
+            log.info('Loaded migration journal with {n} instances: {f}'.format(
+                n=str(len(self.journal)), f=self.journal_file))
+        for instance_id, host_id in self.migrations.items():
+            entry = self.journal.get(instance_id)
+            if not entry or entry['host_id'] != host_id:
+                self.journal[instance_id] = {'host_id': host_id, 'phase': 'pending', 'error': None}
+            elif entry['error']:
+                log.info('Retrying instance [{i}] from phase [{p}] after error: {e}'.format(
+                    i=instance_id, p=entry['phase'], e=entry['error']))
+                entry['error'] = None
+
+    def save_journal(self):
+        """Writes the journal file, replacing it atomically so it is never left partially written
+
+        :return: None
+        :raises: EC2UtilError
+        """
+        if not self.journal_file:
+            return
+        temp_file = self.journal_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump({'instances': self.journal}, f, indent=2, sort_keys=True)
+            os.replace(temp_file, self.journal_file)
+        except OSError as exc:
+            msg = 'Problem writing migration journal file: {f}'.format(f=self.journal_file)
+            raise EC2UtilError(msg) from exc
+
+    def set_phase(self, instance_id, phase):
+        """Records the completed phase for the instance
+
+        :param instance_id: (str) ID of the instance
+        :param phase: (str) completed phase
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.set_phase')
+        with self.lock:
+            self.journal[instance_id]['phase'] = phase
+            self.journal[instance_id]['updated'] = datetime.datetime.now().isoformat()
+            self.phase_start_times[instance_id] = time.time()
+        log.info('Instance [{i}] completed phase: {p}'.format(i=instance_id, p=phase))
+
+    def set_failed(self, instance_id, error):
+        """Records an error for the instance, which stops its migration
+
+        :param instance_id: (str) ID of the instance
+        :param error: (str) error message
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.set_failed')
+        with self.lock:
+            self.journal[instance_id]['error'] = error
+            self.journal[instance_id]['updated'] = datetime.datetime.now().isoformat()
+        log.error('Instance [{i}] failed in phase [{p}]: {e}'.format(
+            i=instance_id, p=self.journal[instance_id]['phase'], e=error))
+
+    def get_instance_ids(self, phases):
+        """Returns the IDs of instances without errors in the provided phases
+
+        :param phases: (list) of str phases
+        :return: (list) of str instance IDs
+        """
+        return [instance_id for instance_id, entry in self.journal.items()
+                if entry['phase'] in phases and not entry['error'] and instance_id in self.migrations]
+
+    def validate(self):
+        """Checks the hosts, availability zones, and host capacity for the remaining migrations
+
+        :return: None
+        :raises: EC2UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.validate')
+        for host_id in set(self.migrations.values()):
+            host_details = self.ec2.get_host(host_id=host_id)
+            if 'AvailabilityZone' not in host_details:
+                msg = 'AvailabilityZone not found in host details: {h}'.format(h=str(host_details))
+                raise EC2UtilError(msg)
+            self.hosts[host_id] = host_details
+        instances = self.ec2.list_instances(
+            filters=[{'Name': 'instance-id', 'Values': list(self.migrations.keys())}],
+            projection='{InstanceId: InstanceId, InstanceType: InstanceType, '
+                       'AvailabilityZone: Placement.AvailabilityZone}'
+        )
+        instances = {x['InstanceId']: x for x in instances}
+        required_capacity = {}
+        for instance_id, host_id in self.migrations.items():
+            if instance_id not in instances:
+                raise EC2UtilError('Instance ID not found: {i}'.format(i=instance_id))
+            host_availability_zone = self.hosts[host_id]['AvailabilityZone']
+            if instances[instance_id]['AvailabilityZone'] != host_availability_zone:
+                msg = 'Instance [{i}] in availability zone [{z1}] cannot move to host [{h}] in availability ' \
+                      'zone [{z2}]'.format(i=instance_id, z1=instances[instance_id]['AvailabilityZone'], h=host_id,
+                                           z2=host_availability_zone)
+                raise EC2UtilError(msg)
+            self.journal[instance_id]['availability_zone'] = host_availability_zone
+            if migration_phases.index(self.journal[instance_id]['phase']) >= migration_phases.index('placed'):
+                continue
+            instance_type = self.size if self.size else instances[instance_id]['InstanceType']
+            required_capacity[(host_id, instance_type)] = required_capacity.get((host_id, instance_type), 0) + 1
+        for (host_id, instance_type), required in required_capacity.items():
+            capacity = self.ec2.get_host_capacity_for_instance_type(host_id=host_id, instance_type=instance_type)
+            if capacity < required:
+                msg = 'Host available capacity for size {s} on host {h} is {c}, need at least {r}'.format(
+                    s=instance_type, h=host_id, c=str(capacity), r=str(required))
+                raise EC2UtilError(msg)
+            log.info('Host [{h}] has capacity for {r} instances of type {s}'.format(
+                h=host_id, r=str(required), s=instance_type))
+
+    def admit(self):
+        """Returns pending instances that fit under the per-host and per-availability zone limits
+
+        :return: (list) of str instance IDs
+        """
+        in_flight = self.get_instance_ids(phases=['stopping', 'stopped', 'placed', 'starting'])
+        host_counts = {}
+        az_counts = {}
+        for instance_id in in_flight:
+            entry = self.journal[instance_id]
+            host_counts[entry['host_id']] = host_counts.get(entry['host_id'], 0) + 1
+            az_counts[entry['availability_zone']] = az_counts.get(entry['availability_zone'], 0) + 1
+        admitted = []
+        for instance_id in self.get_instance_ids(phases=['pending']):
+            entry = self.journal[instance_id]
+            if host_counts.get(entry['host_id'], 0) >= self.max_per_host:
+                continue
+            if az_counts.get(entry['availability_zone'], 0) >= self.max_per_az:
+                continue
+            host_counts[entry['host_id']] = host_counts.get(entry['host_id'], 0) + 1
+            az_counts[entry['availability_zone']] = az_counts.get(entry['availability_zone'], 0) + 1
+            admitted.append(instance_id)
+        return admitted
+
+    def place(self, instance_id):
+        """Resizes the stopped instance if needed and places it on its host
+
+        :param instance_id: (str) ID of the instance
+        :return: None
+        """
+        try:
+            if self.size:
+                self.ec2.modify_instance_type(instance_id=instance_id, instance_type=self.size)
+            self.ec2.modify_instance_placement(instance_id=instance_id, host_id=self.journal[instance_id]['host_id'])
+        except EC2UtilError as exc:
+            self.set_failed(instance_id=instance_id, error=str(exc))
+            return
+        self.set_phase(instance_id=instance_id, phase='placed')
+
+    def advance(self, states):
+        """Moves each instance in flight to its next phase based on its current state
+
+        :param states: (dict) of instance ID to state from describe_resource_states with instance_status
+        :return: (bool) True if any instance changed phase
+        """
+        changed = False
+        now = time.time()
+        for instance_id in self.get_instance_ids(phases=['stopping', 'starting']):
+            phase = self.journal[instance_id]['phase']
+            state = states.get(instance_id)
+            if state == 'terminated':
+                self.set_failed(instance_id=instance_id, error='Instance was terminated')
+                changed = True
+            elif phase == 'stopping' and state == 'stopped':
+                self.set_phase(instance_id=instance_id, phase='stopped')
+                changed = True
+            elif phase == 'starting' and state == 'ok':
+                self.set_phase(instance_id=instance_id, phase='available')
+                changed = True
+            elif now - self.phase_start_times.get(instance_id, now) > self.phase_timeout_sec:
+                self.set_failed(instance_id=instance_id, error='Timed out in state: {s}'.format(s=state))
+                changed = True
+
+        # Place the stopped instances concurrently, then start them with one call
+        stopped = self.get_instance_ids(phases=['stopped'])
+        if stopped:
+            with ThreadPoolExecutor(max_workers=len(stopped), thread_name_prefix='migrate') as executor:
+                list(executor.map(self.place, stopped))
+            changed = True
+        placed = self.get_instance_ids(phases=['placed'])
+        if placed:
+            try:
+                self.ec2.start_instances(instance_ids=placed)
+            except EC2UtilError as exc:
+                for instance_id in placed:
+                    self.set_failed(instance_id=instance_id, error=str(exc))
+            else:
+                for instance_id in placed:
+                    self.set_phase(instance_id=instance_id, phase='starting')
+            changed = True
+        return changed
+
+    def run(self):
+        """Runs the migrations until every instance is available or failed
+
+        :return: (dict) of lists of instance IDs: migrated and failed
+        :raises: EC2UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.run')
+        start_time = time.time()
+        self.load_journal()
+        self.validate()
+        self.save_journal()
+        for instance_id in self.get_instance_ids(phases=migration_phases):
+            self.phase_start_times[instance_id] = start_time
+        log.info('Migrating {n} instances on to {h} hosts, {d} already completed'.format(
+            n=str(len(self.migrations)), h=str(len(self.hosts)),
+            d=str(len(self.get_instance_ids(phases=['available'])))))
+        interval_sec = default_waiter_min_interval_sec
+        while True:
+            changed = False
+            admitted = self.admit()
+            if admitted:
+                try:
+                    self.ec2.stop_instances(instance_ids=admitted)
+                except EC2UtilError as exc:
+                    for instance_id in admitted:
+                        self.set_failed(instance_id=instance_id, error=str(exc))
+                else:
+                    for instance_id in admitted:
+                        self.set_phase(instance_id=instance_id, phase='stopping')
+                changed = True
+            in_flight = self.get_instance_ids(phases=['stopping', 'stopped', 'placed', 'starting'])
+            if in_flight:
+                try:
+                    states = self.ec2.describe_resource_states(resource_type='instance_status', resource_ids=in_flight)
+                except EC2UtilError as exc:
+                    log.warning('Problem describing instance states, will retry\n{e}'.format(e=str(exc)))
+                    states = {}
+                if self.advance(states=states):
+                    changed = True
+            if changed:
+                self.save_journal()
+            if not self.get_instance_ids(phases=['pending', 'stopping', 'stopped', 'placed', 'starting']):
+                break
+            if changed:
+                interval_sec = default_waiter_min_interval_sec
+            else:
+                interval_sec = min(interval_sec * 2, default_waiter_max_interval_sec)
+            time.sleep(interval_sec)
+        results = {
+            'migrated': self.get_instance_ids(phases=['available']),
+            'failed': sorted(x for x in self.migrations if self.journal[x]['error'])
+        }
+        log.info('Migrated {n} instances with {f} failures in {t} seconds'.format(
+            n=str(len(results['migrated'])), f=str(len(results['failed'])),
+            t=str(round(time.time() - start_time, 1))))
+        return results
+
+
+def migrate_ec2_instances_to_host_parallel(instance_ids, host_id, size=None, journal_file=None,
+                                           max_per_host=default_max_per_host, max_per_az=default_max_per_az):
+    """Migrates a list of instance IDs to a specific host in parallel by changing their placement
+
+    :param instance_ids: (list) of string instance IDs
+    :param host_id: (str) host ID
+    :param size: (str) instance type for the instance on the host, or None to keep the current type
+    :param journal_file: (str) path to the JSON journal used to resume an interrupted migration
+    :param max_per_host: (int) maximum number of instances migrating on to the host at once
+    :param max_per_az: (int) maximum number of instances migrating in the availability zone at once
+    :return: (bool) True if all instances migrated successfully, False otherwise
+    """
+    log = logging.getLogger(mod_logger + '.migrate_ec2_instances_to_host_parallel')
+    orchestrator = HostMigrationOrchestrator(
+        migrations={instance_id: host_id for instance_id in instance_ids},
+        size=size,
+        journal_file=journal_file,
+        max_per_host=max_per_host,
+        max_per_az=max_per_az
+    )
+    try:
+        results = orchestrator.run()
+    except EC2UtilError as exc:
+        log.error('Problem migrating instances on to host: {h}\n{e}'.format(h=host_id, e=str(exc)))
+        return False
+    if results['failed']:
+        log.error('Failed to migrate {n} out of {t} instances on to host [{h}]: {i}'.format(
+            n=str(len(results['failed'])), t=str(len(instance_ids)), h=host_id, i=','.join(results['failed'])))
+        return False
+    return True
+
+
 def main():
     parser = argparse.ArgumentParser(description='CONS3RT command line interface (CLI)')
     parser.add_argument('command', help='Command for the cons3rt CLI')
@@ -463,7 +813,10 @@ def main():
     parser.add_argument('--id', help='ID of instance to move on/off a dedicated host', required=False)
     parser.add_argument('--ids', help='ID of instances to move on/off a dedicated host', required=False)
     parser.add_argument('--nat', help='Identifies the instance(s) as a NAT box', required=False, action='store_true')
+    parser.add_argument('--journal', help='Journal file for resuming a parallel migration', required=False)
     parser.add_argument('--ostype', help='Type of OS: [windows or linux]', required=False)
+    parser.add_argument('--parallel', help='Migrate the instances in parallel by changing their placement',
+                        required=False, action='store_true')
     parser.add_argument('--size', help='Instance type to use for the instance on the host', required=False)
     args = parser.parse_args()
 
@@ -556,8 +909,12 @@ def main():
             print('The --size arg is required to move an instance on to the host')
             return 5
         if cloud_type == 'aws':
-            if not migrate_ec2_instances_to_host(instance_ids=instance_ids, host_id=host_id, size=size,
-                                                 os_type=os_type, ami_id=ami_id, nat=nat):
+            if args.parallel:
+                if not migrate_ec2_instances_to_host_parallel(instance_ids=instance_ids, host_id=host_id, size=size,
+                                                              journal_file=args.journal):
+                    return 6
+            elif not migrate_ec2_instances_to_host(instance_ids=instance_ids, host_id=host_id, size=size,
+                                                   os_type=os_type, ami_id=ami_id, nat=nat):
                 return 6
     elif args.command == 'off':
         print('Migration off the dedicated host is not yet supported')
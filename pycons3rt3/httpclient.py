@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import collections
+import contextlib
 import logging
 import os
 import sys
+import threading
 import time
 import traceback
 
@@ -24,6 +27,9 @@ default_connect_timeout = 27.05
 default_read_timeout = 99
 default_read_timeout_asset_downloads = 900
 
+# Default maximum number of bytes held in memory by a BoundedPipe
+default_pipe_buffer_bytes = 33554432
+
 
 class Client:
 
@@ -115,13 +121,14 @@ class Client:
         return response
 
     def http_get_download(self, rest_user, target, connect_timeout=default_connect_timeout,
-                          read_timeout=default_read_timeout_asset_downloads):
+                          read_timeout=default_read_timeout_asset_downloads, stream=False):
         """Runs an HTTP GET request to the CONS3RT ReST API
 
         :param rest_user: (RestUser) user info
         :param connect_timeout: (float) seconds to wait for the connection to succeed, should be > multiple of 3
         :param read_timeout: (int) seconds to wait in between bytes received, 99.9% it's the 1st byte
         :param target: (str) URL
+        :param stream: (bool) Set True to return before the response body is read
         :return: http response
         """
         log = logging.getLogger(self.cls_logger + '.http_get_download')
@@ -138,7 +145,7 @@ class Client:
         try:
             response = http_get_with_retries(url=url, headers=headers, client_cert_path=rest_user.cert_file_path,
                                              cert_bundle_path=rest_user.cert_bundle, connect_timeout=connect_timeout,
-                                             read_timeout=read_timeout)
+                                             read_timeout=read_timeout, stream=stream)
         except Cons3rtClientError:
             raise
         return response
@@ -329,16 +336,20 @@ class Client:
             attempt_num += 1
             time.sleep(self.retry_time_sec)
 
-    def http_multipart(self, method, rest_user, target, content_file, connect_timeout=default_connect_timeout,
-                       read_timeout=default_read_timeout):
+    def http_multipart(self, method, rest_user, target, content_file=None, connect_timeout=default_connect_timeout,
+                       read_timeout=default_read_timeout, content_stream=None):
         """Makes an HTTP Multipart request to upload a file
 
+        Provide either content_file or content_stream.  A content_stream is a file-like object with a known
+        length (e.g. BoundedPipe), it can only be read once so the request is not retried.
+
         :param method: (str) PUT or POST
         :param rest_user: (RestUser) user info
         :param target: (str) ReST API target URL
         :param content_file: (str) path to the content file
         :param connect_timeout: (float) seconds to wait for the connection to succeed, should be > multiple of 3
         :param read_timeout: (int) seconds to wait in between bytes received, 99.9% it's the 1st byte
+        :param content_stream: (file-like) readable content with a known length to upload instead of a file
         :return: (str) HTTP Response or None
         :raises: Cons3rtClientError
         """
@@ -352,9 +363,9 @@ class Client:
         else:
             raise Cons3rtClientError('http_multipart supports PUT or POST, found: {m}'.format(m=method))
 
-        # Ensure a content file was provided
-        if not content_file:
-            raise Cons3rtClientError('content_file arg is None')
+        # Ensure a content file or stream was provided
+        if not content_file and content_stream is None:
+            raise Cons3rtClientError('content_file and content_stream args are None')
 
         # Determine the full URL
         self.validate_target(target)
@@ -368,9 +379,13 @@ class Client:
         headers['Expect'] = '100-continue'
         # file_name = content_file.split(os.sep)[-1]
 
-        # Open the content_file to create the multipart encoder
+        # Open the content_file to create the multipart encoder, a content_stream is used as-is
         start_time = time.time()
-        with open(content_file, 'rb') as f:
+        if content_stream is not None:
+            content_context = contextlib.nullcontext(content_stream)
+        else:
+            content_context = open(content_file, 'rb')
+        with content_context as f:
 
             # Create the MultipartEncoder (thanks requests_toolbelt!)
             form = MultipartEncoder({
@@ -455,17 +470,22 @@ class Client:
                     return response
 
                 err_msg_tally += err_msg + '\n'
+                if content_stream is not None:
+                    msg = 'Streaming {m} to URL [{u}] failed and cannot be retried\n{e}'.format(
+                        m=method, u=url, e=err_msg)
+                    raise Cons3rtClientError(msg)
                 log.warning('Problem encountered, retrying in {n} sec: {e}'.format(
                     n=str(self.retry_time_sec), e=err_msg))
                 attempt_num += 1
                 time.sleep(self.retry_time_sec)
 
-    def http_put_multipart(self, rest_user, target, content_file):
+    def http_put_multipart(self, rest_user, target, content_file=None, content_stream=None):
         """Makes an HTTP PUT Multipart request to upload a file
 
         :param rest_user: (RestUser) user info
         :param target: (str) ReST API target URL
         :param content_file: (str) path to the content file
+        :param content_stream: (file-like) readable content with a known length to upload instead of a file
         :return: (str) HTTP Response or None
         :raises: Cons3rtClientError
         """
@@ -473,15 +493,17 @@ class Client:
             method='PUT',
             rest_user=rest_user,
             target=target,
-            content_file=content_file
+            content_file=content_file,
+            content_stream=content_stream
         )
 
-    def http_post_multipart(self, rest_user, target, content_file):
+    def http_post_multipart(self, rest_user, target, content_file=None, content_stream=None):
         """Makes an HTTP POST Multipart request to upload a file
 
         :param rest_user: (RestUser) user info
         :param target: (str) ReST API target URL
         :param content_file: (str) path to the content file
+        :param content_stream: (file-like) readable content with a known length to upload instead of a file
         :return: (str) HTTP Response or None
         :raises: Cons3rtClientError
         """
@@ -489,7 +511,8 @@ class Client:
             method='POST',
             rest_user=rest_user,
             target=target,
-            content_file=content_file
+            content_file=content_file,
+            content_stream=content_stream
         )
 
     # This only exists for backwards compatibility
@@ -583,6 +606,142 @@ class Client:
         return download_file
 
 
+class BoundedPipe(object):
+    """In-memory pipe with a bounded buffer for streaming a download into an upload
+
+    A producer thread calls write() and close_writer(), and the consumer reads from the pipe like
+    a file.  len() reports the bytes not yet read, starting at content_length, so the pipe can be the
+    body of a MultipartEncoder, which uses it to tell when the body is drained.  Writers block when
+    max_buffer_bytes are held in memory until the reader catches up.
+    """
+
+    def __init__(self, content_length, max_buffer_bytes=default_pipe_buffer_bytes):
+        self.content_length = content_length
+        self.max_buffer_bytes = max_buffer_bytes
+        self.chunks = collections.deque()
+        self.buffered_bytes = 0
+        self.bytes_read = 0
+        self.writer_closed = False
+        self.reader_closed = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        with self.condition:
+            return max(self.content_length - self.bytes_read, 0)
+
+    def tell(self):
+        return self.bytes_read
+
+    def write(self, data):
+        """Adds data to the pipe, blocking while the buffer is full
+
+        :param data: (bytes) data to add
+        :return: (int) number of bytes written
+        :raises: OSError if the reader was closed
+        """
+        with self.condition:
+            while self.buffered_bytes >= self.max_buffer_bytes and not self.reader_closed:
+                self.condition.wait()
+            if self.reader_closed:
+                raise OSError('The pipe reader is closed')
+            self.chunks.append(data)
+            self.buffered_bytes += len(data)
+            self.condition.notify_all()
+        return len(data)
+
+    def close_writer(self, error=None):
+        """Signals the end of the data, or a producer error the reader will raise
+
+        :param error: (str) error message from the producer
+        :return: None
+        """
+        with self.condition:
+            self.writer_closed = True
+            self.error = error
+            self.condition.notify_all()
+
+    def read(self, size=-1):
+        """Reads up to size bytes, blocking until data is available
+
+        :param size: (int) maximum number of bytes to read, or -1 for all remaining data
+        :return: (bytes) data, or empty bytes at the end of the stream
+        :raises: OSError if the producer failed or the stream ended before content_length bytes
+        """
+        with self.condition:
+            while True:
+                if self.error:
+                    raise OSError('The pipe writer failed: {e}'.format(e=self.error))
+                if self.buffered_bytes > 0:
+                    if size is not None and size >= 0:
+                        break
+                    if self.writer_closed or self.buffered_bytes >= self.max_buffer_bytes:
+                        break
+                if self.writer_closed:
+                    if self.bytes_read < self.content_length:
+                        raise OSError('The pipe closed after {n} of {t} bytes'.format(
+                            n=str(self.bytes_read), t=str(self.content_length)))
+                    return b''
+                self.condition.wait()
+            if size is None or size < 0:
+                size = self.buffered_bytes
+            parts = []
+            num_bytes = 0
+            while self.chunks and num_bytes < size:
+                chunk = self.chunks.popleft()
+                if num_bytes + len(chunk) > size:
+                    self.chunks.appendleft(chunk[size - num_bytes:])
+                    chunk = chunk[:size - num_bytes]
+                parts.append(chunk)
+                num_bytes += len(chunk)
+            self.buffered_bytes -= num_bytes
+            self.bytes_read += num_bytes
+            self.condition.notify_all()
+        return b''.join(parts)
+
+    def close(self):
+        """Closes the reader side, unblocking and failing any further writes
+
+        :return: None
+        """
+        with self.condition:
+            self.reader_closed = True
+            self.condition.notify_all()
+
+
+def pump_response_to_pipe(http_response, pipe, tee_file=None, chunk_size=1048576):
+    """Copies a streaming response into a BoundedPipe, optionally saving a copy to disk
+
+    Intended to run as the producer thread for a BoundedPipe.  Errors are passed to the pipe reader.
+
+    :param http_response: (requests.models.Response) streaming response
+    :param pipe: (BoundedPipe) pipe to write to
+    :param tee_file: (str) path to a file to also write the content to
+    :param chunk_size: (int) number of bytes to read from the response at a time
+    :return: None
+    """
+    log = logging.getLogger(mod_logger + '.pump_response_to_pipe')
+    error = None
+    try:
+        if tee_file:
+            with open(tee_file, 'wb') as f:
+                for chunk in http_response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        pipe.write(chunk)
+        else:
+            for chunk in http_response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    pipe.write(chunk)
+    except (requests.exceptions.ConnectionError, requests.exceptions.RequestException, OSError) as exc:
+        error = '[{n}] error streaming response content after [{s}] bytes\n{e}'.format(
+            n=type(exc).__name__, s=str(pipe.bytes_read + pipe.buffered_bytes), e=str(exc))
+        log.warning(error)
+    finally:
+        http_response.close()
+        pipe.close_writer(error=error)
+
+
 def get_content(content_file=None, content_data=None):
     """Returns the content of a file, provided data, or None
 
@@ -674,7 +833,7 @@ def http_download(url, download_file, headers=None, basic_auth=None, client_cert
 
 def http_get_with_retries(url, headers=None, basic_auth=None, client_cert_path=None, cert_bundle_path=None,
                           max_retry_attempts=10, retry_time_sec=3, connect_timeout=default_connect_timeout,
-                          read_timeout=default_read_timeout):
+                          read_timeout=default_read_timeout, stream=False):
     """Run http get request with retries
 
     :param url: (str) URL to query
@@ -686,6 +845,7 @@ def http_get_with_retries(url, headers=None, basic_auth=None, client_cert_path=N
     :param retry_time_sec: (int) seconds between attempts
     :param connect_timeout: (float) seconds to wait for the connection to succeed, should be > multiple of 3
     :param read_timeout: (int) seconds to wait in between bytes received, 99.9% it's the 1st byte
+    :param stream: (bool) Set True to return before the response body is read, for large downloads
     :return: requests.Response object
     :raises: Cons3rtClientError
     """
@@ -741,7 +901,7 @@ def http_get_with_retries(url, headers=None, basic_auth=None, client_cert_path=N
             raise Cons3rtClientError(msg)
         err_msg = ''
         try:
-            response = s.send(prepped, timeout=(connect_timeout, read_timeout))
+            response = s.send(prepped, timeout=(connect_timeout, read_timeout), stream=stream)
         except SSLError as exc:
             err_msg += 'SSlError on GET to URL [{u}]\n{e}'.format(u=url, e=str(exc))
         except requests.ConnectionError as exc:
@@ -9,8 +9,8 @@ import os
 
 from botocore.client import ClientError
 
-from .awsutil import get_boto3_client
-from .exceptions import IamUtilError
+from .awsutil import get_boto3_client, paginate
+from .exceptions import AWSAPIError, IamUtilError
 from .logify import Logify
 from .network import validate_ip_address
 
@@ -21,6 +21,9 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.iamutil'
 
+# Maximum page size for IAM list calls
+iam_max_page_size = 1000
+
 
 class IamUtil(object):
     """Utility for interacting with the AWS IAM API
@@ -634,35 +637,24 @@ def list_groups_with_marker(client, path_prefix='/', marker=None, max_results=10
         )
 
 
-def list_groups(client, path_prefix='/'):
-    """Lists groups in IAM
+def list_groups(client, path_prefix='/', projection=None):
+    """Lists IAM groups
 
     :param client: boto3.client object
     :param path_prefix: (str) IAM group path prefix
-    :return: (list) of groups (dict)
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list) of IAM groups (dict)
     :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_groups')
-    marker = None
-    next_query = True
-    group_list = []
     log.info('Attempting to list IAM groups...')
-    while True:
-        if not next_query:
-            break
-        response = list_groups_with_marker(client=client, path_prefix=path_prefix, marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return group_list
-        if 'Groups' not in response.keys():
-            log.warning('Groups not found in response: {r}'.format(r=str(response)))
-            return group_list
-        next_query = response['IsTruncated']
-        group_list += response['Groups']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        group_list = list(paginate(
+            client=client, operation='list_groups', projection=projection, page_size=iam_max_page_size,
+            PathPrefix=path_prefix))
+    except AWSAPIError as exc:
+        msg = 'Problem listing IAM groups'
+        raise IamUtilError(msg) from exc
     log.info('Found {n} IAM groups'.format(n=str(len(group_list))))
     return group_list
 
@@ -694,35 +686,24 @@ def list_users_with_marker(client, path_prefix='/', marker=None, max_results=100
         )
 
 
-def list_users(client, path_prefix='/'):
-    """Lists users in IAM
+def list_users(client, path_prefix='/', projection=None):
+    """Lists IAM users
 
     :param client: boto3.client object
-    :param path_prefix: (str) IAM group path prefix
-    :return: (list) of groups (dict)
+    :param path_prefix: (str) IAM user path prefix
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list) of IAM users (dict)
     :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_users')
-    marker = None
-    next_query = True
-    user_list = []
     log.info('Attempting to list IAM users...')
-    while True:
-        if not next_query:
-            break
-        response = list_users_with_marker(client=client, path_prefix=path_prefix, marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return user_list
-        if 'Users' not in response.keys():
-            log.warning('Users not found in response: {r}'.format(r=str(response)))
-            return user_list
-        next_query = response['IsTruncated']
-        user_list += response['Users']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        user_list = list(paginate(
+            client=client, operation='list_users', projection=projection, page_size=iam_max_page_size,
+            PathPrefix=path_prefix))
+    except AWSAPIError as exc:
+        msg = 'Problem listing IAM users'
+        raise IamUtilError(msg) from exc
     log.info('Found {n} IAM users'.format(n=str(len(user_list))))
     return user_list
 
@@ -778,28 +759,14 @@ def list_policies(client, scope='Local', only_attached=False, path_prefix='/',
     :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_policies')
-    marker = None
-    next_query = True
-    policy_list = []
     log.info('Attempting to list IAM policies...')
-    while True:
-        if not next_query:
-            break
-        response = list_policies_with_marker(client=client, scope=scope, only_attached=only_attached,
-                                             path_prefix=path_prefix, policy_usage_filter=policy_usage_filter,
-                                             marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return policy_list
-        if 'Policies' not in response.keys():
-            log.warning('Policies not found in response: {r}'.format(r=str(response)))
-            return policy_list
-        next_query = response['IsTruncated']
-        policy_list += response['Policies']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        policy_list = list(paginate(client=client, operation='list_policies', page_size=iam_max_page_size,
+                                    Scope=scope, OnlyAttached=only_attached, PathPrefix=path_prefix,
+                                    PolicyUsageFilter=policy_usage_filter))
+    except AWSAPIError as exc:
+        msg = 'Problem listing IAM policies'
+        raise IamUtilError(msg) from exc
 
     # Filter the policy list based on name_contains
     filtered_policy_list = []
@@ -842,35 +809,24 @@ def list_policy_versions_with_marker(client, policy_arn, marker=None, max_result
         )
 
 
-def list_policy_versions(client, policy_arn):
-    """Lists policies in IAM
+def list_policy_versions(client, policy_arn, projection=None):
+    """Lists IAM policy versions
 
     :param client: boto3.client object
     :param policy_arn: (str) ARN of the policy
-    :return: (list) of policies (dict)
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list) of IAM policy versions (dict)
     :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_policy_versions')
-    marker = None
-    next_query = True
-    policy_version_list = []
     log.info('Attempting to list IAM policy version for [{p}]'.format(p=policy_arn))
-    while True:
-        if not next_query:
-            break
-        response = list_policy_versions_with_marker(client=client, policy_arn=policy_arn, marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return policy_version_list
-        if 'Versions' not in response.keys():
-            log.warning('Versions not found in response: {r}'.format(r=str(response)))
-            return policy_version_list
-        next_query = response['IsTruncated']
-        policy_version_list += response['Versions']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        policy_version_list = list(paginate(
+            client=client, operation='list_policy_versions', projection=projection, page_size=iam_max_page_size,
+            PolicyArn=policy_arn))
+    except AWSAPIError as exc:
+        msg = 'Problem listing IAM policy versions'
+        raise IamUtilError(msg) from exc
     log.info('Found {n} IAM policy versions'.format(n=str(len(policy_version_list))))
     return policy_version_list
 
@@ -1030,34 +986,24 @@ def list_roles_with_marker(client, path_prefix='/', marker=None, max_results=100
         )
 
 
-def list_roles(client, path_prefix='/'):
-    """Lists roles in IAM
+def list_roles(client, path_prefix='/', projection=None):
+    """Lists IAM roles
 
     :param client: boto3.client object
-    :param path_prefix: (str) IAM role prefix
-    :return:
+    :param path_prefix: (str) IAM role path prefix
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list) of IAM roles (dict)
+    :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_roles')
-    marker = None
-    next_query = True
-    role_list = []
     log.info('Attempting to list IAM roles...')
-    while True:
-        if not next_query:
-            break
-        response = list_roles_with_marker(client=client, marker=marker, path_prefix=path_prefix)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return role_list
-        if 'Roles' not in response.keys():
-            log.warning('Roles not found in response: {r}'.format(r=str(response)))
-            return role_list
-        next_query = response['IsTruncated']
-        role_list += response['Roles']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        role_list = list(paginate(
+            client=client, operation='list_roles', projection=projection, page_size=iam_max_page_size,
+            PathPrefix=path_prefix))
+    except AWSAPIError as exc:
+        msg = 'Problem listing IAM roles'
+        raise IamUtilError(msg) from exc
     log.info('Found {n} IAM roles'.format(n=str(len(role_list))))
     return role_list
 
@@ -1590,35 +1536,24 @@ def list_access_keys_for_user_with_marker(client, user_name, marker=None, max_re
         )
 
 
-def list_access_keys_for_user(client, user_name):
-    """Lists access keys for user
+def list_access_keys_for_user(client, user_name, projection=None):
+    """Lists access keys for the user
 
     :param client: boto3.client object
     :param user_name: (str) user name
-    :return: (list) of groups (dict)
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
+    :return: (list) of access keys for the user (dict)
     :raises: IamUtilError
     """
     log = logging.getLogger(mod_logger + '.list_access_keys_for_user')
-    marker = None
-    next_query = True
-    access_key_list = []
     log.info('Attempting to list access keys for user: {n}'.format(n=user_name))
-    while True:
-        if not next_query:
-            break
-        response = list_access_keys_for_user_with_marker(client=client, user_name=user_name, marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return access_key_list
-        if 'AccessKeyMetadata' not in response.keys():
-            log.warning('AccessKeyMetadata not found in response: {r}'.format(r=str(response)))
-            return access_key_list
-        next_query = response['IsTruncated']
-        access_key_list += response['AccessKeyMetadata']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        access_key_list = list(paginate(
+            client=client, operation='list_access_keys', projection=projection, page_size=iam_max_page_size,
+            UserName=user_name))
+    except AWSAPIError as exc:
+        msg = 'Problem listing access keys for the user'
+        raise IamUtilError(msg) from exc
     log.info('Found {n} IAM access keys for user: {u}'.format(u=user_name, n=str(len(access_key_list))))
     return access_key_list
 
@@ -0,0 +1,172 @@
+"""Module: metadataclient
+
+This module provides the HTTP client shared by the AWS and Azure instance
+metadata utilities.
+
+A single keep-alive session is used for every request, retries are handled in
+one place, and values that cannot change while the system is up are memoised
+in memory and in a small file in the pycons3rt data directory.  The file is
+scoped to the kernel boot ID, so a system launched from an image of this one,
+or a stopped and started instance, never reads values cached by another boot.
+
+Classes:
+    MetadataClient: Base client for instance metadata services
+
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from .logify import Logify
+from .osutil import get_pycons3rt_data_dir
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.metadataclient'
+
+# File containing an ID unique to the current boot on Linux
+boot_id_file = '/proc/sys/kernel/random/boot_id'
+
+# Number of seconds to timeout after, metadata services should return quickly
+default_query_timeout_sec = 5
+
+# Number of seconds to wait between retries
+default_retry_time_sec = 3
+
+# Number of tries before giving up
+default_max_num_tries = 3
+
+# Character encoding
+character_encoding = 'utf-8'
+
+
+def get_boot_id():
+    """Returns an ID unique to the current boot
+
+    :return: (str) boot ID, or None where the boot ID is not available, which disables the cache file
+    """
+    try:
+        with open(boot_id_file, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class MetadataClient(object):
+    """Base client for instance metadata services
+
+    :param cache_file: (str) path to the file of cached immutable values, or None to disable the file
+    :param query_timeout_sec: (int) timeout for each request
+    :param retry_time_sec: (int) time to wait between retries
+    :param max_num_tries: (int) number of tries before giving up
+    """
+
+    def __init__(self, cache_file=None, query_timeout_sec=default_query_timeout_sec,
+                 retry_time_sec=default_retry_time_sec, max_num_tries=default_max_num_tries):
+        self.cls_logger = mod_logger + '.MetadataClient'
+        self.cache_file = cache_file
+        self.query_timeout_sec = query_timeout_sec
+        self.retry_time_sec = retry_time_sec
+        self.max_num_tries = max_num_tries
+        self.session = requests.Session()
+        self.lock = threading.RLock()
+        self.boot_id = get_boot_id()
+        self.cache = None
+
+    def get_default_cache_file(self, name):
+        """Returns the path to a cache file in the pycons3rt data directory
+
+        :param name: (str) name of the cache file
+        :return: (str) path to the cache file
+        """
+        return os.path.join(get_pycons3rt_data_dir(), name)
+
+    def load_cache(self):
+        """Loads the cached values for the current boot from the cache file
+
+        :return: (dict) cached values
+        """
+        log = logging.getLogger(self.cls_logger + '.load_cache')
+        with self.lock:
+            if self.cache is not None:
+                return self.cache
+            self.cache = {}
+            if not self.cache_file or not self.boot_id or not os.path.isfile(self.cache_file):
+                return self.cache
+            try:
+                with open(self.cache_file, 'r') as f:
+                    content = json.load(f)
+            except (OSError, ValueError) as exc:
+                log.warning('Unable to read metadata cache file [{f}]: {e}'.format(f=self.cache_file, e=str(exc)))
+                return self.cache
+            if content.get('boot_id') == self.boot_id:
+                self.cache = content.get('values', {})
+            return self.cache
+
+    def save_cache(self):
+        """Writes the cached values to the cache file, logging instead of failing since the cache is optional
+
+        :return: None
+        """
+        log = logging.getLogger(self.cls_logger + '.save_cache')
+        if not self.cache_file or not self.boot_id:
+            return
+        tmp_file = self.cache_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(tmp_file, 'w') as f:
+                json.dump({'boot_id': self.boot_id, 'values': self.cache}, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as exc:
+            log.warning('Unable to write metadata cache file [{f}]: {e}'.format(f=self.cache_file, e=str(exc)))
+
+    def get_cached(self, key, func):
+        """Returns the cached value for the key, calling the function and caching its result when not cached
+
+        None results are not cached.
+
+        :param key: (str) cache key
+        :param func: (callable) function that returns the value
+        :return: value
+        """
+        with self.lock:
+            cache = self.load_cache()
+            if key in cache:
+                return cache[key]
+            value = func()
+            if value is not None:
+                cache[key] = value
+                self.save_cache()
+            return value
+
+    def request(self, method, url, headers=None, retry=True):
+        """Sends a request to the metadata service with retries on connection errors and server errors
+
+        :param method: (str) HTTP method
+        :param url: (str) URL
+        :param headers: (dict) request headers
+        :param retry: (bool) Set False to try only once
+        :return: (requests.Response) or None if the service could not be reached
+        """
+        log = logging.getLogger(self.cls_logger + '.request')
+        max_num_tries = self.max_num_tries if retry else 1
+        for attempt_num in range(1, max_num_tries + 1):
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.query_timeout_sec)
+            except (IOError, OSError, requests.exceptions.RequestException) as exc:
+                log.info('Problem querying metadata URL [{u}] on attempt {n} of {m}\n{e}'.format(
+                    u=url, n=str(attempt_num), m=str(max_num_tries), e=str(exc)))
+            else:
+                if response.status_code < 500 and response.status_code != 429:
+                    return response
+                log.warning('Metadata URL [{u}] returned code {c} on attempt {n} of {m}'.format(
+                    u=url, c=str(response.status_code), n=str(attempt_num), m=str(max_num_tries)))
+            if attempt_num < max_num_tries:
+                time.sleep(self.retry_time_sec)
+        return None
@@ -5,6 +5,9 @@ This module provides networking utilities
 """
 import logging
 import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from .logify import Logify
 
@@ -15,25 +18,206 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.network'
 
+# Maximum number of hostname lookups run at once
+default_dns_max_workers = 16
 
-def get_ip_list_for_hostname_list(hostname_list):
+# Seconds to wait for each hostname lookup
+default_dns_timeout_sec = 10.0
+
+# Seconds to cache hostname lookups, the system resolver does not return record TTLs
+default_dns_ttl_sec = 300
+
+# Seconds to cache hostnames that do not resolve
+default_dns_negative_ttl_sec = 60
+
+# Lookup errors that may succeed on retry, these are not cached
+dns_transient_error_codes = [getattr(socket, name) for name in ['EAI_AGAIN', 'EAI_SYSTEM'] if hasattr(socket, name)]
+
+# Shared resolver used by get_ip_list_for_hostname_list
+shared_resolver = None
+shared_resolver_lock = threading.Lock()
+
+
+class DnsResolver(object):
+    """Resolves hostnames concurrently with a per-lookup timeout and a TTL-bounded cache
+
+    Hostnames that do not exist are cached for negative_ttl_sec.  Lookups that time out or
+    fail with a transient error are not cached, and a lookup still running from an earlier
+    call is shared rather than repeated.
+
+    :param max_workers: (int) maximum number of lookups run at once
+    :param timeout_sec: (float) seconds to wait for each lookup, counted from when the lookup starts running
+    :param ttl_sec: (int) seconds to cache resolved hostnames
+    :param negative_ttl_sec: (int) seconds to cache hostnames that do not resolve
+    :param resolve_func: (callable) lookup function with the signature of socket.gethostbyname_ex
+    """
+
+    def __init__(self, max_workers=default_dns_max_workers, timeout_sec=default_dns_timeout_sec,
+                 ttl_sec=default_dns_ttl_sec, negative_ttl_sec=default_dns_negative_ttl_sec,
+                 resolve_func=socket.gethostbyname_ex):
+        self.cls_logger = mod_logger + '.DnsResolver'
+        self.timeout_sec = timeout_sec
+        self.ttl_sec = ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+        self.resolve_func = resolve_func
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dns')
+        self.cache = {}
+        self.pending = {}
+        self.start_times = {}
+        self.lock = threading.RLock()
+
+    def get_cached(self, hostname):
+        """Returns the cached lookup result for the hostname
+
+        :param hostname: (str) hostname
+        :return: (tuple) list of IP addresses or None if the hostname did not resolve, and the error message,
+            or None if not cached or expired
+        """
+        with self.lock:
+            entry = self.cache.get(hostname)
+            if not entry:
+                return None
+            expires, ips, error = entry
+            if expires < time.monotonic():
+                del self.cache[hostname]
+                return None
+            return ips, error
+
+    def lookup(self, hostname):
+        """Resolves the hostname and caches the result
+
+        :param hostname: (str) hostname
+        :return: (tuple) list of IP addresses or None if the hostname did not resolve, and the error message
+        """
+        with self.lock:
+            self.start_times[hostname] = time.monotonic()
+        try:
+            _, _, ips = self.resolve_func(hostname)
+        except (socket.gaierror, socket.herror) as exc:
+            if isinstance(exc, socket.gaierror) and exc.errno in dns_transient_error_codes:
+                return None, str(exc)
+            with self.lock:
+                self.cache[hostname] = (time.monotonic() + self.negative_ttl_sec, None, str(exc))
+            return None, str(exc)
+        except socket.error as exc:
+            return None, str(exc)
+        with self.lock:
+            self.cache[hostname] = (time.monotonic() + self.ttl_sec, ips, None)
+        return ips, None
+
+    def get_pending_lookup(self, hostname):
+        """Returns the running lookup for the hostname, starting one if none is running
+
+        :param hostname: (str) hostname
+        :return: (concurrent.futures.Future) lookup result, see lookup
+        """
+        with self.lock:
+            future = self.pending.get(hostname)
+            if future is None:
+                future = self.executor.submit(self.lookup, hostname)
+                self.pending[hostname] = future
+                future.add_done_callback(lambda _: self.remove_pending_lookup(hostname, future))
+            return future
+
+    def remove_pending_lookup(self, hostname, future):
+        """Forgets the lookup for the hostname once it is done
+
+        :param hostname: (str) hostname
+        :param future: (concurrent.futures.Future) lookup that is done
+        :return: None
+        """
+        with self.lock:
+            if self.pending.get(hostname) is future:
+                del self.pending[hostname]
+                self.start_times.pop(hostname, None)
+
+    def resolve(self, hostname_list):
+        """Resolves the hostnames concurrently
+
+        Each lookup times out timeout_sec after it starts running, so hostnames queued behind max_workers
+        running lookups are not reported as timed out while they wait.
+
+        :param hostname_list: (list) of (str) hostnames
+        :return: (list) of tuples in input order: hostname, list of IP addresses or None if the hostname
+            did not resolve, and the error message
+        """
+        results = {}
+        futures = {}
+        for hostname in hostname_list:
+            if hostname in results or hostname in futures:
+                continue
+            cached = self.get_cached(hostname)
+            if cached:
+                results[hostname] = cached
+            else:
+                futures[hostname] = self.get_pending_lookup(hostname)
+        while futures:
+            now = time.monotonic()
+            next_deadline = None
+            for hostname, future in list(futures.items()):
+                if future.done():
+                    results[hostname] = future.result()
+                    del futures[hostname]
+                    continue
+                with self.lock:
+                    start_time = self.start_times.get(hostname)
+                if start_time is None:
+                    # Still queued behind running lookups
+                    continue
+                deadline = start_time + self.timeout_sec
+                if deadline <= now:
+                    results[hostname] = None, 'Lookup timed out after {t} seconds'.format(t=str(self.timeout_sec))
+                    del futures[hostname]
+                elif next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+            if futures:
+                wait_sec = self.timeout_sec if next_deadline is None else next_deadline - now
+                wait(list(futures.values()), timeout=wait_sec, return_when=FIRST_COMPLETED)
+        return [(hostname,) + results[hostname] for hostname in hostname_list]
+
+    def clear_cache(self):
+        """Removes all cached lookups
+
+        :return: None
+        """
+        with self.lock:
+            self.cache.clear()
+
+
+def get_dns_resolver():
+    """Returns the shared DNS resolver
+
+    :return: (DnsResolver)
+    """
+    global shared_resolver
+    with shared_resolver_lock:
+        if shared_resolver is None:
+            shared_resolver = DnsResolver()
+        return shared_resolver
+
+
+def get_ip_list_for_hostname_list(hostname_list, resolver=None):
     """Returns a list of IP addresses objects for a list of hostnames and a list of hostnames that failed
 
     Note, its possible for a hostname to return an IP and also end up on the failed list if more than one
     entries is returned, and one of the entries is not a valid IP address
 
+    Hostnames are resolved concurrently and cached, see DnsResolver, and results are returned in
+    the order of the hostname list.
+
     :param hostname_list: (list) of (str) hostnames to query
+    :param resolver: (DnsResolver) resolver to use, the shared resolver by default
     :return: (tuple) list of IP addresses, and list of failed hostnames
     """
     log = logging.getLogger(mod_logger + '.get_ip_list_for_hostname_list')
+    if not resolver:
+        resolver = get_dns_resolver()
     failed_hostname_list = []
     ip_address_list = []
-    for hostname in hostname_list:
+    for hostname, hostname_ips, error in resolver.resolve(hostname_list=hostname_list):
         hostname_ip_list = []
-        try:
-            _, _, hostname_ips = socket.gethostbyname_ex(hostname)
-        except (socket.gaierror, socket.error, socket.herror) as exc:
-            log.warning('Problem retrieving IP address for hostname: {r}\n{e}'.format(r=hostname, e=str(exc)))
+        if hostname_ips is None:
+            log.warning('Problem retrieving IP address for hostname: {r}\n{e}'.format(r=hostname, e=error))
             failed_hostname_list.append(hostname)
             continue
         if len(hostname_ips) < 1:
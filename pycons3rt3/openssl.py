@@ -5,11 +5,37 @@
 This module provides utilities for performing encryption and decryption
 with openssl
 
+The openssl_* functions run the openssl command on whole files.  The streaming
+classes produce and read the same formats in process, in large chunks with
+constant memory, so data can be encrypted while it is zipped or uploaded and
+decrypted while it is downloaded:
+
+    openssl enc -aes-256-cbc -a -salt -pass file:<password_file>
+    openssl smime -encrypt -binary -aes-256-cbc -outform DER <cert_file>
+
+Classes:
+    EncEncryptor: Encrypts in the openssl enc format
+    EncDecryptor: Decrypts the openssl enc format
+    SmimeEncryptor: Encrypts in the openssl smime DER format
+    SmimeDecryptor: Decrypts the openssl smime DER format
+    CipherReader: File-like reader that encrypts or decrypts data read from a file
+    CipherWriter: File-like writer that encrypts or decrypts data written to a file
+
 """
+import binascii
+import hashlib
+import itertools
 import logging
 import os
+import struct
+import time
 import traceback
 
+from cryptography import x509
+from cryptography.hazmat.primitives import padding, serialization
+from cryptography.hazmat.primitives.asymmetric import padding as asymmetric_padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
 from .logify import Logify
 from .bash import run_command
 from .exceptions import CommandError
@@ -20,6 +46,38 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.openssl'
 
+# Size of each chunk read from or written to a stream
+default_chunk_bytes = 1024 * 1024
+
+# openssl reads at most this many bytes of the first line of a password file
+password_max_bytes = 1023
+
+# openssl enc salted header, key and IV sizes for aes-256-cbc, and base64 line length
+enc_salt_magic = b'Salted__'
+enc_salt_bytes = 8
+enc_key_bytes = 32
+enc_iv_bytes = 16
+base64_line_chars = 64
+
+# Raw bytes per base64 line
+base64_line_bytes = base64_line_chars // 4 * 3
+
+# DER encoded object identifiers for the smime format
+oid_enveloped_data = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x03'
+oid_data = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x01'
+oid_rsa_encryption = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x01\x01'
+oid_aes256_cbc = b'\x06\x09\x60\x86\x48\x01\x65\x03\x04\x01\x2a'
+
+# Key sizes of the supported smime content encryption algorithms
+smime_key_bytes = {
+    b'\x06\x09\x60\x86\x48\x01\x65\x03\x04\x01\x02': 16,
+    b'\x06\x09\x60\x86\x48\x01\x65\x03\x04\x01\x16': 24,
+    oid_aes256_cbc: 32
+}
+
+# BER end of contents marker that closes an indefinite length value
+ber_end_of_contents = b'\x00\x00'
+
 
 def generate_password_file(pwd_bytes=4096, out_file=None):
     """Generates a password file with openssl
@@ -167,3 +225,666 @@ def openssl_smime_encrypt(decrypted_file, password_file, encrypted_file=None):
         raise CommandError('openssl exited with code: {c}'.format(c=str(result['code'])))
     log.info('Created encrypted file: {d}'.format(d=encrypted_file))
     return True
+
+
+def read_password_file(password_file):
+    """Reads a password file the way openssl -pass file: does, using the first line
+
+    :param password_file: (str) path to the password file
+    :return: (bytes) password
+    :raises: CommandError
+    """
+    try:
+        with open(password_file, 'rb') as f:
+            password = f.readline(password_max_bytes).split(b'\n')[0]
+    except OSError as exc:
+        raise CommandError('Problem reading password file: {f}'.format(f=password_file)) from exc
+    if not password:
+        raise CommandError('No password found in password file: {f}'.format(f=password_file))
+    return password
+
+
+def get_enc_key_iv(password, salt):
+    """Derives the key and IV from the password and salt the way openssl enc does without -pbkdf2
+
+    :param password: (bytes) password
+    :param salt: (bytes) salt
+    :return: (tuple) key and IV bytes
+    """
+    derived = b''
+    digest = b''
+    while len(derived) < enc_key_bytes + enc_iv_bytes:
+        digest = hashlib.sha256(digest + password + salt).digest()
+        derived += digest
+    return derived[:enc_key_bytes], derived[enc_key_bytes:enc_key_bytes + enc_iv_bytes]
+
+
+def encode_base64_lines(data):
+    """Base64 encodes data in lines the way openssl -a does
+
+    :param data: (bytes) data to encode
+    :return: (bytes) base64 lines, each ending with a newline
+    """
+    # Encode each whole line separately, b2a_base64 adds the newline
+    body_bytes = len(data) // base64_line_bytes * base64_line_bytes
+    rows = struct.iter_unpack('{n}s'.format(n=str(base64_line_bytes)), memoryview(data)[:body_bytes])
+    lines = b''.join(map(binascii.b2a_base64, itertools.chain.from_iterable(rows)))
+    if body_bytes < len(data):
+        lines += binascii.b2a_base64(data[body_bytes:])
+    return lines
+
+
+def encode_der_length(length):
+    """Returns the DER encoding of a length
+
+    :param length: (int) length
+    :return: (bytes)
+    """
+    if length < 0x80:
+        return bytes([length])
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(length_bytes)]) + length_bytes
+
+
+def encode_der(tag, content):
+    """Returns the DER encoding of a value
+
+    :param tag: (int) tag byte
+    :param content: (bytes) content
+    :return: (bytes)
+    """
+    return bytes([tag]) + encode_der_length(len(content)) + content
+
+
+def decode_ber_header(data, pos):
+    """Decodes the tag and length at a position in BER encoded data
+
+    :param data: (bytes) BER encoded data
+    :param pos: (int) position of the tag
+    :return: (tuple) tag, length (None for indefinite), and position of the content, or None if more data is needed
+    :raises: CommandError
+    """
+    if pos + 2 > len(data):
+        return None
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if tag & 0x1f == 0x1f:
+        raise CommandError('Unsupported multi-byte tag in smime data')
+    if length == 0x80:
+        return tag, None, pos
+    if length < 0x80:
+        return tag, length, pos
+    num_bytes = length & 0x7f
+    if num_bytes > 8:
+        raise CommandError('Invalid length in smime data')
+    if pos + num_bytes > len(data):
+        return None
+    return tag, int.from_bytes(data[pos:pos + num_bytes], 'big'), pos + num_bytes
+
+
+def get_der_children(data):
+    """Returns the tag and content of each definite length value in DER encoded data
+
+    :param data: (bytes) DER encoded values
+    :return: (list) of tuples of tag and content bytes
+    :raises: CommandError
+    """
+    children = []
+    pos = 0
+    while pos < len(data):
+        header = decode_ber_header(data, pos)
+        if header is None or header[1] is None or header[2] + header[1] > len(data):
+            raise CommandError('Invalid DER encoding in smime data')
+        tag, length, pos = header
+        children.append((tag, bytes(data[pos:pos + length])))
+        pos += length
+    return children
+
+
+class EncEncryptor(object):
+    """Encrypts in the openssl enc -aes-256-cbc -a -salt format
+
+    :param password_file: (str) path to the password file, the first line is the password
+    :param salt: (bytes) 8 byte salt, random by default
+    """
+
+    def __init__(self, password_file, salt=None):
+        salt = salt if salt else os.urandom(enc_salt_bytes)
+        key, iv = get_enc_key_iv(password=read_password_file(password_file), salt=salt)
+        self.encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        self.padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self.pending = enc_salt_magic + salt
+
+    def encode(self, data, final=False):
+        """Base64 encodes the whole lines of pending data and data
+
+        :param data: (bytes) encrypted data
+        :param final: (bool) Set True to encode the last partial line as well
+        :return: (bytes) base64 lines
+        """
+        data = self.pending + data
+        num_bytes = len(data) if final else len(data) // base64_line_bytes * base64_line_bytes
+        self.pending = data[num_bytes:]
+        return encode_base64_lines(data[:num_bytes])
+
+    def update(self, data):
+        """Encrypts a chunk of data
+
+        :param data: (bytes) plaintext
+        :return: (bytes) base64 encrypted data
+        """
+        return self.encode(self.encryptor.update(self.padder.update(data)))
+
+    def finalize(self):
+        """Pads and encrypts the remaining data
+
+        :return: (bytes) base64 encrypted data
+        """
+        return self.encode(self.encryptor.update(self.padder.finalize()) + self.encryptor.finalize(), final=True)
+
+
+class EncDecryptor(object):
+    """Decrypts the openssl enc -aes-256-cbc -a -salt format
+
+    :param password_file: (str) path to the password file, the first line is the password
+    """
+
+    def __init__(self, password_file):
+        self.password = read_password_file(password_file)
+        self.encoded = bytearray()
+        self.header = b''
+        self.decryptor = None
+        self.unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+
+    def decrypt(self, data):
+        """Decrypts decoded data, reading the salt from the header first
+
+        :param data: (bytes) decoded encrypted data
+        :return: (bytes) plaintext
+        :raises: CommandError
+        """
+        if self.decryptor is None:
+            self.header += data
+            if len(self.header) < len(enc_salt_magic) + enc_salt_bytes:
+                return b''
+            if not self.header.startswith(enc_salt_magic):
+                raise CommandError('Encrypted data does not start with the openssl salt header')
+            salt = self.header[len(enc_salt_magic):len(enc_salt_magic) + enc_salt_bytes]
+            data = self.header[len(enc_salt_magic) + enc_salt_bytes:]
+            key, iv = get_enc_key_iv(password=self.password, salt=salt)
+            self.decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        return self.unpadder.update(self.decryptor.update(data))
+
+    def update(self, data):
+        """Decrypts a chunk of base64 encrypted data
+
+        :param data: (bytes) base64 encrypted data
+        :return: (bytes) plaintext
+        :raises: CommandError
+        """
+        self.encoded += data.translate(None, b' \t\r\n')
+        num_chars = len(self.encoded) // 4 * 4
+        try:
+            decoded = binascii.a2b_base64(self.encoded[:num_chars])
+        except binascii.Error as exc:
+            raise CommandError('Invalid base64 in encrypted data') from exc
+        del self.encoded[:num_chars]
+        return self.decrypt(decoded)
+
+    def finalize(self):
+        """Decrypts the remaining data and removes the padding
+
+        :return: (bytes) plaintext
+        :raises: CommandError
+        """
+        if self.encoded:
+            raise CommandError('Encrypted data ends with incomplete base64')
+        if self.decryptor is None:
+            raise CommandError('Encrypted data is too short')
+        try:
+            return self.unpadder.update(self.decryptor.finalize()) + self.unpadder.finalize()
+        except ValueError as exc:
+            raise CommandError('Bad decrypt, the password may be incorrect') from exc
+
+
+class SmimeEncryptor(object):
+    """Encrypts in the openssl smime -encrypt -binary -aes-256-cbc -outform DER format
+
+    The output uses indefinite lengths and a chunked encrypted content octet string so
+    it can be written in one pass, which openssl smime -decrypt -inform DER reads.
+
+    :param cert_file: (str) path to the PEM recipient certificate
+    """
+
+    def __init__(self, cert_file):
+        try:
+            with open(cert_file, 'rb') as f:
+                cert = x509.load_pem_x509_certificate(f.read())
+        except (OSError, ValueError) as exc:
+            raise CommandError('Problem loading certificate file: {f}'.format(f=cert_file)) from exc
+        key = os.urandom(smime_key_bytes[oid_aes256_cbc])
+        iv = os.urandom(enc_iv_bytes)
+        self.encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        self.padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        serial_number = cert.serial_number
+        issuer_and_serial = encode_der(0x30, cert.issuer.public_bytes() + encode_der(
+            0x02, serial_number.to_bytes((serial_number.bit_length() + 8) // 8, 'big', signed=True)))
+        recipient_info = encode_der(0x30, b''.join([
+            encode_der(0x02, b'\x00'),
+            issuer_and_serial,
+            encode_der(0x30, oid_rsa_encryption + b'\x05\x00'),
+            encode_der(0x04, cert.public_key().encrypt(key, asymmetric_padding.PKCS1v15()))
+        ]))
+        self.pending = b''.join([
+            b'\x30\x80', oid_enveloped_data,
+            b'\xa0\x80', b'\x30\x80', encode_der(0x02, b'\x00'), encode_der(0x31, recipient_info),
+            b'\x30\x80', oid_data, encode_der(0x30, oid_aes256_cbc + encode_der(0x04, iv)),
+            b'\xa0\x80'
+        ])
+
+    def encode(self, data):
+        """Wraps encrypted data in an octet string chunk after any pending header
+
+        :param data: (bytes) encrypted data
+        :return: (bytes) DER encoded data
+        """
+        encoded = self.pending + (encode_der(0x04, data) if data else b'')
+        self.pending = b''
+        return encoded
+
+    def update(self, data):
+        """Encrypts a chunk of data
+
+        :param data: (bytes) plaintext
+        :return: (bytes) encrypted data
+        """
+        return self.encode(self.encryptor.update(self.padder.update(data)))
+
+    def finalize(self):
+        """Pads and encrypts the remaining data and closes the indefinite length values
+
+        :return: (bytes) encrypted data
+        """
+        encoded = self.encode(self.encryptor.update(self.padder.finalize()) + self.encryptor.finalize())
+        return encoded + ber_end_of_contents * 5
+
+
+class SmimeDecryptor(object):
+    """Decrypts the openssl smime DER format, encrypted to an RSA key with AES-CBC
+
+    :param key_file: (str) path to the PEM private key
+    """
+
+    def __init__(self, key_file):
+        try:
+            with open(key_file, 'rb') as f:
+                self.private_key = serialization.load_pem_private_key(f.read(), password=None)
+        except (OSError, ValueError, TypeError) as exc:
+            raise CommandError('Problem loading private key file: {f}'.format(f=key_file)) from exc
+        self.buffer = bytearray()
+        self.state = 'header'
+        self.decryptor = None
+        self.unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        self.segment_remaining = 0
+        self.content_remaining = None
+        self.primitive_content = False
+
+    def get_content_key(self, recipient_infos, key_bytes):
+        """Returns the content encryption key decrypted with the private key
+
+        :param recipient_infos: (bytes) content of the recipientInfos set
+        :param key_bytes: (int) expected key size
+        :return: (bytes) content encryption key
+        :raises: CommandError
+        """
+        for _, recipient_info in get_der_children(recipient_infos):
+            fields = get_der_children(recipient_info)
+            if len(fields) < 4 or not get_der_children(fields[2][1]):
+                continue
+            algorithm_tag, algorithm_oid = get_der_children(fields[2][1])[0]
+            if encode_der(algorithm_tag, algorithm_oid) != oid_rsa_encryption:
+                continue
+            try:
+                key = self.private_key.decrypt(fields[3][1], asymmetric_padding.PKCS1v15())
+            except ValueError:
+                continue
+            if len(key) == key_bytes:
+                return key
+        raise CommandError('No recipient in the smime data could be decrypted with the private key')
+
+    def parse_header(self):
+        """Parses the header up to the encrypted content once enough data is buffered
+
+        :return: (bool) True when the header was parsed
+        :raises: CommandError
+        """
+        # Tag of each value before the encrypted content, and whether its content is needed, the
+        # enclosing ContentInfo, [0], EnvelopedData, and EncryptedContentInfo only have their headers read
+        header_fields = [(0x30, False), (0x06, True), (0xa0, False), (0x30, False), (0x02, True), (0x31, True),
+                         (0x30, False), (0x06, True), (0x30, True)]
+        values = []
+        pos = 0
+        for expected_tag, has_content in header_fields:
+            header = decode_ber_header(self.buffer, pos)
+            if header is None:
+                return False
+            tag, length, pos = header
+            if tag != expected_tag:
+                raise CommandError('Unexpected tag in smime data: {t}'.format(t=hex(tag)))
+            if not has_content:
+                values.append(None)
+                continue
+            if length is None:
+                raise CommandError('Unsupported indefinite length in smime data')
+            if pos + length > len(self.buffer):
+                return False
+            values.append(bytes(self.buffer[pos:pos + length]))
+            pos += length
+        header = decode_ber_header(self.buffer, pos)
+        if header is None:
+            return False
+        tag, length, pos = header
+        if encode_der(0x06, values[1]) != oid_enveloped_data:
+            raise CommandError('smime data is not enveloped data')
+        if tag == 0x80:
+            self.primitive_content = True
+            self.segment_remaining = length
+            self.state = 'segment'
+        elif tag == 0xa0:
+            self.content_remaining = length
+            self.state = 'chunks'
+        else:
+            raise CommandError('smime data has no encrypted content')
+        algorithm = get_der_children(values[8])
+        if len(algorithm) != 2 or algorithm[1][0] != 0x04:
+            raise CommandError('Invalid content encryption algorithm in smime data')
+        algorithm_oid = encode_der(algorithm[0][0], algorithm[0][1])
+        if algorithm_oid not in smime_key_bytes:
+            raise CommandError('Unsupported content encryption algorithm in smime data')
+        key = self.get_content_key(recipient_infos=values[5], key_bytes=smime_key_bytes[algorithm_oid])
+        self.decryptor = Cipher(algorithms.AES(key), modes.CBC(algorithm[1][1])).decryptor()
+        del self.buffer[:pos]
+        return True
+
+    def consume(self, num_bytes):
+        """Removes bytes from the buffer and counts them against a definite length content
+
+        :param num_bytes: (int) bytes to remove
+        :return: (bytes) removed bytes
+        """
+        data = bytes(self.buffer[:num_bytes])
+        del self.buffer[:num_bytes]
+        if self.content_remaining is not None:
+            self.content_remaining -= num_bytes
+        return data
+
+    def update(self, data):
+        """Decrypts a chunk of smime data
+
+        :param data: (bytes) encrypted data
+        :return: (bytes) plaintext
+        :raises: CommandError
+        """
+        self.buffer += data
+        if self.state == 'header' and not self.parse_header():
+            return b''
+        encrypted = []
+        while True:
+            if self.state == 'segment':
+                num_bytes = min(self.segment_remaining, len(self.buffer))
+                encrypted.append(self.consume(num_bytes))
+                self.segment_remaining -= num_bytes
+                if self.segment_remaining:
+                    break
+                self.state = 'done' if self.primitive_content else 'chunks'
+            elif self.state == 'chunks':
+                if self.content_remaining == 0:
+                    self.state = 'done'
+                    continue
+                header = decode_ber_header(self.buffer, 0)
+                if header is None:
+                    break
+                tag, length, pos = header
+                if self.content_remaining is None and tag == 0 and length == 0:
+                    del self.buffer[:pos]
+                    self.state = 'done'
+                elif tag == 0x04 and length is not None:
+                    self.consume(pos)
+                    self.segment_remaining = length
+                    self.state = 'segment'
+                else:
+                    raise CommandError('Unsupported encrypted content encoding in smime data')
+            else:
+                # The rest is the end of the enclosing values
+                self.buffer = bytearray()
+                break
+        return self.unpadder.update(self.decryptor.update(b''.join(encrypted)))
+
+    def finalize(self):
+        """Decrypts the remaining data and removes the padding
+
+        :return: (bytes) plaintext
+        :raises: CommandError
+        """
+        if self.state != 'done':
+            raise CommandError('smime data is truncated')
+        try:
+            return self.unpadder.update(self.decryptor.finalize()) + self.unpadder.finalize()
+        except ValueError as exc:
+            raise CommandError('Bad decrypt, the private key may be incorrect') from exc
+
+
+class CipherReader(object):
+    """File-like reader that encrypts or decrypts data read from a file
+
+    For example pass an EncEncryptor reader to an upload to encrypt while uploading.
+
+    :param input_file: (str) path of the file to read, or a readable binary file object
+    :param cipher: EncEncryptor, EncDecryptor, SmimeEncryptor, or SmimeDecryptor
+    :param chunk_bytes: (int) size of each read from the input
+    """
+
+    def __init__(self, input_file, cipher, chunk_bytes=default_chunk_bytes):
+        if isinstance(input_file, str):
+            try:
+                self.stream = open(input_file, 'rb')
+            except OSError as exc:
+                raise CommandError('Unable to open file: {f}'.format(f=input_file)) from exc
+            self.close_stream = True
+        else:
+            self.stream = input_file
+            self.close_stream = False
+        self.cipher = cipher
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+        self.eof = False
+        self.closed = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def readable(self):
+        return True
+
+    def fill(self):
+        """Reads and transforms the next chunk of the input
+
+        :return: None
+        :raises: CommandError
+        """
+        data = self.stream.read(self.chunk_bytes)
+        if data:
+            self.bytes_in += len(data)
+            self.buffer += self.cipher.update(data)
+        else:
+            self.buffer += self.cipher.finalize()
+            self.eof = True
+
+    def read(self, size=-1):
+        """Reads transformed data
+
+        :param size: (int) maximum bytes to return, all remaining data when negative or None
+        :return: (bytes) data, empty at the end of the input
+        :raises: CommandError
+        """
+        while not self.eof and (size is None or size < 0 or len(self.buffer) < size):
+            self.fill()
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+    def close(self):
+        """Closes the input if it was opened from a path
+
+        :return: None
+        """
+        if not self.closed and self.close_stream:
+            self.stream.close()
+        self.closed = True
+
+
+class CipherWriter(object):
+    """File-like writer that encrypts or decrypts data written to a file
+
+    Writes are buffered into chunks before they are transformed.  close() writes the
+    final padded block, for example pass an EncEncryptor writer as the ZipArchiver
+    output to encrypt while zipping.
+
+    :param output_file: (str) path of the file to create, or a writable binary file object such as a pipe
+    :param cipher: EncEncryptor, EncDecryptor, SmimeEncryptor, or SmimeDecryptor
+    :param chunk_bytes: (int) size of each chunk transformed and written to the output
+    """
+
+    def __init__(self, output_file, cipher, chunk_bytes=default_chunk_bytes):
+        if isinstance(output_file, str):
+            try:
+                self.stream = open(output_file, 'wb')
+            except OSError as exc:
+                raise CommandError('Unable to create file: {f}'.format(f=output_file)) from exc
+            self.close_stream = True
+        else:
+            self.stream = output_file
+            self.close_stream = False
+        self.cipher = cipher
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+        self.closed = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self.close_stream:
+            self.stream.close()
+
+    def writable(self):
+        return True
+
+    def write_output(self, data):
+        """Writes transformed data to the output
+
+        :param data: (bytes) transformed data
+        :return: None
+        """
+        if data:
+            self.stream.write(data)
+            self.bytes_out += len(data)
+
+    def write(self, data):
+        """Writes data to be transformed
+
+        :param data: (bytes) data
+        :return: (int) number of bytes written
+        :raises: CommandError
+        """
+        self.buffer += data
+        self.bytes_in += len(data)
+        if len(self.buffer) >= self.chunk_bytes:
+            self.write_output(self.cipher.update(bytes(self.buffer)))
+            self.buffer = bytearray()
+        return len(data)
+
+    def flush(self):
+        """Transforms and writes the buffered data and flushes the output
+
+        :return: None
+        :raises: CommandError
+        """
+        if self.buffer:
+            self.write_output(self.cipher.update(bytes(self.buffer)))
+            self.buffer = bytearray()
+        self.stream.flush()
+
+    def close(self):
+        """Writes the final transformed data, and closes the output if it was opened from a path
+
+        :return: None
+        :raises: CommandError
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+            self.write_output(self.cipher.finalize())
+            self.stream.flush()
+        finally:
+            if self.close_stream:
+                self.stream.close()
+
+
+def cipher_copy(input_file, output_file, cipher, chunk_bytes=default_chunk_bytes):
+    """Encrypts or decrypts from an input to an output in chunks with constant memory
+
+    :param input_file: (str) path of the file to read, or a readable binary file object
+    :param output_file: (str) path of the file to create, or a writable binary file object
+    :param cipher: EncEncryptor, EncDecryptor, SmimeEncryptor, or SmimeDecryptor
+    :param chunk_bytes: (int) size of each chunk
+    :return: (dict) bytes_in, bytes_out, elapsed_sec, and mb_per_sec (input)
+    :raises: CommandError
+    """
+    log = logging.getLogger(mod_logger + '.cipher_copy')
+    start_time = time.monotonic()
+    with CipherReader(input_file=input_file, cipher=cipher, chunk_bytes=chunk_bytes) as reader:
+        if isinstance(output_file, str):
+            try:
+                stream = open(output_file, 'wb')
+            except OSError as exc:
+                raise CommandError('Unable to create file: {f}'.format(f=output_file)) from exc
+        else:
+            stream = output_file
+        try:
+            while True:
+                data = reader.read(chunk_bytes)
+                if not data:
+                    break
+                stream.write(data)
+            stream.flush()
+        except OSError as exc:
+            raise CommandError('Problem copying encrypted or decrypted data') from exc
+        finally:
+            if isinstance(output_file, str):
+                stream.close()
+    elapsed_sec = time.monotonic() - start_time
+    stats = {
+        'bytes_in': reader.bytes_in,
+        'bytes_out': reader.bytes_out,
+        'elapsed_sec': elapsed_sec,
+        'mb_per_sec': reader.bytes_in / (1024.0 * 1024.0) / elapsed_sec if elapsed_sec > 0 else 0.0
+    }
+    log.info('Transformed {i} bytes to {o} bytes in {t:.2f} seconds ({r:.1f} MB/s)'.format(
+        i=str(stats['bytes_in']), o=str(stats['bytes_out']), t=elapsed_sec, r=stats['mb_per_sec']))
+    return stats
@@ -2,6 +2,8 @@
 This module contains a shared library of classes
 
 """
+import threading
+import time
 
 
 class HostActionResult(object):
@@ -112,3 +114,36 @@ class RestUser(object):
         if self.site_default_project:
             user_str += ' (default)'
         return user_str
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket that limits the rate of calls shared across threads
+
+    :param max_calls_per_sec: (float) sustained number of calls per second
+    :param burst: (int) number of calls allowed at once before limiting, defaults to max_calls_per_sec
+    """
+
+    def __init__(self, max_calls_per_sec, burst=None):
+        if max_calls_per_sec <= 0:
+            raise ValueError('max_calls_per_sec must be greater than 0')
+        self.max_calls_per_sec = float(max_calls_per_sec)
+        self.burst = burst if burst else max(1, int(max_calls_per_sec))
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed
+
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.max_calls_per_sec)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_sec = (1 - self.tokens) / self.max_calls_per_sec
+            time.sleep(wait_sec)
@@ -4,9 +4,21 @@
 
 This module provides utilities for performing Java keystore operations
 
+Each keytool run starts a JVM, so batch operations list the keystore aliases
+once and import many certificates with a single keytool -importkeystore from a
+temporary JKS trust store written in Python.
+
 """
+import base64
+import hashlib
 import logging
 import os
+import re
+import secrets
+import shutil
+import struct
+import tempfile
+import time
 
 from .logify import Logify
 from .bash import run_command
@@ -18,20 +30,29 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.pyjavakeys'
 
+# Default keystore password
+default_keystore_password = 'changeit'
 
-def alias_exists(alias, keystore_path=None, keystore_password='changeit'):
-    """Checks if an alias already exists in a keystore
+# Matches the PEM encoded certificates in a file
+pem_cert_regex = re.compile(b'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', re.DOTALL)
 
-    :param alias:
-    :param keystore_path:
-    :param keystore_password:
-    :return: (bool) True when the alias already exists in the keystore
+# Matches the aliases in verbose keytool -list output
+alias_name_regex = re.compile(r'^Alias name: (.*)$', re.MULTILINE)
+
+# JKS file format constants
+jks_magic = 0xFEEDFEED
+jks_version = 2
+jks_trusted_cert_tag = 2
+jks_digest_whitener = b'Mighty Aphrodite'
+
+
+def get_keytool():
+    """Returns the path to keytool in JAVA_HOME
+
+    :return: (str) full path to keytool
     :raises: OSError
     """
-    log = logging.getLogger(mod_logger + '.alias_exists')
-    if not isinstance(alias, str):
-        msg = 'alias arg must be a string'
-        raise OSError(msg)
+    log = logging.getLogger(mod_logger + '.get_keytool')
 
     # Ensure JAVA_HOME is set
     log.debug('Determining JAVA_HOME...')
@@ -46,27 +67,51 @@ def alias_exists(alias, keystore_path=None, keystore_password='changeit'):
     if not os.path.isfile(keytool):
         msg = 'keytool file not found: {f}'.format(f=keytool)
         raise OSError(msg)
+    return keytool
 
-    # Find the cacerts file
-    if keystore_path is None:
-        keystore_path = os.path.join(java_home, 'lib', 'security', 'cacerts')
 
-        # If the JRE cacerts location is not found, look for the JDK cacerts
-        if not os.path .isfile(keystore_path):
-            keystore_path = os.path.join(java_home, 'jre', 'lib', 'security', 'cacerts')
-            if not os.path.isfile(keystore_path):
-                msg = 'Unable to file cacerts file'
-                raise OSError(msg)
+def get_keystore_path(keystore_path=None):
+    """Returns the keystore path, or the cacerts file in JAVA_HOME when not provided
 
-    log.info('Checking keystore {k} for alias: {a}...'.format(k=keystore_path, a=alias))
+    :param keystore_path: (str) full path to the keystore, or None for cacerts
+    :return: (str) full path to the keystore
+    :raises: OSError
+    """
+    if keystore_path is not None:
+        return keystore_path
+    java_home = os.path.dirname(os.path.dirname(get_keytool()))
+    keystore_path = os.path.join(java_home, 'lib', 'security', 'cacerts')
+
+    # If the JRE cacerts location is not found, look for the JDK cacerts
+    if not os.path.isfile(keystore_path):
+        keystore_path = os.path.join(java_home, 'jre', 'lib', 'security', 'cacerts')
+        if not os.path.isfile(keystore_path):
+            msg = 'Unable to file cacerts file'
+            raise OSError(msg)
+    return keystore_path
+
+
+def list_aliases(keystore_path=None, keystore_password=default_keystore_password):
+    """Returns all of the aliases in a keystore with a single keytool run
+
+    :param keystore_path: (str) full path to the keystore, or None for cacerts
+    :param keystore_password: (str) keystore password
+    :return: (set) of aliases in lower case, keytool aliases are not case sensitive
+    :raises: OSError
+    """
+    log = logging.getLogger(mod_logger + '.list_aliases')
+    keytool = get_keytool()
+    keystore_path = get_keystore_path(keystore_path=keystore_path)
+    log.info('Listing aliases in keystore: {k}'.format(k=keystore_path))
 
-    # Build the keytool command
-    command = [keytool, '-keystore', keystore_path, '-storepass', keystore_password, '-list']
+    # Build the keytool command, verbose output labels each alias in English regardless of the locale
+    command = [keytool, '-J-Duser.language=en', '-J-Duser.country=US', '-keystore', keystore_path, '-storepass',
+               keystore_password, '-list', '-v']
 
     # Running the keytool list command
     log.debug('Running the keytool list command...')
     try:
-        result = run_command(command)
+        result = run_command(command, print_output=False)
     except CommandError as exc:
         msg = 'There was a problem running keytool on keystore: {k}'.format(k=keystore_path)
         raise OSError(msg) from exc
@@ -74,9 +119,31 @@ def alias_exists(alias, keystore_path=None, keystore_password='changeit'):
         msg = 'keytool command exited with a non-zero code: {c}, and produced output: {o}'.format(
             c=result['code'], o=result['output'])
         raise OSError(msg)
+    aliases = set(alias.strip().lower() for alias in alias_name_regex.findall(result['output']))
+    log.info('Found {n} aliases in keystore: {k}'.format(n=str(len(aliases)), k=keystore_path))
+    return aliases
+
+
+def alias_exists(alias, keystore_path=None, keystore_password=default_keystore_password):
+    """Checks if an alias already exists in a keystore
+
+    To check many aliases, call list_aliases once instead.
+
+    :param alias: (str) alias to check
+    :param keystore_path: (str) full path to the keystore, or None for cacerts
+    :param keystore_password: (str) keystore password
+    :return: (bool) True when the alias already exists in the keystore
+    :raises: OSError
+    """
+    log = logging.getLogger(mod_logger + '.alias_exists')
+    if not isinstance(alias, str):
+        msg = 'alias arg must be a string'
+        raise OSError(msg)
+    keystore_path = get_keystore_path(keystore_path=keystore_path)
+    log.info('Checking keystore {k} for alias: {a}...'.format(k=keystore_path, a=alias))
 
-    # Check for the alias in the output
-    if alias in result['output']:
+    # Check for the alias in the keystore aliases
+    if alias.lower() in list_aliases(keystore_path=keystore_path, keystore_password=keystore_password):
         log.info('Found alias {a} in keystore: {k}'.format(a=alias, k=keystore_path))
         return True
     else:
@@ -84,7 +151,7 @@ def alias_exists(alias, keystore_path=None, keystore_password='changeit'):
         return False
 
 
-def add_root_ca(root_ca_path, alias, keystore_path=None, keystore_password='changeit'):
+def add_root_ca(root_ca_path, alias, keystore_path=None, keystore_password=default_keystore_password):
     """Adds a root CA to the specified Java keystore
 
     :param root_ca_path:
@@ -106,30 +173,8 @@ def add_root_ca(root_ca_path, alias, keystore_path=None, keystore_password='chan
         msg = 'Root CA cert file not found: {f}'.format(f=root_ca_path)
         raise OSError(msg)
 
-    # Ensure JAVA_HOME is set
-    log.debug('Determining JAVA_HOME...')
-    try:
-        java_home = os.environ['JAVA_HOME']
-    except KeyError:
-        msg = 'JAVA_HOME is required but not set'
-        raise OSError(msg)
-
-    # Ensure keytool can be found
-    keytool = os.path.join(java_home, 'bin', 'keytool')
-    if not os.path.isfile(keytool):
-        msg = 'keytool file not found: {f}'.format(f=keytool)
-        raise OSError(msg)
-
-    # Find the cacerts file
-    if keystore_path is None:
-        keystore_path = os.path.join(java_home, 'lib', 'security', 'cacerts')
-
-        # If the JRE cacerts location is not found, look for the JDK cacerts
-        if not os.path .isfile(keystore_path):
-            keystore_path = os.path.join(java_home, 'jre', 'lib', 'security', 'cacerts')
-            if not os.path.isfile(keystore_path):
-                msg = 'Unable to file cacerts file'
-                raise OSError(msg)
+    keytool = get_keytool()
+    keystore_path = get_keystore_path(keystore_path=keystore_path)
 
     log.info('Attempting to import alias [{a}] in keystore [{k}] from root ca file: {f}'.format(
         a=alias, k=keystore_path, f=root_ca_path))
@@ -164,3 +209,156 @@ def add_root_ca(root_ca_path, alias, keystore_path=None, keystore_password='chan
         raise AliasImportError(msg)
     else:
         log.info('Successfully imported Root CA {c} with alias: {a}'.format(c=root_ca_path, a=alias))
+
+
+def read_certificates(cert_path):
+    """Reads the certificates from a PEM file or bundle, or a single DER encoded certificate
+
+    :param cert_path: (str) full path to the certificate file
+    :return: (list) of DER encoded certificates (bytes)
+    :raises: OSError
+    """
+    if not os.path.isfile(cert_path):
+        msg = 'Root CA cert file not found: {f}'.format(f=cert_path)
+        raise OSError(msg)
+    with open(cert_path, 'rb') as f:
+        content = f.read()
+    pem_certs = pem_cert_regex.findall(content)
+    if not pem_certs:
+        if not content.startswith(b'\x30'):
+            msg = 'No PEM or DER encoded certificate found in file: {f}'.format(f=cert_path)
+            raise OSError(msg)
+        return [content]
+    try:
+        return [base64.b64decode(b''.join(pem_cert.split())) for pem_cert in pem_certs]
+    except ValueError as exc:
+        msg = 'Invalid PEM encoded certificate found in file: {f}'.format(f=cert_path)
+        raise OSError(msg) from exc
+
+
+def write_trust_store(certs, keystore_path, keystore_password):
+    """Writes a JKS keystore containing only trusted certificate entries
+
+    :param certs: (list) of tuples of alias and DER encoded certificate
+    :param keystore_path: (str) full path to the keystore to create
+    :param keystore_password: (str) keystore password
+    :return: None
+    """
+    timestamp_ms = int(time.time() * 1000)
+    body = [struct.pack('>III', jks_magic, jks_version, len(certs))]
+    for alias, cert in certs:
+        alias_bytes = alias.encode('utf-8')
+        body.append(struct.pack('>IH', jks_trusted_cert_tag, len(alias_bytes)))
+        body.append(alias_bytes)
+        body.append(struct.pack('>QH', timestamp_ms, len(b'X.509')))
+        body.append(b'X.509')
+        body.append(struct.pack('>I', len(cert)))
+        body.append(cert)
+    body = b''.join(body)
+    digest = hashlib.sha1(keystore_password.encode('utf-16-be') + jks_digest_whitener + body).digest()
+    with open(keystore_path, 'wb') as f:
+        f.write(body + digest)
+
+
+def get_root_ca_entries(root_cas):
+    """Returns the alias and certificate for each certificate in the root CA files
+
+    :param root_cas: (dict) alias -> full path to a PEM or DER certificate file, a file containing several
+        PEM certificates is imported as alias, alias-2, alias-3, and so on
+    :return: (list) of tuples of alias and DER encoded certificate
+    :raises: OSError
+    """
+    entries = []
+    for alias, root_ca_path in root_cas.items():
+        if not isinstance(alias, str):
+            msg = 'alias must be a string'
+            raise OSError(msg)
+        if not isinstance(root_ca_path, str):
+            msg = 'root CA path must be a string'
+            raise OSError(msg)
+        for cert_num, cert in enumerate(read_certificates(cert_path=root_ca_path), 1):
+            entries.append((alias if cert_num == 1 else '{a}-{n}'.format(a=alias, n=str(cert_num)), cert))
+    return entries
+
+
+def add_root_cas(root_cas, keystore_path=None, keystore_password=default_keystore_password):
+    """Adds many root CAs to the specified Java keystore in one pass
+
+    The existing aliases are listed once, the new certificates are written to a temporary
+    JKS trust store, and that store is merged into the keystore with a single keytool
+    -importkeystore, so the keystore is rewritten once and only two JVMs are started no
+    matter how many certificates are imported.
+
+    :param root_cas: (dict) alias -> full path to a PEM or DER certificate file or PEM bundle, see
+        get_root_ca_entries
+    :param keystore_path: (str) full path to the keystore, or None for cacerts
+    :param keystore_password: (str) keystore password
+    :return: (dict) imported and skipped lists of aliases
+    :raises: OSError, AliasImportError
+    """
+    log = logging.getLogger(mod_logger + '.add_root_cas')
+    if not isinstance(root_cas, dict):
+        msg = 'root_cas arg must be a dict'
+        raise OSError(msg)
+    keytool = get_keytool()
+    keystore_path = get_keystore_path(keystore_path=keystore_path)
+    entries = get_root_ca_entries(root_cas=root_cas)
+    existing_aliases = list_aliases(keystore_path=keystore_path, keystore_password=keystore_password)
+
+    # Skip aliases that already exist, and repeated aliases
+    new_entries = []
+    skipped = []
+    for alias, cert in entries:
+        if alias.lower() in existing_aliases:
+            log.warning('Alias {a} already exists in keystore: {k}, not updating'.format(a=alias, k=keystore_path))
+            skipped.append(alias)
+            continue
+        existing_aliases.add(alias.lower())
+        new_entries.append((alias, cert))
+    if not new_entries:
+        log.info('No new root CAs to import into keystore: {k}'.format(k=keystore_path))
+        return {'imported': [], 'skipped': skipped}
+
+    log.info('Importing {n} root CAs into keystore: {k}'.format(n=str(len(new_entries)), k=keystore_path))
+    work_dir = tempfile.mkdtemp(prefix='pyjavakeys_')
+    try:
+        src_keystore_path = os.path.join(work_dir, 'import.jks')
+        src_keystore_password = secrets.token_hex(16)
+        write_trust_store(certs=new_entries, keystore_path=src_keystore_path,
+                          keystore_password=src_keystore_password)
+
+        # Build the keytool import command
+        command = [keytool, '-importkeystore', '-noprompt', '-srckeystore', src_keystore_path, '-srcstoretype',
+                   'JKS', '-srcstorepass', src_keystore_password, '-destkeystore', keystore_path,
+                   '-deststorepass', keystore_password]
+
+        # Running the keytool import
+        log.debug('Running the keytool import...')
+        try:
+            result = run_command(command)
+        except CommandError as exc:
+            msg = 'There was a problem running keytool on keystore: {k}'.format(k=keystore_path)
+            raise OSError(msg) from exc
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if result['code'] != 0:
+        msg = 'keytool command exited with a non-zero code: {c}, and produced output: {o}'.format(
+            c=result['code'], o=result['output'])
+        raise AliasImportError(msg)
+    imported = [alias for alias, _ in new_entries]
+    log.info('Successfully imported {n} root CAs into keystore: {k}'.format(n=str(len(imported)), k=keystore_path))
+    return {'imported': imported, 'skipped': skipped}
+
+
+def add_root_ca_bundle(bundle_path, alias, keystore_path=None, keystore_password=default_keystore_password):
+    """Adds every certificate in a PEM bundle to the specified Java keystore in one pass
+
+    :param bundle_path: (str) full path to the PEM bundle
+    :param alias: (str) alias of the first certificate, the rest are imported as alias-2, alias-3, and so on
+    :param keystore_path: (str) full path to the keystore, or None for cacerts
+    :param keystore_password: (str) keystore password
+    :return: (dict) imported and skipped lists of aliases
+    :raises: OSError, AliasImportError
+    """
+    return add_root_cas(root_cas={alias: bundle_path}, keystore_path=keystore_path,
+                        keystore_password=keystore_password)
@@ -8,11 +8,11 @@ import logging
 
 from botocore.client import ClientError
 
-from .awsutil import read_service_config
+from .awsutil import paginate, read_service_config
 from .logify import Logify
 from .awsutil import get_boto3_client
 from .ec2util import EC2Util, IpPermission
-from .exceptions import EC2UtilError, RdsUtilError
+from .exceptions import AWSAPIError, EC2UtilError, RdsUtilError
 
 __author__ = 'Joe Yennaco'
 
@@ -20,6 +20,9 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.rdsutil'
 
+# Maximum page size for RDS describe calls
+rds_max_page_size = 100
+
 # Default settings for DB instances
 default_db_instance_type = 'db.m5.large'
 default_db_master_username = 'dbadmin'
@@ -338,30 +341,21 @@ class RdsUtil(object):
                 MaxRecords=max_records
             )
 
-    def list_rds_instances(self):
-        """Returns data on the existing DB instance or none
+    def list_rds_instances(self, projection=None):
+        """Returns data on the existing DB instances
 
+        :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
         :return: (list) of DB instances
+        :raises: RdsUtilError
         """
         log = logging.getLogger(self.cls_logger + '.list_rds_instances')
         log.info('Retrieving RDS instances...')
-        marker = None
-        next_query = True
-        max_records = 100
-        rds_instance_list = []
-        while True:
-            if not next_query:
-                break
-            response = self.list_rds_instances_with_marker(marker=marker, max_records=max_records)
-            if 'DBInstances' not in response.keys():
-                log.warning('DBInstances not found in response: {r}'.format(r=str(response)))
-            else:
-                rds_instance_list += response['DBInstances']
-            if 'Marker' not in response.keys():
-                marker = None
-                next_query = False
-            else:
-                marker = response['Marker']
+        try:
+            rds_instance_list = list(paginate(client=self.client, operation='describe_db_instances',
+                                              projection=projection, page_size=rds_max_page_size))
+        except AWSAPIError as exc:
+            msg = 'Problem listing RDS instances'
+            raise RdsUtilError(msg) from exc
         log.info('Found {n} RDS instances'.format(n=str(len(rds_instance_list))))
         return rds_instance_list
 
@@ -505,30 +499,21 @@ class RdsUtil(object):
                 MaxRecords=max_records
             )
 
-    def list_db_subnet_groups(self):
-        """Returns data on the existing DB subnet groups or none
+    def list_db_subnet_groups(self, projection=None):
+        """Returns data on the existing DB subnet groups
 
+        :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
         :return: (list) of subnet groups
+        :raises: RdsUtilError
         """
         log = logging.getLogger(self.cls_logger + '.list_db_subnet_groups')
         log.info('Retrieving DB subnet groups...')
-        marker = None
-        next_query = True
-        max_records = 100
-        group_list = []
-        while True:
-            if not next_query:
-                break
-            response = self.list_db_subnet_groups_with_marker(marker=marker, max_records=max_records)
-            if 'DBSubnetGroups' not in response.keys():
-                log.warning('DBSubnetGroups not found in response: {r}'.format(r=str(response)))
-            else:
-                group_list += response['DBSubnetGroups']
-            if 'Marker' not in response.keys():
-                marker = None
-                next_query = False
-            else:
-                marker = response['Marker']
+        try:
+            group_list = list(paginate(client=self.client, operation='describe_db_subnet_groups',
+                                       projection=projection, page_size=rds_max_page_size))
+        except AWSAPIError as exc:
+            msg = 'Problem listing DB subnet groups'
+            raise RdsUtilError(msg) from exc
         log.info('Found {n} DB subnet groups'.format(n=str(len(group_list))))
         return group_list
 
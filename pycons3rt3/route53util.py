@@ -4,14 +4,17 @@ This module provides utilities for interacting with the AWS
 route53 API
 
 """
+import collections
 import datetime
 import logging
+import random
+import time
 
 from botocore.client import ClientError
 
-from .awsutil import get_boto3_client
+from .awsutil import get_boto3_client, paginate
 from .ec2util import EC2Util
-from .exceptions import EC2UtilError, Route53UtilError
+from .exceptions import AWSAPIError, EC2UtilError, Route53UtilError
 from .logify import Logify
 
 
@@ -21,6 +24,23 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.route53util'
 
+# Maximum page size for Route53 list calls
+route53_max_page_size = 100
+
+# Route53 limits for a single change_resource_record_sets call, UPSERT values count twice
+max_records_per_change_batch = 1000
+max_value_chars_per_change_batch = 32000
+
+# Retries and backoff for throttled change_resource_record_sets calls
+max_change_attempts = 8
+change_backoff_base_sec = 1
+change_backoff_max_sec = 30
+route53_throttle_codes = ['Throttling', 'ThrottlingException', 'PriorRequestNotComplete']
+
+# Polling for changes to reach INSYNC
+default_change_wait_timeout_sec = 900
+change_poll_interval_sec = 5
+
 
 class Route53Util(object):
     """Utility for interacting with the AWS Route53
@@ -202,11 +222,9 @@ class Route53Util(object):
         if not self.hosted_zone_id:
             msg = 'Must create a hosted zone first, there is no hosted zone ID to delete from!'
             raise Route53UtilError(msg)
-        change_record_sets(
-            client=self.client,
-            hosted_zone_id=self.hosted_zone_id,
-            changes=[delete_record]
-        )
+        batcher = Route53ChangeBatcher(client=self.client, hosted_zone_id=self.hosted_zone_id)
+        batcher.add_change(delete_record)
+        batcher.submit()
 
     def get_existing_private_zone(self):
         """Determine if there is an existing private zone for the same domain
@@ -275,10 +293,18 @@ class Route53Util(object):
         log.info('This is not a matching private hosted zone: {z}'.format(z=hosted_zone_id))
         return False
 
-    def update_records(self):
+    def update_records(self, wait=False, timeout_sec=default_change_wait_timeout_sec, return_all=False):
         """Updates the hosted zone with the records in self.dns_records
 
-        :return: (dict) Change info (see boto3 docs)
+        Duplicate records are merged and the changes are sent in as few batches as the Route53 limits allow.
+        Each batch has its own change ID, so set return_all to get the change info of every batch, by default
+        only the last one is returned.
+
+        :param wait: (bool) Set True to wait for all the changes to reach INSYNC
+        :param timeout_sec: (int) seconds to wait for the changes
+        :param return_all: (bool) Set True to return the list of change info dicts of every batch
+        :return: (dict) Change info of the last batch (see boto3 docs), or None when there are no records, or
+                 (list) of change info dicts when return_all is set
         :raises: Route53UtilError
         """
         log = logging.getLogger(mod_logger + '.update_records')
@@ -286,11 +312,161 @@ class Route53Util(object):
             msg = 'Unable to update records, create a hosted zone first!'
             raise Route53UtilError(msg)
         log.info('Updating records for hosted zone: {i}'.format(i=self.hosted_zone_id))
-        return change_record_sets(
-            client=self.client,
-            hosted_zone_id=self.hosted_zone_id,
-            changes=self.dns_records
-        )
+        batcher = Route53ChangeBatcher(client=self.client, hosted_zone_id=self.hosted_zone_id)
+        for dns_record in self.dns_records:
+            batcher.add_change(dns_record)
+        change_infos = batcher.submit(wait=wait, timeout_sec=timeout_sec)
+        if return_all:
+            return change_infos
+        if not change_infos:
+            return
+        return change_infos[-1]
+
+
+class Route53ChangeBatcher(object):
+    """Collects record set changes for a hosted zone and submits them in batches
+
+    Changes to the same record set are merged so each record set appears once per batch, except for a
+    DELETE followed by a CREATE, which replaces a record set and is kept in order within one batch.  A
+    change replaces an earlier change with the same action, a DELETE of a record set created earlier in
+    the batcher cancels the CREATE, and any other change replaces the earlier changes.  Batches are split to
+    stay under the Route53 limits on resource records and value characters per call, submitted back to back
+    with backoff on throttling, then waited on together.
+
+    :param client: boto3.client object for Route53
+    :param hosted_zone_id: (str) ID of the hosted zone
+    :param comment: (str) comment for the changes
+    """
+
+    def __init__(self, client, hosted_zone_id, comment=''):
+        self.cls_logger = mod_logger + '.Route53ChangeBatcher'
+        self.client = client
+        self.hosted_zone_id = hosted_zone_id
+        self.comment = comment
+        self.changes = collections.OrderedDict()
+
+    def add_change(self, change):
+        """Adds a change, merging it with earlier changes to the same record set
+
+        :param change: (dict) change with Action and ResourceRecordSet (see boto3 docs)
+        :return: None
+        :raises: Route53UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.add_change')
+        try:
+            key = get_record_set_key(change['ResourceRecordSet'])
+            action = change['Action']
+        except KeyError as exc:
+            msg = 'Change is missing Action or ResourceRecordSet data: {c}'.format(c=str(change))
+            raise Route53UtilError(msg) from exc
+        change = {'Action': action, 'ResourceRecordSet': change['ResourceRecordSet']}
+        key_changes = self.changes.pop(key, [])
+        if not key_changes:
+            key_changes = [change]
+        elif key_changes[-1]['Action'] == action:
+            log.debug('Replacing earlier {a} change for record set: {k}'.format(a=action, k=str(key)))
+            key_changes[-1] = change
+        elif key_changes[-1]['Action'] == 'DELETE' and action == 'CREATE':
+            key_changes.append(change)
+        elif key_changes[-1]['Action'] == 'CREATE' and action == 'DELETE' and \
+                key_changes[-1]['ResourceRecordSet'] == change['ResourceRecordSet']:
+            log.debug('DELETE cancels the earlier CREATE for record set: {k}'.format(k=str(key)))
+            key_changes.pop()
+        else:
+            log.debug('Replacing earlier {a} change for record set: {k}'.format(
+                a=key_changes[-1]['Action'], k=str(key)))
+            key_changes = [change]
+        if key_changes:
+            self.changes[key] = key_changes
+
+    def get_changes(self):
+        """Returns the merged changes in the order they will be submitted
+
+        :return: (list) of changes
+        """
+        return [change for key_changes in self.changes.values() for change in key_changes]
+
+    def upsert(self, record_type, name, value, time_to_live=300):
+        """Adds an UPSERT change for a simple record
+
+        :param record_type: (str) type of record (see boto3 docs)
+        :param name: (str) fully qualified name of the record
+        :param value: (str) value for the record (e.g. IP address)
+        :param time_to_live: (int) time to live in seconds for the record
+        :return: None
+        :raises: Route53UtilError
+        """
+        self.add_change(create_simple_change_record(
+            record_type=record_type, name=name, value=value, action='UPSERT', time_to_live=time_to_live))
+
+    def delete(self, record_type, name, value, time_to_live=300):
+        """Adds a DELETE change for a simple record, the TTL and value must match the existing record
+
+        :param record_type: (str) type of record (see boto3 docs)
+        :param name: (str) fully qualified name of the record
+        :param value: (str) value of the record
+        :param time_to_live: (int) time to live in seconds of the record
+        :return: None
+        :raises: Route53UtilError
+        """
+        self.add_change(create_simple_change_record(
+            record_type=record_type, name=name, value=value, action='DELETE', time_to_live=time_to_live))
+
+    def get_batches(self):
+        """Splits the changes into batches under the Route53 per-call limits
+
+        :return: (list) of lists of changes
+        :raises: Route53UtilError
+        """
+        batches = []
+        batch = []
+        batch_records = 0
+        batch_chars = 0
+        for key_changes in self.changes.values():
+            # Changes to the same record set stay together in one batch
+            num_records = 0
+            num_chars = 0
+            for change in key_changes:
+                change_records, change_chars = get_change_size(change)
+                num_records += change_records
+                num_chars += change_chars
+            if num_records > max_records_per_change_batch or num_chars > max_value_chars_per_change_batch:
+                msg = 'Change exceeds the Route53 limits for a single call: {c}'.format(
+                    c=str(key_changes[0]['ResourceRecordSet']['Name']))
+                raise Route53UtilError(msg)
+            if batch and (batch_records + num_records > max_records_per_change_batch or
+                          batch_chars + num_chars > max_value_chars_per_change_batch):
+                batches.append(batch)
+                batch = []
+                batch_records = 0
+                batch_chars = 0
+            batch += key_changes
+            batch_records += num_records
+            batch_chars += num_chars
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def submit(self, wait=False, timeout_sec=default_change_wait_timeout_sec):
+        """Submits the changes in batches and clears them
+
+        :param wait: (bool) Set True to wait for all the changes to reach INSYNC
+        :param timeout_sec: (int) seconds to wait for the changes
+        :return: (list) of change info dicts, one per batch (see boto3 docs)
+        :raises: Route53UtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.submit')
+        batches = self.get_batches()
+        log.info('Submitting {n} changes in {b} batches to hosted zone: {i}'.format(
+            n=str(sum(len(x) for x in batches)), b=str(len(batches)), i=self.hosted_zone_id))
+        change_infos = []
+        for batch in batches:
+            change_infos.append(change_record_sets_with_backoff(
+                client=self.client, hosted_zone_id=self.hosted_zone_id, changes=batch, comment=self.comment))
+        self.changes = collections.OrderedDict()
+        if wait and change_infos:
+            wait_for_changes(client=self.client, change_ids=[x['Id'] for x in change_infos], timeout_sec=timeout_sec)
+        return change_infos
 
 
 def change_record_sets(client, hosted_zone_id, changes, comment=''):
@@ -322,6 +498,39 @@ def change_record_sets(client, hosted_zone_id, changes, comment=''):
     return response['ChangeInfo']
 
 
+def change_record_sets_with_backoff(client, hosted_zone_id, changes, comment=''):
+    """Updates record sets for a hosted zone, retrying with exponential backoff when throttled
+
+    :param client: Route53 client object
+    :param hosted_zone_id: (str) hosted zone ID
+    :param changes: (list) of changes (see boto3 docs)
+    :param comment: (str) comment for the changes
+    :return: (dict) change info (see boto3 docs)
+    :raises: Route53UtilError
+    """
+    log = logging.getLogger(mod_logger + '.change_record_sets_with_backoff')
+    attempt_num = 1
+    while True:
+        try:
+            return change_record_sets(client=client, hosted_zone_id=hosted_zone_id, changes=changes, comment=comment)
+        except Route53UtilError as exc:
+            cause = exc.__cause__
+            if not isinstance(cause, ClientError):
+                raise
+            if cause.response.get('Error', {}).get('Code') not in route53_throttle_codes:
+                raise
+            if attempt_num >= max_change_attempts:
+                msg = 'Hosted zone [{h}] still throttled after {n} attempts'.format(
+                    h=hosted_zone_id, n=str(attempt_num))
+                raise Route53UtilError(msg) from exc
+            backoff_sec = min(change_backoff_max_sec, change_backoff_base_sec * 2 ** (attempt_num - 1))
+            backoff_sec = random.uniform(backoff_sec / 2, backoff_sec)
+            log.warning('Throttled updating hosted zone [{h}], retrying in {s} seconds'.format(
+                h=hosted_zone_id, s=str(round(backoff_sec, 1))))
+            time.sleep(backoff_sec)
+            attempt_num += 1
+
+
 def create_private_hosted_zone(client, domain, vpc_id, vpc_region, comment=''):
     """Creates a private hosted zone
 
@@ -442,6 +651,21 @@ def enable_vpc_private_dns(vpc_id):
         raise Route53UtilError(msg) from exc
 
 
+def get_change_size(change):
+    """Returns the size of a change as counted against the Route53 per-call limits
+
+    :param change: (dict) change with Action and ResourceRecordSet (see boto3 docs)
+    :return: (tuple) number of resource records and number of value characters
+    """
+    records = change['ResourceRecordSet'].get('ResourceRecords', [])
+    num_records = max(len(records), 1)
+    num_chars = sum(len(record.get('Value', '')) for record in records)
+    if change['Action'] == 'UPSERT':
+        num_records *= 2
+        num_chars *= 2
+    return num_records, num_chars
+
+
 def get_hosted_zone(client, hosted_zone_id):
     """Returns the hosted zone ID
 
@@ -463,6 +687,18 @@ def get_hosted_zone(client, hosted_zone_id):
     return response
 
 
+def get_record_set_key(record_set):
+    """Returns the key that identifies a record set within a hosted zone
+
+    :param record_set: (dict) resource record set (see boto3 docs)
+    :return: (tuple) lowercase fully qualified name, type, and set identifier
+    """
+    name = record_set['Name'].lower()
+    if not name.endswith('.'):
+        name += '.'
+    return name, record_set['Type'], record_set.get('SetIdentifier')
+
+
 def get_route53_client(region_name=None, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None):
     """Gets a Route53 client
 
@@ -473,33 +709,22 @@ def get_route53_client(region_name=None, aws_access_key_id=None, aws_secret_acce
                             aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
 
 
-def list_hosted_zones(client):
+def list_hosted_zones(client, projection=None):
     """Returns a list of hosted zones
 
     :param client: boto3.client object
+    :param projection: (str) JMESPath expression applied to each item to keep only the fields needed
     :return: (list) of hosted zones (see boto3 docs)
+    :raises: Route53UtilError
     """
     log = logging.getLogger(mod_logger + '.list_hosted_zones')
-    marker = None
-    next_query = True
-    hosted_zone_list = []
     log.info('Attempting to list Route53 hosted zones')
-    while True:
-        if not next_query:
-            break
-        response = list_hosted_zones_with_marker(client=client, marker=marker)
-        if 'IsTruncated' not in response.keys():
-            log.warning('IsTruncated not found in response: {r}'.format(r=str(response)))
-            return hosted_zone_list
-        if 'HostedZones' not in response.keys():
-            log.warning('HostedZones not found in response: {r}'.format(r=str(response)))
-            return hosted_zone_list
-        next_query = response['IsTruncated']
-        hosted_zone_list += response['HostedZones']
-        if 'Marker' not in response.keys():
-            next_query = False
-        else:
-            marker = response['Marker']
+    try:
+        hosted_zone_list = list(paginate(client=client, operation='list_hosted_zones', projection=projection,
+                                         page_size=route53_max_page_size))
+    except AWSAPIError as exc:
+        msg = 'Problem listing Route53 hosted zones'
+        raise Route53UtilError(msg) from exc
     log.info('Found {n} hosted zones'.format(n=str(len(hosted_zone_list))))
     return hosted_zone_list
 
@@ -549,3 +774,38 @@ def list_public_hosted_zones(client):
         else:
             public_hosted_zones.append(hosted_zone)
     return public_hosted_zones
+
+
+def wait_for_changes(client, change_ids, timeout_sec=default_change_wait_timeout_sec):
+    """Waits for all the changes to reach INSYNC, polling only the changes still pending
+
+    :param client: boto3.client object
+    :param change_ids: (list) of str change IDs
+    :param timeout_sec: (int) seconds to wait for the changes
+    :return: None
+    :raises: Route53UtilError
+    """
+    log = logging.getLogger(mod_logger + '.wait_for_changes')
+    pending = set(change_ids)
+    log.info('Waiting for {n} changes to reach INSYNC'.format(n=str(len(pending))))
+    start_time = time.time()
+    while True:
+        for change_id in sorted(pending):
+            try:
+                response = client.get_change(Id=change_id)
+            except ClientError as exc:
+                if exc.response.get('Error', {}).get('Code') in route53_throttle_codes:
+                    log.warning('Throttled getting change ID: {i}'.format(i=change_id))
+                    break
+                msg = 'Problem getting change ID: {i}'.format(i=change_id)
+                raise Route53UtilError(msg) from exc
+            if response['ChangeInfo']['Status'] == 'INSYNC':
+                pending.discard(change_id)
+        if not pending:
+            break
+        if time.time() - start_time > timeout_sec:
+            msg = 'Changes did not reach INSYNC after {t} seconds: {i}'.format(t=str(timeout_sec), i=sorted(pending))
+            raise Route53UtilError(msg)
+        log.info('Waiting on {n} changes...'.format(n=str(len(pending))))
+        time.sleep(change_poll_interval_sec)
+    log.info('All changes reached INSYNC after {t} seconds'.format(t=str(round(time.time() - start_time, 1))))
@@ -22,12 +22,12 @@ import socket
 import time
 import traceback
 
-import boto3
+from boto3 import set_stream_logger
 from botocore.client import ClientError
 from botocore.exceptions import EndpointConnectionError
 from s3transfer.exceptions import RetriesExceededError
 
-from .awsutil import get_boto3_client
+from .awsutil import get_boto3_client, get_boto3_resource
 from .logify import Logify
 from .exceptions import KmsUtilError, S3UtilError
 from .kmsutil import get_kms_client, get_kms_key
@@ -137,12 +137,12 @@ class S3Util(object):
 
         log.debug('Configuring S3 client with AWS Access key ID {k} and region {r}'.format(
             k=aws_access_key_id, r=region_name))
-        self.s3resource = boto3.resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
-                                         aws_secret_access_key=aws_secret_access_key)
+        self.s3resource = get_boto3_resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
+                                             aws_secret_access_key=aws_secret_access_key)
         if self.bucket_name:
             self.bucket_resource = self.s3resource.Bucket(self.bucket_name)
-        self.s3client = boto3.client('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
-                                     aws_secret_access_key=aws_secret_access_key)
+        self.s3client = get_boto3_client('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
+                                         aws_secret_access_key=aws_secret_access_key)
 
     def block_public_access(self, block_public_acls=True, ignore_public_acls=True, block_public_policy=True,
                             restrict_public_buckets=True):
@@ -794,8 +794,8 @@ def download(download_info):
         k=aws_access_key_id, r=region_name))
 
     # Establish an S3 client
-    client = boto3.client('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
-                          aws_secret_access_key=aws_secret_access_key)
+    client = get_boto3_client('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
+                              aws_secret_access_key=aws_secret_access_key)
 
     # Attempt to determine the file name from key
     filename = key.split('/')[-1]
@@ -1072,15 +1072,15 @@ def delete_bucket_object_versions(bucket_resource=None, bucket_name=None, region
         if not all([bucket_name, region_name, aws_access_key_id, aws_secret_access_key]):
             raise S3UtilError('bucket_name, region_name, aws_access_key_id, aws_secret_access_key are all required to '
                               'create a bucket resource')
-        s3resource = boto3.resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
-                                    aws_secret_access_key=aws_secret_access_key)
+        s3resource = get_boto3_resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
+                                        aws_secret_access_key=aws_secret_access_key)
         bucket_resource = s3resource.Bucket(bucket_name)
     else:
         bucket_name = bucket_resource.name
 
     if enable_debug:
         log.info('Enabling debug logging for boto3...')
-        boto3.set_stream_logger('', logging.DEBUG)
+        set_stream_logger('', logging.DEBUG)
 
     log.info('Deleting object versions from bucket (THIS COULD TAKE A WHILE): {b}'.format(b=bucket_name))
     exception_happened = True
@@ -1462,8 +1462,8 @@ def find_bucket_keys(bucket_name, regex, region_name=None, aws_access_key_id=Non
         if not all([bucket_name, region_name, aws_access_key_id, aws_secret_access_key]):
             raise S3UtilError('bucket_name, region_name, aws_access_key_id, aws_secret_access_key are all required to '
                               'create a bucket resource')
-        s3resource = boto3.resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
-                                    aws_secret_access_key=aws_secret_access_key)
+        s3resource = get_boto3_resource('s3', region_name=region_name, aws_access_key_id=aws_access_key_id,
+                                        aws_secret_access_key=aws_secret_access_key)
         bucket_resource = s3resource.Bucket(bucket_name)
 
     log.info('Looking up S3 keys based on regex: {r}'.format(r=regex))
@@ -7,18 +7,20 @@ generating SSH keys
 
 """
 from datetime import datetime
+import errno
 import logging
 import os
+import selectors
 import shutil
 import socket
+import tempfile
 import time
-
-import paramiko
-from scp import SCPClient, SCPException
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from .bash import mkdir_p, manage_service, run_command, run_remote_command
 from .exceptions import CommandError, SshConfigError
 from .logify import Logify
+from .sshpool import get_ssh_pool
 
 __author__ = 'Joe Yennaco'
 
@@ -26,6 +28,12 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.ssh'
 
+# Default number of hosts scanned for host keys at once
+default_key_scan_max_workers = 16
+
+# Connect results that mean a non-blocking connect is still in progress
+connect_in_progress_codes = [errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)]
+
 
 def generate_ssh_rsa_key(key_name, dest_directory=None, passphrase='', comment='', size=4096):
     return generate_ssh_key(
@@ -178,13 +186,67 @@ def add_host_key_to_known_hosts(key_contents=None, key_file=None, known_hosts_fi
     keys_to_add_str = os.linesep + os.linesep.join(keys_to_add) + os.linesep
     known_hosts_file_contents += os.linesep + keys_to_add_str + os.linesep
     known_hosts_file_contents = os.linesep.join([s for s in known_hosts_file_contents.splitlines() if s]) + os.linesep
-    with open(known_hosts_file, 'w') as f:
-        f.write(known_hosts_file_contents)
-    os.chmod(known_hosts_file, 0o644)
+    write_known_hosts_file(known_hosts_file=known_hosts_file, contents=known_hosts_file_contents)
     log.info('keys successfully added to known hosts file')
     return keys_to_add
 
 
+def write_known_hosts_file(known_hosts_file, contents):
+    """Replaces the known_hosts file atomically, so readers never see a partial file
+
+    :param known_hosts_file: (str) full path to the known_hosts file
+    :param contents: (str) new file contents
+    :return: None
+    :raises: SshConfigError
+    """
+    known_hosts_dir = os.path.dirname(os.path.abspath(known_hosts_file))
+    try:
+        os.makedirs(known_hosts_dir, mode=0o700, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(prefix='.known_hosts.', dir=known_hosts_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(contents)
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, known_hosts_file)
+        except OSError:
+            os.remove(tmp_file)
+            raise
+    except OSError as exc:
+        raise SshConfigError('Problem writing known_hosts file: {f}'.format(f=known_hosts_file)) from exc
+
+
+def merge_host_keys_into_known_hosts(key_lines, known_hosts_file=None):
+    """Adds host key lines to the known_hosts file in a single atomic write, skipping duplicates
+
+    :param key_lines: (list) of known_hosts key lines
+    :param known_hosts_file: (str) full path to the known_hosts file to populate
+    :return: (list) of key lines added
+    :raises: SshConfigError
+    """
+    log = logging.getLogger(mod_logger + '.merge_host_keys_into_known_hosts')
+    if not known_hosts_file:
+        known_hosts_file = os.path.join(os.path.expanduser('~'), '.ssh', 'known_hosts')
+    existing_lines = []
+    if os.path.isfile(known_hosts_file):
+        with open(known_hosts_file, 'r') as f:
+            existing_lines = [line.strip() for line in f.read().splitlines() if line.strip()]
+    known_lines = set(existing_lines)
+    added_lines = []
+    for key_line in key_lines:
+        key_line = ' '.join(key_line.split())
+        if not key_line or key_line.startswith('#') or key_line in known_lines:
+            continue
+        known_lines.add(key_line)
+        added_lines.append(key_line)
+    if not added_lines:
+        log.info('No new keys to add to known_hosts file: {f}'.format(f=known_hosts_file))
+        return added_lines
+    write_known_hosts_file(known_hosts_file=known_hosts_file,
+                           contents=os.linesep.join(existing_lines + added_lines) + os.linesep)
+    log.info('Added {n} keys to known_hosts file: {f}'.format(n=str(len(added_lines)), f=known_hosts_file))
+    return added_lines
+
+
 def add_host_key_to_authorized_keys(key_contents=None, key_file=None):
     """Adds keys to the authorized keys file
 
@@ -224,18 +286,21 @@ def add_host_key_to_authorized_keys(key_contents=None, key_file=None):
     log.info('keys successfully added to authorized keys file')
 
 
-def add_host_to_known_hosts(host, known_hosts_file=None, key_type='rsa'):
-    """Adds a remote host key to the known_hosts file
+def scan_host_keys(host, key_type='rsa', port=22):
+    """Returns the host keys of a remote host using ssh-keyscan
 
     :param host: (str) hostname or IP of the remote host
-    :param known_hosts_file: (str) full path to the known_hosts file to populate
     :param key_type: (str) type of SSH key to scan (e.g rsa, ecdsa)
-    :return: (list) of SSH keys
+    :param port: (int) SSH port number
+    :return: (list) of known_hosts key lines
     :raises: SshConfigError
     """
-    log = logging.getLogger(mod_logger + '.add_host_to_known_hosts')
+    log = logging.getLogger(mod_logger + '.scan_host_keys')
     log.info('Scanning host [{h}] for host key of type: {t}'.format(h=host, t=key_type))
-    command = ['ssh-keyscan', '-t', key_type, host]
+    command = ['ssh-keyscan', '-t', key_type]
+    if port != 22:
+        command += ['-p', str(port)]
+    command += [host]
     try:
         result = run_command(command, timeout_sec=30.0, output=True, print_output=False)
     except CommandError as exc:
@@ -246,6 +311,23 @@ def add_host_to_known_hosts(host, known_hosts_file=None, key_type='rsa'):
     if 'getaddrinfo' in host_key:
         msg = 'Host key not returned in output:\n{o}'.format(o=host_key)
         raise SshConfigError(msg)
+    key_lines = [line.strip() for line in host_key.splitlines() if line.strip() and not line.startswith('#')]
+    if not key_lines:
+        raise SshConfigError('Host key not returned in output:\n{o}'.format(o=host_key))
+    return key_lines
+
+
+def add_host_to_known_hosts(host, known_hosts_file=None, key_type='rsa'):
+    """Adds a remote host key to the known_hosts file
+
+    :param host: (str) hostname or IP of the remote host
+    :param known_hosts_file: (str) full path to the known_hosts file to populate
+    :param key_type: (str) type of SSH key to scan (e.g rsa, ecdsa)
+    :return: (list) of SSH keys
+    :raises: SshConfigError
+    """
+    log = logging.getLogger(mod_logger + '.add_host_to_known_hosts')
+    host_key = os.linesep.join(scan_host_keys(host=host, key_type=key_type))
     try:
         added_keys = add_host_key_to_known_hosts(key_contents=host_key, known_hosts_file=known_hosts_file)
     except CommandError as exc:
@@ -255,9 +337,130 @@ def add_host_to_known_hosts(host, known_hosts_file=None, key_type='rsa'):
     return added_keys
 
 
+def probe_ssh_hosts(hosts, port=22, timeout_sec=5.0):
+    """Returns the hosts that accept a connection and send an SSH banner
+
+    All hosts are probed at once with non-blocking sockets, so the probe takes at most
+    timeout_sec regardless of the number of hosts.
+
+    :param hosts: (list) of hostnames or IP addresses
+    :param port: (int) SSH port number
+    :param timeout_sec: (float) seconds to wait for the hosts to respond
+    :return: (set) of hosts that are ready
+    """
+    log = logging.getLogger(mod_logger + '.probe_ssh_hosts')
+    ready_hosts = set()
+    selector = selectors.DefaultSelector()
+    try:
+        for host in set(hosts):
+            try:
+                family, sock_type, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+            except socket.gaierror as exc:
+                log.debug('Unable to resolve host [{h}]: {e}'.format(h=host, e=str(exc)))
+                continue
+            sock = socket.socket(family, sock_type, proto)
+            sock.setblocking(False)
+            if sock.connect_ex(address) not in [0] + connect_in_progress_codes:
+                sock.close()
+                continue
+            selector.register(sock, selectors.EVENT_WRITE, host)
+        deadline = time.monotonic() + timeout_sec
+        while selector.get_map():
+            remaining_sec = deadline - time.monotonic()
+            if remaining_sec <= 0:
+                break
+            for key, events in selector.select(timeout=remaining_sec):
+                sock, host = key.fileobj, key.data
+                if events & selectors.EVENT_WRITE:
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        selector.modify(sock, selectors.EVENT_READ, host)
+                        continue
+                else:
+                    try:
+                        if sock.recv(64).startswith(b'SSH-'):
+                            ready_hosts.add(host)
+                    except OSError:
+                        pass
+                selector.unregister(sock)
+                sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+    return ready_hosts
+
+
+def wait_for_host_keys(hosts, max_wait_time_sec=7200, check_interval_sec=2, port=22, key_type='rsa',
+                       known_hosts_file=None, max_workers=default_key_scan_max_workers):
+    """Waits for SSH on many hosts and adds their host keys to known_hosts in a single write
+
+    Hosts that are not yet ready are probed every check_interval_sec, each host is scanned
+    for its keys as soon as it is ready, and this returns as soon as the last host key is
+    collected.  The known_hosts file is written once, atomically and without duplicates,
+    including when some hosts time out.
+
+    :param hosts: (list) of hostnames or IP addresses
+    :param max_wait_time_sec: (int) max time to wait before raising exception
+    :param check_interval_sec: (int) seconds between probes of hosts that are not ready
+    :param port: (int) SSH port number
+    :param key_type: (str) type of SSH key to scan (e.g rsa, ecdsa)
+    :param known_hosts_file: (str) full path to the known_hosts file to populate
+    :param max_workers: (int) maximum number of hosts scanned at once
+    :return: (dict) host -> list of key lines
+    :raises: SshConfigError
+    """
+    log = logging.getLogger(mod_logger + '.wait_for_host_keys')
+    pending_hosts = set(hosts)
+    host_keys = {}
+    futures = {}
+    log.info('Waiting for SSH host keys from {n} hosts'.format(n=str(len(pending_hosts))))
+    deadline = time.monotonic() + max_wait_time_sec
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='key_scan') as executor:
+        while pending_hosts or futures:
+            remaining_sec = deadline - time.monotonic()
+            if remaining_sec <= 0:
+                break
+            next_probe_time = time.monotonic() + check_interval_sec
+            if pending_hosts:
+                ready_hosts = probe_ssh_hosts(
+                    hosts=pending_hosts, port=port, timeout_sec=min(check_interval_sec, remaining_sec))
+                for host in ready_hosts:
+                    pending_hosts.remove(host)
+                    futures[executor.submit(scan_host_keys, host, key_type, port)] = host
+
+            # Collect scans until the next probe is due, or until every scan is done if no hosts are pending
+            while futures:
+                timeout_sec = max(0.0, min(next_probe_time, deadline) - time.monotonic()) if pending_hosts else \
+                    max(0.0, deadline - time.monotonic())
+                done, _ = wait(futures, timeout=timeout_sec, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    host = futures.pop(future)
+                    try:
+                        host_keys[host] = future.result()
+                    except SshConfigError as exc:
+                        log.info('Host key scan failed for host [{h}], re-trying: {e}'.format(h=host, e=str(exc)))
+                        pending_hosts.add(host)
+                    else:
+                        log.info('Collected host key for host: {h}'.format(h=host))
+            if pending_hosts:
+                time.sleep(max(0.0, min(next_probe_time, deadline) - time.monotonic()))
+        for future in futures:
+            future.cancel()
+    key_lines = [key_line for host in hosts if host in host_keys for key_line in host_keys[host]]
+    merge_host_keys_into_known_hosts(key_lines=key_lines, known_hosts_file=known_hosts_file)
+    missing_hosts = [host for host in hosts if host not in host_keys]
+    if missing_hosts:
+        raise SshConfigError('Unable to scan SSH keys for hosts [{h}] after {t} sec'.format(
+            h=', '.join(missing_hosts), t=str(max_wait_time_sec)))
+    log.info('Collected SSH host keys from {n} hosts'.format(n=str(len(host_keys))))
+    return host_keys
+
+
 def wait_for_host_key(host, max_wait_time_sec=7200, check_interval_sec=10):
     """Query for available host key until the host is available
-    
+
     :param host: (str) hostname or IP address to query
     :param max_wait_time_sec: (int) max time to wait before raising exception
     :param check_interval_sec: (int) seconds to re-try scanning a host for SSH key
@@ -266,24 +469,8 @@ def wait_for_host_key(host, max_wait_time_sec=7200, check_interval_sec=10):
     """
     log = logging.getLogger(mod_logger + '.wait_for_host_key')
     log.info('Querying host for SSH host key availability: {h}'.format(h=host))
-    num_checks = max_wait_time_sec // check_interval_sec
-    start_time = time.time()
-    for _ in range(0, num_checks):
-        elapsed_time = round(time.time() - start_time, 1)
-        if elapsed_time > max_wait_time_sec:
-            raise SshConfigError('Unable to scan SSH key for host {h} after {t} sec'.format(
-                h=host, t=str(max_wait_time_sec)))
-        try:
-            add_host_to_known_hosts(host)
-        except SshConfigError as exc:
-            log.warning('Failed to query host {h} for SSH key, re-trying in {t} sec\n{e}'.format(
-                h=host, t=str(check_interval_sec), e=str(exc)
-            ))
-            time.sleep(check_interval_sec)
-        else:
-            log.info('Successful SSH query of host: {h}'.format(h=host))
-            return
-    raise SshConfigError('Unable to scan SSH key for host {h} after {n} attempts'.format(h=host, n=str(num_checks)))
+    wait_for_host_keys(hosts=[host], max_wait_time_sec=max_wait_time_sec, check_interval_sec=check_interval_sec)
+    log.info('Successful SSH query of host: {h}'.format(h=host))
 
 
 def unrestrict_host_key_checking(pattern):
@@ -369,6 +556,9 @@ def scp_file(host, src_path, dest_path, put=False, username=None, password=None,
              port=22):
     """SCP a file from a remote host
 
+    The transfer runs on a pooled connection, so repeated transfers to the same host reuse the
+    authenticated transport.
+
     :param host: (str) hostname or IP address to connect to
     :param src_path: (str) full path of the source file
     :param dest_path: (str) full path of the destination file or directory
@@ -381,57 +571,26 @@ def scp_file(host, src_path, dest_path, put=False, username=None, password=None,
     :return: (str) destination path if successful
     :raises: SshConfigError
     """
-    log = logging.getLogger(mod_logger + '.update_sshd_config')
-
-    # Stand up the SSH client with paramiko
-    client = paramiko.SSHClient()
-    client.load_system_host_keys()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    log = logging.getLogger(mod_logger + '.scp_file')
 
     # String for help with log messages
     action = 'put' if put else 'get'
     dest_host = host if put else 'local'
-    connection_msg = 'Connection to host [{h}:{p}] with params (if any): '.format(h=host, p=str(port))
-    connection_msg += '\n[Username: ' + username + ']' if username else ''
-    connection_msg += '\n[Password included]' if password else ''
-    connection_msg += '\n[Private key: ' + key_filename + ']' if key_filename else ''
-    connection_msg += '\n[Passphrase included]' if passphrase else ''
-    log.info('Making ' + connection_msg)
-
-    # Connect to the remote host using the provided params
-    try:
-        client.connect(hostname=host, port=port, username=username, password=password, key_filename=key_filename,
-                       passphrase=passphrase)
-    except (paramiko.SSHException, socket.error) as exc:
-        msg = 'SSH problem: ' + connection_msg
-        raise SshConfigError(msg) from exc
-
-    # Attempt the SCP file transfer
-    with SCPClient(client.get_transport()) as scp:
-        if put:
-            log.info('Attempting to SCP file from [local:{s}] to [{h}:{d}]'.format(h=host, s=src_path, d=dest_path))
-            try:
-                scp.put(files=src_path, remote_path=dest_path, preserve_times=True)
-            except SCPException as exc:
-                client.close()
-                msg = 'Problem putting file [{s}] to [{d}] with: '.format(s=src_path, d=dest_path) + connection_msg
-                raise SshConfigError(msg) from exc
-            finally:
-                client.close()
-        else:
-            log.info('Attempting to SCP file from [{h}:{s}] to [local:{d}]'.format(h=host, s=src_path, d=dest_path))
-            try:
-                scp.get(local_path=dest_path, remote_path=src_path, preserve_times=True)
-            except SCPException as exc:
-                msg = 'Problem getting file [{s}] to [{d}] with: '.format(s=src_path, d=dest_path) + connection_msg
-                raise SshConfigError(msg) from exc
-            finally:
-                client.close()
+    if put:
+        log.info('Attempting to SCP file from [local:{s}] to [{h}:{d}]'.format(h=host, s=src_path, d=dest_path))
+    else:
+        log.info('Attempting to SCP file from [{h}:{s}] to [local:{d}]'.format(h=host, s=src_path, d=dest_path))
+    get_ssh_pool().scp(host=host, src_path=src_path, dest_path=dest_path, put=put, port=port, username=username,
+                       password=password, key_filename=key_filename, passphrase=passphrase)
     log.info('SCP [{a}] complete to [{h}:{d}]'.format(a=action, h=dest_host, d=dest_path))
+    return dest_path
 
 
 def read_file_over_ssh(host, file_path, username=None, password=None, key_filename=None, passphrase=None, port=22):
-    """SCP a file from a remote host
+    """Reads a file from a remote host over SFTP
+
+    The file is read over the SFTP session of a pooled connection, so repeated reads from the same
+    host reuse the authenticated transport.
 
     :param host: (str) hostname or IP address to connect to
     :param file_path: (str) full path of the source file
@@ -444,43 +603,8 @@ def read_file_over_ssh(host, file_path, username=None, password=None, key_filena
     :raises: SshConfigError
     """
     log = logging.getLogger(mod_logger + '.read_file_over_ssh')
-
-    # Stand up the SSH client with paramiko
-    client = paramiko.SSHClient()
-    client.load_system_host_keys()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # String for help with log messages
-    connection_msg = 'Connection to host [{h}:{p}] with params (if any): '.format(h=host, p=str(port))
-    connection_msg += '\n[Username: ' + username + ']' if username else ''
-    connection_msg += '\n[Password included]' if password else ''
-    connection_msg += '\n[Private key: ' + key_filename + ']' if key_filename else ''
-    connection_msg += '\n[Passphrase included]' if passphrase else ''
-    log.info('Making ' + connection_msg)
-
-    # Connect to the remote host using the provided params
-    try:
-        client.connect(hostname=host, port=port, username=username, password=password, key_filename=key_filename,
-                       passphrase=passphrase)
-    except (paramiko.SSHException, socket.error) as exc:
-        err_msg = 'SSH problem: ' + connection_msg
-        raise SshConfigError(err_msg) from exc
-
     log.info('Opening SFTP connection to retrieve file: {f}'.format(f=file_path))
-    sftp_client = client.open_sftp()
-    try:
-        remote_file = sftp_client.open(file_path)
-    except IOError as exc:
-        err_msg = 'SFTP client had a problem opening file {f} on host: {h}'.format(f=file_path, h=host)
-        client.close()
-        raise SshConfigError(err_msg) from exc
-
-    # Collect the file content
-    file_content = ''
-    try:
-        for line in remote_file:
-            file_content += line
-    finally:
-        remote_file.close()
+    file_content = get_ssh_pool().read_file(host=host, file_path=file_path, port=port, username=username,
+                                            password=password, key_filename=key_filename, passphrase=passphrase)
     log.info('Returning file content for: {f}'.format(f=file_path))
-    return file_content
+    return file_content.decode('utf-8')
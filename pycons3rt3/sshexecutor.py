@@ -0,0 +1,305 @@
+"""Module: sshexecutor
+
+This module runs commands and file transfers on many hosts at once over SSH.
+
+Each host is handled by a worker from a bounded thread pool, using connections
+from an SshConnectionPool so repeated operations on the same hosts reuse their
+authenticated transports.  Command output is streamed per host as it arrives,
+results are yielded as each host finishes, and each result includes the
+connection and total latency for the host.
+
+Hosts can be hostnames or IP addresses, dicts with a host key and optional
+connection params, or the host details returned by
+Cons3rtApi.list_detailed_hosts_in_run.
+
+Classes:
+    ParallelSshExecutor: Runs commands and transfers on many hosts in parallel
+
+"""
+import collections
+import logging
+import os
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .exceptions import CommandError, SshConfigError
+from .logify import Logify
+from .sshpool import get_ssh_pool
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.sshexecutor'
+
+# Default number of hosts handled at once
+default_max_workers = 16
+
+# Connection params that can be set per host
+host_connect_args = ['port', 'username', 'password', 'key_filename', 'passphrase']
+
+
+def get_run_host_address(host_details):
+    """Returns the first internal IP address of a deployment run host
+
+    :param host_details: (dict) host details from Cons3rtApi.list_detailed_hosts_in_run
+    :return: (str) IP address or None if not found
+    """
+    for network_interface in host_details.get('networkInterfaces', []):
+        if network_interface.get('internalIpAddress'):
+            return network_interface['internalIpAddress']
+    return None
+
+
+def get_ssh_hosts(hosts, port=22, username=None, password=None, key_filename=None, passphrase=None):
+    """Returns a list of host dicts with a unique name and connection params for each host
+
+    :param hosts: (list) of hostnames or IP addresses, dicts with a host key and optional name, port,
+        username, password, key_filename, and passphrase, or deployment run host details
+    :param port: (int) default SSH port
+    :param username: (str) default username
+    :param password: (str) default password
+    :param key_filename: (str) default SSH key
+    :param passphrase: (str) default SSH key passphrase
+    :return: (list) of dict with name, host, port, username, password, key_filename, and passphrase
+    :raises: SshConfigError
+    """
+    ssh_hosts = []
+    names = set()
+    for host in hosts:
+        ssh_host = {
+            'port': port,
+            'username': username,
+            'password': password,
+            'key_filename': key_filename,
+            'passphrase': passphrase
+        }
+        if isinstance(host, str):
+            ssh_host['name'] = host
+            ssh_host['host'] = host
+        elif isinstance(host, dict) and 'host' in host:
+            ssh_host.update({k: v for k, v in host.items() if v is not None})
+            ssh_host['name'] = host.get('name', host['host'])
+        elif isinstance(host, dict) and 'networkInterfaces' in host:
+            ssh_host['host'] = get_run_host_address(host_details=host)
+            if not ssh_host['host']:
+                raise SshConfigError('No internal IP address found for run host: {i}'.format(i=str(host.get('id'))))
+            ssh_host['name'] = host.get('hostname', host.get('systemRole', ssh_host['host']))
+        else:
+            raise SshConfigError('Unable to determine the host to connect to from: {h}'.format(h=str(host)))
+        name = ssh_host['name']
+        name_num = 1
+        while ssh_host['name'] in names:
+            name_num += 1
+            ssh_host['name'] = '{n}-{i}'.format(n=name, i=str(name_num))
+        names.add(ssh_host['name'])
+        ssh_hosts.append(ssh_host)
+    return ssh_hosts
+
+
+class ParallelSshExecutor(object):
+    """Runs commands and transfers on many hosts in parallel
+
+    :param hosts: (list) hosts, see get_ssh_hosts
+    :param max_workers: (int) maximum number of hosts handled at once
+    :param port: (int) default SSH port
+    :param username: (str) default username
+    :param password: (str) default password
+    :param key_filename: (str) default SSH key
+    :param passphrase: (str) default SSH key passphrase
+    :param pool: (SshConnectionPool) connection pool, the shared pool by default
+    """
+
+    def __init__(self, hosts, max_workers=default_max_workers, port=22, username=None, password=None,
+                 key_filename=None, passphrase=None, pool=None):
+        self.cls_logger = mod_logger + '.ParallelSshExecutor'
+        self.hosts = get_ssh_hosts(hosts=hosts, port=port, username=username, password=password,
+                                   key_filename=key_filename, passphrase=passphrase)
+        self.max_workers = max_workers
+        self.pool = pool if pool else get_ssh_pool()
+        self.print_lock = threading.Lock()
+
+    def print_line(self, name, line):
+        """Prints a line of output prefixed by the host name
+
+        :param name: (str) host name
+        :param line: (str) line of output
+        :return: None
+        """
+        with self.print_lock:
+            print('[{n}] {l}'.format(n=name, l=line))
+
+    def run_on_host(self, ssh_host, task):
+        """Runs the task for one host and returns its result with timing
+
+        Errors from the task, including local OSErrors such as failing to create a download directory, are
+        reported as the error of the host result instead of stopping the other hosts.
+
+        :param ssh_host: (dict) host from get_ssh_hosts
+        :param task: (callable) called with the host dict and its connection args, returns a dict with code and
+            output
+        :return: (dict) result with name, host, status, code, output, error, connect_sec, and elapsed_sec
+        """
+        log = logging.getLogger(self.cls_logger + '.run_on_host')
+        connect_args = {k: ssh_host[k] for k in host_connect_args}
+        result = {
+            'name': ssh_host['name'],
+            'host': ssh_host['host'],
+            'status': 'error',
+            'code': None,
+            'output': None,
+            'error': None,
+            'connect_sec': None,
+            'elapsed_sec': None
+        }
+        start_time = time.monotonic()
+        try:
+            # Keep the connection checked out for the whole task so it is not evicted between calls
+            with self.pool.checkout(host=ssh_host['host'], **connect_args):
+                result['connect_sec'] = time.monotonic() - start_time
+                task_result = task(ssh_host, connect_args)
+        except (CommandError, SshConfigError, OSError) as exc:
+            log.warning('Problem on host [{n}]: {e}'.format(n=ssh_host['name'], e=str(exc)))
+            result['error'] = str(exc)
+        else:
+            result['code'] = task_result['code']
+            result['output'] = task_result['output']
+            result['status'] = 'success' if task_result['code'] == 0 else 'failed'
+        result['elapsed_sec'] = time.monotonic() - start_time
+        return result
+
+    def iter_results(self, task):
+        """Runs the task on every host in parallel and yields each host result as it completes
+
+        :param task: (callable) see run_on_host
+        :return: (generator) of dict results, see run_on_host
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ssh_exec') as executor:
+            futures = [executor.submit(self.run_on_host, ssh_host, task) for ssh_host in self.hosts]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def collect_results(self, task, action):
+        """Runs the task on every host and returns the results in host order
+
+        :param task: (callable) see run_on_host
+        :param action: (str) description of the task for log messages
+        :return: (collections.OrderedDict) host name -> result, see run_on_host
+        """
+        log = logging.getLogger(self.cls_logger + '.collect_results')
+        log.info('Running [{a}] on {n} hosts with up to {w} at a time'.format(
+            a=action, n=str(len(self.hosts)), w=str(self.max_workers)))
+        start_time = time.monotonic()
+        results_by_name = {}
+        for result in self.iter_results(task=task):
+            results_by_name[result['name']] = result
+            log.info('Host [{n}] finished [{a}] with status [{s}] in {t:.2f} seconds'.format(
+                n=result['name'], a=action, s=result['status'], t=result['elapsed_sec']))
+        results = collections.OrderedDict((h['name'], results_by_name[h['name']]) for h in self.hosts)
+        num_success = len([r for r in results.values() if r['status'] == 'success'])
+        log.info('Completed [{a}] on {s} of {n} hosts in {t:.2f} seconds'.format(
+            a=action, s=str(num_success), n=str(len(results)), t=time.monotonic() - start_time))
+        return results
+
+    def get_command_task(self, command, timeout_sec, line_callback):
+        """Returns a task that runs the command
+
+        :param command: (str) command to run
+        :param timeout_sec: (float) seconds to wait for the command on each host
+        :param line_callback: (callable) called with the host name and each line of output, or None
+        :return: (callable) see run_on_host
+        """
+        def task(ssh_host, connect_args):
+            host_line_callback = None
+            if line_callback:
+                def host_line_callback(line):
+                    line_callback(ssh_host['name'], line)
+            return self.pool.exec_command(host=ssh_host['host'], command=command, timeout_sec=timeout_sec,
+                                          line_callback=host_line_callback, **connect_args)
+        return task
+
+    def iter_command_results(self, command, timeout_sec=3600.0, line_callback=None):
+        """Runs the command on every host in parallel and yields each host result as it completes
+
+        :param command: (str) command to run
+        :param timeout_sec: (float) seconds to wait for the command on each host
+        :param line_callback: (callable) called with the host name and each line of output as it arrives
+        :return: (generator) of dict results, see run_on_host
+        """
+        return self.iter_results(task=self.get_command_task(
+            command=command, timeout_sec=timeout_sec, line_callback=line_callback))
+
+    def run_command(self, command, timeout_sec=3600.0, print_output=False, line_callback=None):
+        """Runs the command on every host in parallel
+
+        :param command: (str) command to run
+        :param timeout_sec: (float) seconds to wait for the command on each host
+        :param print_output: (bool) Set True to print each line of output prefixed by the host name
+        :param line_callback: (callable) called with the host name and each line of output as it arrives
+        :return: (collections.OrderedDict) host name -> result, see run_on_host
+        """
+        if print_output and not line_callback:
+            line_callback = self.print_line
+        task = self.get_command_task(command=command, timeout_sec=timeout_sec, line_callback=line_callback)
+        return self.collect_results(task=task, action=command)
+
+    def put_file(self, src_path, dest_path):
+        """Copies a local file to every host in parallel
+
+        :param src_path: (str) full path of the local file
+        :param dest_path: (str) full path of the remote file or directory
+        :return: (collections.OrderedDict) host name -> result, see run_on_host
+        """
+        def task(ssh_host, connect_args):
+            self.pool.scp(host=ssh_host['host'], src_path=src_path, dest_path=dest_path, put=True, **connect_args)
+            return {'code': 0, 'output': dest_path}
+        return self.collect_results(task=task, action='put {s}'.format(s=src_path))
+
+    def get_file(self, src_path, dest_dir):
+        """Copies a remote file from every host in parallel into a directory per host
+
+        :param src_path: (str) full path of the remote file
+        :param dest_dir: (str) local directory, the file from each host is saved to dest_dir/<host name>/
+        :return: (collections.OrderedDict) host name -> result, see run_on_host
+        """
+        def task(ssh_host, connect_args):
+            host_dir = os.path.join(dest_dir, ssh_host['name'].replace(os.sep, '_'))
+            os.makedirs(host_dir, exist_ok=True)
+            self.pool.scp(host=ssh_host['host'], src_path=src_path, dest_path=host_dir, put=False, **connect_args)
+            return {'code': 0, 'output': os.path.join(host_dir, os.path.basename(src_path))}
+        return self.collect_results(task=task, action='get {s}'.format(s=src_path))
+
+    def check_marker_file(self, file_path, timeout_sec=30.0):
+        """Checks every host in parallel for a marker file
+
+        :param file_path: (str) full path of the remote marker file
+        :param timeout_sec: (float) seconds to wait on each host
+        :return: (dict) host name -> True if the file exists, False if not, None if the host could not be checked
+        """
+        results = self.run_command(command='test -f {f}'.format(f=shlex.quote(file_path)), timeout_sec=timeout_sec)
+        return {name: None if result['status'] == 'error' else result['code'] == 0
+                for name, result in results.items()}
+
+
+def run_remote_command_on_hosts(hosts, command, timeout_sec=3600.0, max_workers=default_max_workers, port=22,
+                                username=None, password=None, key_filename=None, passphrase=None, print_output=True):
+    """Runs a command on many hosts in parallel over SSH
+
+    :param hosts: (list) hosts, see get_ssh_hosts
+    :param command: (str) command to run
+    :param timeout_sec: (float) seconds to wait for the command on each host
+    :param max_workers: (int) maximum number of hosts handled at once
+    :param port: (int) default SSH port
+    :param username: (str) default username
+    :param password: (str) default password
+    :param key_filename: (str) default SSH key
+    :param passphrase: (str) default SSH key passphrase
+    :param print_output: (bool) Set True to print each line of output prefixed by the host name
+    :return: (collections.OrderedDict) host name -> result, see ParallelSshExecutor.run_on_host
+    :raises: SshConfigError
+    """
+    executor = ParallelSshExecutor(hosts=hosts, max_workers=max_workers, port=port, username=username,
+                                   password=password, key_filename=key_filename, passphrase=passphrase)
+    return executor.run_command(command=command, timeout_sec=timeout_sec, print_output=print_output)
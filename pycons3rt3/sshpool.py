@@ -0,0 +1,419 @@
+"""Module: sshpool
+
+This module provides a pool of authenticated SSH connections.
+
+Connections are keyed by host, port, username, key file, and a digest of the
+password and passphrase.  Each pooled connection keeps its paramiko transport
+open, so commands, SFTP reads, and SCP puts to the same host open a new channel
+on the existing transport instead of repeating the handshake and
+authentication.  Connections are checked out while in use and are never
+evicted while checked out.  Connections idle for longer than the idle timeout
+are closed, and a connection that has been idle for a while is checked before
+it is reused and reconnected if it has gone away.
+
+Classes:
+    SshConnectionPool: Pool of authenticated SSH connections
+
+"""
+import atexit
+import collections
+import contextlib
+import hashlib
+import logging
+import socket
+import threading
+import time
+
+import paramiko
+from scp import SCPClient, SCPException
+
+from .exceptions import CommandError, SshConfigError
+from .logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.sshpool'
+
+# Connections idle longer than this are closed
+default_max_idle_sec = 300
+
+# Connections idle longer than this are checked before they are reused
+default_health_check_idle_sec = 30
+
+# Maximum number of pooled connections, the least recently used is closed first
+default_max_connections = 64
+
+# Size of each read from a command channel
+channel_read_size_bytes = 65536
+
+# Character encoding
+character_encoding = 'utf-8'
+
+# Shared pool used by the ssh module functions
+shared_pool = None
+shared_pool_lock = threading.Lock()
+
+
+class PooledConnection(object):
+    """An authenticated SSH client, its last use time, and the number of users that have it checked out
+
+    :param client: (paramiko.SSHClient) connected client
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.sftp = None
+        self.sftp_lock = threading.Lock()
+
+    def is_active(self):
+        """Returns True if the transport is still open
+
+        :return: (bool)
+        """
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def check(self):
+        """Sends an ignore message to verify the remote end is still there
+
+        :return: (bool) True if the connection is healthy
+        """
+        if not self.is_active():
+            return False
+        try:
+            self.client.get_transport().send_ignore()
+        except (paramiko.SSHException, socket.error, EOFError):
+            return False
+        return True
+
+    def close(self):
+        """Closes the SFTP session and the client
+
+        :return: None
+        """
+        if self.sftp:
+            try:
+                self.sftp.close()
+            except (paramiko.SSHException, socket.error, EOFError):
+                pass
+            self.sftp = None
+        self.client.close()
+
+
+class SshConnectionPool(object):
+    """Pool of authenticated SSH connections keyed by host, port, username, key file, and credentials
+
+    get_connection checks a connection out, and it must be returned with release, or use the checkout
+    context manager.  Checked out connections are not closed by idle or least recently used eviction.
+
+    :param max_idle_sec: (int) connections idle longer than this are closed
+    :param health_check_idle_sec: (int) connections idle longer than this are checked before reuse
+    :param max_connections: (int) maximum number of pooled connections
+    """
+
+    def __init__(self, max_idle_sec=default_max_idle_sec, health_check_idle_sec=default_health_check_idle_sec,
+                 max_connections=default_max_connections):
+        self.cls_logger = mod_logger + '.SshConnectionPool'
+        self.max_idle_sec = max_idle_sec
+        self.health_check_idle_sec = health_check_idle_sec
+        self.max_connections = max_connections
+        self.connections = collections.OrderedDict()
+        self.key_locks = {}
+        self.lock = threading.Lock()
+
+    def get_key_lock(self, key):
+        """Returns the lock that serializes connecting for the key
+
+        :param key: (tuple) connection key
+        :return: (threading.Lock)
+        """
+        with self.lock:
+            if key not in self.key_locks:
+                self.key_locks[key] = threading.Lock()
+            return self.key_locks[key]
+
+    def evict_idle(self):
+        """Closes connections idle longer than max_idle_sec, and the least recently used over max_connections
+
+        Connections that are checked out are skipped, so the pool can briefly hold more than max_connections.
+
+        :return: (int) number of connections closed
+        """
+        log = logging.getLogger(self.cls_logger + '.evict_idle')
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for key, connection in list(self.connections.items()):
+                if connection.in_use:
+                    continue
+                if now - connection.last_used > self.max_idle_sec or not connection.is_active():
+                    evicted.append(self.connections.pop(key))
+                    log.debug('Closing idle SSH connection to: {h}:{p}'.format(h=key[0], p=str(key[1])))
+            idle_keys = [key for key, connection in self.connections.items() if not connection.in_use]
+            for key in idle_keys[:max(len(self.connections) - self.max_connections, 0)]:
+                evicted.append(self.connections.pop(key))
+        for connection in evicted:
+            connection.close()
+        return len(evicted)
+
+    def get_connection(self, host, port=22, username=None, password=None, key_filename=None, passphrase=None,
+                       timeout_sec=30):
+        """Checks out a pooled connection to the host, connecting when there is no healthy one
+
+        Return the connection with release when done with it.
+
+        :param host: (str) hostname or IP address to connect to
+        :param port: (int) SSH port number
+        :param username: (str) username to connect as
+        :param password: (str) password to use in the connection
+        :param key_filename: (str) SSH key to use in the connection
+        :param passphrase: (str) SSH key passphrase
+        :param timeout_sec: (int) connection timeout
+        :return: (PooledConnection)
+        :raises: SshConfigError
+        """
+        log = logging.getLogger(self.cls_logger + '.get_connection')
+        self.evict_idle()
+        key = (host, port, username, key_filename, get_credential_digest(password=password, passphrase=passphrase))
+        with self.get_key_lock(key):
+            with self.lock:
+                connection = self.connections.get(key)
+                if connection:
+                    self.connections.move_to_end(key)
+                    connection.in_use += 1
+            if connection:
+                if time.monotonic() - connection.last_used < self.health_check_idle_sec or connection.check():
+                    connection.last_used = time.monotonic()
+                    return connection
+                log.info('Pooled SSH connection to [{h}:{p}] failed the health check, reconnecting'.format(
+                    h=host, p=str(port)))
+                self.release(connection)
+                self.discard(connection)
+            connection_msg = 'Connection to host [{h}:{p}] with params (if any): '.format(h=host, p=str(port))
+            connection_msg += '\n[Username: ' + username + ']' if username else ''
+            connection_msg += '\n[Password included]' if password else ''
+            connection_msg += '\n[Private key: ' + key_filename + ']' if key_filename else ''
+            connection_msg += '\n[Passphrase included]' if passphrase else ''
+            log.info('Making ' + connection_msg)
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(hostname=host, port=port, username=username, password=password,
+                               key_filename=key_filename, passphrase=passphrase, timeout=timeout_sec)
+            except (paramiko.SSHException, socket.error) as exc:
+                client.close()
+                msg = 'SSH problem: ' + connection_msg
+                raise SshConfigError(msg) from exc
+            connection = PooledConnection(client=client)
+            connection.in_use = 1
+            with self.lock:
+                self.connections[key] = connection
+            return connection
+
+    def release(self, connection):
+        """Returns a connection checked out with get_connection to the pool
+
+        :param connection: (PooledConnection)
+        :return: None
+        """
+        with self.lock:
+            connection.in_use = max(connection.in_use - 1, 0)
+            connection.last_used = time.monotonic()
+
+    @contextlib.contextmanager
+    def checkout(self, host, **connect_args):
+        """Context manager that checks out a pooled connection and releases it on exit
+
+        :param host: (str) hostname or IP address
+        :param connect_args: port, username, password, key_filename, passphrase, and timeout_sec for
+                             get_connection
+        :return: (PooledConnection)
+        :raises: SshConfigError
+        """
+        connection = self.get_connection(host=host, **connect_args)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def discard(self, connection):
+        """Closes and removes a connection that hit a transport error
+
+        :param connection: (PooledConnection)
+        :return: None
+        """
+        with self.lock:
+            for key, pooled in list(self.connections.items()):
+                if pooled is connection:
+                    del self.connections[key]
+        connection.close()
+
+    def exec_command(self, host, command, timeout_sec=3600.0, line_callback=None, **connect_args):
+        """Runs a command on the host over a new channel of the pooled connection
+
+        :param host: (str) hostname or IP address
+        :param command: (str) command to run
+        :param timeout_sec: (float) seconds to wait for the command
+        :param line_callback: (callable) called with each line of output as it arrives
+        :param connect_args: port, username, password, key_filename, and passphrase for get_connection
+        :return: (dict) output (str, stdout and stderr combined) and code (int)
+        :raises: SshConfigError, CommandError
+        """
+        with self.checkout(host=host, **connect_args) as connection:
+            return self.exec_command_on_connection(
+                connection=connection, host=host, command=command, timeout_sec=timeout_sec,
+                line_callback=line_callback)
+
+    def exec_command_on_connection(self, connection, host, command, timeout_sec=3600.0, line_callback=None):
+        """Runs a command over a new channel of a checked out connection
+
+        :param connection: (PooledConnection) connection checked out by the caller
+        :param host: (str) hostname or IP address, for messages
+        :param command: (str) command to run
+        :param timeout_sec: (float) seconds to wait for the command
+        :param line_callback: (callable) called with each line of output as it arrives
+        :return: (dict) output (str, stdout and stderr combined) and code (int)
+        :raises: SshConfigError, CommandError
+        """
+        try:
+            channel = connection.client.get_transport().open_session()
+        except (paramiko.SSHException, socket.error, EOFError) as exc:
+            self.discard(connection)
+            raise SshConfigError('Problem opening a channel to host: {h}'.format(h=host)) from exc
+        chunks = []
+        partial_line = b''
+        deadline = time.monotonic() + timeout_sec
+        try:
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+            while True:
+                remaining_sec = deadline - time.monotonic()
+                if remaining_sec <= 0:
+                    raise CommandError('Command timed out after {t} seconds on host [{h}]: {c}'.format(
+                        t=str(timeout_sec), h=host, c=command))
+                channel.settimeout(remaining_sec)
+                try:
+                    data = channel.recv(channel_read_size_bytes)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                chunks.append(data)
+                if line_callback:
+                    lines = (partial_line + data).split(b'\n')
+                    partial_line = lines.pop()
+                    for line in lines:
+                        line_callback(line.decode(character_encoding, errors='replace').rstrip())
+            if line_callback and partial_line:
+                line_callback(partial_line.decode(character_encoding, errors='replace').rstrip())
+            code = channel.recv_exit_status()
+        except (paramiko.SSHException, socket.error, EOFError) as exc:
+            raise CommandError('Problem running command on host [{h}]: {c}'.format(h=host, c=command)) from exc
+        finally:
+            channel.close()
+        return {
+            'output': b''.join(chunks).decode(character_encoding, errors='replace').strip(),
+            'code': code
+        }
+
+    def get_sftp(self, connection):
+        """Returns the SFTP session of the connection, opening it on first use
+
+        :param connection: (PooledConnection)
+        :return: (paramiko.SFTPClient)
+        :raises: SshConfigError
+        """
+        if connection.sftp is None:
+            try:
+                connection.sftp = connection.client.open_sftp()
+            except (paramiko.SSHException, socket.error, EOFError) as exc:
+                self.discard(connection)
+                raise SshConfigError('Problem opening an SFTP session') from exc
+        return connection.sftp
+
+    def read_file(self, host, file_path, **connect_args):
+        """Reads a remote file over the SFTP session of the pooled connection
+
+        :param host: (str) hostname or IP address
+        :param file_path: (str) full path of the remote file
+        :param connect_args: port, username, password, key_filename, and passphrase for get_connection
+        :return: (bytes) file content
+        :raises: SshConfigError
+        """
+        with self.checkout(host=host, **connect_args) as connection:
+            with connection.sftp_lock:
+                sftp = self.get_sftp(connection)
+                try:
+                    with sftp.open(file_path, 'rb') as remote_file:
+                        remote_file.prefetch()
+                        content = remote_file.read()
+                except IOError as exc:
+                    msg = 'SFTP client had a problem opening file {f} on host: {h}'.format(f=file_path, h=host)
+                    raise SshConfigError(msg) from exc
+        return content
+
+    def scp(self, host, src_path, dest_path, put=False, **connect_args):
+        """Copies a file to or from the host with SCP over the pooled connection
+
+        :param host: (str) hostname or IP address
+        :param src_path: (str) full path of the source file
+        :param dest_path: (str) full path of the destination file or directory
+        :param put: (bool) Set True to put the file, get by default
+        :param connect_args: port, username, password, key_filename, and passphrase for get_connection
+        :return: None
+        :raises: SshConfigError
+        """
+        with self.checkout(host=host, **connect_args) as connection:
+            try:
+                with SCPClient(connection.client.get_transport()) as scp:
+                    if put:
+                        scp.put(files=src_path, remote_path=dest_path, preserve_times=True)
+                    else:
+                        scp.get(local_path=dest_path, remote_path=src_path, preserve_times=True)
+            except (SCPException, paramiko.SSHException, socket.error) as exc:
+                msg = 'Problem {a} file [{s}] to [{d}] on host: {h}'.format(
+                    a='putting' if put else 'getting', s=src_path, d=dest_path, h=host)
+                raise SshConfigError(msg) from exc
+
+    def close_all(self):
+        """Closes every pooled connection
+
+        :return: None
+        """
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for connection in connections:
+            connection.close()
+
+
+def get_credential_digest(password=None, passphrase=None):
+    """Returns a digest of the password and passphrase, so the pool key does not hold the secrets
+
+    :param password: (str) password used in the connection
+    :param passphrase: (str) SSH key passphrase
+    :return: (str) hex digest
+    """
+    digest = hashlib.sha256()
+    for value in [password, passphrase]:
+        digest.update(str(value).encode(character_encoding))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_ssh_pool():
+    """Returns the shared SSH connection pool
+
+    :return: (SshConnectionPool)
+    """
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is None:
+            shared_pool = SshConnectionPool()
+            atexit.register(shared_pool.close_all)
+        return shared_pool
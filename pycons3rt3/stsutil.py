@@ -3,14 +3,18 @@
 This module provides utilities for interacting AWS STS
 
 """
+import collections
+import datetime
 import logging
 import os
 import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from botocore.client import ClientError
 
-from .awsutil import get_boto3_client
+from .awsutil import get_boto3_client, invalidate_boto3_clients
 from .exceptions import StsUtilError
 from .logify import Logify
 
@@ -47,6 +51,16 @@ default_output_format = 'text'
 # AWS config file locations
 default_aws_dir = os.path.join(os.path.expanduser('~'), '.aws')
 
+# Role assumed in child accounts of the organization
+default_role_name = 'OrganizationAccountAccessRole'
+
+# Seconds before expiration to refresh assumed role credentials
+default_refresh_ahead_sec = 300
+
+# Concurrency limits when running a function across accounts and regions
+default_sweep_max_workers = 16
+default_sweep_max_per_account = 4
+
 
 class AwsOrganizationAccount(object):
     """Defines an AWS organization (either in AWS Commercial/Standard or AWS GovCloud by:
@@ -137,6 +151,7 @@ class AwsOrganizationAccount(object):
         config_content = '[default]\nregion = {r}\noutput = {f}\n\n'.format(r=region, f=self.output_format)
         with open(self.config_file, 'w') as f:
             f.write(config_content)
+        invalidate_boto3_clients()
 
     def set_credentials(self, access_key_id, secret_access_key, session_token=None, region=None):
         """Set the credentials file to the provided credentials
@@ -171,6 +186,7 @@ class AwsOrganizationAccount(object):
         credentials_content += '\n'
         with open(self.credentials_file, 'w') as f:
             f.write(credentials_content)
+        invalidate_boto3_clients()
 
     def get_master_account_credentials(self):
         """Reads and returns the master account credentials
@@ -191,6 +207,203 @@ class AwsOrganizationAccount(object):
             raise OSError('master account credentials not found')
         return access_key_id, secret_access_key
 
+    def get_active_account_ids(self):
+        """Returns the IDs of the active child accounts
+
+        :return: (list) of str account IDs
+        """
+        return [x['account_id'] for x in self.child_account_list if x.get('active', True)]
+
+    def run_in_accounts(self, func, account_ids=None, regions=None, role_name=default_role_name,
+                        max_workers=default_sweep_max_workers, max_per_account=default_sweep_max_per_account,
+                        mfa_totp=None):
+        """Runs the function in every (account, region) pair in parallel using in-memory role credentials
+
+        The credentials files are not modified.  See run_in_accounts in this module.
+
+        :param func: (callable) called as func(account_id, region, provider), use provider.get_client to get
+                     boto3 clients for the account and region
+        :param account_ids: (list) of str account IDs, defaults to the active child accounts
+        :param regions: (list) of str regions, defaults to the organization regions
+        :param role_name: (str) name of the role to assume in each account
+        :param max_workers: (int) maximum number of functions running at once
+        :param max_per_account: (int) maximum number of functions running at once in a single account
+        :param mfa_totp: (str) MFA code for the master account user when MFA is required, or a callable
+                         returning a new code, see RoleCredentialProvider
+        :return: (dict) results, failed, and items, see run_in_accounts
+        :raises: StsUtilError
+        """
+        provider = RoleCredentialProvider(aws_account=self, role_name=role_name, mfa_totp=mfa_totp)
+        if account_ids is None:
+            account_ids = self.get_active_account_ids()
+        if regions is None:
+            regions = self.regions
+        return run_in_accounts(
+            provider=provider,
+            func=func,
+            account_ids=account_ids,
+            regions=regions,
+            max_workers=max_workers,
+            max_per_account=max_per_account
+        )
+
+
+class RoleCredentialProvider(object):
+    """Assumes roles in the organization accounts and keeps the credentials in memory
+
+    Credentials are cached per account and refreshed refresh_ahead_sec before they expire, so
+    long-running sweeps never use an expired token.  Concurrent requests for the same account
+    share a single assume_role call.
+
+    :param aws_account: (AwsOrganizationAccount) organization with the master credentials
+    :param role_name: (str) name of the role to assume in each account
+    :param session_name: (str) name of the assumed role sessions
+    :param duration_sec: (int) requested duration of the credentials
+    :param refresh_ahead_sec: (int) seconds before expiration to refresh the credentials
+    :param mfa_totp: (str) MFA code for the master account user, used once to get a session token, or a
+                     callable returning a new MFA code, called each time the MFA session token is refreshed
+    """
+
+    def __init__(self, aws_account, role_name=default_role_name, session_name='pycons3rt-sweep',
+                 duration_sec=3600, refresh_ahead_sec=default_refresh_ahead_sec, mfa_totp=None):
+        self.cls_logger = mod_logger + '.RoleCredentialProvider'
+        self.aws_account = aws_account
+        self.role_name = role_name
+        self.session_name = session_name
+        self.duration_sec = duration_sec
+        self.refresh_ahead_sec = refresh_ahead_sec
+        self.mfa_totp = mfa_totp
+        self.use_mfa = bool(mfa_totp)
+        self.source_credentials = None
+        self.credentials = {}
+        self.account_locks = {}
+        self.lock = threading.Lock()
+
+    def get_source_credentials(self):
+        """Returns the master account credentials used to assume roles
+
+        With MFA, a session token is created from the master credentials.  Each MFA code can only be
+        used once, so when the session token expires a new code is requested from the mfa_totp
+        callable, and when mfa_totp was a code an error is raised instead of falling back to the
+        master credentials without MFA.
+
+        :return: (dict) aws_access_key_id, aws_secret_access_key, and aws_session_token
+        :raises: StsUtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.get_source_credentials')
+        with self.lock:
+            if self.source_credentials and not self.is_expiring(self.source_credentials):
+                return self.source_credentials
+            mfa_totp = self.mfa_totp() if callable(self.mfa_totp) else self.mfa_totp
+            if self.use_mfa and not mfa_totp:
+                if self.source_credentials and not self.is_expiring(self.source_credentials, refresh_ahead_sec=0):
+                    log.warning('MFA session token expires at {e}, provide a new MFA code to refresh it'.format(
+                        e=str(self.source_credentials['expiration'])))
+                    return self.source_credentials
+                raise StsUtilError('The MFA session token for the master account has expired, create a new '
+                                   'RoleCredentialProvider with a new MFA code or pass a callable for mfa_totp')
+            try:
+                access_key_id, secret_access_key = self.aws_account.get_master_account_credentials()
+            except OSError as exc:
+                raise StsUtilError('Problem reading the master account credentials') from exc
+            source_credentials = {
+                'aws_access_key_id': access_key_id,
+                'aws_secret_access_key': secret_access_key,
+                'aws_session_token': None,
+                'expiration': None
+            }
+            if mfa_totp:
+                sts = get_sts_client(region_name=self.aws_account.default_region, aws_access_key_id=access_key_id,
+                                     aws_secret_access_key=secret_access_key)
+                current_id = get_current_id(sts)
+                mfa_device = 'arn:{a}:iam::{m}:mfa/{u}'.format(
+                    a=self.aws_account.arn_str, m=self.aws_account.master_account_id,
+                    u=current_id['Arn'].split('/')[-1])
+                log.info('Getting a session token using MFA device: {d}'.format(d=mfa_device))
+                try:
+                    response = sts.get_session_token(SerialNumber=mfa_device, TokenCode=mfa_totp)
+                except ClientError as exc:
+                    msg = 'Problem getting a session token using MFA device: {d}'.format(d=mfa_device)
+                    raise StsUtilError(msg) from exc
+                if not callable(self.mfa_totp):
+                    self.mfa_totp = None
+                source_credentials = get_credentials_dict(response['Credentials'])
+            self.source_credentials = source_credentials
+            return self.source_credentials
+
+    def is_expiring(self, credentials, refresh_ahead_sec=None):
+        """Determines if the credentials expire within the refresh ahead time
+
+        :param credentials: (dict) credentials with an expiration datetime or None
+        :param refresh_ahead_sec: (int) seconds before expiration, defaults to the provider refresh_ahead_sec
+        :return: (bool) True if the credentials should be refreshed
+        """
+        if not credentials['expiration']:
+            return False
+        if refresh_ahead_sec is None:
+            refresh_ahead_sec = self.refresh_ahead_sec
+        remaining = credentials['expiration'] - datetime.datetime.now(datetime.timezone.utc)
+        return remaining.total_seconds() < refresh_ahead_sec
+
+    def get_account_lock(self, account_id):
+        """Returns the lock that serializes assume_role calls for the account
+
+        :param account_id: (str) ID of the account
+        :return: (threading.Lock)
+        """
+        with self.lock:
+            if account_id not in self.account_locks:
+                self.account_locks[account_id] = threading.Lock()
+            return self.account_locks[account_id]
+
+    def get_credentials(self, account_id):
+        """Returns credentials for the role in the account, assuming the role when not cached or expiring
+
+        :param account_id: (str) ID of the account
+        :return: (dict) aws_access_key_id, aws_secret_access_key, aws_session_token, and expiration
+        :raises: StsUtilError
+        """
+        log = logging.getLogger(self.cls_logger + '.get_credentials')
+        with self.get_account_lock(account_id):
+            credentials = self.credentials.get(account_id)
+            if credentials and not self.is_expiring(credentials):
+                return credentials
+            source_credentials = self.get_source_credentials()
+            sts = get_sts_client(
+                region_name=self.aws_account.default_region,
+                aws_access_key_id=source_credentials['aws_access_key_id'],
+                aws_secret_access_key=source_credentials['aws_secret_access_key'],
+                aws_session_token=source_credentials['aws_session_token']
+            )
+            role_arn = 'arn:{a}:iam::{i}:role/{r}'.format(a=self.aws_account.arn_str, i=account_id, r=self.role_name)
+            new_credentials = get_credentials_dict(assume_role(
+                client=sts, role_arn=role_arn, session_name=self.session_name, duration_sec=self.duration_sec))
+            if credentials:
+                log.info('Refreshed credentials for account: {i}'.format(i=account_id))
+                invalidate_boto3_clients(aws_access_key_id=credentials['aws_access_key_id'])
+            self.credentials[account_id] = new_credentials
+            return new_credentials
+
+    def get_client(self, service, account_id, region=None):
+        """Returns a cached boto3 client for the service in the account and region
+
+        :param service: (str) name of the service
+        :param account_id: (str) ID of the account
+        :param region: (str) region, defaults to the organization default region
+        :return: boto3.client object
+        :raises: StsUtilError
+        """
+        credentials = self.get_credentials(account_id=account_id)
+        if not region:
+            region = self.aws_account.default_region
+        return get_boto3_client(
+            service=service,
+            region_name=region,
+            aws_access_key_id=credentials['aws_access_key_id'],
+            aws_secret_access_key=credentials['aws_secret_access_key'],
+            aws_session_token=credentials['aws_session_token']
+        )
+
 
 def assume_role(client, role_arn, session_name, duration_sec=3600, mfa_device=None, mfa_totp=None):
     """Assume role with or without MFA
@@ -240,6 +453,25 @@ def assume_role(client, role_arn, session_name, duration_sec=3600, mfa_device=No
     return response['Credentials']
 
 
+def get_credentials_dict(credentials):
+    """Converts STS credentials into boto3 client keyword arguments plus the expiration
+
+    :param credentials: (dict) Credentials from an STS response (see boto3 docs)
+    :return: (dict) aws_access_key_id, aws_secret_access_key, aws_session_token, and expiration
+    :raises: StsUtilError
+    """
+    try:
+        return {
+            'aws_access_key_id': credentials['AccessKeyId'],
+            'aws_secret_access_key': credentials['SecretAccessKey'],
+            'aws_session_token': credentials['SessionToken'],
+            'expiration': credentials['Expiration']
+        }
+    except KeyError as exc:
+        msg = 'Problem retrieving data from credentials'
+        raise StsUtilError(msg) from exc
+
+
 def get_caller_identity(client=None):
     """Gets the identity of the calling client
 
@@ -383,3 +615,77 @@ def login_as_role(aws_account, account_id_to_switch_to, session_name, role_name=
             region=region
         )
     return access_key_id, secret_access_key, session_token, region, mfa_device
+
+
+def run_in_accounts(provider, func, account_ids, regions, max_workers=default_sweep_max_workers,
+                    max_per_account=default_sweep_max_per_account):
+    """Runs the function in every (account, region) pair in parallel
+
+    Work is handed out across accounts so that no account runs more than max_per_account functions
+    at once, which keeps each account under its API rate limits while the sweep as a whole runs
+    max_workers functions in parallel.
+
+    :param provider: (RoleCredentialProvider) credentials for the accounts
+    :param func: (callable) called as func(account_id, region, provider)
+    :param account_ids: (list) of str account IDs
+    :param regions: (list) of str regions
+    :param max_workers: (int) maximum number of functions running at once
+    :param max_per_account: (int) maximum number of functions running at once in a single account
+    :return: (dict) results: dict of (account_id, region) to the function result, failed: dict of
+             (account_id, region) to the error message, and items: the list results merged together with
+             the AccountId and Region added to each dict item
+    """
+    log = logging.getLogger(mod_logger + '.run_in_accounts')
+    pending = collections.OrderedDict()
+    for account_id in account_ids:
+        # Accounts with no regions to run in are left out of scheduling
+        if regions:
+            pending[account_id] = collections.deque(regions)
+    running = collections.Counter()
+    results = {'results': {}, 'failed': {}, 'items': []}
+    start_time = time.time()
+    log.info('Running in {a} accounts and {r} regions with {w} workers and {p} per account'.format(
+        a=str(len(account_ids)), r=str(len(regions)), w=str(max_workers), p=str(max_per_account)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sweep') as executor:
+        futures = {}
+        while pending or futures:
+            # Submit work round-robin across the accounts that are under their limit
+            submitted = True
+            while submitted and len(futures) < max_workers:
+                submitted = False
+                for account_id in list(pending.keys()):
+                    if len(futures) >= max_workers:
+                        break
+                    if running[account_id] >= max_per_account:
+                        continue
+                    region = pending[account_id].popleft()
+                    if not pending[account_id]:
+                        del pending[account_id]
+                    running[account_id] += 1
+                    futures[executor.submit(func, account_id, region, provider)] = (account_id, region)
+                    submitted = True
+            if not futures:
+                break
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                account_id, region = futures.pop(future)
+                running[account_id] -= 1
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    log.warning('Problem running in account [{a}] region [{r}]: {e}'.format(
+                        a=account_id, r=region, e=str(exc)))
+                    results['failed'][(account_id, region)] = str(exc)
+                    continue
+                results['results'][(account_id, region)] = result
+                if isinstance(result, list):
+                    for item in result:
+                        if isinstance(item, dict):
+                            item = dict(item)
+                            item['AccountId'] = account_id
+                            item['Region'] = region
+                        results['items'].append(item)
+    log.info('Completed {n} account regions with {f} failures in {t} seconds'.format(
+        n=str(len(results['results'])), f=str(len(results['failed'])),
+        t=str(round(time.time() - start_time, 1))))
+    return results
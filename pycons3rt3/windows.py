@@ -8,7 +8,7 @@ Windows machines
 """
 import os
 
-from .bash import update_hosts_file_content
+from .bash import update_hosts_file_content, update_hosts_file_entries as bash_update_hosts_file_entries
 from .logify import Logify
 
 __author__ = 'Joe Yennaco'
@@ -17,6 +17,9 @@ __author__ = 'Joe Yennaco'
 # Set up logger name for this module
 mod_logger = Logify.get_name() + '.windows'
 
+# Hosts file on Windows: C:\Windows\System32\drivers\etc\hosts
+windows_hosts_file = os.path.join('C:', os.sep, 'Windows', 'System32', 'drivers', 'etc', 'hosts')
+
 
 def update_hosts_file(ip, entry):
     """Updates the hosts file for the specified ip
@@ -29,6 +32,14 @@ def update_hosts_file(ip, entry):
     :return: None
     :raises CommandError
     """
-    # C:\Windows\System32\drivers\etc
-    windows_hosts_file = os.path.join('C:', os.sep, 'Windows', 'System32', 'drivers', 'etc', 'hosts')
     update_hosts_file_content(hosts_file_path=windows_hosts_file, ip=ip, entry=entry)
+
+
+def update_hosts_file_entries(entries):
+    """Adds or updates many hosts file entries in a single pass
+
+    :param entries: (list) of (ip, entry) tuples, or (dict) of ip -> entry
+    :return: (int) number of lines added or updated
+    :raises CommandError
+    """
+    return bash_update_hosts_file_entries(entries=entries, hosts_file_path=windows_hosts_file)
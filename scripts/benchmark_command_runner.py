@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Benchmarks command output collection for a command that emits a large amount of output
+
+Compares the previous run_command approach (readline, decode, and string concatenation per
+line) with CommandRunner (chunked non-blocking reads into an OutputBuffer that spills to a
+temporary file).  Each approach runs in its own child process so its peak memory can be
+reported separately.
+
+Usage:
+    python benchmark_command_runner.py --mb 300
+
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from pycons3rt3.commandrunner import CommandRunner
+
+__author__ = 'Joe Yennaco'
+
+
+def get_emit_command(size_mb):
+    """Returns a command that writes size_mb of 100 byte lines to stdout
+
+    :param size_mb: (int) megabytes of output
+    :return: (list) command
+    """
+    script = 'import sys\n' \
+             'block = (b"x" * 99 + b"\\n") * 10486\n' \
+             'for _ in range({n}):\n' \
+             '    sys.stdout.buffer.write(block)\n'.format(n=str(size_mb))
+    return [sys.executable, '-c', script]
+
+
+def collect_legacy(command):
+    """Collects output the way run_command did before, one readline, decode, and concatenation per line
+
+    :param command: (list) command
+    :return: (int) length of the collected output
+    """
+    subproc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output_collector = ''
+    with subproc.stdout:
+        for line in iter(subproc.stdout.readline, b''):
+            line_str = line.decode('utf-8')
+            line_str = str(line_str).rstrip()
+            output_collector += line_str + '\n'
+    subproc.wait()
+    return len(output_collector.strip())
+
+
+def collect_runner(command):
+    """Collects output with CommandRunner
+
+    :param command: (list) command
+    :return: (int) number of bytes collected
+    """
+    runner = CommandRunner(command=command, merge_stderr=True)
+    result = runner.run()
+    size = result['stdout'].total_bytes
+    result['stdout'].close()
+    return size
+
+
+def run_child(mode, size_mb):
+    """Runs one approach in this process and prints the results as JSON
+
+    :param mode: (str) legacy or runner
+    :param size_mb: (int) megabytes of output
+    :return: None
+    """
+    command = get_emit_command(size_mb=size_mb)
+    start_time = time.time()
+    if mode == 'legacy':
+        size = collect_legacy(command=command)
+    else:
+        size = collect_runner(command=command)
+    elapsed_sec = time.time() - start_time
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(json.dumps({'size': size, 'seconds': elapsed_sec, 'peak_rss_mb': peak_rss_mb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks command output collection')
+    parser.add_argument('--mb', help='Megabytes of output emitted by the command', required=False, type=int,
+                        default=300)
+    parser.add_argument('--mode', help=argparse.SUPPRESS, required=False)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_child(mode=args.mode, size_mb=args.mb)
+        return 0
+
+    for mode in ['legacy', 'runner']:
+        output = subprocess.check_output([sys.executable, __file__, '--mode', mode, '--mb', str(args.mb)])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        print('{m:<8} {n} MB of output: {s:.2f}s, peak RSS {r:.0f} MB'.format(
+            m=mode, n=str(args.mb), s=result['seconds'], r=result['peak_rss_mb']))
+    return 0
+
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.exit(exit_code)
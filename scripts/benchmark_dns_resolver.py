@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Benchmarks hostname resolution for a long hostname list against a local stub resolver
+
+Compares the previous get_ip_list_for_hostname_list approach (one blocking lookup at a
+time) with DnsResolver (concurrent lookups with a per-lookup timeout), cold and with a
+warm cache.  The system resolver cannot be pointed at a local server without changing
+system configuration, so the stub resolver is a lookup function with the signature of
+socket.gethostbyname_ex that answers from a local table after a simulated latency.
+Hostnames starting with "missing" do not resolve and hostnames starting with "slow"
+take longer than the lookup timeout.
+
+Usage:
+    python benchmark_dns_resolver.py --hosts 200 --latency-ms 50
+
+"""
+
+import argparse
+import logging
+import socket
+import sys
+import time
+
+from pycons3rt3.network import DnsResolver
+
+__author__ = 'Joe Yennaco'
+
+
+class StubResolver(object):
+    """Local stub resolver with simulated latency
+
+    :param latency_sec: (float) latency of each lookup
+    :param slow_latency_sec: (float) latency of lookups for hostnames starting with slow
+    """
+
+    def __init__(self, latency_sec, slow_latency_sec):
+        self.latency_sec = latency_sec
+        self.slow_latency_sec = slow_latency_sec
+        self.num_queries = 0
+
+    def gethostbyname_ex(self, hostname):
+        """Resolves the hostname from the local table
+
+        :param hostname: (str) hostname
+        :return: (tuple) hostname, aliases, and list of IP addresses
+        :raises: socket.gaierror
+        """
+        self.num_queries += 1
+        if hostname.startswith('slow'):
+            time.sleep(self.slow_latency_sec)
+        else:
+            time.sleep(self.latency_sec)
+        if hostname.startswith('missing'):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        num = int(hostname.split('.')[0].split('-')[-1])
+        return hostname, [], ['10.{a}.{b}.{c}'.format(a=str(num // 65536 % 256), b=str(num // 256 % 256),
+                                                      c=str(num % 256))]
+
+
+def get_hostname_list(num_hosts, num_missing, num_slow):
+    """Returns a list of hostnames
+
+    :param num_hosts: (int) total number of hostnames
+    :param num_missing: (int) number of hostnames that do not resolve
+    :param num_slow: (int) number of hostnames slower than the lookup timeout
+    :return: (list) of hostnames
+    """
+    hostnames = []
+    for num in range(num_hosts):
+        if num < num_missing:
+            prefix = 'missing'
+        elif num < num_missing + num_slow:
+            prefix = 'slow'
+        else:
+            prefix = 'host'
+        hostnames.append('{p}-{n}.example.com'.format(p=prefix, n=str(num)))
+    return hostnames
+
+
+def resolve_serial(resolve_func, hostname_list):
+    """Resolves hostnames one at a time the way get_ip_list_for_hostname_list did before
+
+    :param resolve_func: (callable) lookup function
+    :param hostname_list: (list) of hostnames
+    :return: (int) number of hostnames resolved
+    """
+    num_resolved = 0
+    for hostname in hostname_list:
+        try:
+            _, _, hostname_ips = resolve_func(hostname)
+        except (socket.gaierror, socket.error, socket.herror):
+            continue
+        if hostname_ips:
+            num_resolved += 1
+    return num_resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks hostname resolution')
+    parser.add_argument('--hosts', help='Number of hostnames', required=False, type=int, default=200)
+    parser.add_argument('--missing', help='Number of hostnames that do not resolve', required=False, type=int,
+                        default=10)
+    parser.add_argument('--slow', help='Number of hostnames slower than the timeout', required=False, type=int,
+                        default=2)
+    parser.add_argument('--latency-ms', help='Stub resolver latency', required=False, type=int, default=50)
+    parser.add_argument('--timeout-sec', help='Per-lookup timeout', required=False, type=float, default=2.0)
+    parser.add_argument('--workers', help='Concurrent lookups', required=False, type=int, default=16)
+    args = parser.parse_args()
+
+    # Logging every lookup would dominate the timings
+    logging.disable(logging.WARNING)
+
+    hostname_list = get_hostname_list(num_hosts=args.hosts, num_missing=args.missing, num_slow=args.slow)
+    stub = StubResolver(latency_sec=args.latency_ms / 1000.0, slow_latency_sec=args.timeout_sec * 2)
+
+    start_time = time.time()
+    num_resolved = resolve_serial(resolve_func=stub.gethostbyname_ex, hostname_list=hostname_list)
+    print('serial           {n} hostnames, {r} resolved: {s:.2f}s, {q} queries'.format(
+        n=str(args.hosts), r=str(num_resolved), s=time.time() - start_time, q=str(stub.num_queries)))
+
+    resolver = DnsResolver(max_workers=args.workers, timeout_sec=args.timeout_sec,
+                           resolve_func=stub.gethostbyname_ex)
+    for name in ['concurrent cold', 'concurrent warm']:
+        stub.num_queries = 0
+        start_time = time.time()
+        results = resolver.resolve(hostname_list=hostname_list)
+        elapsed_sec = time.time() - start_time
+        if [result[0] for result in results] != hostname_list:
+            print('Results are not in input order')
+            return 1
+        num_resolved = len([result for result in results if result[1]])
+        print('{m:<16} {n} hostnames, {r} resolved: {s:.2f}s, {q} queries'.format(
+            m=name, n=str(args.hosts), r=str(num_resolved), s=elapsed_sec, q=str(stub.num_queries)))
+    return 0
+
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""Benchmarks streaming encryption and decryption against the openssl subprocess path
+
+Compares openssl_encrypt, openssl_decrypt, openssl_smime_encrypt, and
+openssl_smime_decrypt (the openssl command on whole files) with cipher_copy using
+the streaming encryptors and decryptors, and zipping then encrypting a directory
+with openssl_encrypt against encrypting while zipping with a CipherWriter.  Every
+output is decrypted by the other path and checked against the original data.
+
+Usage:
+    python benchmark_openssl_stream.py --mb 256
+
+"""
+
+import argparse
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pycons3rt3.archiver import ZipArchiver
+from pycons3rt3.exceptions import CommandError
+from pycons3rt3.openssl import cipher_copy, openssl_decrypt, openssl_encrypt, openssl_smime_decrypt, \
+    openssl_smime_encrypt, CipherWriter, EncDecryptor, EncEncryptor, SmimeDecryptor, SmimeEncryptor
+
+__author__ = 'Joe Yennaco'
+
+
+def get_sha256(file_path):
+    """Returns the SHA-256 digest of a file
+
+    :param file_path: (str) full path to the file
+    :return: (str) hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def timed(name, size_mb, func):
+    """Runs and times a function and prints the throughput
+
+    :param name: (str) name to print
+    :param size_mb: (float) size of the input in MB
+    :param func: (callable) function to run
+    :return: (bool) True if the function succeeded
+    """
+    start_time = time.time()
+    try:
+        func()
+    except CommandError as exc:
+        print('{n:<28} failed: {e}'.format(n=name, e=str(exc).splitlines()[0]))
+        return False
+    elapsed_sec = time.time() - start_time
+    print('{n:<28} {s:.2f}s, {r:.1f} MB/s'.format(n=name, s=elapsed_sec, r=size_mb / elapsed_sec))
+    return True
+
+
+def check(name, file_path, expected_sha256):
+    """Prints whether the file matches the expected digest
+
+    :param name: (str) name to print
+    :param file_path: (str) full path to the file
+    :param expected_sha256: (str) expected hex digest
+    :return: (bool) True if the file matches
+    """
+    if not os.path.isfile(file_path) or get_sha256(file_path) != expected_sha256:
+        print('{n} does not match the original data'.format(n=name))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks streaming encryption and decryption')
+    parser.add_argument('--mb', help='Size of the test file in MB', required=False, type=int, default=256)
+    args = parser.parse_args()
+
+    # Logging each operation is not part of the timings
+    logging.disable(logging.INFO)
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_openssl_')
+    try:
+        tree_dir = os.path.join(work_dir, 'tree')
+        os.makedirs(tree_dir)
+        plain_file = os.path.join(tree_dir, 'data.bin')
+        with open(plain_file, 'wb') as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(1024 * 1024))
+        plain_sha256 = get_sha256(plain_file)
+        password_file = os.path.join(work_dir, 'password.txt')
+        with open(password_file, 'w') as f:
+            f.write(base64.encodebytes(os.urandom(3072)).decode('ascii'))
+        key_file = os.path.join(work_dir, 'key.pem')
+        cert_file = os.path.join(work_dir, 'cert.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key_file, '-out',
+                        cert_file, '-subj', '/CN=benchmark', '-days', '1'], check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        print('Test file of {m} MB, {c} CPUs'.format(m=str(args.mb), c=str(os.cpu_count())))
+
+        def out_path(name):
+            return os.path.join(work_dir, name)
+
+        ok = True
+        if timed('enc encrypt subprocess', args.mb, lambda: openssl_encrypt(
+                decrypted_file=plain_file, password_file=password_file, encrypted_file=out_path('sub.enc'))):
+            timed('enc decrypt stream', args.mb, lambda: cipher_copy(
+                input_file=out_path('sub.enc'), output_file=out_path('sub.dec'), cipher=EncDecryptor(password_file)))
+            ok = check('stream decrypt of subprocess enc', out_path('sub.dec'), plain_sha256) and ok
+        timed('enc encrypt stream', args.mb, lambda: cipher_copy(
+            input_file=plain_file, output_file=out_path('stream.enc'), cipher=EncEncryptor(password_file)))
+        if timed('enc decrypt subprocess', args.mb, lambda: openssl_decrypt(
+                encrypted_file=out_path('stream.enc'), decrypted_file=out_path('stream.dec'),
+                password_file=password_file)):
+            ok = check('subprocess decrypt of stream enc', out_path('stream.dec'), plain_sha256) and ok
+
+        if timed('smime encrypt subprocess', args.mb, lambda: openssl_smime_encrypt(
+                decrypted_file=plain_file, password_file=cert_file, encrypted_file=out_path('sub.der'))):
+            timed('smime decrypt stream', args.mb, lambda: cipher_copy(
+                input_file=out_path('sub.der'), output_file=out_path('sub.smime'), cipher=SmimeDecryptor(key_file)))
+            ok = check('stream decrypt of subprocess smime', out_path('sub.smime'), plain_sha256) and ok
+        timed('smime encrypt stream', args.mb, lambda: cipher_copy(
+            input_file=plain_file, output_file=out_path('stream.der'), cipher=SmimeEncryptor(cert_file)))
+        if timed('smime decrypt subprocess', args.mb, lambda: openssl_smime_decrypt(
+                encrypted_file=out_path('stream.der'), decrypted_file=out_path('stream.smime'),
+                password_file=key_file)):
+            ok = check('subprocess decrypt of stream smime', out_path('stream.smime'), plain_sha256) and ok
+
+        def zip_then_encrypt():
+            with ZipArchiver(output=out_path('tree.zip')) as zip_w:
+                zip_w.add_dir(dir_path=tree_dir, prefix='tree')
+            openssl_encrypt(decrypted_file=out_path('tree.zip'), password_file=password_file,
+                            encrypted_file=out_path('tree.zip.enc'))
+
+        def zip_while_encrypting():
+            with CipherWriter(output_file=out_path('stream.zip.enc'), cipher=EncEncryptor(password_file)) as writer:
+                with ZipArchiver(output=writer) as zip_w:
+                    zip_w.add_dir(dir_path=tree_dir, prefix='tree')
+
+        timed('zip then encrypt', args.mb, zip_then_encrypt)
+        timed('zip while encrypting', args.mb, zip_while_encrypting)
+        cipher_copy(input_file=out_path('stream.zip.enc'), output_file=out_path('stream.zip'),
+                    cipher=EncDecryptor(password_file))
+        ok = check('zip encrypted while zipping', out_path('stream.zip'), get_sha256(out_path('tree.zip'))) and ok
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Benchmarks security group rule reconciliation against a moto mock of EC2
+
+Compares the previous approach (nested-loop comparison and one API call per rule)
+with EC2Util.configure_security_group_ingress (keyed set difference and batched calls).
+
+Requires moto: pip install moto
+
+Usage:
+    python benchmark_security_group_rules.py --rules 2000 --change 500
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from moto import mock_aws
+from moto.ec2.models.security_groups import SecurityGroupBackend
+
+from pycons3rt3.ec2util import EC2Util, IpPermission, get_ip_permission_changes
+from pycons3rt3.logify import Logify
+
+__author__ = 'Joe Yennaco'
+
+# Set up logger name for this module
+mod_logger = Logify.get_name() + '.benchmark_security_group_rules'
+
+
+def get_rules(start, count):
+    """Returns a list of /32 ingress rules
+
+    :param start: (int) index of the first rule
+    :param count: (int) number of rules
+    :return: (list) of IpPermission objects
+    """
+    rules = []
+    for num in range(start, start + count):
+        cidr = '10.{a}.{b}.{c}/32'.format(a=str(num // 65536 % 256), b=str(num // 256 % 256), c=str(num % 256))
+        rules.append(IpPermission(IpProtocol='tcp', FromPort=443, ToPort=443, CidrIp=cidr))
+    return rules
+
+
+def get_changes_nested(existing_ip_perms, desired_ip_perms):
+    """Compares rules the way configure_security_group_ingress did before, with nested loops
+
+    :param existing_ip_perms: (list) of IpPermission objects
+    :param desired_ip_perms: (list) of IpPermission objects
+    :return: (tuple) lists of IpPermission objects to revoke and to add
+    """
+    revoke_ip_perms = []
+    for existing_ip_perm in existing_ip_perms:
+        revoke = True
+        for desired_ip_perm in desired_ip_perms:
+            if existing_ip_perm == desired_ip_perm:
+                revoke = False
+        if revoke:
+            revoke_ip_perms.append(existing_ip_perm)
+    add_ip_perms = []
+    for desired_ip_perm in desired_ip_perms:
+        add = True
+        for existing_ip_perm in existing_ip_perms:
+            if desired_ip_perm == existing_ip_perm:
+                add = False
+        if add:
+            add_ip_perms.append(desired_ip_perm)
+    return revoke_ip_perms, add_ip_perms
+
+
+def configure_one_at_a_time(ec2, security_group_id, desired_ip_perms):
+    """Reconciles rules with nested loops and one API call per rule
+
+    :param ec2: (EC2Util)
+    :param security_group_id: (str) Security Group ID
+    :param desired_ip_perms: (list) of IpPermission objects
+    :return: None
+    """
+    existing_ip_perms = ec2.get_security_group_ingress_rules(security_group_id=security_group_id)
+    revoke_ip_perms, add_ip_perms = get_changes_nested(existing_ip_perms, desired_ip_perms)
+    for revoke_ip_perm in revoke_ip_perms:
+        ec2.revoke_single_security_group_ingress_rule(security_group_id=security_group_id, revoke_rule=revoke_ip_perm)
+    for add_ip_perm in add_ip_perms:
+        ec2.add_single_security_group_ingress_rule(security_group_id=security_group_id, add_rule=add_ip_perm)
+
+
+def main():
+    log = logging.getLogger(mod_logger + '.main')
+    parser = argparse.ArgumentParser(description='Benchmarks security group rule reconciliation')
+    parser.add_argument('--rules', help='Number of rules in the security group', required=False, type=int,
+                        default=2000)
+    parser.add_argument('--change', help='Number of rules to replace', required=False, type=int, default=500)
+    args = parser.parse_args()
+
+    existing_rules = get_rules(start=0, count=args.rules)
+    desired_rules = get_rules(start=args.change, count=args.rules)
+
+    # Compare the CPU cost of the rule comparison alone
+    start_time = time.time()
+    nested_revoke, nested_add = get_changes_nested(existing_rules, desired_rules)
+    nested_sec = time.time() - start_time
+    start_time = time.time()
+    keyed_revoke, keyed_add = get_ip_permission_changes(existing_rules, desired_rules)
+    keyed_sec = time.time() - start_time
+    if len(nested_revoke) != len(keyed_revoke) or len(nested_add) != len(keyed_add):
+        log.error('Nested and keyed comparisons do not agree')
+        return 1
+    print('Comparison of {n} rules: nested loops {a:.3f}s, keyed sets {b:.3f}s'.format(
+        n=str(args.rules), a=nested_sec, b=keyed_sec))
+
+    # Logging every rule would dominate the timings
+    logging.disable(logging.INFO)
+
+    # moto caps security groups at 60 rules, lift the cap to benchmark large groups
+    SecurityGroupBackend._verify_group_will_respect_rule_count_limit = lambda *a, **k: None
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    results = {}
+    for name in ['one_at_a_time', 'batched']:
+        with mock_aws():
+            ec2 = EC2Util(region_name='us-east-1', skip_is_aws=True)
+            vpc_id = ec2.client.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+            security_group_id = ec2.client.create_security_group(
+                GroupName='benchmark', Description='benchmark', VpcId=vpc_id)['GroupId']
+            ec2.add_security_group_ingress_rules(security_group_id=security_group_id, add_rules=existing_rules)
+            start_time = time.time()
+            if name == 'one_at_a_time':
+                configure_one_at_a_time(ec2=ec2, security_group_id=security_group_id, desired_ip_perms=desired_rules)
+            else:
+                ec2.configure_security_group_ingress(
+                    security_group_id=security_group_id, desired_ingress_rules=desired_rules)
+            results[name] = time.time() - start_time
+            final_rules = ec2.get_security_group_ingress_rules(security_group_id=security_group_id)
+            if len(final_rules) != args.rules:
+                log.error('Expected {n} rules after {m}, found: {f}'.format(
+                    n=str(args.rules), m=name, f=str(len(final_rules))))
+                return 2
+    print('Reconciling {n} rules with {c} changes against moto: one at a time {a:.3f}s, batched {b:.3f}s'.format(
+        n=str(args.rules), c=str(args.change), a=results['one_at_a_time'], b=results['batched']))
+    return 0
+
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Benchmarks zip archive creation for a large synthetic directory tree
+
+Compares the previous bash.zip_dir approach (zipfile.ZipFile writing one member at a time,
+which stored members uncompressed), the same loop with deflate, and ZipArchiver (parallel
+member compression with a per-extension store policy).  The tree mixes compressible text
+logs, incompressible binary files, and already-compressed .gz files.
+
+Usage:
+    python benchmark_zip_archiver.py --files 2000 --mb 512
+
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from pycons3rt3.archiver import ZipArchiver
+
+__author__ = 'Joe Yennaco'
+
+
+def create_tree(tree_dir, num_files, size_mb):
+    """Creates a synthetic directory tree
+
+    :param tree_dir: (str) directory to create the files in
+    :param num_files: (int) number of files
+    :param size_mb: (int) approximate total size in megabytes
+    :return: None
+    """
+    rand = random.Random(42)
+    file_size = max(1, size_mb * 1024 * 1024 // num_files)
+    words = [''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(3, 10)))
+             for _ in range(500)]
+    text_block = ' '.join(rand.choice(words) for _ in range(20000)).encode('utf-8')
+    for num in range(num_files):
+        sub_dir = os.path.join(tree_dir, 'dir{a:02d}'.format(a=num % 50), 'sub{b:02d}'.format(b=num % 7))
+        os.makedirs(sub_dir, exist_ok=True)
+        kind = num % 4
+        if kind == 0:
+            file_path = os.path.join(sub_dir, 'data{n}.bin'.format(n=str(num)))
+            content = os.urandom(file_size)
+        elif kind == 1:
+            file_path = os.path.join(sub_dir, 'archive{n}.gz'.format(n=str(num)))
+            content = os.urandom(file_size)
+        else:
+            file_path = os.path.join(sub_dir, 'log{n}.log'.format(n=str(num)))
+            content = (text_block * (file_size // len(text_block) + 1))[:file_size]
+        with open(file_path, 'wb') as f:
+            f.write(content)
+
+
+def zip_dir_legacy(dir_path, zip_file, compression):
+    """Creates a zip file the way bash.zip_dir did before
+
+    :param dir_path: (str) full path to the directory
+    :param zip_file: (str) full path to the zip file
+    :param compression: (int) zipfile.ZIP_STORED as before, or zipfile.ZIP_DEFLATED
+    :return: None
+    """
+    with contextlib.closing(zipfile.ZipFile(zip_file, 'w', compression=compression, allowZip64=True)) as zip_w:
+        for root, dirs, files in os.walk(dir_path):
+            for f in files:
+                strip = len(dir_path) - len(os.path.split(dir_path)[-1])
+                file_name = os.path.join(root, f)
+                archive_name = os.path.join(root[strip:], f)
+                zip_w.write(file_name, archive_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks zip archive creation')
+    parser.add_argument('--files', help='Number of files in the tree', required=False, type=int, default=2000)
+    parser.add_argument('--mb', help='Approximate total size of the tree in MB', required=False, type=int,
+                        default=512)
+    parser.add_argument('--workers', help='Parallel compression workers', required=False, type=int, default=None)
+    parser.add_argument('--level', help='Deflate compression level', required=False, type=int, default=6)
+    args = parser.parse_args()
+
+    # Logging every file would dominate the timings
+    logging.disable(logging.INFO)
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_zip_')
+    try:
+        tree_dir = os.path.join(work_dir, 'tree')
+        create_tree(tree_dir=tree_dir, num_files=args.files, size_mb=args.mb)
+        total_bytes = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(tree_dir)
+                          for f in files)
+        total_mb = total_bytes / (1024.0 * 1024.0)
+        print('Tree of {n} files, {m:.0f} MB, {c} CPUs'.format(n=str(args.files), m=total_mb, c=str(os.cpu_count())))
+
+        for name, compression in [('stored', zipfile.ZIP_STORED), ('deflate', zipfile.ZIP_DEFLATED)]:
+            legacy_zip = os.path.join(work_dir, 'legacy.zip')
+            start_time = time.time()
+            zip_dir_legacy(dir_path=tree_dir, zip_file=legacy_zip, compression=compression)
+            elapsed_sec = time.time() - start_time
+            print('zipfile {m:<8} {s:.2f}s, {r:.1f} MB/s, {o:.0f} MB archive'.format(
+                m=name, s=elapsed_sec, r=total_mb / elapsed_sec, o=os.path.getsize(legacy_zip) / (1024.0 * 1024.0)))
+            os.remove(legacy_zip)
+
+        archiver_zip = os.path.join(work_dir, 'archiver.zip')
+        archiver = ZipArchiver(output=archiver_zip, max_workers=args.workers, compress_level=args.level)
+        archiver.add_dir(dir_path=tree_dir, prefix='tree')
+        stats = archiver.close()
+        print('ZipArchiver -{l}   {s:.2f}s, {r:.1f} MB/s, {o:.0f} MB archive'.format(
+            l=str(args.level), s=stats['elapsed_sec'], r=stats['mb_per_sec'], o=stats['bytes_out'] / (1024.0 * 1024.0)))
+
+        with zipfile.ZipFile(archiver_zip) as zip_r:
+            bad_member = zip_r.testzip()
+            if bad_member:
+                print('Archive member failed the CRC check: {m}'.format(m=bad_member))
+                return 1
+            if len(zip_r.infolist()) != args.files:
+                print('Expected {n} members, found: {f}'.format(n=str(args.files), f=str(len(zip_r.infolist()))))
+                return 2
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.exit(exit_code)
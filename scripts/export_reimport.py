@@ -9,7 +9,6 @@ This is a sample script for exporting and re-importing assets between CONS3RT si
 
 """
 
-import os
 import sys
 import traceback
 from pycons3rt3.cons3rtapi import Cons3rtApi
@@ -35,7 +34,7 @@ re_import_asset_ids_dev = []
 export_config_file = ''
 import_config_file = ''
 
-# Directory where the assets will be exported to before importing
+# Optional directory to save a copy of the assets to, assets are streamed between sites without it
 export_import_dir = ''
 
 # ################### END EDIT HERE ############################
@@ -67,16 +66,6 @@ for asset_id in asset_ids:
     count += 1
     print('Exporting asset #[{n}] of [{t}]'.format(n=str(count), t=str(len(asset_ids))))
 
-    # Export the asset
-    try:
-        exported_asset = exporter.download_asset(asset_id=asset_id, background=False, dest_dir=export_import_dir,
-                                                 overwrite=True, suppress_status=True)
-    except Cons3rtApiError as exc:
-        print('Problem exporting asset ID: {i}\n{e}'.format(i=str(asset_id), e=str(exc)))
-        traceback.print_exc()
-        failed_export_asset_ids.append(asset_id)
-        continue
-
     # Retrieve the exported asset data
     if asset_type == 'software':
         try:
@@ -128,23 +117,22 @@ for asset_id in asset_ids:
     print('Re-importing asset ID [{i}]: #[{n}] of [{t}]'.format(
         i=str(imported_asset_id), n=str(count), t=str(len(asset_ids))))
 
-    # Re-import the asset
+    # Stream the asset from the export site into the re-import, saving a copy if export_import_dir is set
     try:
-        importer.update_asset_content(
-            asset_id=imported_asset_id,
-            asset_zip_file=exported_asset
+        exporter.transfer_asset(
+            asset_id=asset_id,
+            target_api=importer,
+            target_asset_id=imported_asset_id,
+            tee_dir=export_import_dir if export_import_dir else None
         )
     except Cons3rtApiError as exc:
-        print('Problem importing asset ID: {i}\n{e}'.format(i=str(asset_id), e=str(exc)))
+        print('Problem re-importing asset ID: {i}\n{e}'.format(i=str(asset_id), e=str(exc)))
         traceback.print_exc()
         failed_import_asset_ids.append(asset_id)
         continue
     else:
         successful_asset_ids.append(asset_id)
         successful_re_imported_asset_ids.append(imported_asset_id)
-    finally:
-        print('Removing exported asset: {z}'.format(z=exported_asset))
-        os.remove(exported_asset)
 
     # Set visibility to match the export site
     print('Setting visibility to [{v}] for asset ID: [{i}]'.format(
@@ -78,7 +78,7 @@ def main():
     # Retrieve the software assets
     log.info('Retrieving software assets for project ID: {i}'.format(i=str(project_id)))
     try:
-        software_assets = c.retrieve_software_assets(asset_type='software')
+        software_assets = c.retrieve_software_assets()
     except Cons3rtApiError as exc:
         log.error('Problem retrieving software assets\n{e}'.format(e=str(exc)))
         traceback.print_exc()
@@ -86,19 +86,13 @@ def main():
 
     log.info('Found {n} software assets for project: {p}'.format(n=str(len(software_assets)), p=str(project_id)))
 
-    # Track problems
-    problems = []
-
-    # Set visibility for each asset
-    for software_asset in software_assets:
-        software_asset_id = software_asset['id']
-        log.info('Setting visibility to [{v}] for asset: {a}'.format(v=visibility, a=str(software_asset_id)))
-        try:
-            c.update_asset_visibility(asset_id=software_asset_id, visibility=visibility)
-        except Cons3rtApiError as exc:
-            log.error('Problem setting visibility to [{v}] for software asset [{a}]\n{e}'.format(
-                v=visibility, a=str(software_asset_id), e=str(exc)))
-            problems.append(software_asset_id)
+    # Set visibility for all assets concurrently, assets already at the visibility are skipped
+    results = c.update_assets_visibility(
+        changes=[(software_asset, visibility) for software_asset in software_assets]
+    )
+    problems = results['failed']
+    log.info('Set visibility to [{v}] on {n} assets, {s} were already set'.format(
+        v=visibility, n=str(len(results['succeeded'])), s=str(len(results['skipped']))))
 
     # Print errors
     if len(problems) > 0:
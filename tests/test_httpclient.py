@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import threading
+import unittest
+
+from requests_toolbelt import MultipartEncoder
+
+from pycons3rt3.httpclient import BoundedPipe
+
+
+class TestBoundedPipe(unittest.TestCase):
+
+    def test_len_is_bytes_left_to_read(self):
+        pipe = BoundedPipe(content_length=10)
+        pipe.write(b'0123456789')
+        pipe.close_writer()
+        self.assertEqual(len(pipe), 10)
+        pipe.read(4)
+        self.assertEqual(len(pipe), 6)
+        pipe.read()
+        self.assertEqual(len(pipe), 0)
+
+    def test_multipart_encoder_reads_pipe_to_eof(self):
+        data = bytes(range(256)) + b'x' * 44
+        pipe = BoundedPipe(content_length=len(data), max_buffer_bytes=64)
+
+        def produce():
+            for start in range(0, len(data), 50):
+                pipe.write(data[start:start + 50])
+            pipe.close_writer()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        encoder = MultipartEncoder(fields={'file': ('asset.zip', pipe, 'application/octet-stream')})
+        expected_len = encoder.len
+        result = {}
+
+        def consume():
+            chunks = []
+            while True:
+                chunk = encoder.read(100)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            result['body'] = b''.join(chunks)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        consumer.join(timeout=10)
+        self.assertFalse(consumer.is_alive(), 'MultipartEncoder.read() did not reach EOF')
+        self.assertEqual(len(result['body']), expected_len)
+        self.assertIn(data, result['body'])
+
+
+if __name__ == '__main__':
+    unittest.main()